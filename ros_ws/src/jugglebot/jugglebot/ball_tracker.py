@@ -1,235 +1,392 @@
 '''
 Class overview:
-This class is responsible for tracking the ball in the air. It uses a kalman filter to estimate the position and velocity of the ball.
-It also uses a linear regression model to classify whether the ball is in projectile motion or not.
-The class has a buffer to store the last few measurements, and once it has enough data, it attempts to classify projectile motion.
-If projectile motion is confirmed, the kalman filter is initialized with the initial state of the ball.
-The class also has a method to predict the landing state (pos, vel, time) of the ball based on the kalman filter estimate.
+This class is responsible for tracking the balls in the air. It keeps every track in a fixed-capacity table of
+preallocated array slots, so tracks coming and going (eg. for every noise marker) don't create or destroy any objects.
+
+Each mocap frame is associated with the live tracks, and each track then goes through these states:
+    TENTATIVE - Just started, from a marker that didn't match any track.
+    CONFIRMED - Matched in at least confirm_hits of its last confirm_window frames, so it's a real marker rather than
+                noise. A confirmed track keeps a short buffer of its recent measurements with a least-squares quadratic
+                fit, to classify whether it's in projectile motion. Once it is, a Kalman Filter is started for it, and
+                the landing state (pos, vel, time) of the ball is predicted from the Kalman Filter estimate.
+                With drag enabled, the filter also learns the ball's drag coefficient, and the landing is found
+                by integrating the motion with air drag rather than in closed form.
+    DELETED   - The slot is free. Tentative tracks are deleted if they aren't confirmed in time, and confirmed tracks
+                once they haven't been matched for buffer_duration (or, if they're in projectile motion, once they've
+                landed).
+
+Track IDs combine the slot with a generation number that's bumped every time the slot is reused, so an old ID won't
+refer to whichever track has the slot now.
 
 One big assumption is that once the ball enters projectile motion, it won't stop until it lands.
-This landing is based on the kalman filter estimate, so as soon as projectile motion is confirmed, the virtual 
+This landing is based on the kalman filter estimate, so as soon as projectile motion is confirmed, the virtual
 ball won't stop 'existing' until it 'lands'.
 '''
 
-from collections import deque
 from jugglebot_interfaces.msg import BallStateSingle
 from builtin_interfaces.msg import Time
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from typing import Optional
-from .kalman_filter import KalmanFilter
+from typing import List, Optional
+from .drag_model import integrate_landing
+from .kalman_filter import DragKalmanFilterBank, KalmanFilterBank
+from .landing_solver import LandingSurface, PlaneSurface, landing_confidence, solve_landing
+from .trajectory_fit import IncrementalPolynomialFit
+from .data_association import CHI2_3DOF_99, gated_nearest_neighbour
+
+# Track states
+DELETED = 0
+TENTATIVE = 1
+CONFIRMED = 2
+
+SLOT_BITS = 16  # Low bits of a track ID hold the slot, and the high bits its generation
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+HIT_COUNTS = np.array([bin(history).count('1') for history in range(256)], dtype=np.uint8)  # Set bits in each uint8
+
+
+class BallTrackTable:
+    def __init__(self, dt: float, capacity: int = 64, ground_height: float = 0.0, match_threshold: float = 50.0,
+                 confirm_hits: int = 3, confirm_window: int = 5, landing_surface: Optional[LandingSurface] = None,
+                 drag: bool = False, logger=None):
+        '''
+        Args:
+            dt: Nominal time step that the Kalman Filter process noise is given for {s}.
+            capacity: Most tracks that can be live at once. Markers that don't match a track while the table is full
+                      are dropped.
+            ground_height: Height of the ground {mm}. Balls that reach it have landed, whatever the landing surface.
+            match_threshold: Furthest a marker can be from a track that isn't in projectile motion to match it {mm}.
+            confirm_hits: Number of frames (M) out of the last confirm_window (N) that a track has to be matched in to
+                          be confirmed.
+            confirm_window: Number of frames (N, at most 8) that a track has to be confirmed within.
+            landing_surface: Surface that landings are predicted on. Defaults to the horizontal plane at
+                             ground_height.
+            drag: Whether to model air drag, with an extended Kalman Filter that learns each ball's drag coefficient
+                  (see drag_model). Slower, but more accurate on long or fast throws.
+        '''
+        if capacity > 1 << SLOT_BITS:
+            raise ValueError(f"Capacity can be at most {1 << SLOT_BITS}")
+        if not 0 < confirm_hits <= confirm_window <= 8:
+            raise ValueError("Need 0 < confirm_hits <= confirm_window <= 8")
 
-class BallTracker:
-    def __init__(self, dt: float, ground_height: float = 0.0, logger=None, initial_data=None, node=None):
         self.logger = logger
-        self.node = node
 
         # Parameters
         self.process_noise = 5.0
         self.measurement_noise = 1.0
         self.ground_z = ground_height
+        self.landing_surface = PlaneSurface((0.0, 0.0, ground_height)) if landing_surface is None else landing_surface
         self.landing_threshold = 20.0
         self.is_projectile_residual_threshold = 10.0
         self.is_projectile_a_threshold = 400.0
         self.buffer_duration = 0.1  # seconds to store for projectile motion classification
         self.expected_a = -0.5 * 9810.0
+        self.confidence_radius = 25.0  # mm. Radius around each predicted landing position that its confidence is for
+        self.match_threshold = match_threshold
+        self.association_gate = CHI2_3DOF_99  # Gate on the squared Mahalanobis distance between a track and a marker
+        self.confirm_hits = confirm_hits
+        self.confirm_window = confirm_window
+        self.window_mask = np.uint8((1 << confirm_window) - 1)
+        self.drag = drag
+
+        # Track slots
+        self.state = np.full(capacity, DELETED, dtype=np.int8)
+        self.generation = np.zeros(capacity, dtype=np.uint32)
+        self.ids = np.zeros(capacity, dtype=np.uint32)
+        self.hits = np.zeros(capacity, dtype=np.uint8)       # Whether the track was matched in its last 8 frames
+        self.age = np.zeros(capacity, dtype=np.uint8)        # Frames since the track started (saturating)
+        self.positions = np.zeros((capacity, 3))             # Latest measured position of each track {mm}
+        self.measurement_times = np.zeros(capacity)          # Time of each track's latest measurement {s}
+        self.kf_slots = np.full(capacity, -1, dtype=np.int32)  # Kalman Filter slot, while in projectile motion
+        self.free_slots = list(range(capacity - 1, -1, -1))    # Lowest slot is handed out first
+
+        # Measurements (and their times) with a running quadratic fit, for projectile motion classification
+        self.measurement_buffers = [IncrementalPolynomialFit(capacity=64) for _ in range(capacity)]
+
+        # Kalman Filters of every track in projectile motion, so that they're all stepped with batched operations.
+        # There's a filter slot for every track slot, so the bank never has to grow
+        filter_bank_type = DragKalmanFilterBank if drag else KalmanFilterBank
+        self.filter_bank = filter_bank_type(dt, capacity=capacity, process_noise=self.process_noise,
+                                            measurement_noise=self.measurement_noise)
+
+        # Covariance for matching the tracks without a filter, so that the gate falls at match_threshold
+        self.unfiltered_covariance = np.eye(3) * (self.match_threshold**2 / self.association_gate)
+
+        self.dropped_count = 0  # Markers that didn't get a track because the table was full
+
+        # Latest landing predictions (with their covariances), and the slots of the tracks that they're for
+        self.landing_solution = None
+        self.landing_slots = np.empty(0, dtype=int)
+
+    def __len__(self) -> int:
+        """Number of live (tentative or confirmed) tracks"""
+        return int(np.count_nonzero(self.state != DELETED))
+
+    @property
+    def capacity(self) -> int:
+        return len(self.state)
+
+    def slot_of(self, track_id: int) -> Optional[int]:
+        """
+        Find the slot of a live track.
 
-        self.current_position = None
+        Args:
+            track_id: ID of the track.
 
-        self.measurement_buffer = deque()
-        self.latest_measurement: Optional[np.ndarray] = None  # Holds the latest measurement, or None if no new measurement.
+        Returns:
+            Optional[int]: The slot, or None if the track has been deleted (even if its slot has since been reused).
+        """
+        slot = track_id & SLOT_MASK
+        if slot < self.capacity and self.state[slot] != DELETED and self.ids[slot] == track_id:
+            return slot
+        return None
 
-        self.projectile_motion_confirmed = False
-        self.previous_time = self.node.get_clock().now().nanoseconds * 1e-9
+    #########################################################################################################
+    #                                          Track Lifecycle                                              #
+    #########################################################################################################
 
-        self.kf = KalmanFilter(
-            dt=dt,
-            process_noise=self.process_noise,
-            measurement_noise=self.measurement_noise,
-            logger=self.logger
-        )
+    def create(self, position: np.ndarray, measurement_time: float) -> Optional[int]:
+        """
+        Start a tentative track from a marker.
 
-        self.update_with_new_data(initial_data)
+        Returns:
+            Optional[int]: The slot of the new track, or None if the table is full.
+        """
+        if not self.free_slots:
+            self.dropped_count += 1
+            return None
+
+        slot = self.free_slots.pop()
+        self.generation[slot] = (self.generation[slot] + 1) & SLOT_MASK
+        self.ids[slot] = (self.generation[slot] << SLOT_BITS) | slot
+        self.state[slot] = TENTATIVE
+        self.hits[slot] = 1
+        self.age[slot] = 1
+        self.kf_slots[slot] = -1
+        self.measurement_buffers[slot].clear()
+        self.record(slot, position, measurement_time)
+        return slot
+
+    def delete(self, slot: int):
+        """
+        Delete a track, freeing its slot (and its Kalman Filter slot, if it has one) for reuse.
+        """
+        if self.state[slot] == DELETED:
+            return
 
-        # self.logger.info(f"BallTracker initialized.")
+        if self.kf_slots[slot] >= 0:
+            self.filter_bank.remove(self.kf_slots[slot])
+            self.kf_slots[slot] = -1
+        self.state[slot] = DELETED
+        self.free_slots.append(slot)
 
-    def update_with_new_data(self, data):
+    def update_states(self, live_slots: np.ndarray):
         """
-        Update the tracker with new data. This method should be called whenever new data is available.
+        Confirm the tentative tracks that have been matched in enough of their recent frames, and delete those that
+        ran out of frames to be.
 
         Args:
-            data: The new data to update the tracker with. (np.ndarray)
+            live_slots: Slots of the tracks that were live at the start of the frame.
         """
-        # Only store the latest measurement
-        if isinstance(data, np.ndarray):
-            self.latest_measurement = np.array([[data[0]],
-                                                [data[1]],
-                                                [data[2]]])
-            
-            if self.current_position is None:
-                self.current_position = self.latest_measurement
-        else:
-            self.latest_measurement = None
-
-    def advance_tracker(self) -> Optional[BallStateSingle]:
+        hit_counts = HIT_COUNTS[self.hits[live_slots] & self.window_mask]
+        tentative = self.state[live_slots] == TENTATIVE
+
+        self.state[live_slots[tentative & (hit_counts >= self.confirm_hits)]] = CONFIRMED
+
+        failed = tentative & (hit_counts < self.confirm_hits) & (self.age[live_slots] >= self.confirm_window)
+        for slot in live_slots[failed]:
+            self.delete(slot)
+
+    #########################################################################################################
+    #                                            Measurements                                               #
+    #########################################################################################################
+
+    def add_measurements(self, positions: np.ndarray, measurement_time: float):
         """
-        Update the tracker, advancing it to the current timestep. 
-        If there's a new measurement, add it to the buffer and check for projectile motion.
-        If projectile motion is confirmed, predict the landing state and return it.
+        Add a frame of markers. The markers are associated with the live tracks, with gated global nearest neighbour
+        matching (each track gets at most one marker, and each marker goes to at most one track), and any marker that
+        doesn't match a track starts a new one.
 
-        If there is no new measurement and we were previously classed as being in projectile motion,
-        just predict the landing state with the Kalman Filter.
+        Tracks in projectile motion are compared with where their Kalman Filter expects the ball at the measurement
+        time, gated on the Mahalanobis distance with the filter's innovation covariance. The others are compared with
+        their latest position, and gated at match_threshold.
 
-        Returns:
-            Optional[BallStateSingle]: The predicted landing state (pos, vel, time_to_land) of the ball.
+        Args:
+            positions: Positions of the markers (N, 3) {mm}.
+            measurement_time: Time that the frame was captured {s}.
         """
-        current_time = self.node.get_clock().now().nanoseconds * 1e-9
-        self.previous_time = current_time
-
-        # Initialize landing state
-        landing_state = None
-
-        new_measurement = self.latest_measurement
-        # Clear latest_measurement since we're consuming it now
-        self.latest_measurement = None
-
-        if not self.projectile_motion_confirmed:
-            # Not in projectile motion yet
-            if new_measurement is not None:
-                # We got a new measurement: add it to the buffer
-                self.measurement_buffer.append((new_measurement, current_time))
-
-                # Also update the current state of this tracked object
-                self.current_position = new_measurement.ravel()
-
-                # Check if we have enough data to classify projectile motion
-                if len(self.measurement_buffer) >= 3:
-                    time_span = self.measurement_buffer[-1][1] - self.measurement_buffer[0][1]
-                    if time_span >= self.buffer_duration:
-                        # Attempt classification
-                        if self.is_projectile_motion():
-                            self.projectile_motion_confirmed = True
-                            self.initialize_kalman_filter()
-                            # self.logger.info("Projectile motion confirmed. KF initialized.")
-                            # Do not trim since we now want full path
-                        else:
-                            # Not projectile yet, trim buffer to maintain buffer_duration window
-                            self.trim_buffer_to_duration()
-                    else:
-                        # Not enough time span yet, just wait
-                        self.trim_buffer_to_duration()
-                else:
-                    # Not enough points yet
-                    self.trim_buffer_to_duration()
-            else:
-                # No new measurement and not projectile (yet). Just wait.
-                self.trim_buffer_to_duration()
-                pass
-        else:
-            # Projectile motion confirmed
-            if new_measurement is not None:
-                # Add measurement to buffer
-                self.measurement_buffer.append((new_measurement, current_time))
-                # Update KF with measurement
-                self.kf.predict()
-                self.kf.update(new_measurement)
-            else:
-                # No new measurement, just predict forward
-                self.kf.predict()
-
-            # Get the current state
-            self.current_position = self.kf.get_current_position().ravel()
-
-            # Check landing from KF state
-            estimated_state = self.kf.state.ravel()
-            est_z = estimated_state[2]
-            if est_z <= self.ground_z + self.landing_threshold and self.projectile_motion_confirmed:
-                # self.logger.info("Ball has landed (KF estimate). Resetting.")
-                self.kf.reset()
-                self.measurement_buffer.clear()
-                self.projectile_motion_confirmed = False
-                return None
-
-            # Predict landing
-            prediction = self.kf.predict_landing_state(self.ground_z)
-            if prediction is not None:
-                # If we have a prediction, publish it
-                (landing_x, landing_y), (landing_velx, landing_vely, landing_velz), time_to_land = prediction
-                landing_state = BallStateSingle()
-                
-                # Header
-                landing_state.header.stamp = self.node.get_clock().now().to_msg()
-                landing_state.header.frame_id = "base"
-                # Position
-                landing_state.landing_position.x = landing_x
-                landing_state.landing_position.y = landing_y
-                landing_state.landing_position.z = self.ground_z
-                # Velocity
-                landing_state.landing_velocity.x = landing_velx
-                landing_state.landing_velocity.y = landing_vely
-                landing_state.landing_velocity.z = landing_velz
-                # Time at land - when the ball will cross the catch plane - as a ROS2 Time object
-                # This is the current time + the time to land
-                landing_state.time_at_land = Time()
-                landing_state.time_at_land.sec = int(current_time + time_to_land)
-                landing_state.time_at_land.nanosec = int((current_time + time_to_land) % 1 * 1e9)
-                
-            # Since projectile motion confirmed, we do not trim the buffer.
-
-        return landing_state
-
-    def is_projectile_motion(self) -> bool:
-        if len(self.measurement_buffer) < 3:
-            return False
-        positions = np.array([p[0].ravel() for p in self.measurement_buffer])
-        times = np.array([t[1] for t in self.measurement_buffer])
-        times = times - times[0]
+        live_slots = np.flatnonzero(self.state != DELETED)
+
+        track_positions = self.positions[live_slots]
+        innovation_covariances = np.broadcast_to(self.unfiltered_covariance, (len(live_slots), 3, 3)).copy()
+
+        kf_slots = self.kf_slots[live_slots]
+        filtered = kf_slots >= 0
+        if np.any(filtered):
+            track_positions[filtered], innovation_covariances[filtered] = self.filter_bank.predict_measurements(
+                kf_slots[filtered], measurement_time)
 
-        z_positions = positions[:, 2]
-        t = times.reshape(-1, 1)
-        X = np.hstack((t**2, t, np.ones_like(t)))
+        matched_tracks, matched_indices, unmatched_indices = gated_nearest_neighbour(
+            track_positions, positions, innovation_covariances, gate=self.association_gate)
 
-        model = LinearRegression().fit(X, z_positions)
-        z_pred = model.predict(X)
+        # Shift every live track's match history along, marking the tracks that were matched this frame
+        self.hits[live_slots] <<= 1
+        self.age[live_slots] = np.minimum(self.age[live_slots], 254) + 1
+        matched_slots = live_slots[matched_tracks]
+        self.hits[matched_slots] |= 1
 
-        residuals = z_positions - z_pred
-        residuals_std = np.std(residuals)
-        a = model.coef_[0]
+        for slot, index in zip(matched_slots, matched_indices):
+            self.record(slot, positions[index], measurement_time)
+
+        # Every filter with a new measurement is predicted to the time of the measurement and updated in one go
+        self.filter_bank.update()
+
+        self.update_states(live_slots)
+
+        for index in unmatched_indices:
+            self.create(positions[index], measurement_time)
+
+    def record(self, slot: int, position: np.ndarray, measurement_time: float):
+        """
+        Record a track's new measurement. While projectile motion hasn't been confirmed, add it to the buffer and
+        check for projectile motion. Once it has, queue it for the next Kalman Filter update.
+        """
+        self.positions[slot] = position
+        self.measurement_times[slot] = measurement_time
+
+        if self.kf_slots[slot] >= 0:
+            self.filter_bank.queue_measurement(self.kf_slots[slot], position, measurement_time)
+            return
+
+        measurement_buffer = self.measurement_buffers[slot]
+        measurement_buffer.append(measurement_time, position)
+
+        # Check if we have enough data to classify projectile motion. Only confirmed tracks are classified
+        if self.state[slot] == CONFIRMED and len(measurement_buffer) >= 3 and \
+           measurement_buffer.end_time - measurement_buffer.start_time >= self.buffer_duration:
+            if self.is_projectile_motion(measurement_buffer):
+                self.initialize_kalman_filter(slot)
+                # Do not trim since the buffer isn't used once the filter is running
+                return
+
+        # Not projectile yet, trim buffer to maintain buffer_duration window
+        while measurement_buffer.end_time - measurement_buffer.start_time > self.buffer_duration:
+            measurement_buffer.pop_oldest()
+
+    def is_projectile_motion(self, measurement_buffer: IncrementalPolynomialFit) -> bool:
+        result = measurement_buffer.fit(degree=2)
+        if result is None:
+            return False
+        coefficients, squared_residuals = result
+
+        # The fit has an intercept, so the residuals have zero mean and their std is the RMS residual
+        residuals_std = np.sqrt(squared_residuals[2] / len(measurement_buffer))
+        a = coefficients[2, 2]
         a_diff = np.abs(a - self.expected_a)
 
         return (residuals_std < self.is_projectile_residual_threshold) and (a_diff < self.is_projectile_a_threshold)
 
-    def initialize_kalman_filter(self):
-        if len(self.measurement_buffer) < 3:
+    def initialize_kalman_filter(self, slot: int):
+        measurement_buffer = self.measurement_buffers[slot]
+        linear = measurement_buffer.fit(degree=1)
+        quadratic = measurement_buffer.fit(degree=2)
+        if linear is None or quadratic is None:
             self.logger.warning("Not enough data to initialize KF.")
             return
 
-        initial_position = self.measurement_buffer[-1][0]
-        times = np.array([m[1] for m in self.measurement_buffer])
-        times -= times[0]
-        positions = np.array([m[0].ravel() for m in self.measurement_buffer])
-
-        X_t = times.reshape(-1, 1)
-        vx_model = LinearRegression().fit(X_t, positions[:, 0])
-        vy_model = LinearRegression().fit(X_t, positions[:, 1])
-        initial_vx = vx_model.coef_[0]
-        initial_vy = vy_model.coef_[0]
-
-        z_positions = positions[:, 2]
-        X_z = np.vstack((times**2, times, np.ones_like(times))).T
-        z_model = LinearRegression().fit(X_z, z_positions)
-        a = z_model.coef_[0]
-        b = z_model.coef_[1]
-        last_time = times[-1]
-        initial_vz = 2 * a * last_time + b
-
-        initial_velocity = np.array([[initial_vx], [initial_vy], [initial_vz]])
-        initial_state = np.vstack((initial_position, initial_velocity))
-        self.kf.initialize_with_state(initial_state)
-        # self.logger.info(f"KF initialized: position={initial_position.ravel()}, velocity={initial_velocity.ravel()}")
-
-    def trim_buffer_to_duration(self):
-        current_time = self.node.get_clock().now().nanoseconds * 1e-9
-        while len(self.measurement_buffer) > 0 and \
-              (current_time - self.measurement_buffer[0][1]) > self.buffer_duration:
-            self.measurement_buffer.popleft()
\ No newline at end of file
+        initial_state = np.empty(6)
+        initial_state[:3] = measurement_buffer.latest_position
+
+        # Horizontal velocity from a straight line fit, vertical velocity from the parabola at the latest time
+        last_time = measurement_buffer.end_time
+        initial_state[3:5] = measurement_buffer.velocity_at(linear[0], last_time)[:2]
+        initial_state[5] = measurement_buffer.velocity_at(quadratic[0], last_time)[2]
+
+        self.kf_slots[slot] = self.filter_bank.add(initial_state, last_time)
+        # self.logger.info(f"KF initialized: state={initial_state}")
+
+    #########################################################################################################
+    #                                          Landing Prediction                                           #
+    #########################################################################################################
+
+    def predict_landings(self, current_time: float, stamp=None) -> List[BallStateSingle]:
+        """
+        Predict the landing state of every track in projectile motion, from its Kalman Filter estimate carried forward
+        to the current time. Tracks that have landed, and tracks without a filter that haven't been matched for
+        buffer_duration, are deleted.
+
+        Args:
+            current_time: The time now {s}.
+            stamp: Header stamp for the predictions (builtin_interfaces/Time).
+
+        Returns:
+            List[BallStateSingle]: The predicted landing state (pos, vel, time_at_land) of each ball, with its track ID
+                                   and the uncertainty of the prediction.
+        """
+        live = self.state != DELETED
+        in_flight = live & (self.kf_slots >= 0)
+
+        # Cleanup the tracks that have lost their marker
+        lost = live & ~in_flight & (current_time - self.measurement_times > self.buffer_duration)
+        for slot in np.flatnonzero(lost):
+            self.delete(slot)
+
+        # Get the current state of every ball in flight, carried forward from the time of its latest measurement
+        slots = np.flatnonzero(in_flight)
+        estimated_states, estimated_covariances = self.filter_bank.predict_states(self.kf_slots[slots], current_time)
+
+        # Check landing from KF state: within landing_threshold of the landing surface (or through it), or of the
+        # ground. S / |grad S| is the distance to the surface near it, whatever the scale of S
+        positions = estimated_states[:, :3]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distances = (self.landing_surface.value(positions)
+                         / np.linalg.norm(self.landing_surface.gradient(positions), axis=1))
+        landed = (distances <= self.landing_threshold) | (positions[:, 2] <= self.ground_z + self.landing_threshold)
+        for slot in slots[landed]:
+            # self.logger.info("Ball has landed (KF estimate). Deleting its track.")
+            self.delete(slot)
+        slots, estimated_states, estimated_covariances = (slots[~landed], estimated_states[~landed],
+                                                          estimated_covariances[~landed])
+
+        # Predict landing, for every ball at once
+        solve = integrate_landing if self.drag else solve_landing
+        solution = solve(estimated_states, self.landing_surface, estimated_covariances)
+        self.landing_solution = solution
+        self.landing_slots = slots
+
+        # Uncertainty of each landing position, with the state covariance propagated through the landing solution
+        position_covariances = solution.covariance[:, 1:4, 1:4]
+        confidences = landing_confidence(position_covariances, self.confidence_radius)
+
+        landing_states = []
+        for index in np.flatnonzero(solution.valid):
+            landing_x, landing_y, landing_z = solution.position[index]
+            landing_velx, landing_vely, landing_velz = solution.velocity[index]
+            time_to_land = solution.time[index]
+            landing_state = BallStateSingle()
+
+            # Header
+            if stamp is not None:
+                landing_state.header.stamp = stamp
+            landing_state.header.frame_id = "base"
+            landing_state.id = int(self.ids[slots[index]])
+            # Position
+            landing_state.landing_position.x = landing_x
+            landing_state.landing_position.y = landing_y
+            landing_state.landing_position.z = landing_z
+            # Velocity
+            landing_state.landing_velocity.x = landing_velx
+            landing_state.landing_velocity.y = landing_vely
+            landing_state.landing_velocity.z = landing_velz
+            # Time at land - when the ball will cross the catch surface - as a ROS2 Time object
+            # This is the current time + the time to land
+            landing_state.time_at_land = Time()
+            landing_state.time_at_land.sec = int(current_time + time_to_land)
+            landing_state.time_at_land.nanosec = int((current_time + time_to_land) % 1 * 1e9)
+            # Uncertainty
+            landing_state.landing_position_covariance = position_covariances[index].ravel().tolist()
+            landing_state.time_at_land_variance = float(solution.covariance[index, 0, 0])
+            landing_state.confidence = float(confidences[index])
+
+            landing_states.append(landing_state)
+
+        return landing_states
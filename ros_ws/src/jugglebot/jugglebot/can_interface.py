@@ -462,8 +462,8 @@ class CANInterface:
         Args:
             axis_id (int): The axis ID to command.
             setpoint (float): The desired position setpoint in revolutions.
-            veL_ff (float, optional): The velocity feedforward term.
-            torque_ff (float, optional): The torque feedforward term.
+            veL_ff (float, optional): The velocity feedforward term {rev/s}. Same sign convention as the setpoint.
+            torque_ff (float, optional): The torque feedforward term {Nm}. Same sign convention as the setpoint.
             min_position (float, optional): The minimum allowable position.
 
         Raises:
@@ -484,10 +484,15 @@ class CANInterface:
                     f"({min_position}, {max_position}) and has been clipped."
                 )
                 setpoint = max(min_position, min(setpoint, max_position))
+                # The axis will be held at its limit, so there's nothing to feed forward
+                veL_ff = 0.0
+                torque_ff = 0.0
 
-            # Invert setpoint for legs since -ve is extension
+            # Invert setpoint (and feedforward terms) for legs since -ve is extension
             if axis_id != 6:
                 setpoint = -setpoint
+                veL_ff = -veL_ff
+                torque_ff = -torque_ff
 
             data = self.db.encode_message(
                 f'Axis{axis_id}_Set_Input_Pos',
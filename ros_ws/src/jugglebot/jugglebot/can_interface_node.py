@@ -5,6 +5,7 @@ from rclpy.action import ActionServer, CancelResponse, GoalResponse
 from jugglebot_interfaces.msg import (
     CanTrafficReportMessage,
     LegsTargetReachedMessage,
+    LegsTargetMessage,
     SetMotorVelCurrLimitsMessage,
     SetTrapTrajLimitsMessage,
     HandTelemetryMessage,
@@ -12,7 +13,7 @@ from jugglebot_interfaces.msg import (
 )
 from jugglebot_interfaces.srv import ODriveCommandService, GetTiltReadingService, ActivateOrDeactivate
 from jugglebot_interfaces.action import HomeMotors
-from std_msgs.msg import Float64MultiArray, String
+from std_msgs.msg import String
 from std_srvs.srv import Trigger
 from .can_interface import CANInterface
 
@@ -43,7 +44,7 @@ class CanInterfaceNode(Node):
 
         #### Initialize subscribers ####
         self.motor_pos_subscription = self.create_subscription(
-            Float64MultiArray, 'leg_lengths_topic', self.handle_movement, 10
+            LegsTargetMessage, 'legs_target_topic', self.handle_movement, 10
         )
         self.motor_vel_curr_limits_subscription = self.create_subscription(
             SetMotorVelCurrLimitsMessage, 'set_motor_vel_curr_limits', self.motor_vel_curr_limits_callback, 10
@@ -216,14 +217,15 @@ class CanInterfaceNode(Node):
     def handle_movement(self, msg):
         """Handle movement commands for the robot."""
         try:
-            # Extract the leg lengths
-            motor_positions = msg.data
+            # Extract the leg lengths and the velocity feedforward terms (if any were sent)
+            motor_positions = msg.positions
+            motor_velocities = msg.velocities if len(msg.velocities) == len(msg.positions) else [0.0] * len(msg.positions)
 
             # Store these positions as the target positions
             self.legs_target_position = motor_positions
 
-            for axis_id, setpoint in enumerate(motor_positions):
-                self.can_handler.send_position_target(axis_id=axis_id, setpoint=setpoint)
+            for axis_id, (setpoint, vel_ff) in enumerate(zip(motor_positions, motor_velocities)):
+                self.can_handler.send_position_target(axis_id=axis_id, setpoint=setpoint, veL_ff=vel_ff)
                 # self.get_logger().debug(f'Motor {axis_id} commanded to setpoint {setpoint}')
 
         except Exception as e:
@@ -47,6 +47,7 @@ class CatchABallNode(Node):
         self.catch_height = self.initial_plat_height + 170  # mm. The height of the catch plane from the base plane 
         self.catch_angle_limit_deg = 30.0         # deg. The maximum angle the robot can move to catch the ball, wrt the z-axis
         self.minimum_time_to_attempt_catch = 0.5  # s. The minimum time before the ball lands to attempt a catch
+        self.minimum_landing_confidence = 0.8     # The minimum confidence in a landing prediction to move for it
         self.time_after_catching_to_return_to_default = 1.0  # s. The time after catching the ball to return to the default pose
         self.last_catch_time = None  # The time at which the last catch was attempted
 
@@ -56,6 +57,7 @@ class CatchABallNode(Node):
                               "vel": None, # The predicted landing velocity of the ball
                               "time_to_land": None, # The time remaining before the ball lands (s)
                               "time_at_land": None, # The time at which the ball will land (ROS2 Time)
+                              "confidence": None,   # The confidence in the predicted landing position (0-1)
                               "catching": None}    # Flag to indicate if the robot is catching the ball
         
         # Initialise the default 'active' pose
@@ -106,15 +108,22 @@ class CatchABallNode(Node):
         landing_position = msg.landing_predictions[0].landing_position
         landing_velocity = msg.landing_predictions[0].landing_velocity
         time_at_land = msg.landing_predictions[0].time_at_land
+        confidence = msg.landing_predictions[0].confidence
 
         # Calculate how much time remains before the ball lands
         time_to_land_s = time_at_land.sec - self.get_clock().now().to_msg().sec
         time_to_land_ns = time_at_land.nanosec - self.get_clock().now().to_msg().nanosec
         time_to_land = time_to_land_s + time_to_land_ns * 1e-9
 
+        # Wait for the prediction to converge before moving for it, rather than chasing noisy early estimates
+        if confidence < self.minimum_landing_confidence:
+            self.get_logger().info(f"Waiting for the prediction for ball {id} to converge. Confidence: {confidence:.2f}",
+                                   throttle_duration_sec=0.5)
+            return
+
         # Log the landing position
         self.get_logger().info(f"Predicted landing position: [{landing_position.x}, {landing_position.y}, {landing_position.z}]"
-                               f" in {time_to_land:.2f} seconds.")
+                               f" in {time_to_land:.2f} seconds (confidence {confidence:.2f}).")
 
         # Check if the ball is catchable based on the landing position and time to land
         catchable = self.check_preliminary_catch_feasibility(id, landing_position, time_to_land)
@@ -127,6 +136,7 @@ class CatchABallNode(Node):
         self.landing_state["vel"] = landing_velocity
         self.landing_state["time_to_land"] = time_to_land
         self.landing_state["time_at_land"] = time_at_land
+        self.landing_state["confidence"] = confidence
         self.landing_state["catching"] = True # Set the catching flag to True
 
     #########################################################################################################
@@ -241,6 +251,7 @@ class CatchABallNode(Node):
         self.landing_state["vel"] = None
         self.landing_state["time_to_land"] = None
         self.landing_state["time_at_land"] = None
+        self.landing_state["confidence"] = None
         self.landing_state["catching"] = None
 
     #########################################################################################################
@@ -0,0 +1,91 @@
+# clock_sync.py
+
+from collections import deque
+from typing import Optional
+
+
+class ClockOffsetEstimator:
+    """
+    Estimates the offset between a device clock (eg. QTM's frame timestamps) and the host clock, so that device
+    timestamps can be converted into host (ROS) time.
+
+    Each frame gives one sample of (host receive time - device capture time). That's the true offset plus however long
+    the frame spent in the network, the kernel and the QTM thread, which is always positive and very noisy. The
+    smallest sample over a sliding window is the one with the least latency, so it's used as the estimate. The window
+    is kept short enough that drift between the two clocks doesn't matter.
+
+    The estimate is reset if the device clock jumps (eg. QTM starts a new measurement), or if the samples stay well
+    above the estimate for a while (eg. the host clock has been stepped forward).
+    """
+
+    def __init__(self, window: float = 10.0, max_gap: float = 1.0, max_excess: float = 0.05, reset_after: int = 100):
+        """
+        Args:
+            window (float): Length of the sliding window {s}.
+            max_gap (float): Largest gap between device timestamps before the estimate is reset {s}.
+            max_excess (float): How far above the estimate a sample can be before it counts towards a reset {s}.
+            reset_after (int): Number of consecutive samples above max_excess that trigger a reset.
+        """
+        self.window_ns = int(window * 1e9)
+        self.max_gap_ns = int(max_gap * 1e9)
+        self.max_excess_ns = int(max_excess * 1e9)
+        self.reset_after = reset_after
+
+        self.reset_count = 0  # Number of times the estimate has been reset because of a jump in either clock
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all samples.
+        """
+        # (device_time, offset) pairs with increasing offsets, so that the front is always the smallest offset in the
+        # window. Each sample is added and removed once, so updates are O(1) on average
+        self._samples = deque()
+        self._last_device_time = None
+        self._excess_count = 0
+
+    def update(self, device_time: int, host_time: int) -> int:
+        """
+        Add a sample and return the device time converted to host time.
+
+        Args:
+            device_time (int): Time that the device captured the frame, in the device clock {ns}.
+            host_time (int): Time that the frame was received, in the host clock {ns}.
+
+        Returns:
+            int: The estimated capture time in the host clock {ns}.
+        """
+        offset = host_time - device_time
+
+        # Start again if the device clock has jumped...
+        if self._last_device_time is not None and \
+           not 0 <= device_time - self._last_device_time <= self.max_gap_ns:
+            self.reset()
+            self.reset_count += 1
+        # ...or if the offset has been well above the estimate for too long
+        elif self._samples and offset - self._samples[0][1] > self.max_excess_ns:
+            self._excess_count += 1
+            if self._excess_count >= self.reset_after:
+                self.reset()
+                self.reset_count += 1
+        else:
+            self._excess_count = 0
+
+        self._last_device_time = device_time
+
+        # Drop samples that can never be the minimum again, then any that have left the window
+        while self._samples and self._samples[-1][1] >= offset:
+            self._samples.pop()
+        self._samples.append((device_time, offset))
+        while device_time - self._samples[0][0] > self.window_ns:
+            self._samples.popleft()
+
+        return device_time + self._samples[0][1]
+
+    @property
+    def offset(self) -> Optional[int]:
+        """
+        Returns:
+            Optional[int]: The current estimate of (host time - device time) {ns}, or None if there are no samples.
+        """
+        return self._samples[0][1] if self._samples else None
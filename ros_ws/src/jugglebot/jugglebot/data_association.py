@@ -0,0 +1,79 @@
+# data_association.py
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
+from typing import Optional, Tuple
+
+
+CHI2_3DOF_99 = 11.345  # 99% point of the chi-squared distribution with 3 degrees of freedom
+
+
+def gated_nearest_neighbour(track_positions: np.ndarray, measurements: np.ndarray,
+                            innovation_covariances: Optional[np.ndarray] = None, gate: float = CHI2_3DOF_99,
+                            kdtree_min_tracks: int = 32) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Global nearest neighbour association of measurements with tracks.
+
+    The cost of pairing a track with a measurement is the squared Mahalanobis distance between them,
+    (z - p).T @ inv(S) @ (z - p), with S the track's innovation covariance. Pairs with a cost above the gate are ruled
+    out, and the remaining pairs are assigned to minimise the total cost, so that each track gets at most one
+    measurement and each measurement goes to at most one track.
+
+    For many tracks, a KD-tree of the track positions finds the candidate pairs (those within the largest Euclidean
+    distance that any track's gate allows), so that only those pairs are costed and the assignment is only solved for
+    the tracks and measurements that have a candidate.
+
+    Args:
+        track_positions (np.ndarray): Predicted position of each track (T, 3) {mm}.
+        measurements (np.ndarray): Measured positions (M, 3) {mm}.
+        innovation_covariances (np.ndarray): Innovation covariance of each track (T, 3, 3) {mm^2}. If not given, every
+                                             track uses the identity, so the cost is the squared distance {mm^2}.
+        gate (float): Largest cost for a track and a measurement to be paired.
+        kdtree_min_tracks (int): Number of tracks from which the KD-tree is used to find the candidate pairs.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Indices of the paired tracks and of their measurements (both (N,)),
+                                                   and the indices of the measurements that weren't paired.
+    """
+    track_positions = np.asarray(track_positions, dtype=float).reshape(-1, 3)
+    measurements = np.asarray(measurements, dtype=float).reshape(-1, 3)
+    num_tracks, num_measurements = len(track_positions), len(measurements)
+    if innovation_covariances is None:
+        innovation_covariances = np.broadcast_to(np.eye(3), (num_tracks, 3, 3))
+
+    if num_tracks == 0 or num_measurements == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.arange(num_measurements)
+
+    if num_tracks >= kdtree_min_tracks:
+        # A track's gate is an ellipsoid whose longest semi-axis is sqrt(gate * largest eigenvalue of S)
+        radius = np.sqrt(gate * np.linalg.eigvalsh(innovation_covariances)[:, -1].max())
+        pairs = cKDTree(track_positions).query_ball_point(measurements, radius)
+        measurement_indices = np.repeat(np.arange(num_measurements), [len(tracks) for tracks in pairs])
+        track_indices = np.fromiter((track for tracks in pairs for track in tracks), dtype=int,
+                                    count=len(measurement_indices))
+    else:
+        track_indices, measurement_indices = np.indices((num_tracks, num_measurements)).reshape(2, -1)
+
+    # Squared Mahalanobis distance of every candidate pair, in one batched solve
+    innovations = measurements[measurement_indices] - track_positions[track_indices]
+    weighted = np.linalg.solve(innovation_covariances[track_indices], innovations[:, :, np.newaxis])[:, :, 0]
+    costs = np.einsum('ij,ij->i', innovations, weighted)
+
+    gated = costs <= gate
+    track_indices, measurement_indices, costs = track_indices[gated], measurement_indices[gated], costs[gated]
+
+    # Solve the assignment over just the tracks and measurements that have a candidate. Ruled out pairs get a cost
+    # that's higher than any set of gated pairs could add up to, so they're only chosen if there's nothing else
+    tracks, track_rows = np.unique(track_indices, return_inverse=True)
+    candidates, measurement_columns = np.unique(measurement_indices, return_inverse=True)
+    cost_matrix = np.full((len(tracks), len(candidates)), gate * (min(len(tracks), len(candidates)) + 1))
+    cost_matrix[track_rows, measurement_columns] = costs
+
+    rows, columns = linear_sum_assignment(cost_matrix)
+    valid = cost_matrix[rows, columns] <= gate
+    paired_tracks, paired_measurements = tracks[rows[valid]], candidates[columns[valid]]
+
+    unpaired = np.ones(num_measurements, dtype=bool)
+    unpaired[paired_measurements] = False
+    return paired_tracks, paired_measurements, np.flatnonzero(unpaired)
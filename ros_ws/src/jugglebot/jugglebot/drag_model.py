@@ -0,0 +1,231 @@
+# drag_model.py
+
+import numpy as np
+from typing import Optional, Tuple
+
+from .landing_solver import GRAVITY_VECTOR, LandingSolution, LandingSurface, propagate_landing_covariance
+
+
+# Ballistic motion with quadratic air drag, for states [x, y, z, vx, vy, vz, k]:
+#     a = g - k |v| v
+# where k = rho Cd A / 2m is the drag coefficient of the ball {1/mm}. Units are mm and seconds.
+# A 67 mm, 130 g juggling ball with Cd ~ 0.5 in air at 1.2 kg/m^3. About 1.3% of g at 4 m/s
+DRAG_COEFFICIENT = 8e-6  # {1/mm}
+
+COMPLEX_STEP = 1e-20  # Imaginary step for complex step differentiation
+
+
+def acceleration(velocities: np.ndarray, drag_coefficients: np.ndarray) -> np.ndarray:
+    """
+    Acceleration of a set of balls, from gravity and drag (N, 3) {mm/s^2}.
+
+    Args:
+        velocities (np.ndarray): Velocity of each ball (N, 3) {mm/s}.
+        drag_coefficients (np.ndarray): Drag coefficient of each ball (N, 1) {1/mm}.
+    """
+    speeds = np.sqrt(np.einsum('ij,ij->i', velocities, velocities))[:, np.newaxis]
+    return GRAVITY_VECTOR - drag_coefficients * speeds * velocities
+
+
+def rk4_step(states: np.ndarray, dt) -> np.ndarray:
+    """
+    Step a set of states forward with one step of RK4. The drag coefficient doesn't change, and the position
+    derivative is the velocity, so only the accelerations need to be evaluated at each stage.
+
+    Args:
+        states (np.ndarray): States [x, y, z, vx, vy, vz, k] (N, 7).
+        dt (float or np.ndarray): Time step, for every state or for each one (N,) {s}.
+
+    Returns:
+        np.ndarray: The stepped states (N, 7).
+    """
+    h = np.reshape(dt, (-1, 1))
+    v1, k = states[:, 3:6], states[:, 6:7]
+
+    a1 = acceleration(v1, k)
+    v2 = v1 + 0.5 * h * a1
+    a2 = acceleration(v2, k)
+    v3 = v1 + 0.5 * h * a2
+    a3 = acceleration(v3, k)
+    v4 = v1 + h * a3
+    a4 = acceleration(v4, k)
+
+    stepped = states.copy()
+    stepped[:, :3] += h / 6.0 * (v1 + 2 * (v2 + v3) + v4)
+    stepped[:, 3:6] += h / 6.0 * (a1 + 2 * (a2 + a3) + a4)
+    return stepped
+
+
+def integrate(states: np.ndarray, dt: np.ndarray, max_step: float = 0.05) -> np.ndarray:
+    """
+    Integrate a set of states over their own time steps, with as many equal RK4 steps as the longest one needs.
+
+    Args:
+        states (np.ndarray): States [x, y, z, vx, vy, vz, k] (N, 7).
+        dt (np.ndarray): Time to integrate each state over (N,) {s}. Can be negative.
+        max_step (float): Longest RK4 step {s}.
+
+    Returns:
+        np.ndarray: The integrated states (N, 7).
+    """
+    dt = np.asarray(dt, dtype=float)
+    num_steps = max(1, int(np.ceil(np.max(np.abs(dt), initial=0.0) / max_step)))
+    for _ in range(num_steps):
+        states = rk4_step(states, dt / num_steps)
+    return states
+
+
+def integrate_with_jacobian(states: np.ndarray, dt: np.ndarray,
+                            max_step: float = 0.05) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Integrate a set of states along with the Jacobian of the integration with respect to them (the state transition
+    matrix of an extended Kalman Filter).
+
+    The Jacobian is by complex step differentiation: integrating a state with an imaginary step h added to one of its
+    variables gives the derivative with respect to that variable as the imaginary part over h. Unlike finite
+    differences, nothing is subtracted, so it's exact to rounding for any small h. Each state is integrated together
+    with a copy of it for each variable.
+
+    Args:
+        states (np.ndarray): States [x, y, z, vx, vy, vz, k] (N, 7).
+        dt (np.ndarray): Time to integrate each state over (N,) {s}. Can be negative.
+        max_step (float): Longest RK4 step {s}.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The integrated states (N, 7) and state transition matrices (N, 7, 7).
+    """
+    num_states = len(states)
+    perturbed = np.repeat(states[:, np.newaxis, :], 8, axis=1).astype(complex)
+    perturbed[:, np.arange(1, 8), np.arange(7)] += 1j * COMPLEX_STEP
+
+    integrated = integrate(perturbed.reshape(-1, 7), np.repeat(dt, 8), max_step).reshape(num_states, 8, 7)
+    return integrated[:, 0].real, integrated[:, 1:].imag.transpose(0, 2, 1) / COMPLEX_STEP
+
+
+def integrate_landing(states: np.ndarray, surface: LandingSurface, covariances: Optional[np.ndarray] = None,
+                      step: float = 0.1, max_time: float = 3.0, tolerance: float = 1e-6,
+                      iterations: int = 12) -> LandingSolution:
+    """
+    Find when and where each of a set of balls lands on a surface, with quadratic drag.
+
+    Every ball that's still in the air is stepped together with RK4 until it crosses the surface (S goes from positive
+    to not positive). Once every ball has crossed (or stopped), each crossing is refined within its step with the
+    Illinois variant of regula falsi, for every ball at once. Balls that are already inside the surface and still
+    heading into it, that don't land within max_time, or that cross where the surface isn't defined, don't land.
+
+    RK4 is exact for the ballistic part of the motion, and drag changes slowly over a flight, so the steps can be long.
+    They only need to be short next to the time a ball spends above the surface, as a ball that's only above it in
+    the middle of a step is missed.
+
+    If the covariances of the states are given, they're propagated through the Jacobian of the ballistic landing
+    solution (see landing_solver.propagate_landing_covariance), at the landing found with drag. Drag only changes that
+    Jacobian by about a percent, and the uncertainty in the drag coefficient itself isn't included.
+
+    Args:
+        states (np.ndarray): States [x, y, z, vx, vy, vz, k] (N, 7). States without k (N, 6) get DRAG_COEFFICIENT.
+        surface (LandingSurface): The surface to land on.
+        covariances (np.ndarray): Covariance of each state (N, 6, 6) or (N, 7, 7).
+        step (float): RK4 step {s}.
+        max_time (float): Longest time to look ahead for a landing {s}.
+        tolerance (float): Root finding stops once |S| at every crossing is within this.
+        iterations (int): Most root finding iterations.
+
+    Returns:
+        LandingSolution: The landing time, position and velocity of each ball (and their covariance).
+    """
+    states = np.asarray(states, dtype=float)
+    if states.shape[1] == 6:
+        states = np.hstack((states, np.full((len(states), 1), DRAG_COEFFICIENT)))
+
+    num_balls = len(states)
+
+    # The state at the start of the step where each ball crosses the surface, and S at either end of that step
+    crossing_states = np.zeros((num_balls, 7))
+    crossing_values = np.zeros((num_balls, 2))
+    crossing_times = np.full(num_balls, np.nan)
+
+    # Balls still in the air, their state at the start of the current step and the value of S there
+    flying = np.arange(num_balls)
+    current = states
+    values = surface.value(states[:, :3])
+    elapsed = 0.0
+
+    while len(flying) and elapsed < max_time:
+        stepped = rk4_step(current, step)
+        stepped_values = surface.value(stepped[:, :3])
+
+        crossed = (values > 0.0) & (stepped_values <= 0.0)
+        inside = stepped_values <= 0.0
+        elapsed += step
+        if not np.any(inside):
+            current, values = stepped, stepped_values
+            continue
+
+        landed = flying[crossed]
+        crossing_states[landed] = current[crossed]
+        crossing_values[landed, 0] = values[crossed]
+        crossing_values[landed, 1] = stepped_values[crossed]
+        crossing_times[landed] = elapsed - step
+
+        # Stop following balls that have landed, and balls inside the surface that are heading further into it
+        inside &= ~crossed
+        stopped = crossed
+        if np.any(inside):
+            heading_in = np.einsum('ij,ij->i', surface.gradient(stepped[inside, :3]), stepped[inside, 3:6]) <= 0.0
+            stopped[np.flatnonzero(inside)[heading_in]] = True
+
+        keep = ~stopped
+        flying, current, values = flying[keep], stepped[keep], stepped_values[keep]
+
+    # Refine every crossing at once
+    times = np.full(num_balls, np.nan)
+    landing_states = np.full((num_balls, 7), np.nan)
+    landed = np.flatnonzero(np.isfinite(crossing_times))
+    if len(landed):
+        tau = refine_crossing(crossing_states[landed], surface, crossing_values[landed, 0],
+                              crossing_values[landed, 1], step, tolerance, iterations)
+        times[landed] = crossing_times[landed] + tau
+        landing_states[landed] = rk4_step(crossing_states[landed], tau)
+
+    valid = np.isfinite(times)
+    landing_positions, landing_velocities = landing_states[:, :3], landing_states[:, 3:6]
+
+    landing_covariances = None
+    if covariances is not None:
+        landing_covariances = propagate_landing_covariance(surface, times, landing_positions, landing_velocities,
+                                                           np.asarray(covariances)[:, :6, :6])
+
+    return LandingSolution(valid, times, landing_positions, landing_velocities, landing_covariances)
+
+
+def refine_crossing(states: np.ndarray, surface: LandingSurface, start_values: np.ndarray, end_values: np.ndarray,
+                    step: float, tolerance: float, iterations: int) -> np.ndarray:
+    """
+    Find when within a step each of a set of states crosses the surface, given S at either end of the step (positive at
+    the start, not positive at the end). The states between are found with a single RK4 step from the start.
+    Stops after the given number of iterations, or once every |S| is within the tolerance.
+
+    Returns:
+        np.ndarray: Time of each crossing after the start of the step (N,) {s}. NaN where S isn't defined there.
+    """
+    lo, hi = np.zeros(len(states)), np.full(len(states), step)
+    f_lo, f_hi = start_values.copy(), end_values.copy()
+    side = np.zeros(len(states))  # Which end was moved last (-1 lo, 1 hi)
+
+    for _ in range(iterations):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tau = np.clip(hi - f_hi * (hi - lo) / (f_hi - f_lo), lo, hi)
+        f = surface.value(rk4_step(states, tau)[:, :3])
+
+        # Keep the root bracketed, halving the value at an end that's kept twice in a row so that it still moves
+        move_hi = f <= 0.0
+        f_lo = np.where(move_hi & (side == 1), 0.5 * f_lo, f_lo)
+        f_hi = np.where(~move_hi & (side == -1), 0.5 * f_hi, f_hi)
+        lo, f_lo = np.where(move_hi, lo, tau), np.where(move_hi, f_lo, f)
+        hi, f_hi = np.where(move_hi, tau, hi), np.where(move_hi, f, f_hi)
+        side = np.where(move_hi, 1, -1)
+
+        if np.all(np.abs(f) <= tolerance):
+            break
+
+    return np.where(np.isfinite(f), tau, np.nan)
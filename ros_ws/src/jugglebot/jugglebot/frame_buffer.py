@@ -0,0 +1,102 @@
+# frame_buffer.py
+
+import numpy as np
+from typing import Iterator, Tuple
+
+
+class FrameRingBuffer:
+    """
+    Single-producer/single-consumer ring buffer of mocap frames.
+
+    The producer (the QTM asyncio thread) writes each frame into a preallocated slot and then advances the write
+    index. The consumer (the ROS node) reads slots up to the write index and then advances the read index. Each index
+    is only ever written by one side, and a slot is only handed over once it's been fully written, so no lock is
+    needed and the markers are never copied between threads.
+
+    If the consumer falls behind and the buffer fills up, new frames are dropped (and counted) rather than
+    overwriting a slot that the consumer might be reading.
+
+    Each slot holds:
+        frame_number   QTM frame number
+        timestamp      QTM capture timestamp {us}
+        receive_time   Host time that the frame was received {ns}
+        markers        Up to max_markers rows of (x, y, z, residual) {mm}
+    """
+
+    def __init__(self, capacity: int = 64, max_markers: int = 64):
+        """
+        Args:
+            capacity (int): Number of frames that can be waiting for the consumer.
+            max_markers (int): Most markers that will be stored for one frame. Any more are dropped.
+        """
+        self.capacity = capacity
+        self.max_markers = max_markers
+
+        self.frame_numbers = np.zeros(capacity, dtype=np.int64)
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.receive_times = np.zeros(capacity, dtype=np.int64)
+        self.marker_counts = np.zeros(capacity, dtype=np.int64)
+        self.markers = np.zeros((capacity, max_markers, 4))
+
+        # Total number of frames written/read. Only the producer writes _write_count and only the consumer writes
+        # _read_count
+        self._write_count = 0
+        self._read_count = 0
+
+        # Producer-side counts of frames that couldn't be stored
+        self.overflow_count = 0
+        self.truncated_count = 0
+
+    def push(self, frame_number: int, timestamp: int, receive_time: int, markers: np.ndarray) -> bool:
+        """
+        Write a frame into the buffer. Only call this from the producer thread.
+
+        Args:
+            frame_number (int): QTM frame number.
+            timestamp (int): QTM capture timestamp {us}.
+            receive_time (int): Host time that the frame was received {ns}.
+            markers (np.ndarray): (N, 4) array of marker positions and residuals.
+
+        Returns:
+            bool: True if the frame was stored, False if the buffer was full.
+        """
+        if self._write_count - self._read_count >= self.capacity:
+            self.overflow_count += 1
+            return False
+
+        slot = self._write_count % self.capacity
+        count = min(len(markers), self.max_markers)
+        if count < len(markers):
+            self.truncated_count += 1
+
+        self.frame_numbers[slot] = frame_number
+        self.timestamps[slot] = timestamp
+        self.receive_times[slot] = receive_time
+        self.marker_counts[slot] = count
+        self.markers[slot, :count] = markers[:count]
+
+        # Publish the slot to the consumer only once it's fully written
+        self._write_count += 1
+        return True
+
+    def drain(self) -> Iterator[Tuple[int, int, int, np.ndarray]]:
+        """
+        Read every frame that's waiting, oldest first. Only call this from the consumer thread.
+
+        The markers are a view into the buffer, which is only valid until the next frame is requested. Copy them if
+        they need to be kept.
+
+        Yields:
+            Tuple[int, int, int, np.ndarray]: (frame_number, timestamp, receive_time, markers)
+        """
+        while self._read_count < self._write_count:
+            slot = self._read_count % self.capacity
+            count = self.marker_counts[slot]
+            yield (int(self.frame_numbers[slot]), int(self.timestamps[slot]), int(self.receive_times[slot]),
+                   self.markers[slot, :count])
+
+            # Hand the slot back to the producer
+            self._read_count += 1
+
+    def __len__(self) -> int:
+        return self._write_count - self._read_count
@@ -0,0 +1,176 @@
+"""
+Helpers for caching the robot geometry on disk.
+
+The geometry is saved as a .npz file keyed by a hash of the parameters it was built from, alongside a small
+'latest.json' file that records which hash (and version) was built most recently. This lets nodes that need the
+geometry (eg. sp_ik) start straight from the cache instead of waiting for the robot_geometry node to come up.
+The latched 'robot_geometry_topic' then keeps them up to date if the geometry changes while they're running.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+# Bump this if the way the geometry is built changes, so that stale cache files are never loaded
+GEOMETRY_FORMAT_VERSION = 1
+
+GEOMETRY_CACHE_DIR = os.environ.get('JUGGLEBOT_GEOMETRY_CACHE_DIR',
+                                    os.path.join(os.path.expanduser('~'), '.jugglebot', 'geometry_cache'))
+
+# The arrays (and their shapes) that make up the geometry. Strokes are stored as 0-d arrays
+GEOMETRY_SHAPES = {
+    'start_pos': (3, 1),
+    'base_nodes': (6, 3),
+    'init_plat_nodes': (6, 3),
+    'init_arm_nodes': (6, 3),
+    'init_hand_nodes': (3, 3),
+    'init_leg_lengths': (6,),
+    'leg_stroke': (),
+    'hand_stroke': (),
+}
+
+# The arrays that the offline calibration replaces (see geometry_calibration.py)
+CALIBRATED_KEYS = ('base_nodes', 'init_plat_nodes', 'init_leg_lengths')
+
+
+def hash_geometry_parameters(parameters: Dict[str, float]) -> str:
+    """
+    Hash the parameters that the geometry is built from.
+
+    Args:
+        parameters: Dictionary of parameter names to values (eg. {'base_radius': 410.0, ...}).
+
+    Returns:
+        str: Hex digest that identifies this set of parameters.
+    """
+    keyed = {'format_version': GEOMETRY_FORMAT_VERSION, **parameters}
+    return hashlib.sha1(json.dumps(keyed, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def geometry_from_message(msg) -> Dict[str, np.ndarray]:
+    """
+    Rebuild the geometry arrays from a RobotGeometryMessage (or a GetRobotGeometry response).
+
+    Returns:
+        Dict[str, np.ndarray]: The geometry arrays, shaped as in GEOMETRY_SHAPES.
+    """
+    return {key: np.asarray(getattr(msg, key), dtype=float).reshape(shape) for key, shape in GEOMETRY_SHAPES.items()}
+
+
+def save_geometry(geometry: Dict[str, np.ndarray], geometry_hash: str, version: int,
+                  cache_dir: str = GEOMETRY_CACHE_DIR) -> str:
+    """
+    Save the geometry to the cache and mark it as the latest geometry.
+
+    Files are written to a temporary path and then moved into place so that a reader never sees a partial file.
+
+    Args:
+        geometry: The geometry arrays, keyed as in GEOMETRY_SHAPES.
+        geometry_hash: Hash of the parameters that the geometry was built from.
+        version: Version number of this geometry.
+        cache_dir: Directory to save the geometry into.
+
+    Returns:
+        str: Path of the saved .npz file.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    file_path = os.path.join(cache_dir, f'geometry_{geometry_hash}.npz')
+
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **{key: np.asarray(geometry[key], dtype=float) for key in GEOMETRY_SHAPES})
+    os.replace(tmp_path, file_path)
+
+    latest_path = os.path.join(cache_dir, 'latest.json')
+    with open(latest_path + '.tmp', 'w') as f:
+        json.dump({'geometry_hash': geometry_hash, 'version': version}, f)
+    os.replace(latest_path + '.tmp', latest_path)
+
+    return file_path
+
+
+def load_geometry(geometry_hash: str, cache_dir: str = GEOMETRY_CACHE_DIR) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Load the geometry with the given hash from the cache.
+
+    Returns:
+        Optional[Dict[str, np.ndarray]]: The geometry arrays, or None if they aren't cached (or the file is unreadable).
+    """
+    file_path = os.path.join(cache_dir, f'geometry_{geometry_hash}.npz')
+    try:
+        with np.load(file_path) as data:
+            return {key: data[key].reshape(shape) for key, shape in GEOMETRY_SHAPES.items()}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def load_latest_geometry(cache_dir: str = GEOMETRY_CACHE_DIR) -> Optional[Tuple[str, int, Dict[str, np.ndarray]]]:
+    """
+    Load the most recently built geometry from the cache.
+
+    Returns:
+        Optional[Tuple[str, int, Dict[str, np.ndarray]]]: (geometry_hash, version, geometry), or None if nothing has
+                                                          been cached yet.
+    """
+    try:
+        with open(os.path.join(cache_dir, 'latest.json'), 'r') as f:
+            latest = json.load(f)
+        geometry_hash, version = latest['geometry_hash'], latest['version']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    geometry = load_geometry(geometry_hash, cache_dir)
+    if geometry is None:
+        return None
+
+    return geometry_hash, version, geometry
+
+
+def latest_geometry_version(cache_dir: str = GEOMETRY_CACHE_DIR) -> Tuple[Optional[str], int]:
+    """
+    Get the hash and version of the most recently built geometry.
+
+    Returns:
+        Tuple[Optional[str], int]: (geometry_hash, version). (None, 0) if nothing has been cached yet.
+    """
+    try:
+        with open(os.path.join(cache_dir, 'latest.json'), 'r') as f:
+            latest = json.load(f)
+        return latest['geometry_hash'], latest['version']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, 0
+
+
+def next_geometry_version(geometry_hash: str, cache_dir: str = GEOMETRY_CACHE_DIR) -> int:
+    """
+    Get the version number for a geometry: the same as the latest geometry's if it's the same geometry, or the next
+    one if the geometry has changed since it was last built.
+
+    Args:
+        geometry_hash: Hash of the parameters that the geometry is built from.
+        cache_dir: Directory that the geometry is cached in.
+
+    Returns:
+        int: The version number.
+    """
+    last_hash, last_version = latest_geometry_version(cache_dir)
+    return last_version if geometry_hash == last_hash else last_version + 1
+
+
+def load_calibration(file_path: str) -> Dict[str, np.ndarray]:
+    """
+    Load the calibrated arrays (CALIBRATED_KEYS) from a file saved by the offline geometry calibration.
+
+    Args:
+        file_path: Path of the calibrated geometry (.npz).
+
+    Returns:
+        Dict[str, np.ndarray]: The calibrated arrays, shaped as in GEOMETRY_SHAPES.
+
+    Raises:
+        OSError, KeyError or ValueError: If the file can't be read, or doesn't hold the calibrated arrays.
+    """
+    with np.load(file_path) as data:
+        return {key: data[key].reshape(GEOMETRY_SHAPES[key]) for key in CALIBRATED_KEYS}
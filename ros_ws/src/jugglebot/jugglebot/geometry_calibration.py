@@ -0,0 +1,223 @@
+"""
+Offline kinematic calibration of the Stewart platform.
+
+Takes recorded pairs of (six leg positions from the encoders, platform pose measured by the mocap system) and solves
+a nonlinear least-squares problem for the geometry that best explains them:
+    - base_nodes        (6x3) Base frame
+    - init_plat_nodes   (6x3) Platform frame
+    - init_leg_lengths  (6)   Length of each leg when its encoder reads zero {mm}
+
+That's 42 parameters. The calibrated geometry is saved in the same .npz format as the geometry cache, so it can be
+given to the robot_geometry node with the 'calibration_file' parameter:
+    ros2 run jugglebot robot_geometry --ros-args -p calibration_file:=/path/to/calibrated_geometry.npz
+
+The recorded data can be a .csv (with a header row) or a .npz file with these columns/arrays:
+    leg_0 ... leg_5   Leg positions, as published on 'legs_target_topic' (+ve is extension) {rev}
+    x, y, z           Position of the platform origin in the base frame, including the start position {mm}
+    qw, qx, qy, qz    Orientation of the platform in the base frame
+
+This runs offline, so nothing here adds any cost to the control loop.
+"""
+
+import argparse
+import numpy as np
+import quaternion  # numpy quaternion
+from scipy.optimize import least_squares
+from typing import Dict, Tuple
+
+from .geometry_cache import GEOMETRY_SHAPES, load_latest_geometry
+from .kinematics import LEG_MM_PER_REV, leg_vectors
+
+LEG_COLUMNS = [f'leg_{leg}' for leg in range(6)]
+POSE_COLUMNS = ['x', 'y', 'z', 'qw', 'qx', 'qy', 'qz']
+
+
+def load_calibration_data(file_path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load recorded (leg position, platform pose) pairs.
+
+    Args:
+        file_path: Path to a .csv or .npz file with the columns described in the module docstring.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Leg lengths relative to zero encoder position (N, 6) {mm},
+                                                   platform positions (N, 3) {mm} and rotation matrices (N, 3, 3).
+    """
+    if file_path.endswith('.npz'):
+        with np.load(file_path) as data:
+            columns = {name: np.asarray(data[name], dtype=float) for name in LEG_COLUMNS + POSE_COLUMNS}
+    else:
+        data = np.genfromtxt(file_path, delimiter=',', names=True)
+        columns = {name: np.asarray(data[name], dtype=float) for name in LEG_COLUMNS + POSE_COLUMNS}
+
+    leg_positions_mm = np.column_stack([columns[name] for name in LEG_COLUMNS]) * LEG_MM_PER_REV
+    positions = np.column_stack((columns['x'], columns['y'], columns['z']))
+    quats = np.column_stack((columns['qw'], columns['qx'], columns['qy'], columns['qz']))
+    quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+    rotations = quaternion.as_rotation_matrix(quaternion.as_quat_array(quats))
+
+    return leg_positions_mm, positions, rotations
+
+
+def pack_parameters(base_nodes: np.ndarray, plat_nodes: np.ndarray, leg_offsets: np.ndarray) -> np.ndarray:
+    """Pack the geometry into a flat parameter vector: [base_nodes (18), plat_nodes (18), leg_offsets (6)]"""
+    return np.concatenate((base_nodes.ravel(), plat_nodes.ravel(), leg_offsets.ravel()))
+
+
+def unpack_parameters(params: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Unpack a flat parameter vector into (base_nodes (6x3), plat_nodes (6x3), leg_offsets (6))"""
+    return params[:18].reshape(6, 3), params[18:36].reshape(6, 3), params[36:42]
+
+
+def leg_residuals(params: np.ndarray, leg_positions_mm: np.ndarray, positions: np.ndarray,
+                  rotations: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the difference between the leg lengths implied by the measured poses and the measured leg lengths.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Residuals (N, 6) {mm}, unit leg vectors (N, 6, 3) in the base
+                                                   frame and the platform nodes rotated into the base frame (N, 6, 3).
+    """
+    base_nodes, plat_nodes, leg_offsets = unpack_parameters(params)
+
+    # Legs for every sample at once. (N, 6, 3)
+    legs, rotated_plat_nodes = leg_vectors(positions, rotations, base_nodes, plat_nodes)
+    leg_lengths = np.linalg.norm(legs, axis=2)
+    unit_legs = legs / leg_lengths[:, :, np.newaxis]
+
+    residuals = leg_lengths - (leg_offsets[np.newaxis, :] + leg_positions_mm)
+
+    return residuals, unit_legs, rotated_plat_nodes
+
+
+class GeometryCalibrator:
+    """
+    Solves for the geometry that best fits the recorded data.
+
+    The fit is regularized towards the nominal geometry so that parameters that the data doesn't excite (eg. if the
+    recorded poses don't include much rotation) stay close to their nominal values rather than wandering off.
+    """
+
+    def __init__(self, nominal_geometry: Dict[str, np.ndarray], node_prior_std: float = 10.0,
+                 leg_offset_prior_std: float = 10.0):
+        """
+        Args:
+            nominal_geometry: The geometry to start from (eg. as loaded from the geometry cache).
+            node_prior_std: How far the nodes are expected to be from their nominal positions {mm}.
+            leg_offset_prior_std: How far the leg offsets are expected to be from their nominal values {mm}.
+        """
+        self.nominal_geometry = nominal_geometry
+        self.nominal_params = pack_parameters(nominal_geometry['base_nodes'], nominal_geometry['init_plat_nodes'],
+                                              nominal_geometry['init_leg_lengths'])
+
+        self.prior_weights = np.concatenate((np.full(36, 1.0 / node_prior_std), np.full(6, 1.0 / leg_offset_prior_std)))
+
+    def residuals(self, params, leg_positions_mm, positions, rotations, measurement_std):
+        residuals, _, _ = leg_residuals(params, leg_positions_mm, positions, rotations)
+        prior = (params - self.nominal_params) * self.prior_weights
+        return np.concatenate((residuals.ravel() / measurement_std, prior))
+
+    def jacobian(self, params, leg_positions_mm, positions, rotations, measurement_std):
+        """Analytical Jacobian of the residuals with respect to the parameters"""
+        _, unit_legs, _ = leg_residuals(params, leg_positions_mm, positions, rotations)
+        num_samples = unit_legs.shape[0]
+        legs = np.arange(6)
+
+        jac = np.zeros((num_samples, 6, 42))
+        # d(length_i)/d(base_node_i) = -u_i
+        for axis in range(3):
+            jac[:, legs, legs * 3 + axis] = -unit_legs[:, :, axis]
+        # d(length_i)/d(plat_node_i) = R^T u_i
+        plat_gradients = np.einsum('nji,nkj->nki', rotations, unit_legs)
+        for axis in range(3):
+            jac[:, legs, 18 + legs * 3 + axis] = plat_gradients[:, :, axis]
+        # d(residual_i)/d(leg_offset_i) = -1
+        jac[:, legs, 36 + legs] = -1.0
+
+        return np.vstack((jac.reshape(num_samples * 6, 42) / measurement_std, np.diag(self.prior_weights)))
+
+    def calibrate(self, leg_positions_mm: np.ndarray, positions: np.ndarray, rotations: np.ndarray,
+                  measurement_std: float = 1.0) -> Tuple[Dict[str, np.ndarray], Dict[str, float]]:
+        """
+        Solve for the calibrated geometry.
+
+        Args:
+            leg_positions_mm: Leg positions relative to zero encoder position (N, 6) {mm}.
+            positions: Measured platform positions in the base frame (N, 3) {mm}.
+            rotations: Measured platform rotation matrices (N, 3, 3).
+            measurement_std: Expected error in the measured leg lengths {mm}. Sets the weight of the data vs the prior.
+
+        Returns:
+            Tuple[Dict[str, np.ndarray], Dict[str, float]]: The calibrated geometry (keyed as in GEOMETRY_SHAPES) and
+                                                            a summary of the fit.
+        """
+        args = (leg_positions_mm, positions, rotations, measurement_std)
+
+        initial_residuals, _, _ = leg_residuals(self.nominal_params, leg_positions_mm, positions, rotations)
+        result = least_squares(self.residuals, self.nominal_params, jac=self.jacobian, args=args, method='trf',
+                               x_scale='jac')
+        final_residuals, _, _ = leg_residuals(result.x, leg_positions_mm, positions, rotations)
+
+        base_nodes, plat_nodes, leg_offsets = unpack_parameters(result.x)
+        geometry = {key: np.asarray(self.nominal_geometry[key], dtype=float) for key in GEOMETRY_SHAPES}
+        geometry['base_nodes'] = base_nodes
+        geometry['init_plat_nodes'] = plat_nodes
+        geometry['init_leg_lengths'] = leg_offsets
+
+        summary = {
+            'num_samples': int(leg_positions_mm.shape[0]),
+            'initial_rms_mm': float(np.sqrt(np.mean(initial_residuals ** 2))),
+            'final_rms_mm': float(np.sqrt(np.mean(final_residuals ** 2))),
+            'max_node_change_mm': float(np.max(np.abs(result.x[:36] - self.nominal_params[:36]))),
+            'max_leg_offset_change_mm': float(np.max(np.abs(result.x[36:] - self.nominal_params[36:]))),
+            'converged': bool(result.success),
+        }
+
+        return geometry, summary
+
+
+def save_calibrated_geometry(file_path: str, geometry: Dict[str, np.ndarray], summary: Dict[str, float]):
+    """Save the calibrated geometry in the geometry cache format (plus the fit summary)"""
+    np.savez(file_path, **{key: np.asarray(geometry[key], dtype=float) for key in GEOMETRY_SHAPES},
+             final_rms_mm=summary['final_rms_mm'], num_samples=summary['num_samples'])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Calibrate the platform geometry from recorded leg positions and '
+                                                 'mocap-measured platform poses.')
+    parser.add_argument('data', help='Recorded (leg positions, platform pose) pairs (.csv or .npz)')
+    parser.add_argument('-o', '--output', default='calibrated_geometry.npz', help='Where to save the geometry')
+    parser.add_argument('--nominal', default=None,
+                        help='Geometry to start from (.npz). Defaults to the latest geometry in the geometry cache')
+    parser.add_argument('--measurement-std', type=float, default=1.0, help='Expected leg length error {mm}')
+    parser.add_argument('--node-prior-std', type=float, default=10.0, help='Expected node position error {mm}')
+    parser.add_argument('--leg-offset-prior-std', type=float, default=10.0, help='Expected leg offset error {mm}')
+    parsed = parser.parse_args(args)
+
+    if parsed.nominal is not None:
+        with np.load(parsed.nominal) as data:
+            nominal_geometry = {key: data[key].reshape(shape) for key, shape in GEOMETRY_SHAPES.items()}
+    else:
+        latest = load_latest_geometry()
+        if latest is None:
+            parser.error('No cached geometry found. Run the robot_geometry node first, or pass --nominal')
+        _, _, nominal_geometry = latest
+
+    leg_positions_mm, positions, rotations = load_calibration_data(parsed.data)
+
+    calibrator = GeometryCalibrator(nominal_geometry, node_prior_std=parsed.node_prior_std,
+                                    leg_offset_prior_std=parsed.leg_offset_prior_std)
+    geometry, summary = calibrator.calibrate(leg_positions_mm, positions, rotations,
+                                             measurement_std=parsed.measurement_std)
+
+    save_calibrated_geometry(parsed.output, geometry, summary)
+
+    print(f"Calibrated from {summary['num_samples']} samples. "
+          f"RMS leg length error: {summary['initial_rms_mm']:.3f} mm -> {summary['final_rms_mm']:.3f} mm")
+    print(f"Largest node change: {summary['max_node_change_mm']:.2f} mm, "
+          f"largest leg offset change: {summary['max_leg_offset_change_mm']:.2f} mm")
+    print(f'Saved calibrated geometry to {parsed.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,27 @@
 import numpy as np
 from typing import Optional, Tuple
 
+from .drag_model import DRAG_COEFFICIENT, integrate, integrate_with_jacobian
+from .landing_solver import GRAVITY, PlaneSurface, solve_landing
+
+
+def assemble_axis_covariances(axis_covariances: np.ndarray) -> np.ndarray:
+    """
+    Assemble covariance matrices of [x, y, z, vx, vy, vz] from their per-axis [position, velocity] blocks.
+
+    Args:
+        axis_covariances (np.ndarray): Covariance of [position, velocity] on each axis (..., 3, 2, 2).
+
+    Returns:
+        np.ndarray: The full covariance matrices (..., 6, 6).
+    """
+    covariances = np.zeros(axis_covariances.shape[:-3] + (6, 6))
+    axes = np.arange(3)
+    for row in range(2):
+        for column in range(2):
+            covariances[..., axes + 3 * row, axes + 3 * column] = axis_covariances[..., row, column]
+    return covariances
+
 
 class KalmanFilter:
     """
@@ -10,9 +31,15 @@ class KalmanFilter:
 
     Note units are mm and seconds.
 
+    The motion model doesn't couple the axes (gravity only acts on z, and the noise is the same and uncorrelated on
+    every axis), so the filter runs as three independent [position, velocity] filters, one per axis. Their covariances
+    are kept as three 2x2 blocks and stepped together. Everything that only depends on dt is computed once, and the
+    covariance update uses the Joseph form so that it stays symmetric and positive definite.
+
     Attributes:
         state (np.ndarray): The state vector [x, y, z, vx, vy, vz].
-        covariance (np.ndarray): The state covariance matrix.
+        covariance (np.ndarray): The state covariance matrix (assembled from axis_covariance).
+        axis_covariance (np.ndarray): The covariance of [position, velocity] on each axis (3x2x2).
         Q (np.ndarray): The process noise covariance matrix.
         R (np.ndarray): The measurement noise covariance matrix.
         initialized (bool): Flag indicating if the filter has been initialized.
@@ -23,8 +50,9 @@ class KalmanFilter:
         Initializes the Kalman Filter with default parameters.
 
         Args:
-            dt (float): Time step between measurements in seconds. Default is ~300 Hz.
-            process_noise (float): Variance of the process noise.
+            dt (float): Nominal time step between measurements in seconds. Default is ~300 Hz.
+            process_noise (float): Variance of the process noise over one nominal time step. Over other time steps,
+                                   it's scaled in proportion to the step.
             measurement_noise (float): Variance of the measurement noise.
             logger: Logger for debugging.
         """
@@ -33,8 +61,9 @@ class KalmanFilter:
         # State vector: [x, y, z, vx, vy, vz]
         self.state = np.zeros((6, 1))  # Initialized to zero; will be set on first measurement
 
-        # State covariance matrix
-        self.covariance = np.eye(6) * 500.0  # Large initial uncertainty
+        # State covariance, as a [position, velocity] block for each axis
+        self.initial_covariance = 500.0  # Large initial uncertainty
+        self.axis_covariance = np.tile(np.eye(2) * self.initial_covariance, (3, 1, 1))
 
         # Initialize the state transition matrices
         self.F = np.array([
@@ -47,10 +76,20 @@ class KalmanFilter:
         ])
 
         # Process noise covariance
+        self.process_noise = process_noise
         self.Q = np.eye(6) * process_noise
 
+        # Per-axis transition, effect of gravity (B @ u, with u the gravity acceleration) and process noise over one
+        # nominal step. Other steps are built as they're needed (see transition)
+        self.F_axis, self.gravity_step, self.Q_axis = self.transition(self.dt)
+
         # Measurement noise covariance
         self.R = np.eye(3) * measurement_noise
+        self.measurement_noise = measurement_noise
+
+        # H picks the position out of each axis' [position, velocity]. Used to build I - K @ H in the update
+        self.H_axis = np.array([1.0, 0.0])
+        self.I_axis = np.eye(2)
 
         # Flag to indicate if the filter has been initialized with the first measurement
         self.initialized = False
@@ -58,6 +97,29 @@ class KalmanFilter:
         # Logging setup
         self.logger = logger
 
+    def transition(self, dt: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Build the model for a time step.
+
+        Args:
+            dt (float): Time step in seconds.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Per-axis state transition matrix (2x2), change in the state
+                                                       due to gravity (6x1) and per-axis process noise (3x2x2).
+        """
+        F_axis = np.array([[1.0, dt], [0.0, 1.0]])
+        gravity_step = np.array([[0], [0], [0.5 * GRAVITY * dt**2], [0], [0], [GRAVITY * dt]])
+        Q_axis = np.tile(np.eye(2) * (self.process_noise * dt / self.dt), (3, 1, 1))
+        return F_axis, gravity_step, Q_axis
+
+    @property
+    def covariance(self) -> np.ndarray:
+        """
+        The full 6x6 state covariance matrix, assembled from the per-axis blocks.
+        """
+        return assemble_axis_covariances(self.axis_covariance)
+
     def initialize_with_state(self, initial_state: np.ndarray):
         """
         Initializes the filter with a given state vector.
@@ -69,39 +131,33 @@ class KalmanFilter:
             self.logger.error("Initial state must be a 6x1 vector.")
             raise ValueError("Invalid initial state shape.")
 
-        self.state = initial_state
+        self.state = initial_state.astype(float)
         self.initialized = True
         # self.logger.info(f"Filter initialized with state: {self.state.ravel()}")
 
-    def predict(self):
+    def predict(self, dt: Optional[float] = None):
         """
         Performs the prediction step of the Kalman Filter.
+
+        Args:
+            dt (float): Time to predict forward by, in seconds. Defaults to the nominal time step.
         """
         if not self.initialized:
             self.logger.warning("Filter not initialized. Prediction skipped.")
             return
 
-        # Gravity acceleration in mm/s^2
-        gravity = -9810.0
-
-        # Control input (acceleration due to gravity)
-        u = np.array([[0], [0], [gravity]])
+        if dt is None or dt == self.dt:
+            dt = self.dt
+            F_axis, gravity_step, Q_axis = self.F_axis, self.gravity_step, self.Q_axis
+        else:
+            F_axis, gravity_step, Q_axis = self.transition(dt)
 
-        # Control input matrix
-        B = np.array([
-            [0.5 * self.dt**2, 0, 0],
-            [0, 0.5 * self.dt**2, 0],
-            [0, 0, 0.5 * self.dt**2],
-            [self.dt, 0, 0],
-            [0, self.dt, 0],
-            [0, 0, self.dt]
-        ])
+        # Predict the state: position += velocity * dt, plus gravity
+        self.state[:3] += dt * self.state[3:]
+        self.state += gravity_step
 
-        # Predict the state
-        self.state = self.F @ self.state + B @ u
-
-        # Predict the covariance
-        self.covariance = self.F @ self.covariance @ self.F.T + self.Q
+        # Predict the covariance of each axis
+        self.axis_covariance = F_axis @ self.axis_covariance @ F_axis.T + Q_axis
 
         # self.logger.debug(f"Predicted state: {self.state.ravel()}")
         # self.logger.debug(f"Predicted covariance: {self.covariance}")
@@ -121,74 +177,55 @@ class KalmanFilter:
             self.logger.warning("Filter not initialized. Update skipped.")
             return
 
-        # Compute the Kalman Gain
-        S = self.H @ self.covariance @ self.H.T + self.R
-        K = self.covariance @ self.H.T @ np.linalg.inv(S)
+        P = self.axis_covariance
+
+        # Innovation covariance. S = H @ P @ H.T + R is diagonal (one variance per axis), so its Cholesky factor is
+        # just the square root of each variance, and solving with it is a division
+        S = P[:, 0, 0] + self.measurement_noise
+
+        # Kalman gain for [position, velocity] on each axis: K = P @ H.T / S
+        K = P[:, :, 0] / S[:, np.newaxis]
 
         # Update the state with the measurement
-        y = measurement - (self.H @ self.state)
-        self.state = self.state + K @ y
+        y = measurement.ravel() - self.state[:3, 0]
+        self.state[:3, 0] += K[:, 0] * y
+        self.state[3:, 0] += K[:, 1] * y
 
-        # Update the covariance
-        I = np.eye(self.F.shape[0])
-        self.covariance = (I - K @ self.H) @ self.covariance
+        # Update the covariance (Joseph form): P = (I - K @ H) @ P @ (I - K @ H).T + K @ R @ K.T
+        A = self.I_axis - K[:, :, np.newaxis] * self.H_axis
+        KRKt = self.measurement_noise * K[:, :, np.newaxis] * K[:, np.newaxis, :]
+        self.axis_covariance = A @ P @ A.transpose(0, 2, 1) + KRKt
 
         # self.logger.debug(f"Updated state: {self.state.ravel()}")
         # self.logger.debug(f"Updated covariance: {self.covariance}")
 
-    def predict_landing_state(self, ground_z: float = 0.0) -> Optional[Tuple[Tuple[float, float], float]]:
+    def predict_landing_state(self, ground_z: float = 0.0):
         """
-        Predicts the landing position (x, y) and time when the marker will reach the specified ground z-height.
+        Predicts where and when the marker will fall through the specified ground z-height.
 
         Args:
             ground_z (float): The z-height plane representing the ground.
 
         Returns:
-            Optional[Tuple[Tuple[float, float], float]]: The predicted landing position (x, y) and the time to land in seconds.
-                                                         Returns None if prediction is not feasible.
+            Optional[Tuple[Tuple[float, float], Tuple[float, float, float], float]]: The predicted landing position
+                (x, y), landing velocity (vx, vy, vz) and the time to land in seconds. None if prediction is not
+                feasible.
         """
         if not self.initialized:
             self.logger.info("Filter not initialized. Cannot predict landing.")
             return None
 
-        # Current state
-        x, y, z, vx, vy, vz = self.state.ravel()
-
-        # Solve for time when z + vz*t + 0.5*(-g)*t^2 = ground_z
-        a = -0.5 * 9810.0  # 0.5 * gravity in mm/s^2
-        b = vz
-        c = z - ground_z
-
-        discriminant = b**2 - 4 * a * c
-        if discriminant < 0:
-            self.logger.warning("No real solution for landing time.")
-            return None
-
-        sqrt_discriminant = np.sqrt(discriminant)
-        t1 = (-b + sqrt_discriminant) / (2 * a)
-        t2 = (-b - sqrt_discriminant) / (2 * a)
-
-        # Choose the positive and smallest time
-        time_to_land = min(t for t in [t1, t2] if t > 0) if any(t > 0 for t in [t1, t2]) else None
-
-        if time_to_land is None:
-            self.logger.warning("No positive landing time found.")
+        solution = solve_landing(self.state.ravel(), PlaneSurface((0.0, 0.0, ground_z)))
+        if not solution.valid[0]:
+            # Only warn when predictions start failing, rather than for every one
+            if not self.landing_failed:
+                self.logger.warning("No positive landing time found.")
+            self.landing_failed = True
             return None
 
-        # Predict landing positions
-        landing_x = x + vx * time_to_land
-        landing_y = y + vy * time_to_land
-        landing_pos = (landing_x, landing_y)
-
-        # Estimate the landing velocity
-        landing_vx = vx
-        landing_vy = vy
-        landing_vz = vz - 9810.0 * time_to_land
-        landing_vel = (landing_vx, landing_vy, landing_vz)
-
-        # self.logger.info(f"Predicted landing at ({landing_x}, {landing_y}) mm in {landing_time:.2f} seconds.")
-
-        return landing_pos, landing_vel, time_to_land
+        self.landing_failed = False
+        x, y, _ = solution.position[0]
+        return (x, y), tuple(solution.velocity[0]), solution.time[0]
 
     def get_current_position(self) -> np.ndarray:
         """
@@ -204,7 +241,7 @@ class KalmanFilter:
         Resets the filter to its initial state.
         """
         self.state = np.zeros((6, 1))
-        self.covariance = np.eye(6) * 500.0
+        self.axis_covariance = np.tile(np.eye(2) * self.initial_covariance, (3, 1, 1))
         self.initialized = False
         self.previous_velocity = np.zeros((3, 1))
         # self.logger.info("Kalman Filter has been reset.")
@@ -212,9 +249,413 @@ class KalmanFilter:
     # Initialize previous velocity
     previous_velocity = np.zeros((3, 1))
 
+    # Whether the latest landing prediction failed
+    landing_failed = False
+
     # Measurement matrix
     H = np.array([
         [1, 0, 0, 0, 0, 0],  # x
         [0, 1, 0, 0, 0, 0],  # y
         [0, 0, 1, 0, 0, 0]   # z
     ])
+
+
+class KalmanFilterBank:
+    """
+    A bank of Kalman Filters (with the same model as KalmanFilter) for tracking many markers at once.
+
+    The states of every filter are stacked into a (K, 6) array, and their covariances into (K, 3, 2, 2) per-axis
+    [position, velocity] blocks as in KalmanFilter, so predicting or updating every active filter is a handful of
+    element-wise operations. The innovation covariance of each axis is a scalar, so the Kalman gain is a division
+    rather than a solve. Filters are added and removed through slots (indices into the arrays). A removed slot is
+    reused by the next filter that's added, and the arrays double in size if every slot is in use.
+
+    Each filter's state is for a particular time (the time of its last measurement), and filters are predicted to
+    the exact time of each new measurement, so the time steps follow the mocap frames rather than a fixed rate.
+    Measurements are queued per slot with queue_measurement and then applied to every filter that has one with a
+    single call to update. state_at gives a filter's state at any other time (eg. now) without changing the filter.
+
+    Banks with a different motion model subclass this one, with their own state_size, covariance layout
+    (initial_state_covariance) and the steps that use it. covariance gives the full covariance matrix of a filter
+    whatever the layout.
+
+    Note units are mm and seconds.
+    """
+
+    state_size = 6  # [x, y, z, vx, vy, vz]
+
+    def __init__(self, dt: float, capacity: int = 16, process_noise: float = 1.0, measurement_noise: float = 3.0,
+                 initial_covariance: float = 500.0):
+        """
+        Args:
+            dt (float): Nominal time step in seconds, that process_noise is given for.
+            capacity (int): Number of slots to allocate to start with.
+            process_noise (float): Variance of the process noise over one nominal time step. Over other time steps,
+                                   it's scaled in proportion to the step.
+            measurement_noise (float): Variance of the measurement noise.
+            initial_covariance (float): Variance of each state variable when a filter is added.
+        """
+        self.dt = dt
+        self.initial_covariance = initial_covariance
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+
+        # Covariance of a new filter, as a [position, velocity] block for each axis
+        self.initial_state_covariance = np.tile(np.eye(2) * initial_covariance, (3, 1, 1))
+
+        # Used to build I - K @ H in the update, with H = [1, 0] picking the position out of each axis' block
+        self.H_axis = np.array([1.0, 0.0])
+        self.I_axis = np.eye(2)
+
+        # Stacked filters
+        self.states = np.zeros((capacity, self.state_size))
+        self.covariances = np.zeros((capacity,) + self.initial_state_covariance.shape)
+        self.times = np.zeros(capacity)  # Time that each filter's state is for {s}
+        self.active = np.zeros(capacity, dtype=bool)
+        self.free_slots = list(range(capacity - 1, -1, -1))  # Lowest slot is handed out first
+
+        # Measurements waiting for the next update
+        self.measurements = np.zeros((capacity, 3))
+        self.measurement_times = np.zeros(capacity)
+        self.has_measurement = np.zeros(capacity, dtype=bool)
+
+        self.stale_measurement_count = 0  # Measurements dropped for being older than their filter's state
+
+    def __len__(self) -> int:
+        """Number of active filters"""
+        return int(np.count_nonzero(self.active))
+
+    def grow(self):
+        """Double the number of slots"""
+        capacity = len(self.active)
+        self.states = np.vstack((self.states, np.zeros((capacity, self.state_size))))
+        self.covariances = np.concatenate((self.covariances, np.zeros_like(self.covariances)))
+        self.times = np.concatenate((self.times, np.zeros(capacity)))
+        self.active = np.concatenate((self.active, np.zeros(capacity, dtype=bool)))
+        self.measurements = np.vstack((self.measurements, np.zeros((capacity, 3))))
+        self.measurement_times = np.concatenate((self.measurement_times, np.zeros(capacity)))
+        self.has_measurement = np.concatenate((self.has_measurement, np.zeros(capacity, dtype=bool)))
+        self.free_slots = list(range(2 * capacity - 1, capacity - 1, -1)) + self.free_slots
+
+    def add(self, initial_state: np.ndarray, time: float) -> int:
+        """
+        Start a new filter.
+
+        Args:
+            initial_state (np.ndarray): The initial state vector [x, y, z, vx, vy, vz].
+            time (float): Time that the initial state is for {s}.
+
+        Returns:
+            int: The slot that the filter is in.
+        """
+        if not self.free_slots:
+            self.grow()
+
+        slot = self.free_slots.pop()
+        self.states[slot] = np.asarray(initial_state, dtype=float).ravel()
+        self.covariances[slot] = self.initial_state_covariance
+        self.times[slot] = time
+        self.active[slot] = True
+        self.has_measurement[slot] = False
+        return slot
+
+    def remove(self, slot: int):
+        """
+        Stop the filter in a slot, freeing the slot for reuse.
+        """
+        if self.active[slot]:
+            self.active[slot] = False
+            self.has_measurement[slot] = False
+            self.free_slots.append(slot)
+
+    def propagate_states(self, states: np.ndarray, dt: np.ndarray) -> np.ndarray:
+        """
+        Propagate a set of states over their own time steps with the motion model.
+
+        Args:
+            states (np.ndarray): States to propagate (N, state_size).
+            dt (np.ndarray): Time step for each state in seconds (N,). Can be negative.
+
+        Returns:
+            np.ndarray: The propagated states (N, state_size).
+        """
+        propagated = states.copy()
+        propagated[:, :3] += states[:, 3:6] * dt[:, np.newaxis]
+        propagated[:, 2] += 0.5 * GRAVITY * dt**2
+        propagated[:, 5] += GRAVITY * dt
+        return propagated
+
+    def propagate_covariances(self, axis_covariances: np.ndarray, dt: np.ndarray) -> np.ndarray:
+        """
+        Propagate a set of per-axis covariances over their own time steps: F @ P @ F.T + Q on each axis, with
+        F = [[1, dt], [0, 1]], written out element by element.
+
+        Args:
+            axis_covariances (np.ndarray): Per-axis covariances to propagate (N, 3, 2, 2).
+            dt (np.ndarray): Time step for each filter in seconds (N,). Can be negative.
+
+        Returns:
+            np.ndarray: The propagated per-axis covariances (N, 3, 2, 2).
+        """
+        P = axis_covariances
+        q = (self.process_noise * np.abs(dt) / self.dt)[:, np.newaxis]
+        dt = dt[:, np.newaxis]
+
+        propagated = np.empty_like(P)
+        propagated[:, :, 0, 0] = P[:, :, 0, 0] + dt * (P[:, :, 0, 1] + P[:, :, 1, 0] + dt * P[:, :, 1, 1]) + q
+        propagated[:, :, 0, 1] = P[:, :, 0, 1] + dt * P[:, :, 1, 1]
+        propagated[:, :, 1, 0] = P[:, :, 1, 0] + dt * P[:, :, 1, 1]
+        propagated[:, :, 1, 1] = P[:, :, 1, 1] + q
+        return propagated
+
+    def predict(self, slots: np.ndarray, times: np.ndarray):
+        """
+        Performs the prediction step for a set of filters, each to its own time.
+
+        Args:
+            slots (np.ndarray): Slots of the filters to predict (N,).
+            times (np.ndarray): Time to predict each filter to {s} (N,).
+        """
+        if len(slots) == 0:
+            return
+
+        dt = times - self.times[slots]
+        self.states[slots] = self.propagate_states(self.states[slots], dt)
+        self.covariances[slots] = self.propagate_covariances(self.covariances[slots], dt)
+        self.times[slots] = times
+
+    def queue_measurement(self, slot: int, measurement: np.ndarray, time: float):
+        """
+        Queue a measurement for the filter in a slot, to be applied by the next update.
+
+        Args:
+            slot (int): The slot of the filter.
+            measurement (np.ndarray): The measurement vector [x, y, z].
+            time (float): Time that the measurement was captured {s}.
+        """
+        self.measurements[slot] = np.asarray(measurement).ravel()
+        self.measurement_times[slot] = time
+        self.has_measurement[slot] = True
+
+    def take_measurements(self) -> np.ndarray:
+        """
+        Clears the queue of measurements, returning the slots of the active filters whose measurements are to be
+        applied. Measurements from before their filter's state are dropped.
+        """
+        queued = self.has_measurement & self.active
+        stale = queued & (self.measurement_times < self.times)
+        self.stale_measurement_count += int(np.count_nonzero(stale))
+
+        self.has_measurement[:] = False
+        return np.flatnonzero(queued & ~stale)
+
+    def update(self):
+        """
+        Predicts every active filter with a queued measurement to the time of its measurement, then performs the
+        update step for all of them and clears the queue. Measurements from before their filter's state are dropped.
+        """
+        slots = self.take_measurements()
+        if len(slots) == 0:
+            return
+
+        self.predict(slots, self.measurement_times[slots])
+
+        P = self.covariances[slots]
+
+        # Innovation variance of each axis (S = H @ P @ H.T + R), and the Kalman gain for its [position, velocity]:
+        # K = P @ H.T / S
+        S = P[:, :, 0, 0] + self.measurement_noise
+        K = P[:, :, :, 0] / S[:, :, np.newaxis]
+
+        y = self.measurements[slots] - self.states[slots, :3]
+        self.states[slots, :3] += K[:, :, 0] * y
+        self.states[slots, 3:6] += K[:, :, 1] * y
+
+        # Joseph form, as in KalmanFilter.update: P = (I - K @ H) @ P @ (I - K @ H).T + K @ R @ K.T
+        A = self.I_axis - K[:, :, :, np.newaxis] * self.H_axis
+        KRKt = self.measurement_noise * K[:, :, :, np.newaxis] * K[:, :, np.newaxis, :]
+        self.covariances[slots] = A @ P @ A.swapaxes(-1, -2) + KRKt
+
+    def get_state(self, slot: int) -> np.ndarray:
+        """
+        Returns the state vector [x, y, z, vx, vy, vz, ...] of the filter in a slot (a view, not a copy), as of the
+        time in times[slot].
+        """
+        return self.states[slot]
+
+    def covariance(self, slot: int) -> np.ndarray:
+        """
+        Returns the full state covariance matrix of the filter in a slot (state_size, state_size), as of the time in
+        times[slot].
+        """
+        return assemble_axis_covariances(self.covariances[slot])
+
+    def state_at(self, slot: int, time: float) -> np.ndarray:
+        """
+        Returns the state vector [x, y, z, vx, vy, vz, ...] that the filter in a slot predicts for a given time,
+        without changing the filter.
+        """
+        return self.propagate_states(self.states[slot:slot + 1], np.array([time - self.times[slot]]))[0]
+
+    def predict_states(self, slots: np.ndarray, time: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Predict the states and covariances of a set of filters at a given time, without changing the filters.
+
+        Args:
+            slots (np.ndarray): Slots of the filters (N,).
+            time (float): Time to predict to {s}.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: States (N, state_size) and covariances (N, state_size, state_size).
+        """
+        dt = time - self.times[slots]
+        states = self.propagate_states(self.states[slots], dt)
+        return states, assemble_axis_covariances(self.propagate_covariances(self.covariances[slots], dt))
+
+    def predict_measurements(self, slots: np.ndarray, time: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Predict where a set of filters expect their next measurement, for associating measurements with filters.
+        Doesn't change the filters.
+
+        Args:
+            slots (np.ndarray): Slots of the filters (N,).
+            time (float): Time of the measurement {s}.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Predicted position (N, 3) {mm} and innovation covariance, the covariance of
+                                           the predicted position plus the measurement noise (N, 3, 3) {mm^2}.
+        """
+        dt = time - self.times[slots]
+        states = self.states[slots]
+        positions = states[:, :3] + states[:, 3:] * dt[:, np.newaxis]
+        positions[:, 2] += 0.5 * GRAVITY * dt**2
+
+        # Position variance of each axis after the prediction, plus the measurement noise. The axes are independent,
+        # so the innovation covariance is diagonal
+        P = self.covariances[slots]
+        q = self.process_noise * np.abs(dt) / self.dt
+        dt = dt[:, np.newaxis]
+        variances = (P[:, :, 0, 0] + dt * (P[:, :, 0, 1] + P[:, :, 1, 0] + dt * P[:, :, 1, 1])
+                     + (q + self.measurement_noise)[:, np.newaxis])
+
+        S = np.zeros((len(slots), 3, 3))
+        axes = np.arange(3)
+        S[:, axes, axes] = variances
+        return positions, S
+
+
+class DragKalmanFilterBank(KalmanFilterBank):
+    """
+    A bank of extended Kalman Filters for balls with quadratic air drag (see drag_model), for predicting landings more
+    precisely than the ballistic model can on long or fast throws.
+
+    Each filter also estimates its ball's drag coefficient k, as a seventh state [x, y, z, vx, vy, vz, k]. k starts
+    from a prior for a typical juggling ball and is learned from how the trajectory bends away from a parabola. States
+    are propagated with RK4, and covariances through the Jacobian of that (drag_model.integrate_with_jacobian).
+    Filters added with a 6 element state get the prior drag coefficient.
+
+    Drag couples the axes (and k to all of them), so the covariances are full (K, 7, 7) matrices rather than
+    per-axis blocks.
+
+    Note units are mm and seconds.
+    """
+
+    state_size = 7  # [x, y, z, vx, vy, vz, k]
+
+    def __init__(self, dt: float, capacity: int = 16, process_noise: float = 1.0, measurement_noise: float = 3.0,
+                 initial_covariance: float = 500.0, drag_coefficient: float = DRAG_COEFFICIENT,
+                 drag_variance: float = (0.5 * DRAG_COEFFICIENT)**2, drag_process_noise: float = 1e-16):
+        """
+        Args:
+            dt (float): Nominal time step in seconds, that process_noise is given for.
+            capacity (int): Number of slots to allocate to start with.
+            process_noise (float): Variance of the process noise on position and velocity over one nominal time step.
+            measurement_noise (float): Variance of the measurement noise.
+            initial_covariance (float): Variance of the position and velocity when a filter is added.
+            drag_coefficient (float): Prior drag coefficient {1/mm}.
+            drag_variance (float): Variance of the prior drag coefficient {1/mm^2}.
+            drag_process_noise (float): Variance of the process noise on the drag coefficient over one nominal time
+                                        step {1/mm^2}.
+        """
+        super().__init__(dt, capacity, process_noise, measurement_noise, initial_covariance)
+        self.drag_coefficient = drag_coefficient
+
+        # Full covariance matrices
+        self.initial_state_covariance = np.eye(self.state_size) * initial_covariance
+        self.initial_state_covariance[6, 6] = drag_variance
+        self.covariances = np.zeros((capacity, self.state_size, self.state_size))
+
+        self.Q = np.eye(self.state_size) * process_noise
+        self.Q[6, 6] = drag_process_noise
+        self.R = np.eye(3) * measurement_noise
+
+    def add(self, initial_state: np.ndarray, time: float) -> int:
+        initial_state = np.asarray(initial_state, dtype=float).ravel()
+        if len(initial_state) == 6:
+            initial_state = np.append(initial_state, self.drag_coefficient)
+        return super().add(initial_state, time)
+
+    def propagate(self, states: np.ndarray, dt: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Propagate a set of states over their own time steps, along with what's needed to propagate their covariances.
+
+        Args:
+            states (np.ndarray): States to propagate (N, 7).
+            dt (np.ndarray): Time step for each state in seconds (N,). Can be negative.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Propagated states (N, 7), state transition matrices and process
+                                                       noise (N, 7, 7).
+        """
+        states, F = integrate_with_jacobian(states, dt)
+        Q = self.Q * (np.abs(dt) / self.dt)[:, np.newaxis, np.newaxis]
+        return states, F, Q
+
+    def propagate_states(self, states: np.ndarray, dt: np.ndarray) -> np.ndarray:
+        return integrate(states, dt)
+
+    def predict(self, slots: np.ndarray, times: np.ndarray):
+        if len(slots) == 0:
+            return
+
+        self.states[slots], F, Q = self.propagate(self.states[slots], times - self.times[slots])
+        self.covariances[slots] = F @ self.covariances[slots] @ F.transpose(0, 2, 1) + Q
+        self.times[slots] = times
+
+    def update(self):
+        slots = self.take_measurements()
+        if len(slots) == 0:
+            return
+
+        self.predict(slots, self.measurement_times[slots])
+
+        P = self.covariances[slots]
+
+        # The measurement matrix picks out the position, so H @ P @ H.T and P @ H.T are just blocks of P
+        S = P[:, :3, :3] + self.R
+        PHt = P[:, :, :3]
+
+        # K = P @ H.T @ inv(S). S and P are symmetric, so K.T = solve(S, H @ P)
+        K = np.linalg.solve(S, PHt.transpose(0, 2, 1)).transpose(0, 2, 1)
+
+        y = self.measurements[slots] - self.states[slots, :3]
+        self.states[slots] += np.einsum('kij,kj->ki', K, y)
+
+        # Joseph form: P = (I - K @ H) @ P @ (I - K @ H).T + K @ R @ K.T
+        A = np.broadcast_to(np.eye(self.state_size), P.shape).copy()
+        A[:, :, :3] -= K
+        self.covariances[slots] = A @ P @ A.transpose(0, 2, 1) + K @ self.R @ K.transpose(0, 2, 1)
+
+        # Drag can't speed a ball up
+        np.maximum(self.states[:, 6], 0.0, out=self.states[:, 6])
+
+    def covariance(self, slot: int) -> np.ndarray:
+        return self.covariances[slot].copy()
+
+    def predict_states(self, slots: np.ndarray, time: float) -> Tuple[np.ndarray, np.ndarray]:
+        states, F, Q = self.propagate(self.states[slots], time - self.times[slots])
+        return states, F @ self.covariances[slots] @ F.transpose(0, 2, 1) + Q
+
+    def predict_measurements(self, slots: np.ndarray, time: float) -> Tuple[np.ndarray, np.ndarray]:
+        states, P = self.predict_states(slots, time)
+        return states[:, :3], P[:, :3, :3] + self.R
@@ -0,0 +1,484 @@
+"""
+Kinematics of the Stewart platform, with no ROS dependencies.
+
+Everything here works on batches of poses at once: positions are (N, 3) arrays and rotations are (N, 3, 3) arrays,
+so a single pose is just N = 1. Node arrays are (k, 3), with one node per row (as built by robot_geometry).
+
+This is used by the nodes (sp_ik, robot_geometry), the offline geometry calibration and the simulations, so that
+there's only one copy of the maths to optimize, and it can be tested and benchmarked without ROS:
+    python -m pytest test/test_kinematics.py
+"""
+
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+LEG_SPOOL_DIA = 22.0  # Diameter of the leg spools {mm}
+LEG_MM_PER_REV = LEG_SPOOL_DIA * np.pi
+HAND_SPOOL_DIA = 11.7  # Diameter of the hand spool {mm}
+HAND_MM_PER_REV = HAND_SPOOL_DIA * np.pi
+
+#########################################################################################################
+#                                          Building the Platform                                        #
+#########################################################################################################
+
+
+def hexagon_node_angles(offset: float, first_gap: float, second_gap: float) -> np.ndarray:
+    """
+    Find the angles to the six nodes of a 'semi-regular' hexagon, where the gaps between neighbouring nodes alternate.
+
+    Args:
+        offset: Angle to the first node {deg}
+        first_gap: Angle from the first node to the second (and from the third to the fourth etc.) {deg}
+        second_gap: Angle from the second node to the third (and from the fourth to the fifth etc.) {deg}
+
+    Returns:
+        np.ndarray: Angles to each of the six nodes (6,) {deg}
+    """
+    nodes = np.arange(6)
+    return offset + first_gap * ((nodes + 1) // 2) + second_gap * (nodes // 2)
+
+
+def nodes_on_circle(radius: float, angles: np.ndarray, height: float = 0.0) -> np.ndarray:
+    """
+    Place nodes on a horizontal circle.
+
+    Args:
+        radius: Radius of the circle {mm}
+        angles: Angles to each node, measured from the x axis {deg}
+        height: Height of the circle {mm}
+
+    Returns:
+        np.ndarray: The nodes (k, 3) {mm}
+    """
+    angles = np.radians(angles)
+    return np.column_stack((radius * np.cos(angles), radius * np.sin(angles), np.full(len(angles), height)))
+
+
+def build_platform(initial_height: float, base_radius: float, plat_radius: float, base_small_angle: float,
+                   plat_small_angle: float, plat_x_axis_offset: float, arm_radius: float,
+                   arm_height_from_platform: float, hand_stroke: float, hand_radius: float) -> Dict[str, np.ndarray]:
+    """
+    Build the robot, calculating the initial positions of all nodes. Parameters are as described in robot_geometry.
+
+    Returns:
+        Dict[str, np.ndarray]: start_pos, base_nodes, init_plat_nodes, init_arm_nodes, init_hand_nodes and
+                               init_leg_lengths, shaped as in geometry_cache.GEOMETRY_SHAPES
+    """
+    start_pos = np.array([[0.0], [0.0], [initial_height]])
+
+    # Define the angles to the nodes
+    gamma2 = base_small_angle  # Angle between close base nodes {deg}
+    gamma0 = 210 - gamma2 / 2  # Offset from horizontal
+    gamma1 = 120 - gamma2  # Angle between far base nodes {deg}
+
+    lambda1 = plat_small_angle  # Angle between close platform nodes {deg}
+    lambda2 = 120 - lambda1  # Angle between far platform nodes {deg}
+    lambda0 = plat_x_axis_offset  # Offset from x axis for platform nodes {deg} (measured in Onshape)
+
+    base_nodes = nodes_on_circle(base_radius, hexagon_node_angles(gamma0, gamma2, gamma1))
+    init_plat_nodes = nodes_on_circle(plat_radius, hexagon_node_angles(lambda0, lambda2, lambda1))
+
+    # Find the nodes for the arm
+    # Doesn't need to be perfectly realistic, so just assume arm nodes are equally spaced radially.
+    # The top three nodes are at the opening, and the bottom three are one hand stroke below them
+    arm_angles = 120.0 * np.arange(3)
+    top_arm_nodes = nodes_on_circle(arm_radius, arm_angles, arm_height_from_platform)
+    bottom_arm_nodes = nodes_on_circle(arm_radius, arm_angles, arm_height_from_platform - hand_stroke)
+    init_arm_nodes = np.vstack((top_arm_nodes, bottom_arm_nodes))
+
+    # Find the nodes for the hand
+    init_hand_nodes = nodes_on_circle(hand_radius, 60.0 * (1 + 2 * np.arange(3)))
+
+    # Calculate the lengths of the legs in the initial state
+    init_leg_lengths = np.linalg.norm(init_plat_nodes + start_pos.T - base_nodes, axis=1)
+
+    return {
+        'start_pos': start_pos,
+        'base_nodes': base_nodes,
+        'init_plat_nodes': init_plat_nodes,
+        'init_arm_nodes': init_arm_nodes,
+        'init_hand_nodes': init_hand_nodes,
+        'init_leg_lengths': init_leg_lengths,
+    }
+
+#########################################################################################################
+#                                               Rotations                                               #
+#########################################################################################################
+
+
+def euler_to_rotation_matrix(angles: np.ndarray) -> np.ndarray:
+    """
+    Find the rotation matrices for rotations about the x, y then z axes (ie. R = Rz @ Ry @ Rx).
+
+    Args:
+        angles: [phi, theta, psi] about the x, y and z axes (..., 3) {deg}
+
+    Returns:
+        np.ndarray: Rotation matrices (..., 3, 3)
+    """
+    phi, theta, psi = np.moveaxis(np.radians(angles), -1, 0)
+    cx, sx = np.cos(phi), np.sin(phi)
+    cy, sy = np.cos(theta), np.sin(theta)
+    cz, sz = np.cos(psi), np.sin(psi)
+
+    rot = np.empty(np.shape(phi) + (3, 3))
+    rot[..., 0, 0] = cz * cy
+    rot[..., 0, 1] = cz * sy * sx - sz * cx
+    rot[..., 0, 2] = cz * sy * cx + sz * sx
+    rot[..., 1, 0] = sz * cy
+    rot[..., 1, 1] = sz * sy * sx + cz * cx
+    rot[..., 1, 2] = sz * sy * cx - cz * sx
+    rot[..., 2, 0] = -sy
+    rot[..., 2, 1] = cy * sx
+    rot[..., 2, 2] = cy * cx
+
+    return rot
+
+
+def rotation_vector_to_matrix(rotation_vectors: np.ndarray) -> np.ndarray:
+    """
+    Find the rotation matrices for rotation vectors (axis * angle) using Rodrigues' formula.
+
+    Args:
+        rotation_vectors: Rotation vectors (..., 3) {rad}
+
+    Returns:
+        np.ndarray: Rotation matrices (..., 3, 3)
+    """
+    angles = np.linalg.norm(rotation_vectors, axis=-1)[..., np.newaxis, np.newaxis]
+    kx, ky, kz = np.moveaxis(rotation_vectors, -1, 0)
+
+    skew = np.zeros(np.shape(kx) + (3, 3))
+    skew[..., 0, 1], skew[..., 0, 2] = -kz, ky
+    skew[..., 1, 0], skew[..., 1, 2] = kz, -kx
+    skew[..., 2, 0], skew[..., 2, 1] = -ky, kx
+
+    # sin(a)/a and (1 - cos(a))/a^2, using their limits for tiny angles
+    with np.errstate(divide='ignore', invalid='ignore'):
+        first = np.where(angles > 1e-8, np.sin(angles) / angles, 1.0)
+        second = np.where(angles > 1e-8, (1 - np.cos(angles)) / angles ** 2, 0.5)
+
+    return np.eye(3) + first * skew + second * (skew @ skew)
+
+def rotation_matrix_to_vector(rotations: np.ndarray) -> np.ndarray:
+    """
+    Find the rotation vectors (axis * angle) of rotation matrices. The inverse of rotation_vector_to_matrix, for
+    rotations of less than pi.
+
+    Args:
+        rotations: Rotation matrices (..., 3, 3)
+
+    Returns:
+        np.ndarray: Rotation vectors (..., 3) {rad}
+    """
+    # The skew-symmetric part of R is sin(a) [k]x, and its trace is 1 + 2 cos(a)
+    axis_sines = np.stack((rotations[..., 2, 1] - rotations[..., 1, 2],
+                           rotations[..., 0, 2] - rotations[..., 2, 0],
+                           rotations[..., 1, 0] - rotations[..., 0, 1]), axis=-1) / 2
+    cosines = (np.trace(rotations, axis1=-2, axis2=-1) - 1) / 2
+    angles = np.arctan2(np.linalg.norm(axis_sines, axis=-1), cosines)[..., np.newaxis]
+
+    # a/sin(a), using its limit for tiny angles
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(angles > 1e-8, angles / np.sin(angles), 1.0)
+
+    return scale * axis_sines
+
+#########################################################################################################
+#                                          Inverse Kinematics                                           #
+#########################################################################################################
+
+
+def leg_vectors(positions: np.ndarray, rotations: np.ndarray, base_nodes: np.ndarray,
+                plat_nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the vectors along each leg (from base node to platform node) for a batch of platform poses.
+
+    Args:
+        positions: Positions of the platform origin in the base frame (N, 3) {mm}
+        rotations: Rotation matrices of the platform (N, 3, 3)
+        base_nodes: Base nodes in the base frame (k, 3) {mm}
+        plat_nodes: Platform nodes in the platform frame (k, 3) {mm}
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Leg vectors (N, k, 3) {mm} and the platform nodes rotated into the base frame
+                                       (but still relative to the platform origin) (N, k, 3) {mm}
+    """
+    rotated_plat_nodes = np.einsum('nij,kj->nki', rotations, plat_nodes)
+    legs = positions[:, np.newaxis, :] + rotated_plat_nodes - base_nodes[np.newaxis, :, :]
+
+    return legs, rotated_plat_nodes
+
+
+def inverse_kinematics(positions: np.ndarray, rotations: np.ndarray, base_nodes: np.ndarray,
+                       plat_nodes: np.ndarray) -> np.ndarray:
+    """
+    Find the leg lengths for a batch of platform poses. Arguments are as for leg_vectors.
+
+    Returns:
+        np.ndarray: Length of each leg (N, k) {mm}
+    """
+    legs, _ = leg_vectors(positions, rotations, base_nodes, plat_nodes)
+    return np.linalg.norm(legs, axis=2)
+
+
+def jacobians(positions: np.ndarray, rotations: np.ndarray, base_nodes: np.ndarray,
+              plat_nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the leg lengths and Jacobians for a batch of platform poses. Arguments are as for leg_vectors.
+
+    The Jacobian maps the platform twist [vx, vy, vz, wx, wy, wz] (base frame) to the leg velocities. Row i is
+    [u_i, (R p_i) x u_i], where u_i is the unit vector along leg i.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Leg lengths (N, k) {mm} and Jacobians (N, k, 6)
+    """
+    legs, rotated_plat_nodes = leg_vectors(positions, rotations, base_nodes, plat_nodes)
+    leg_lengths = np.linalg.norm(legs, axis=2)
+    unit_legs = legs / leg_lengths[:, :, np.newaxis]
+
+    jac = np.empty(legs.shape[:2] + (6,))
+    jac[:, :, :3] = unit_legs
+    # (R p_i) x u_i, written out because np.cross has a lot of overhead for small arrays
+    p, u = rotated_plat_nodes, unit_legs
+    jac[:, :, 3] = p[:, :, 1] * u[:, :, 2] - p[:, :, 2] * u[:, :, 1]
+    jac[:, :, 4] = p[:, :, 2] * u[:, :, 0] - p[:, :, 0] * u[:, :, 2]
+    jac[:, :, 5] = p[:, :, 0] * u[:, :, 1] - p[:, :, 1] * u[:, :, 0]
+
+    return leg_lengths, jac
+
+#########################################################################################################
+#                                          Velocity Feedforward                                         #
+#########################################################################################################
+
+
+def estimate_twists(last_positions: np.ndarray, last_rotations: np.ndarray, positions: np.ndarray,
+                    rotations: np.ndarray, dt: np.ndarray, min_dt: float, max_dt: float) -> np.ndarray:
+    """
+    Estimate the platform twists by differencing successive poses. Poses that are too close together (or too far
+    apart) for the difference to be trusted, including unstamped poses, get zero twist.
+
+    Args:
+        last_positions: Previous positions of the platform origin in the base frame (N, 3) {mm}
+        last_rotations: Previous rotation matrices of the platform (N, 3, 3)
+        positions: Positions of the platform origin in the base frame (N, 3) {mm}
+        rotations: Rotation matrices of the platform (N, 3, 3)
+        dt: Time from each previous pose to the current one (N,) {s}
+        min_dt: Shortest time between poses to difference them {s}
+        max_dt: Longest time between poses to difference them {s}
+
+    Returns:
+        np.ndarray: Twists [vx, vy, vz, wx, wy, wz] in the base frame (N, 6) {mm/s, rad/s}
+    """
+    dt = np.asarray(dt, dtype=float)
+    trusted = (dt > min_dt) & (dt < max_dt)
+    dt = np.where(trusted, dt, 1.0)[:, np.newaxis]
+
+    # The rotation from the last orientation to this one, as a rotation vector in the base frame
+    twists = np.empty((len(dt), 6))
+    twists[:, :3] = (positions - last_positions) / dt
+    twists[:, 3:] = rotation_matrix_to_vector(rotations @ np.swapaxes(last_rotations, -1, -2)) / dt
+    twists[~trusted] = 0.0
+
+    return twists
+
+
+def offset_twists(offset_rotation: np.ndarray, twists: np.ndarray) -> np.ndarray:
+    """
+    Find the twists of poses once a pose offset has been applied. The offset rotates the orientation (R -> O @ R) and
+    leaves the position alone, so only the angular velocity is rotated.
+
+    Args:
+        offset_rotation: Rotation matrix of the pose offset (3, 3)
+        twists: Twists [vx, vy, vz, wx, wy, wz] of the poses without the offset (N, 6) {mm/s, rad/s}
+
+    Returns:
+        np.ndarray: Twists of the offset poses (N, 6) {mm/s, rad/s}
+    """
+    offset = np.array(twists, dtype=float)
+    offset[:, 3:] = offset[:, 3:] @ offset_rotation.T
+    return offset
+
+
+def leg_velocity_feedforward(jacobians: np.ndarray, twists: np.ndarray, in_bounds: np.ndarray,
+                             max_velocity: float) -> np.ndarray:
+    """
+    Find the leg velocities to feed forward for a batch of platform twists.
+
+    Legs that are out of bounds are clipped (held at their limit), so they get no feedforward. A leg velocity above
+    max_velocity means that the setpoint has jumped (eg. straight to a catch pose) rather than followed a trajectory,
+    so that pose gets no feedforward on any leg.
+
+    Args:
+        jacobians: Jacobians at each pose (N, k, 6)
+        twists: Twists [vx, vy, vz, wx, wy, wz] in the base frame (N, 6) {mm/s, rad/s}
+        in_bounds: Whether each leg is within its stroke (N, k)
+        max_velocity: Largest leg velocity to feed forward {rev/s}
+
+    Returns:
+        np.ndarray: Leg velocities (N, k) {rev/s}
+    """
+    leg_velocities = np.einsum('nkj,nj->nk', jacobians, twists) / LEG_MM_PER_REV
+    leg_velocities = np.where(in_bounds, leg_velocities, 0.0)
+    jumped = np.any(np.abs(leg_velocities) > max_velocity, axis=1)
+    leg_velocities[jumped] = 0.0
+
+    return leg_velocities
+
+#########################################################################################################
+#                                          Forward Kinematics                                           #
+#########################################################################################################
+
+
+def forward_kinematics(leg_lengths: np.ndarray, base_nodes: np.ndarray, plat_nodes: np.ndarray,
+                       initial_positions: np.ndarray, initial_rotations: np.ndarray, tolerance: float = 1e-6,
+                       max_iterations: int = 20) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the platform poses that give a batch of leg lengths, using Newton's method on the Jacobian.
+
+    Newton's method converges to the pose nearest the initial guess, so this should be seeded with a nearby pose
+    (eg. the last pose, or the start position for a platform that's near its home).
+
+    Args:
+        leg_lengths: Length of each leg (N, 6) {mm}
+        base_nodes: Base nodes in the base frame (6, 3) {mm}
+        plat_nodes: Platform nodes in the platform frame (6, 3) {mm}
+        initial_positions: Initial guess for the positions of the platform origin (N, 3) {mm}
+        initial_rotations: Initial guess for the rotation matrices of the platform (N, 3, 3)
+        tolerance: Largest leg length error for a pose to count as converged {mm}
+        max_iterations: Most Newton steps to take
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Positions (N, 3) {mm}, rotation matrices (N, 3, 3) and whether
+                                                   each pose converged (N,)
+    """
+    positions = np.array(initial_positions, dtype=float)
+    rotations = np.array(initial_rotations, dtype=float)
+    converged = np.zeros(len(positions), dtype=bool)
+
+    for _ in range(max_iterations):
+        lengths, jac = jacobians(positions, rotations, base_nodes, plat_nodes)
+        errors = lengths - leg_lengths
+        converged = np.max(np.abs(errors), axis=1) < tolerance
+        if np.all(converged):
+            break
+
+        # Step = [dx, dy, dz, rotation vector] (base frame). Converged poses are left where they are
+        step = np.linalg.solve(jac, -errors[:, :, np.newaxis])[:, :, 0]
+        step[converged] = 0.0
+
+        positions += step[:, :3]
+        rotations = rotation_vector_to_matrix(step[:, 3:]) @ rotations
+
+    return positions, rotations, converged
+
+#########################################################################################################
+#                                                 Hand                                                  #
+#########################################################################################################
+
+
+def hand_nodes(hand_positions: np.ndarray, positions: np.ndarray, rotations: np.ndarray, init_hand_nodes: np.ndarray,
+               init_arm_nodes: np.ndarray, hand_stroke: float,
+               hand_direction: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the hand nodes and the hand tip (centre of the hand) in the base frame, from the hand encoder and a batch of
+    platform poses.
+
+    The hand moves along the platform z axis. At zero encoder position it's at the bottom of its stroke, level with
+    the bottom three arm nodes (which are one hand stroke below the top three).
+
+    Args:
+        hand_positions: Positions of the hand from its encoder (N,) {rev}
+        positions: Positions of the platform origin in the base frame (N, 3) {mm}
+        rotations: Rotation matrices of the platform (N, 3, 3)
+        init_hand_nodes: Hand nodes in the platform frame, with the hand at the platform origin (k, 3) {mm}
+        init_arm_nodes: Arm nodes in the platform frame, top three then bottom three (6, 3) {mm}
+        hand_stroke: Travel of the hand {mm}
+        hand_direction: +1 if +ve encoder positions move the hand up, -1 if they move it down
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Hand nodes (N, k, 3) and hand tips (N, 3) in the base frame {mm}
+    """
+    hand_bottom_height = np.mean(init_arm_nodes[3:, 2])
+    hand_heights = hand_bottom_height + np.clip(hand_direction * np.asarray(hand_positions) * HAND_MM_PER_REV,
+                                                0.0, hand_stroke)
+
+    # Move the hand nodes up to the hand height, then into the base frame along with the platform
+    raised_hand_nodes = np.repeat(init_hand_nodes[np.newaxis], len(hand_heights), axis=0)
+    raised_hand_nodes[:, :, 2] += hand_heights[:, np.newaxis]
+    nodes = positions[:, np.newaxis, :] + np.einsum('nij,nkj->nki', rotations, raised_hand_nodes)
+
+    return nodes, np.mean(nodes, axis=1)
+
+#########################################################################################################
+#                                     Dexterity and Reachability                                        #
+#########################################################################################################
+
+
+def evaluate_dexterity(jacobians: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Evaluate how well-conditioned a batch of Jacobians is. These are the same metrics as evaluate_jacobian in the
+    geometry study, but the singular values come from the eigenvalues of the (symmetric) J^T J, which is much
+    cheaper than a full SVD and is done for the whole batch at once.
+
+    Args:
+        jacobians: Jacobians (N, 6, 6)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: Condition number, submatrix (x, y, rot_x, rot_y)
+                                                               condition number, smallest singular value and norm
+                                                               score for each Jacobian (all (N,))
+    """
+    # Eigenvalues come out in ascending order. Clip tiny negative values caused by rounding at singularities
+    gram = np.einsum('nki,nkj->nij', jacobians, jacobians)
+    singular_values = np.sqrt(np.clip(np.linalg.eigvalsh(gram), 0.0, None))
+
+    submatrix = jacobians[:, :, [0, 1, 3, 4]]
+    sub_gram = np.einsum('nki,nkj->nij', submatrix, submatrix)
+    sub_singular_values = np.sqrt(np.clip(np.linalg.eigvalsh(sub_gram), 0.0, None))
+
+    with np.errstate(divide='ignore'):
+        condition_number = singular_values[:, -1] / singular_values[:, 0]
+        submatrix_condition_number = sub_singular_values[:, -1] / sub_singular_values[:, 0]
+
+    # Ratio between the rotation and translation column norms. Ideally 1
+    column_norms = np.linalg.norm(jacobians, axis=1)
+    norm_score = (column_norms[:, 3] + column_norms[:, 4]) / (column_norms[:, 0] + column_norms[:, 1])
+
+    return condition_number, submatrix_condition_number, singular_values[:, 0], norm_score
+
+
+def leg_angles(legs: np.ndarray) -> np.ndarray:
+    """
+    Find the angle between each leg and the x-y plane.
+
+    Args:
+        legs: Leg vectors (..., 3)
+
+    Returns:
+        np.ndarray: Angle of each leg above (or below) the x-y plane (...) {deg}
+    """
+    return np.abs(np.degrees(np.arctan2(legs[..., 2], np.linalg.norm(legs[..., :2], axis=-1))))
+
+
+def check_reachability(leg_lengths: np.ndarray, min_length, max_length, legs: Optional[np.ndarray] = None,
+                       min_leg_angle: Optional[float] = None) -> np.ndarray:
+    """
+    Check whether a batch of poses are reachable.
+
+    Args:
+        leg_lengths: Length of each leg (N, k) {mm}
+        min_length: Shortest allowable leg length. Either one value for all legs, or one per leg (k,) {mm}
+        max_length: Longest allowable leg length. Either one value for all legs, or one per leg (k,) {mm}
+        legs: Leg vectors (N, k, 3). Only needed if checking the leg angles
+        min_leg_angle: Smallest allowable angle between each leg and the x-y plane {deg}
+
+    Returns:
+        np.ndarray: Whether each pose is reachable (N,)
+    """
+    within_stroke = (leg_lengths >= min_length) & (leg_lengths <= max_length)
+
+    if min_leg_angle is not None and legs is not None:
+        within_stroke &= leg_angles(legs) >= min_leg_angle
+
+    return np.all(within_stroke, axis=1)
@@ -0,0 +1,349 @@
+# landing_solver.py
+
+import numpy as np
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+GRAVITY = -9810.0  # Gravity acceleration {mm/s^2}
+GRAVITY_VECTOR = np.array([0.0, 0.0, GRAVITY])
+
+
+class LandingSurface(ABC):
+    """
+    Base class for the surfaces that a ball can land on. A surface is the zero set of a function S(p) of position,
+    with S > 0 on the side that the ball comes from, so a ball lands where S goes from positive to negative.
+    """
+
+    @abstractmethod
+    def intersect(self, positions: np.ndarray, velocities: np.ndarray) -> np.ndarray:
+        """
+        Find when each of a set of balls first lands on the surface, following a ballistic trajectory.
+
+        Args:
+            positions (np.ndarray): Position of each ball now (N, 3) {mm}.
+            velocities (np.ndarray): Velocity of each ball now (N, 3) {mm/s}.
+
+        Returns:
+            np.ndarray: Time until each ball lands (N,) {s}. NaN if it doesn't.
+        """
+
+    @abstractmethod
+    def value(self, points: np.ndarray) -> np.ndarray:
+        """
+        S at a set of points (N,). NaN where the surface isn't defined.
+        """
+
+    @abstractmethod
+    def gradient(self, points: np.ndarray) -> np.ndarray:
+        """
+        Gradient of S at a set of points on the surface (N, 3).
+        """
+
+
+class PlaneSurface(LandingSurface):
+    """
+    A plane, eg. the platform at its current pose. Solved in closed form.
+    """
+
+    def __init__(self, point=(0.0, 0.0, 0.0), normal=(0.0, 0.0, 1.0)):
+        """
+        Args:
+            point: Any point on the plane {mm}.
+            normal: Normal of the plane, pointing to the side that the ball comes from. Needn't be normalised.
+        """
+        self.set_pose(point, normal)
+
+    def set_pose(self, point, normal):
+        """Move the plane"""
+        self.point = np.asarray(point, dtype=float)
+        self.normal = np.asarray(normal, dtype=float) / np.linalg.norm(normal)
+
+    def intersect(self, positions: np.ndarray, velocities: np.ndarray) -> np.ndarray:
+        # S(t) = n . (p(t) - q) = a t^2 + b t + c
+        a = 0.5 * GRAVITY * self.normal[2]
+        b = velocities @ self.normal
+        c = (positions - self.point) @ self.normal
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if a == 0.0:
+                # Vertical plane, so the ball crosses it at a constant rate
+                times = np.where(b < 0.0, -c / b, np.nan)
+            else:
+                # dS/dt = 2 a t + b is +sqrt(discriminant) at one root and -sqrt(discriminant) at the other, so the
+                # crossing from positive to negative is always the same root
+                times = (-b - np.sqrt(b**2 - 4 * a * c)) / (2 * a)
+
+        return np.where(times >= 0.0, times, np.nan)
+
+    def value(self, points: np.ndarray) -> np.ndarray:
+        return (points - self.point) @ self.normal
+
+    def gradient(self, points: np.ndarray) -> np.ndarray:
+        return np.broadcast_to(self.normal, points.shape)
+
+
+class SphereSurface(LandingSurface):
+    """
+    A sphere, eg. around the hand, that the ball lands on as it enters. The quartic for the crossing times is solved
+    for every ball at once, from the eigenvalues of its companion matrix.
+    """
+
+    def __init__(self, center=(0.0, 0.0, 0.0), radius: float = 100.0):
+        """
+        Args:
+            center: Centre of the sphere {mm}.
+            radius (float): Radius of the sphere {mm}.
+        """
+        self.center = np.asarray(center, dtype=float)
+        self.radius = radius
+
+    def intersect(self, positions: np.ndarray, velocities: np.ndarray) -> np.ndarray:
+        # S(t) = |d + v t + 0.5 g t^2|^2 - r^2, with d the position relative to the centre
+        d = positions - self.center
+        coefficients = np.stack((
+            np.full(len(d), 0.25 * GRAVITY**2),
+            GRAVITY * velocities[:, 2],
+            np.einsum('ij,ij->i', velocities, velocities) + GRAVITY * d[:, 2],
+            2 * np.einsum('ij,ij->i', d, velocities),
+            np.einsum('ij,ij->i', d, d) - self.radius**2,
+        ), axis=1)
+
+        # Roots of the (monic) quartic are the eigenvalues of its companion matrix
+        companion = np.zeros((len(d), 4, 4))
+        companion[:, 0, :] = -coefficients[:, 1:] / coefficients[:, :1]
+        companion[:, [1, 2, 3], [0, 1, 2]] = 1.0
+        roots = np.linalg.eigvals(companion)
+
+        # Polish the real roots with a Newton step on the quartic
+        times = roots.real
+        value = np.polynomial.polynomial.polyval(times, coefficients.T[::-1, :, np.newaxis], tensor=False)
+        slope = np.polynomial.polynomial.polyval(times, (coefficients[:, :-1] * [4, 3, 2, 1]).T[::-1, :, np.newaxis],
+                                                 tensor=False)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            times = times - np.where(slope != 0.0, value / slope, 0.0)
+
+        # The ball enters the sphere where S is falling. Take the first such crossing that's still to come
+        real = np.abs(roots.imag) <= 1e-6 * (1.0 + np.abs(roots.real))
+        entering = slope < 0.0
+        times = np.where(real & entering & (times >= 0.0), times, np.inf).min(axis=1)
+        return np.where(np.isfinite(times), times, np.nan)
+
+    def value(self, points: np.ndarray) -> np.ndarray:
+        d = points - self.center
+        return np.einsum('ij,ij->i', d, d) - self.radius**2
+
+    def gradient(self, points: np.ndarray) -> np.ndarray:
+        return 2 * (points - self.center)
+
+
+class HeightMapSurface(LandingSurface):
+    """
+    A height map z = h(x, y) on a regular grid, interpolated bilinearly, eg. the reachable workspace of the platform.
+    Balls that would land outside the grid don't land. Solved with a few Newton iterations from where each ball falls
+    through the height of the highest (or, failing that, the lowest) point of the map.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, heights: np.ndarray, iterations: int = 8,
+                 tolerance: float = 0.01):
+        """
+        Args:
+            x (np.ndarray): Increasing x coordinates of the grid (X,) {mm}. Must be evenly spaced.
+            y (np.ndarray): Increasing y coordinates of the grid (Y,) {mm}. Must be evenly spaced.
+            heights (np.ndarray): Height at each grid point (X, Y) {mm}.
+            iterations (int): Number of Newton iterations.
+            tolerance (float): Largest height error for a landing to count as found {mm}.
+        """
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.heights = np.asarray(heights, dtype=float)
+        self.spacing = np.array([self.x[1] - self.x[0], self.y[1] - self.y[0]])
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self.top = PlaneSurface((0.0, 0.0, self.heights.max()))
+        self.bottom = PlaneSurface((0.0, 0.0, self.heights.min()))
+
+    def height_and_slope(self, points: np.ndarray):
+        """
+        Interpolate the height map at a set of points.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Height (N,), slope (dh/dx, dh/dy) (N, 2) and whether each point
+                                                       is over the grid (N,).
+        """
+        cells = (points[:, :2] - [self.x[0], self.y[0]]) / self.spacing
+        inside = np.all((cells >= 0.0) & (cells <= [len(self.x) - 1, len(self.y) - 1]), axis=1)
+
+        indices = np.clip(np.floor(cells).astype(int), 0, [len(self.x) - 2, len(self.y) - 2])
+        u, v = (cells - indices).T
+        i, j = indices.T
+        h00, h10 = self.heights[i, j], self.heights[i + 1, j]
+        h01, h11 = self.heights[i, j + 1], self.heights[i + 1, j + 1]
+
+        height = h00 * (1 - u) * (1 - v) + h10 * u * (1 - v) + h01 * (1 - u) * v + h11 * u * v
+        slope = np.stack((((h10 - h00) * (1 - v) + (h11 - h01) * v) / self.spacing[0],
+                          ((h01 - h00) * (1 - u) + (h11 - h10) * u) / self.spacing[1]), axis=1)
+        return height, slope, inside
+
+    def intersect(self, positions: np.ndarray, velocities: np.ndarray) -> np.ndarray:
+        # Start from where the ball falls through the height of the top of the map or, if it doesn't get that high,
+        # the bottom of the map. Balls that are already below the whole map don't land on it
+        times = self.top.intersect(positions, velocities)
+        times = np.where(np.isnan(times), self.bottom.intersect(positions, velocities), times)
+        searching = np.isfinite(times)
+        times = np.where(searching, times, 0.0)
+
+        # Newton's method on f(t) = z(t) - h(x(t), y(t))
+        for _ in range(self.iterations):
+            points = positions + velocities * times[:, np.newaxis] + 0.5 * GRAVITY_VECTOR * times[:, np.newaxis]**2
+            point_velocities = velocities + GRAVITY_VECTOR * times[:, np.newaxis]
+            height, slope, _ = self.height_and_slope(points)
+            error = points[:, 2] - height
+            rate = point_velocities[:, 2] - np.einsum('ij,ij->i', slope, point_velocities[:, :2])
+            # Only step while the ball is falling through the surface, so that the iteration can't run off to the
+            # upward crossing
+            step = np.divide(error, rate, out=np.zeros_like(error), where=rate < 0.0)
+            times = np.maximum(times - step, 0.0)
+
+        points = positions + velocities * times[:, np.newaxis] + 0.5 * GRAVITY_VECTOR * times[:, np.newaxis]**2
+        height, _, inside = self.height_and_slope(points)
+        found = searching & inside & (np.abs(points[:, 2] - height) <= self.tolerance)
+        return np.where(found, times, np.nan)
+
+    def value(self, points: np.ndarray) -> np.ndarray:
+        height, _, inside = self.height_and_slope(points)
+        return np.where(inside, points[:, 2] - height, np.nan)
+
+    def gradient(self, points: np.ndarray) -> np.ndarray:
+        _, slope, _ = self.height_and_slope(points)
+        return np.hstack((-slope, np.ones((len(points), 1))))
+
+
+class LandingSolution:
+    """
+    Where and when a set of balls land, from solve_landing.
+    """
+
+    __slots__ = ('valid', 'time', 'position', 'velocity', 'covariance')
+
+    def __init__(self, valid: np.ndarray, time: np.ndarray, position: np.ndarray, velocity: np.ndarray,
+                 covariance: Optional[np.ndarray]):
+        """
+        Args:
+            valid (np.ndarray): Whether each ball lands on the surface (N,). The rest of its values are NaN if not.
+            time (np.ndarray): Time until each ball lands (N,) {s}.
+            position (np.ndarray): Landing position of each ball (N, 3) {mm}.
+            velocity (np.ndarray): Landing velocity of each ball (N, 3) {mm/s}.
+            covariance (np.ndarray): Covariance of [time, position, velocity] (N, 7, 7), if the state covariances
+                                     were given.
+        """
+        self.valid = valid
+        self.time = time
+        self.position = position
+        self.velocity = velocity
+        self.covariance = covariance
+
+    def __len__(self) -> int:
+        return len(self.valid)
+
+
+def solve_landing(states: np.ndarray, surface: LandingSurface,
+                  covariances: Optional[np.ndarray] = None) -> LandingSolution:
+    """
+    Find where and when each of a set of balls lands on a surface, following a ballistic trajectory.
+
+    If the covariances of the states are given, they're propagated to the landing time, position and velocity (see
+    propagate_landing_covariance).
+
+    Args:
+        states (np.ndarray): State of each ball [x, y, z, vx, vy, vz] (N, 6).
+        surface (LandingSurface): The surface to land on.
+        covariances (np.ndarray): Covariance of each state (N, 6, 6).
+
+    Returns:
+        LandingSolution: The landing time, position and velocity of each ball (and their covariance).
+    """
+    states = np.asarray(states, dtype=float).reshape(-1, 6)
+    positions, velocities = states[:, :3], states[:, 3:]
+
+    times = surface.intersect(positions, velocities)
+    valid = np.isfinite(times)
+
+    t = times[:, np.newaxis]
+    landing_positions = positions + velocities * t + 0.5 * GRAVITY_VECTOR * t**2
+    landing_velocities = velocities + GRAVITY_VECTOR * t
+
+    landing_covariances = None
+    if covariances is not None:
+        landing_covariances = propagate_landing_covariance(surface, times, landing_positions, landing_velocities,
+                                                           covariances)
+
+    return LandingSolution(valid, times, landing_positions, landing_velocities, landing_covariances)
+
+
+def propagate_landing_covariance(surface: LandingSurface, times: np.ndarray, landing_positions: np.ndarray,
+                                 landing_velocities: np.ndarray, covariances: np.ndarray) -> np.ndarray:
+    """
+    Propagate the covariances of a set of ball states to their landing time, position and velocity, through the
+    Jacobian of the ballistic landing solution.
+
+    The landing time t depends on the state x through S(p(t, x)) = 0, so
+        dt/dx = -(grad S . dp/dx) / (grad S . v)
+    and the landing position and velocity pick up v dt/dx and g dt/dx on top of their own dependence on x.
+
+    Args:
+        surface (LandingSurface): The surface that the balls land on.
+        times (np.ndarray): Time until each ball lands (N,) {s}.
+        landing_positions (np.ndarray): Landing position of each ball (N, 3) {mm}.
+        landing_velocities (np.ndarray): Landing velocity of each ball (N, 3) {mm/s}.
+        covariances (np.ndarray): Covariance of each state [x, y, z, vx, vy, vz] (N, 6, 6).
+
+    Returns:
+        np.ndarray: Covariance of [time, position, velocity] (N, 7, 7).
+    """
+    num_balls = len(times)
+    t = times[:, np.newaxis]
+
+    # dp/dx = [I, t I], for the landing position at a fixed time
+    position_jacobian = np.zeros((num_balls, 3, 6))
+    position_jacobian[:, [0, 1, 2], [0, 1, 2]] = 1.0
+    position_jacobian[:, [0, 1, 2], [3, 4, 5]] = t
+
+    gradient = surface.gradient(landing_positions)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        time_jacobian = (-np.einsum('ni,nij->nj', gradient, position_jacobian)
+                         / np.einsum('ni,ni->n', gradient, landing_velocities)[:, np.newaxis])
+
+    jacobian = np.zeros((num_balls, 7, 6))
+    jacobian[:, 0] = time_jacobian
+    jacobian[:, 1:4] = position_jacobian + landing_velocities[:, :, np.newaxis] * time_jacobian[:, np.newaxis]
+    jacobian[:, [4, 5, 6], [3, 4, 5]] = 1.0
+    jacobian[:, 4:7] += GRAVITY_VECTOR[:, np.newaxis] * time_jacobian[:, np.newaxis]
+
+    return jacobian @ covariances @ jacobian.transpose(0, 2, 1)
+
+
+def landing_confidence(position_covariances: np.ndarray, radius: float) -> np.ndarray:
+    """
+    A lower bound on the probability that each ball lands within a radius (horizontally) of its predicted landing
+    position.
+
+    For a 2D Gaussian error with covariance P, P(|error| < r) is at least 1 - exp(-r^2 / (2 lambda)), with lambda the
+    largest eigenvalue of P (the probability for a circular Gaussian with that variance in every direction).
+
+    Args:
+        position_covariances (np.ndarray): Covariance of each landing position (N, 3, 3) {mm^2}.
+        radius (float): Radius around the landing position {mm}.
+
+    Returns:
+        np.ndarray: Confidence of each prediction (N,), from 0 to 1.
+    """
+    horizontal = position_covariances[:, :2, :2]
+
+    # Largest eigenvalue of each symmetric 2x2 block, in closed form
+    mean = 0.5 * (horizontal[:, 0, 0] + horizontal[:, 1, 1])
+    difference = 0.5 * (horizontal[:, 0, 0] - horizontal[:, 1, 1])
+    largest = mean + np.sqrt(difference**2 + horizontal[:, 0, 1]**2)
+
+    with np.errstate(divide='ignore'):
+        return 1.0 - np.exp(-radius**2 / (2 * np.maximum(largest, 0.0)))
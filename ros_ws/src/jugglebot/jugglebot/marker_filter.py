@@ -0,0 +1,156 @@
+# marker_filter.py
+
+import numpy as np
+from typing import Dict, Optional
+
+
+class MarkerPreFilter:
+    """
+    Rejects unlabelled markers that can't be balls before they're published, so that stray points don't each spawn
+    their own ball tracker downstream.
+
+    Every stage works on the whole frame at once (as boolean masks over an Mx4 array of x, y, z, residual in the robot
+    base frame):
+        1. Workspace cull: drop markers outside an axis-aligned box around the space that balls fly through.
+        2. Residual threshold: drop markers that QTM reconstructed poorly.
+        3. Exclusion zones: drop markers within spheres around known robot geometry (eg. the base markers), which
+           catch reflections and leftovers of the robot's own markers.
+        4. Static suppression: drop markers that have stayed within `static_radius` of the same spot for
+           `static_frames` frames. Balls in flight never stay still for that long, but reflections do. Reflections
+           are still in the world frame rather than the base frame, so call change_frame whenever the base
+           transformation changes.
+    """
+
+    def __init__(self, workspace_min=(-1000.0, -1000.0, -100.0), workspace_max=(1000.0, 1000.0, 3000.0),
+                 max_residual: float = 3.0, static_radius: float = 2.0, static_frames: int = 60,
+                 max_static_candidates: int = 256, exclusion_centers: Optional[np.ndarray] = None,
+                 exclusion_radii: Optional[np.ndarray] = None):
+        """
+        Args:
+            workspace_min (array_like): Lower corner of the workspace box in the robot base frame (x, y, z) {mm}.
+            workspace_max (array_like): Upper corner of the workspace box in the robot base frame (x, y, z) {mm}.
+            max_residual (float): Largest residual a marker can have {mm}.
+            static_radius (float): How far a marker can move and still count as static {mm}.
+            static_frames (int): Number of frames a marker has to be static for before it's suppressed.
+            max_static_candidates (int): Most positions to watch for static markers at once.
+            exclusion_centers (np.ndarray): Kx3 centres of the exclusion spheres in the robot base frame {mm}.
+            exclusion_radii (np.ndarray): K radii of the exclusion spheres (or one radius for all of them) {mm}.
+        """
+        self.workspace_min = np.asarray(workspace_min, dtype=float)
+        self.workspace_max = np.asarray(workspace_max, dtype=float)
+        self.max_residual = max_residual
+        self.static_radius = static_radius
+        self.static_frames = static_frames
+        self.max_static_candidates = max_static_candidates
+
+        self.set_exclusion_zones(np.empty((0, 3)) if exclusion_centers is None else exclusion_centers,
+                                 np.empty(0) if exclusion_radii is None else exclusion_radii)
+
+        # Positions that markers have been seen at, and how many frames in a row a marker has been within
+        # static_radius of each of them
+        self.static_positions = np.empty((0, 3))
+        self.static_counts = np.empty(0, dtype=int)
+
+        # Number of markers rejected by each stage
+        self.rejected = {'workspace': 0, 'residual': 0, 'exclusion': 0, 'static': 0}
+
+    def set_exclusion_zones(self, centers: np.ndarray, radii):
+        """
+        Set the spheres that markers are excluded from.
+
+        Args:
+            centers (np.ndarray): Kx3 centres of the spheres in the robot base frame {mm}.
+            radii (array_like): K radii of the spheres (or one radius for all of them) {mm}.
+        """
+        self.exclusion_centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+        self.exclusion_radii_sq = np.broadcast_to(np.asarray(radii, dtype=float),
+                                                  (len(self.exclusion_centers),)) ** 2
+
+    def apply(self, markers: np.ndarray) -> np.ndarray:
+        """
+        Filter a frame of markers.
+
+        Args:
+            markers (np.ndarray): Mx4 array of markers (x, y, z, residual) in the robot base frame.
+
+        Returns:
+            np.ndarray: The markers that passed every stage (a new array).
+        """
+        positions = markers[:, :3]
+
+        in_workspace = np.all((positions >= self.workspace_min) & (positions <= self.workspace_max), axis=1)
+        good_residual = markers[:, 3] <= self.max_residual
+
+        if len(self.exclusion_centers) > 0:
+            distances_sq = np.sum((positions[:, np.newaxis] - self.exclusion_centers[np.newaxis]) ** 2, axis=2)
+            outside_exclusions = np.all(distances_sq > self.exclusion_radii_sq, axis=1)
+        else:
+            outside_exclusions = np.ones(len(markers), dtype=bool)
+
+        # Only markers that pass the cheaper stages are watched for being static
+        candidates = in_workspace & good_residual & outside_exclusions
+        moving = np.ones(len(markers), dtype=bool)
+        moving[candidates] = ~self.update_static(positions[candidates])
+
+        self.rejected['workspace'] += np.count_nonzero(~in_workspace)
+        self.rejected['residual'] += np.count_nonzero(in_workspace & ~good_residual)
+        self.rejected['exclusion'] += np.count_nonzero(in_workspace & good_residual & ~outside_exclusions)
+        self.rejected['static'] += np.count_nonzero(candidates & ~moving)
+
+        return markers[candidates & moving]
+
+    def update_static(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Update the static marker candidates with this frame's markers.
+
+        Args:
+            positions (np.ndarray): Nx3 marker positions.
+
+        Returns:
+            np.ndarray: Which of the markers are static (N,).
+        """
+        static = np.zeros(len(positions), dtype=bool)
+        matched_candidates = np.zeros(len(self.static_positions), dtype=bool)
+        matched_markers = np.zeros(len(positions), dtype=bool)
+
+        if len(positions) > 0 and len(self.static_positions) > 0:
+            distances_sq = np.sum((positions[:, np.newaxis] - self.static_positions[np.newaxis]) ** 2, axis=2)
+            nearest = np.argmin(distances_sq, axis=1)
+            matched_markers = distances_sq[np.arange(len(positions)), nearest] <= self.static_radius ** 2
+
+            matched_candidates[nearest[matched_markers]] = True
+            static[matched_markers] = self.static_counts[nearest[matched_markers]] + 1 >= self.static_frames
+
+        # Candidates that were seen again count up, the rest are forgotten. Markers that didn't match a candidate
+        # become new candidates
+        new_positions = positions[~matched_markers]
+        self.static_positions = np.vstack((self.static_positions[matched_candidates], new_positions))
+        self.static_counts = np.concatenate((self.static_counts[matched_candidates] + 1,
+                                             np.ones(len(new_positions), dtype=int)))
+
+        # Keep the longest-lived candidates if there are too many
+        if len(self.static_positions) > self.max_static_candidates:
+            keep = np.argsort(-self.static_counts, kind='stable')[:self.max_static_candidates]
+            self.static_positions = self.static_positions[keep]
+            self.static_counts = self.static_counts[keep]
+
+        return static
+
+    def change_frame(self, affine: np.ndarray):
+        """
+        Move the static marker candidates into a new frame, eg. when the robot base transformation has been updated,
+        so that markers that are still in the world don't look like they've moved.
+
+        Args:
+            affine (np.ndarray): 3x4 affine transformation from the old frame to the new one.
+        """
+        self.static_positions = self.static_positions @ affine[:, :3].T + affine[:, 3]
+
+    def get_statistics(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Number of markers rejected by each stage, and the number of static candidates being watched.
+        """
+        stats = {f'rejected_{stage}': count for stage, count in self.rejected.items()}
+        stats['static_candidates'] = len(self.static_positions)
+        return stats
@@ -1,59 +1,133 @@
 import asyncio
+import re
 import threading
 import time
 import qtm_rt
+from qtm_rt.packet import (QRTComponentType, RT3DComponent, RT3DMarkerPositionResidual,
+                           RT3DMarkerPositionNoLabelResidual)
 import numpy as np
-from scipy.optimize import linear_sum_assignment
-from typing import Optional, Dict, Tuple
+from typing import Callable, Optional, Dict, Tuple
+
+from .frame_buffer import FrameRingBuffer
+from .marker_filter import MarkerPreFilter
+from .mocap_recording import MocapRecorder
+from .rigid_transform import RigidBodyRegistration, apply_affine, inverse_affine, relative_affine
+from .streaming_statistics import StreamingMetric
+
+
+def marker_dtype(marker_type) -> Optional[np.dtype]:
+    """
+    Build a numpy dtype that matches the binary layout of a qtm_rt marker type, so that a whole component can be read
+    straight out of the packet buffer with np.frombuffer.
+
+    Parameters:
+    - marker_type: A qtm_rt marker namedtuple with a little-endian struct format (eg. RT3DMarkerPositionResidual, '<4f').
+
+    Returns:
+    - A structured dtype with one field per namedtuple field (eg. x, y, z, residual), or None if the layout isn't
+      understood (in which case the markers are read with the qtm_rt getters instead).
+    """
+    codes = re.findall(r'(\d*)([a-zA-Z])', marker_type.format.format.lstrip('<'))
+    letters = ''.join(code * int(count or 1) for count, code in codes)
+
+    try:
+        dtype = np.dtype([(name, '<' + letter) for name, letter in zip(marker_type._fields, letters)])
+    except TypeError:
+        return None
+
+    return dtype if dtype.itemsize == marker_type.format.size else None
+
 
 class MocapInterface:
     """
     Class to track a rigid body using QTM data.
     """
 
-    def __init__(self, host: str="192.168.20.6", port: int=22223, logger=None):
+    # Known positions of the markers in the body frame (from the origin to the markers)
+    BASE_MARKER_POSITIONS = np.array([
+        [-383.49, -42.23, -77.20],
+        [-125.29, 417.32, -74.50],
+        [-172.27, 400.22, -73.30],
+        [172.27, 400.22, -75.10],
+        [151.55, 87.50, -73.80],
+        [432.73, -50.92, -75.80]
+    ])
+
+    def __init__(self, host: str="192.168.20.6", port: int=22223, logger=None,
+                 on_frame: Optional[Callable[[], None]]=None, source=None, marker_filter: bool=True,
+                 marker_filter_options: Optional[Dict[str, float]]=None):
         """
         Initialize the RigidBodyTracker.
 
         Parameters:
         - host: IP address of the QTM server.
         - port: Port to connect to QTM.
+        - on_frame: Called (from the QTM thread) each time a new frame has been added to frame_buffer.
+        - source: Optional stand-in for QTM (eg. a SyntheticMocapSource) with an async stream(on_packet) method and a
+          stop() method. If given, frames are streamed from it instead of connecting to QTM.
+        - marker_filter: Whether to run the unlabelled markers through a MarkerPreFilter.
+        - marker_filter_options: Keyword arguments for the MarkerPreFilter (eg. max_residual). These are given here,
+          rather than set afterwards, because the QTM thread starts filtering frames as soon as this returns.
         """
         self.host = host
         self.port = port
         self.logger = logger
+        self.source = source
+        self.connection = None
 
-        # Known positions of the markers in the body frame (from the origin to the markers)
-        self.base_marker_positions = np.array([
-            [-383.49, -42.23, -77.20],
-            [-125.29, 417.32, -74.50],
-            [-172.27, 400.22, -73.30],
-            [172.27, 400.22, -75.10],
-            [151.55, 87.50, -73.80],
-            [432.73, -50.92, -75.80]
-        ])
+        self.base_marker_positions = self.BASE_MARKER_POSITIONS.copy()
 
         # Current transformation from body to world frame
         self.R = np.eye(3)  # Rotation matrix
         self.t = np.zeros(3)  # Translation vector
 
+        # Rotation of 90 degrees about the z axis to align the body frame with the actual robot base frame.
+        # This is necessary because the QTM frame has X pointing forward, while the robot has Y pointing forward.
+        self.base_alignment = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]], dtype=float)
+
+        # Combined world to robot base transformation (3x4), rebuilt only when the base transformation changes
+        self.world_to_base = inverse_affine(self.R, self.t, self.base_alignment)
+        self.transform_scratch = np.empty((64, 3))
+
+        # Fits the base transformation to the labelled markers every frame, reusing the marker correspondence
+        self.registration = RigidBodyRegistration(self.base_marker_positions, tolerance=5.0)
+
+        # Rejects unlabelled markers that can't be balls (outside the workspace, poorly reconstructed, near the base
+        # markers or not moving) before they're handed over. None passes every marker through. The QTM thread uses
+        # this under data_lock, so it must only be replaced under the lock
+        self.marker_filter: Optional[MarkerPreFilter] = None
+        if marker_filter:
+            self.marker_filter = MarkerPreFilter(exclusion_centers=self.base_marker_positions @ self.base_alignment.T,
+                                                 exclusion_radii=30.0, **(marker_filter_options or {}))
+
         # Data storage for markers
         self.labelled_markers = np.empty((0, 4))    # Labelled markers with residuals
         self.unlabelled_markers = np.empty((0, 4))  # Unlabelled markers with residuals
 
-        # Performance statistics
-        self.residuals_rigid_body = []
-        self.residuals_unlabelled = []
+        # Preallocated buffers for reading markers out of each packet. These grow if a packet has more markers
+        self.labelled_dtype = marker_dtype(RT3DMarkerPositionResidual)
+        self.unlabelled_dtype = marker_dtype(RT3DMarkerPositionNoLabelResidual)
+        self.labelled_buffer = np.empty((16, 4))
+        self.unlabelled_buffer = np.empty((64, 4))
+
+        # Frames (unlabelled markers in the body frame) waiting to be picked up by the consumer, eg. the ROS node
+        self.frame_buffer = FrameRingBuffer(capacity=64, max_markers=64)
+        self.on_frame = on_frame
+
+        # Optional recorder that every frame is appended to (see start_recording)
+        self.recorder: Optional[MocapRecorder] = None
+        self.recorder_lock = threading.Lock()
+
+        # Performance statistics. These are kept in constant memory (running totals and a ring buffer of recent values)
+        # so that they don't grow for as long as the node is running. Adding values is a single copy into the buffer
+        self.residuals_rigid_body = StreamingMetric(window=1000)   # One value per frame
+        self.residuals_unlabelled = StreamingMetric(window=2000)   # One value per marker per frame
         self.drop_rate = 0
         self.out_of_sync_rate = 0
 
-        # Parameters for periodic update of the base transformation
-        self.update_frequency = 10  # Hz
-        self.position_threshold = 1.0  # mm (threshold for marker movement)
-        self.last_update_time = 0.0
-
-        # Storage for previous markers to check movement
-        self.previous_labelled_markers = None
+        # The base transformation is only replaced if the new fit moves a base marker by more than this, so that
+        # noise in the fit doesn't jitter the unlabelled markers
+        self.position_threshold = 1.0  # mm
 
         # Threading lock for data synchronization
         self.data_lock = threading.Lock()
@@ -68,6 +142,11 @@ class MocapInterface:
         """
         Asynchronously connect to QTM and start streaming data.
         """
+        if self.source is not None:
+            self.logger.info(f"Streaming mocap data from {type(self.source).__name__} instead of QTM.")
+            await self.source.stream(self.on_packet)
+            return
+
         try:
             self.connection = await qtm_rt.connect(self.host, port=self.port, timeout=5.0)
             if self.connection is None:
@@ -102,176 +181,164 @@ class MocapInterface:
         Parameters:
         - packet: The data packet received from QTM.
         """
-        current_time = time.time()
-
-        # Update performance statistics from the packet header
-        markers_residual = packet.get_3d_markers_residual()
-        if markers_residual is not None:
-            header, markers = markers_residual
-            with self.data_lock:
-                self.drop_rate = header.drop_rate
-                self.out_of_sync_rate = header.out_of_sync_rate
-
-                # Process labelled markers, skipping NaN positions
-                current_labelled = []
-                for marker in markers:
-                    if not np.isnan([marker.x, marker.y, marker.z]).any():
-                        marker_info = [marker.x, marker.y, marker.z, marker.residual]
-                        current_labelled.append(marker_info)
-                self.labelled_markers = np.array(current_labelled)
-        else:
-            with self.data_lock:
-                self.labelled_markers = np.empty((0, 4))
-
-        # Process unlabelled markers, skipping NaN positions
-        markers_no_label_residual = packet.get_3d_markers_no_label_residual()
-        if markers_no_label_residual is not None:
-            header, markers = markers_no_label_residual
-            current_unlabelled = []
-            for marker in markers:
-                if not np.isnan([marker.x, marker.y, marker.z]).any():
-                    marker_info = [marker.x, marker.y, marker.z, marker.residual]
-                    current_unlabelled.append(marker_info)
-            with self.data_lock:
-                self.unlabelled_markers = np.array(current_unlabelled)
-        else:
-            with self.data_lock:
-                self.unlabelled_markers = np.empty((0, 4))
+        receive_time = time.time_ns()
 
-        # Periodically update the rigid body transformation
-        if current_time - self.last_update_time >= 1.0 / self.update_frequency:
-            if self.should_update_transformation():
-                self.find_rigid_body_transformation()
-            self.last_update_time = current_time
+        labelled_info, labelled = self.read_markers(packet, QRTComponentType.Component3dRes, RT3DMarkerPositionResidual,
+                                                    self.labelled_dtype, 'labelled_buffer')
+        _, unlabelled = self.read_markers(packet, QRTComponentType.Component3dNoLabelsRes,
+                                          RT3DMarkerPositionNoLabelResidual, self.unlabelled_dtype, 'unlabelled_buffer')
+
+        with self.data_lock:
+            # Update performance statistics from the component header
+            if labelled_info is not None:
+                self.drop_rate = labelled_info.drop_rate
+                self.out_of_sync_rate = labelled_info.out_of_sync_rate
+
+            self.labelled_markers = labelled
+            self.unlabelled_markers = unlabelled
+
+        # Record the raw (QTM frame) markers, before the unlabelled ones are transformed in place
+        with self.recorder_lock:
+            if self.recorder is not None:
+                self.recorder.append(packet.timestamp, packet.framenumber, receive_time, labelled, unlabelled)
+
+        # Update the rigid body transformation. This is cheap enough to do every frame, so base drift is caught
+        # straight away
+        self.find_rigid_body_transformation()
 
         # Transform unlabelled markers to body frame
         self.transform_unlabelled_markers()
 
-    def should_update_transformation(self) -> bool:
-        """
-        Determine whether the rigid body transformation should be updated.
+        # Drop the markers that can't be balls
+        self.filter_unlabelled_markers()
 
-        Returns:
-        - True if the transformation should be updated, False otherwise.
-        """
-        with self.data_lock:
-            # Check if previous markers exist and have the same number of markers
-            if self.previous_labelled_markers is not None and len(self.labelled_markers) > 0:
-                if len(self.previous_labelled_markers) == len(self.labelled_markers):
-                    # Compute displacements of markers
-                    displacements = np.linalg.norm(
-                        self.labelled_markers[:, :3] - self.previous_labelled_markers[:, :3], axis=1
-                    )
-                    # Update if all markers have moved more than the threshold
-                    if np.all(displacements > self.position_threshold):
-                        self.logger.info("Base has moved! Updating transformation.")
-                        return True
-                    else:
-                        return False
-                else:
-                    # Number of markers changed; update transformation
-                    self.logger.info("Number of base markers changed! Updating transformation.")
-                    return True
-            else:
-                # First time or missing markers; update transformation
-                return True
+        # Hand the frame over to the consumer. self.unlabelled_markers is only ever replaced on this thread, so it's
+        # safe to read here without the lock
+        self.frame_buffer.push(packet.framenumber, packet.timestamp, receive_time, self.unlabelled_markers)
+        if self.on_frame is not None:
+            self.on_frame()
 
-    def find_rigid_body_transformation(self):
-        """
-        Compute the rigid body transformation based on current labelled markers.
-        Updates self.R and self.t.
+    def read_markers(self, packet, component_type, marker_type, dtype, buffer_name) -> Tuple[Optional[tuple], np.ndarray]:
         """
-        with self.data_lock:
-            if len(self.labelled_markers) >= 3:
-                world_markers = self.labelled_markers[:, :3]
-                # Compute transformation
-                self.R, self.t, residual = self.compute_transformation(
-                    self.base_marker_positions, world_markers
-                )
-                self.residuals_rigid_body.append(residual)
-                # Store current markers for future comparison
-                self.previous_labelled_markers = self.labelled_markers.copy()
-            else:
-                self.logger.info("Not enough labelled markers to compute transformation.")
-
-    def compute_transformation(
-        self, body_markers: np.ndarray, world_markers: np.ndarray
-    ) -> Tuple[np.ndarray, np.ndarray, float]:
-        """
-        Compute the rotation and translation from body frame to world frame.
+        Read all the markers (with residuals) in one component of a packet, dropping any with NaN positions.
+
+        The markers are read straight out of the packet buffer into a preallocated (N, 4) array, rather than being
+        unpacked one namedtuple at a time. If the packet can't be read this way, fall back to the qtm_rt getters.
 
         Parameters:
-        - body_markers: Nx3 array of markers in body frame.
-        - world_markers: Mx3 array of markers in world frame.
+        - packet: The data packet received from QTM.
+        - component_type: The QRTComponentType to read (eg. Component3dRes).
+        - marker_type: The qtm_rt marker namedtuple for this component (eg. RT3DMarkerPositionResidual).
+        - dtype: The numpy dtype that matches marker_type (see marker_dtype).
+        - buffer_name: Name of the preallocated buffer to read into.
 
         Returns:
-        - R: Rotation matrix (3x3).
-        - t: Translation vector (3,).
-        - residual: Root mean square error of the fit.
+        - The component header (RT3DComponent), or None if the component isn't in the packet.
+        - An Mx4 array of marker positions and residuals.
         """
-        # Build cost matrix based on distances
-        cost_matrix = np.linalg.norm(
-            body_markers[:, np.newaxis] - world_markers[np.newaxis, :], axis=2
-        )
-        # Solve assignment problem (Hungarian Algorithm)
-        row_ind, col_ind = linear_sum_assignment(cost_matrix)
-
-        # Matched markers
-        matched_body_markers = body_markers[row_ind]
-        matched_world_markers = world_markers[col_ind]
+        if dtype is None:
+            return self.read_markers_fallback(packet, component_type)
 
-        # Compute centroids
-        centroid_body = np.mean(matched_body_markers, axis=0)
-        centroid_world = np.mean(matched_world_markers, axis=0)
-
-        # Center the markers
-        centered_body = matched_body_markers - centroid_body
-        centered_world = matched_world_markers - centroid_world
+        try:
+            component_position = packet.components.get(component_type)
+            if component_position is None:
+                return None, np.empty((0, 4))
+
+            component_info = RT3DComponent._make(RT3DComponent.format.unpack_from(packet.data, component_position))
+            raw = np.frombuffer(packet.data, dtype=dtype, count=component_info.marker_count,
+                                offset=component_position + RT3DComponent.format.size)
+        except (AttributeError, TypeError, ValueError):
+            return self.read_markers_fallback(packet, component_type)
+
+        count = len(raw)
+        buffer = getattr(self, buffer_name)
+        if count > len(buffer):
+            buffer = np.empty((max(count, 2 * len(buffer)), 4))
+            setattr(self, buffer_name, buffer)
+
+        markers = buffer[:count]
+        markers[:, 0] = raw['x']
+        markers[:, 1] = raw['y']
+        markers[:, 2] = raw['z']
+        markers[:, 3] = raw['residual']
+
+        # Drop any markers that QTM couldn't reconstruct. This copies out of the buffer, so it's safe to keep
+        return component_info, markers[~np.isnan(markers[:, :3]).any(axis=1)]
+
+    def read_markers_fallback(self, packet, component_type) -> Tuple[Optional[tuple], np.ndarray]:
+        """
+        Read the markers in one component of a packet using the qtm_rt getters. Slower than read_markers, but doesn't
+        depend on the packet layout.
+        """
+        if component_type == QRTComponentType.Component3dRes:
+            result = packet.get_3d_markers_residual()
+            columns = [0, 1, 2, 3]  # x, y, z, residual
+        else:
+            result = packet.get_3d_markers_no_label_residual()
+            columns = [0, 1, 2, 4]  # x, y, z, (id), residual
 
-        # Compute covariance matrix
-        H = centered_body.T @ centered_world
+        if result is None:
+            return None, np.empty((0, 4))
 
-        # Perform Singular Value Decomposition
-        U, _, Vt = np.linalg.svd(H)
-        R = Vt.T @ U.T
+        component_info, markers = result
+        if not markers:
+            return component_info, np.empty((0, 4))
 
-        # Correct for reflection if necessary
-        if np.linalg.det(R) < 0:
-            Vt[2, :] *= -1
-            R = Vt.T @ U.T
+        markers = np.array(markers, dtype=float)[:, columns]
+        return component_info, markers[~np.isnan(markers[:, :3]).any(axis=1)]
 
-        # Compute translation vector
-        t = centroid_world - R @ centroid_body
+    def find_rigid_body_transformation(self):
+        """
+        Fit the rigid body transformation to the current labelled markers.
+        Updates self.R and self.t if the base has moved.
+        """
+        with self.data_lock:
+            result = self.registration.update(self.labelled_markers[:, :3])
+            if result is None:
+                # Keep the last good transformation rather than adopting one that doesn't fit
+                self.logger.info(f"Couldn't fit the base markers ({len(self.labelled_markers)} labelled markers). "
+                                 "Keeping the last transformation.", throttle_duration_sec=1.0)
+                return
 
-        # Compute residuals
-        transformed_body_markers = (R @ matched_body_markers.T).T + t
-        errors = transformed_body_markers - matched_world_markers
-        residual = np.sqrt(np.mean(np.sum(errors ** 2, axis=1)))
+            R, t, residual, rematched = result
+            self.residuals_rigid_body.update(residual)
+            if rematched:
+                self.logger.info(f"Matched base markers. Residual: {residual:.2f} mm", throttle_duration_sec=1.0)
 
-        return R, t, residual
+            # Only replace the transformation if the base markers have moved
+            displacements = np.linalg.norm(self.base_marker_positions @ (R - self.R).T + (t - self.t), axis=1)
+            if np.any(displacements > self.position_threshold):
+                self.R, self.t = R, t
+                world_to_base = inverse_affine(R, t, self.base_alignment)
+                if self.marker_filter is not None:
+                    self.marker_filter.change_frame(relative_affine(self.world_to_base, world_to_base))
+                self.world_to_base = world_to_base
 
     def transform_unlabelled_markers(self):
         """
         Transform unlabelled markers from world frame to body frame.
         Then rotate 90 degrees about the z axis to align with the actual robot base frame.
-        This is necessary because the QTM frame has X pointing forward, while the robot has Y pointing forward.
+        Both are done at once, in place, with the cached world_to_base transformation.
         """
         with self.data_lock:
-            if len(self.unlabelled_markers) > 0:
-                positions_world = self.unlabelled_markers[:, :3]
-                # Apply inverse transformation
-                positions_body = (self.R.T @ (positions_world - self.t).T).T
-                
-                # Rotate 90 degrees about z axis
-                rotation_matrix = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
-                positions_body = (rotation_matrix @ positions_body.T).T
-
-                # Store transformed positions
-                self.unlabelled_markers[:, :3] = positions_body
+            count = len(self.unlabelled_markers)
+            if count > 0:
+                if count > len(self.transform_scratch):
+                    self.transform_scratch = np.empty((max(count, 2 * len(self.transform_scratch)), 3))
+
+                positions = self.unlabelled_markers[:, :3]
+                apply_affine(self.world_to_base, positions, positions, self.transform_scratch[:count])
 
                 # Store residuals
-                residuals = self.unlabelled_markers[:, 3]
-                self.residuals_unlabelled.extend(residuals.tolist())
+                self.residuals_unlabelled.update(self.unlabelled_markers[:, 3])
+
+    def filter_unlabelled_markers(self):
+        """
+        Run the unlabelled markers (in the robot base frame) through the marker filter, if there is one.
+        """
+        with self.data_lock:
+            if self.marker_filter is not None:
+                self.unlabelled_markers = self.marker_filter.apply(self.unlabelled_markers)
 
     def get_unlabelled_markers_body_frame(self) -> np.ndarray:
         """
@@ -288,21 +355,62 @@ class MocapInterface:
         Asynchronously get the performance statistics.
 
         Returns:
-        - A dictionary with residuals, drop rate, and out-of-sync rate.
+        - A dictionary with residuals, drop rate, and out-of-sync rate. Residual statistics are given over the whole
+          session (eg. 'residual_unlabelled_mean'), as quantiles of the most recent values (eg.
+          'residual_unlabelled_p95') and over a window of recent values (eg. 'residual_unlabelled_window_mean').
         """
+        # Only copy under the lock. The quantiles sort the whole history, which would hold up the packet callback
         with self.data_lock:
+            rigid_body_snapshot = self.residuals_rigid_body.snapshot()
+            unlabelled_snapshot = self.residuals_unlabelled.snapshot()
+
             stats = {
-                'residual_rigid_body': self.residuals_rigid_body[-1] if self.residuals_rigid_body else None,
-                'average_residual_unlabelled': np.mean(self.residuals_unlabelled) if self.residuals_unlabelled else None,
                 'drop_rate': self.drop_rate,
-                'out_of_sync_rate': self.out_of_sync_rate
+                'out_of_sync_rate': self.out_of_sync_rate,
+                'frame_buffer_overflows': self.frame_buffer.overflow_count
             }
-            return stats
+            if self.marker_filter is not None:
+                filter_stats = self.marker_filter.get_statistics()
+                stats.update({f'marker_filter_{key}': value for key, value in filter_stats.items()})
+
+        rigid_body = rigid_body_snapshot.summary()
+        unlabelled = unlabelled_snapshot.summary()
+        stats['residual_rigid_body'] = rigid_body['last']
+        stats['average_residual_unlabelled'] = unlabelled['mean']
+        stats.update({f'residual_rigid_body_{key}': value for key, value in rigid_body.items() if key != 'last'})
+        stats.update({f'residual_unlabelled_{key}': value for key, value in unlabelled.items() if key != 'last'})
+        return stats
+
+    def start_recording(self, session_dir: str):
+        """
+        Start recording every frame to a session directory (see mocap_recording). Stops any recording in progress.
+
+        Parameters:
+        - session_dir: Directory to record the session into.
+        """
+        recorder = MocapRecorder(session_dir)
+        with self.recorder_lock:
+            previous, self.recorder = self.recorder, recorder
+        if previous is not None:
+            previous.close()
+        self.logger.info(f"Recording mocap session to {session_dir}")
+
+    def stop_recording(self):
+        """
+        Stop recording, if a recording is in progress.
+        """
+        with self.recorder_lock:
+            recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+            self.logger.info(f"Recorded {recorder.total_frames} frames to {recorder.session_dir}")
 
     def start(self):
         """
         Start the tracker in a separate thread.
         """
+        # The loop is made here rather than on the thread, so that it's there for stop() however soon that's called
+        self.loop = asyncio.new_event_loop()
         self.thread = threading.Thread(target=self._run_asyncio_loop)
         self.thread.start()
 
@@ -310,7 +418,6 @@ class MocapInterface:
         """
         Run the asyncio event loop in a separate thread.
         """
-        self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
         try:
             # Schedule the connect coroutine
@@ -320,13 +427,20 @@ class MocapInterface:
         except asyncio.CancelledError:
             pass
         finally:
+            # Let anything still running (eg. a synthetic source's stream) finish cleanly before closing the loop
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
             self.loop.close()
 
     def stop(self):
         """
         Stop the tracker and close the connection.
         """
-        if self.loop:
+        if self.loop and not self.loop.is_closed():
+            if self.source is not None:
+                self.loop.call_soon_threadsafe(self.source.stop)
             if self.connection:
                 # Disconnect the connection in the event loop thread
                 self.loop.call_soon_threadsafe(self.connection.disconnect)
@@ -334,6 +448,7 @@ class MocapInterface:
             self.loop.call_soon_threadsafe(self.loop.stop)
         if self.thread:
             self.thread.join()
+        self.stop_recording()
 
 if __name__ == "__main__":
     tracker = MocapInterface()
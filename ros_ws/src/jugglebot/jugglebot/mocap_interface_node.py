@@ -1,17 +1,33 @@
+import os
+import re
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+import numpy as np
+import quaternion  # numpy quaternion
 import rclpy
 from rclpy.node import Node
 from std_srvs.srv import Trigger
+from geometry_msgs.msg import PoseStamped
 from jugglebot_interfaces.msg import MocapDataMulti, MocapDataSingle
+from .clock_sync import ClockOffsetEstimator
+from .marker_filter import MarkerPreFilter
 from .mocap_interface import MocapInterface
+from .mocap_recording import MocapReplaySource
+from .synthetic_mocap import SyntheticMocapSource
+from .tracking_sources import OpenVRTrackingSource, QtmTrackingSource, TrackingFrame, TrackingFusion
 
 class MocapInterfaceNode(Node):
     def __init__(self):
         super().__init__('mocap_interface_node')
 
-        self.mocap_interface = MocapInterface(logger=self.get_logger())
-
         # Initialize state variables
         self.shutdown_flag = False
+        self.last_frame_number = None  # QTM frame number of the last published frame
+        self.dropped_frame_count = 0
+
+        # Converts QTM's capture timestamps into the ROS clock
+        self.clock_offset = ClockOffsetEstimator()
 
         # Initialize a service to trigger closing the node
         self.service = self.create_service(Trigger, 'end_session', self.end_session)
@@ -19,31 +35,183 @@ class MocapInterfaceNode(Node):
         # Initialize a publisher to publish the mocap data
         self.mocap_publisher = self.create_publisher(MocapDataMulti, 'mocap_data', 10)
 
-        # Initialize a timer to publish the mocap data
-        mocap_frames_per_second = 200
-        self.timer = self.create_timer(1.0 / mocap_frames_per_second, self.publish_mocap_data)
+        # Publish each frame as soon as it arrives. The QTM thread triggers this guard condition after adding a frame
+        # to the mocap interface's frame buffer, which wakes up the executor
+        self.frame_guard = self.create_guard_condition(self.publish_mocap_data)
+
+        # Where to get the mocap data from: 'qtm', 'synthetic' to stream simulated balls without the lab, or
+        # 'replay' to stream a recorded session (from 'replay_session', at 'replay_speed' x real time, 0 for max)
+        self.mocap_source = self.declare_parameter('mocap_source', 'qtm').get_parameter_value().string_value
+        self.qtm_host = self.declare_parameter('qtm_host', '192.168.20.6').get_parameter_value().string_value
+
+        source = None
+        if self.mocap_source == 'synthetic':
+            source = self.create_synthetic_source()
+        elif self.mocap_source == 'replay':
+            session = self.declare_parameter('replay_session', '').get_parameter_value().string_value
+            speed = self.declare_parameter('replay_speed', 1.0).get_parameter_value().double_value
+            source = MocapReplaySource(session, speed=speed, logger=self.get_logger())
+        elif self.mocap_source != 'qtm':
+            self.get_logger().error(f"Unknown mocap_source '{self.mocap_source}'. Using QTM.")
+
+        # With 'steamvr_trackers', the poses of the SteamVR trackers are time-aligned onto the mocap frames, and
+        # published with each frame on 'tracker_poses/<serial number>'. The fusion then takes the frames from the
+        # mocap interface, instead of this node
+        vr_source = self.create_steamvr_source() if self.declare_parameter('steamvr_trackers', False).value else None
+
+        # The marker filter is configured up front, because the mocap interface starts streaming as soon as it's made
+        marker_filter_enabled, marker_filter_options = self.marker_filter_parameters()
+        self.mocap_interface = MocapInterface(host=self.qtm_host, logger=self.get_logger(),
+                                              on_frame=self.frame_guard.trigger if vr_source is None else None,
+                                              source=source, marker_filter=marker_filter_enabled,
+                                              marker_filter_options=marker_filter_options)
+
+        self.tracking_fusion: Optional[TrackingFusion] = None
+        self.fused_frames = deque()    # Fused frames waiting to be published (appended from the fusion thread)
+        self.tracker_publishers = {}   # Pose publisher for each tracker, by serial number
+        if vr_source is not None:
+            self.tracking_fusion = TrackingFusion([QtmTrackingSource(self.mocap_interface), vr_source],
+                                                  on_frame=self.on_fused_frame, logger=self.get_logger())
+            self.tracking_fusion.start()
+
+        # If 'record_directory' is set, record the session into a new directory inside it
+        record_directory = self.declare_parameter('record_directory', '').get_parameter_value().string_value
+        if record_directory:
+            session_name = time.strftime('session_%Y%m%d_%H%M%S')
+            self.mocap_interface.start_recording(os.path.join(os.path.expanduser(record_directory), session_name))
 
         self.get_logger().info("MocapInterfaceNode initialized")
 
-    def publish_mocap_data(self):
-        """Publish the tracking data of any unlabelled markers in the base frame"""
-        mocap_data = self.mocap_interface.get_unlabelled_markers_body_frame()
-
-        if mocap_data is not None and mocap_data.shape[0] > 0:
-            msg_full = MocapDataMulti()
-            
-            # Convert the numpy array to a list of MocapDataSingle messages and publish the full MocapDataMulti message
-            for i in range(mocap_data.shape[0]):
-                msg_single = MocapDataSingle()
-                
-                msg_single.position.x = float(mocap_data[i, 0])
-                msg_single.position.y = float(mocap_data[i, 1])
-                msg_single.position.z = float(mocap_data[i, 2])
-                msg_single.residual = float(mocap_data[i, 3])
+    def create_synthetic_source(self) -> SyntheticMocapSource:
+        """Create a synthetic mocap source, configured from the 'synthetic_*' parameters"""
+        def parameter(name, default):
+            return self.declare_parameter(f'synthetic_{name}', default).value
+
+        seed = parameter('seed', -1)  # -1 for a different stream each run
+
+        return SyntheticMocapSource(
+            MocapInterface.BASE_MARKER_POSITIONS,
+            frame_rate=parameter('frame_rate', 300.0),
+            num_balls=parameter('num_balls', 3),
+            noise_std=parameter('noise_std', 0.3),
+            dropout_probability=parameter('dropout_probability', 0.01),
+            ghost_rate=parameter('ghost_rate', 0.05),
+            seed=seed if seed >= 0 else None,
+        )
+
+    def create_steamvr_source(self) -> Optional[OpenVRTrackingSource]:
+        """Create the SteamVR tracker source, configured from the 'steamvr_*' parameters"""
+        # 3x4 affine transformation from the SteamVR frame to the robot base frame {mm}, row by row
+        vr_to_base = self.declare_parameter('steamvr_to_base', [1.0, 0.0, 0.0, 0.0,
+                                                                0.0, 1.0, 0.0, 0.0,
+                                                                0.0, 0.0, 1.0, 0.0]).value
+        rate = self.declare_parameter('steamvr_rate', 250.0).value
+
+        try:
+            return OpenVRTrackingSource(rate=rate, vr_to_base=np.reshape(vr_to_base, (3, 4)))
+        except ImportError:
+            self.get_logger().error("SteamVR trackers need the openvr package. Streaming mocap data on its own.")
+            return None
+
+    def marker_filter_parameters(self) -> Tuple[bool, Dict[str, float]]:
+        """Read the 'marker_filter_*' parameters: whether to filter, and the options for the mocap interface's filter"""
+        def parameter(name, default):
+            return self.declare_parameter(f'marker_filter_{name}', default).value
+
+        defaults = MarkerPreFilter()
+        enabled = parameter('enabled', True)
+        options = {name: parameter(name, getattr(defaults, name))
+                   for name in ('max_residual', 'static_radius', 'static_frames')}
+        return enabled, options
+
+    def on_fused_frame(self, frame: TrackingFrame):
+        """Queue a fused frame to be published, and wake up the executor. Called from the fusion thread"""
+        self.fused_frames.append(frame)
+        self.frame_guard.trigger()
 
-                msg_full.unlabelled_markers.append(msg_single)
+    def publish_mocap_data(self):
+        """Publish every new frame of unlabelled markers (in the base frame), each exactly once"""
+        if self.tracking_fusion is not None:
+            while self.fused_frames:
+                frame = self.fused_frames.popleft()
+                # The fusion has already converted the capture time into the ROS clock
+                self.publish_frame(frame.sequence, frame.device_time // 1000, frame.capture_time, frame.markers)
+                self.publish_tracker_poses(frame)
+            return
+
+        for frame_number, timestamp, receive_time, mocap_data in self.mocap_interface.frame_buffer.drain():
+            # QTM timestamps are in {us}. Stamp the message with the capture time in the ROS clock
+            capture_time = self.clock_offset.update(timestamp * 1000, receive_time)
+            self.publish_frame(frame_number, timestamp, capture_time, mocap_data)
+
+    def publish_frame(self, frame_number: int, timestamp: int, capture_time: int, mocap_data: np.ndarray):
+        """
+        Publish a frame of unlabelled markers.
 
-            self.mocap_publisher.publish(msg_full)
+        Args:
+            frame_number (int): QTM frame number.
+            timestamp (int): Time that QTM captured the frame, in the QTM clock {us}.
+            capture_time (int): Time that QTM captured the frame, in the ROS clock {ns}.
+            mocap_data (np.ndarray): Mx4 array of unlabelled markers (x, y, z, residual) in the base frame.
+        """
+        self.check_for_dropped_frames(frame_number)
+
+        msg_full = MocapDataMulti()
+        msg_full.header.stamp.sec = capture_time // 1_000_000_000
+        msg_full.header.stamp.nanosec = capture_time % 1_000_000_000
+        msg_full.header.frame_id = 'base'
+        msg_full.frame_number = frame_number
+        msg_full.capture_timestamp = timestamp
+
+        # Convert the numpy array to a list of MocapDataSingle messages and publish the full MocapDataMulti message
+        for i in range(mocap_data.shape[0]):
+            msg_single = MocapDataSingle()
+
+            msg_single.position.x = float(mocap_data[i, 0])
+            msg_single.position.y = float(mocap_data[i, 1])
+            msg_single.position.z = float(mocap_data[i, 2])
+            msg_single.residual = float(mocap_data[i, 3])
+
+            msg_full.unlabelled_markers.append(msg_single)
+
+        self.mocap_publisher.publish(msg_full)
+
+    def publish_tracker_poses(self, frame: TrackingFrame):
+        """Publish the pose of each tracker in a fused frame, stamped with the frame's capture time"""
+        for serial_number, pose in frame.rigid_bodies.items():
+            publisher = self.tracker_publishers.get(serial_number)
+            if publisher is None:
+                # Serial numbers (eg. 'LHR-0DC3A2F1') can have characters that aren't allowed in topic names
+                topic = 'tracker_poses/' + re.sub(r'[^A-Za-z0-9_]', '_', serial_number)
+                publisher = self.tracker_publishers[serial_number] = self.create_publisher(PoseStamped, topic, 10)
+
+            msg = PoseStamped()
+            msg.header.stamp.sec = frame.capture_time // 1_000_000_000
+            msg.header.stamp.nanosec = frame.capture_time % 1_000_000_000
+            msg.header.frame_id = 'base'
+
+            # Positions in {mm}, like the markers
+            msg.pose.position.x, msg.pose.position.y, msg.pose.position.z = (float(value) for value in pose[:, 3])
+            orientation = quaternion.from_rotation_matrix(pose[:, :3])
+            msg.pose.orientation.w, msg.pose.orientation.x = float(orientation.w), float(orientation.x)
+            msg.pose.orientation.y, msg.pose.orientation.z = float(orientation.y), float(orientation.z)
+
+            publisher.publish(msg)
+
+    def check_for_dropped_frames(self, frame_number: int):
+        """Report any frames that were skipped between the last published frame and this one"""
+        if self.last_frame_number is not None and frame_number > self.last_frame_number + 1:
+            first_missing = self.last_frame_number + 1
+            last_missing = frame_number - 1
+            self.dropped_frame_count += last_missing - first_missing + 1
+
+            missing = str(first_missing) if first_missing == last_missing else f'{first_missing}-{last_missing}'
+            self.get_logger().warn(f'Dropped mocap frame(s) {missing}. {self.dropped_frame_count} dropped in total '
+                                   f'({self.mocap_interface.frame_buffer.overflow_count} from a full frame buffer)',
+                                   throttle_duration_sec=1.0)
+
+        # If the frame number has gone backwards, QTM has restarted the measurement, so just start counting again
+        self.last_frame_number = frame_number
 
     #########################################################################################################
     #                                          Node Management                                              #
@@ -61,6 +229,8 @@ class MocapInterfaceNode(Node):
         Cleanup method called when the node is shutting down.
         """
         self.get_logger().info("Shutting down MocapInterfaceNode...")
+        if self.tracking_fusion is not None:
+            self.tracking_fusion.stop()
         self.mocap_interface.stop()
         self.destroy_node()
 
@@ -0,0 +1,268 @@
+"""
+Recording and replaying mocap sessions.
+
+MocapRecorder appends every frame that MocapInterface receives to a session directory on disk. MocapReplaySource
+streams a recorded session back into MocapInterface, in place of QTM, so that it goes through the same processing
+and is published on 'mocap_data' just like a live session. This makes it possible to benchmark the nodes downstream
+(eg. ball_prediction_node) on the same data over and over, and to tune their thresholds offline.
+
+A session is stored as a series of chunks, each a directory of .npy columns that are written through memory maps:
+    session/
+        session.json                Format version and the number of frames/markers in each chunk
+        chunk_00000/
+            timestamp.npy           (F,)    QTM capture timestamp {us}
+            frame_number.npy        (F,)    QTM frame number
+            receive_time.npy        (F,)    Host time that the frame was received {ns}
+            labelled_offset.npy     (F+1,)  Frame i's labelled markers are labelled[offset[i]:offset[i + 1]]
+            unlabelled_offset.npy   (F+1,)  As above, for the unlabelled markers
+            labelled.npy            (L, 4)  Labelled markers (x, y, z, residual) in the QTM frame {mm}
+            unlabelled.npy          (U, 4)  Unlabelled markers (x, y, z, residual) in the QTM frame {mm}
+        chunk_00001/
+        ...
+
+Each chunk's files are preallocated, so appending a frame is just a copy into the memory maps. session.json records
+how much of each chunk is used, and is rewritten every few hundred frames so that little is lost if the recorder
+isn't closed cleanly. The files can be opened with np.load(..., mmap_mode='r') for analysis without loading a whole
+session into memory.
+"""
+
+import asyncio
+import json
+import os
+import numpy as np
+from typing import Callable, Iterator, Optional, Tuple
+
+from .synthetic_mocap import build_packet
+
+RECORDING_FORMAT_VERSION = 1
+
+FRAME_COLUMNS = ('timestamp', 'frame_number', 'receive_time')
+MARKER_COLUMNS = ('labelled', 'unlabelled')
+
+
+class MocapRecorder:
+    """
+    Appends mocap frames to a chunked, memory-mapped session directory.
+    """
+
+    def __init__(self, session_dir: str, frames_per_chunk: int = 30000, markers_per_frame: int = 16,
+                 save_every: int = 300):
+        """
+        Args:
+            session_dir (str): Directory to record the session into. Created if it doesn't exist.
+            frames_per_chunk (int): Number of frames in each chunk (30000 is 100 s at 300 Hz).
+            markers_per_frame (int): Average number of each kind of marker per frame to allocate space for. A new
+                                     chunk is started early if a chunk runs out of marker space.
+            save_every (int): Number of frames between updates of session.json.
+        """
+        self.session_dir = session_dir
+        self.frames_per_chunk = frames_per_chunk
+        self.markers_per_chunk = frames_per_chunk * markers_per_frame
+        self.save_every = save_every
+
+        os.makedirs(session_dir, exist_ok=True)
+
+        self.chunks = []          # Summary of each chunk, as saved in session.json
+        self.columns = {}         # Memory maps of the current chunk
+        self.num_frames = 0       # Frames in the current chunk
+        self.num_markers = {}     # Markers of each kind in the current chunk
+        self.total_frames = 0
+
+        self.start_chunk()
+
+    def start_chunk(self):
+        """Finish the current chunk (if any) and start a new one"""
+        self.flush_chunk()
+
+        chunk_name = f'chunk_{len(self.chunks):05d}'
+        chunk_dir = os.path.join(self.session_dir, chunk_name)
+        os.makedirs(chunk_dir, exist_ok=True)
+
+        def open_column(name, dtype, shape):
+            return np.lib.format.open_memmap(os.path.join(chunk_dir, f'{name}.npy'), mode='w+', dtype=dtype,
+                                             shape=shape)
+
+        self.columns = {name: open_column(name, np.int64, (self.frames_per_chunk,)) for name in FRAME_COLUMNS}
+        for name in MARKER_COLUMNS:
+            self.columns[name] = open_column(name, np.float32, (self.markers_per_chunk, 4))
+            self.columns[f'{name}_offset'] = open_column(f'{name}_offset', np.int64, (self.frames_per_chunk + 1,))
+
+        self.num_frames = 0
+        self.num_markers = {name: 0 for name in MARKER_COLUMNS}
+        self.chunks.append({'name': chunk_name, 'num_frames': 0, 'num_labelled': 0, 'num_unlabelled': 0})
+
+    def append(self, timestamp: int, frame_number: int, receive_time: int, labelled: np.ndarray,
+               unlabelled: np.ndarray):
+        """
+        Record a frame.
+
+        Args:
+            timestamp (int): QTM capture timestamp {us}.
+            frame_number (int): QTM frame number.
+            receive_time (int): Host time that the frame was received {ns}.
+            labelled (np.ndarray): Nx4 array of labelled markers (x, y, z, residual) in the QTM frame.
+            unlabelled (np.ndarray): Mx4 array of unlabelled markers (x, y, z, residual) in the QTM frame.
+        """
+        markers = {'labelled': labelled, 'unlabelled': unlabelled}
+
+        if self.num_frames == self.frames_per_chunk or \
+           any(self.num_markers[name] + len(markers[name]) > self.markers_per_chunk for name in MARKER_COLUMNS):
+            self.start_chunk()
+
+        frame = self.num_frames
+        self.columns['timestamp'][frame] = timestamp
+        self.columns['frame_number'][frame] = frame_number
+        self.columns['receive_time'][frame] = receive_time
+
+        for name in MARKER_COLUMNS:
+            start = self.num_markers[name]
+            end = start + min(len(markers[name]), self.markers_per_chunk)
+            self.columns[name][start:end] = markers[name][:end - start]
+            self.columns[f'{name}_offset'][frame + 1] = end
+            self.num_markers[name] = end
+
+        self.num_frames += 1
+        self.total_frames += 1
+
+        if self.total_frames % self.save_every == 0:
+            self.save_session()
+
+    def flush_chunk(self):
+        """Flush the current chunk to disk and record how much of it is used"""
+        if not self.chunks:
+            return
+
+        for column in self.columns.values():
+            column.flush()
+        self.save_session()
+
+    def save_session(self):
+        """Write session.json, via a temporary file so that a reader never sees a partial file"""
+        self.chunks[-1].update({'num_frames': self.num_frames, 'num_labelled': self.num_markers['labelled'],
+                                'num_unlabelled': self.num_markers['unlabelled']})
+        session_path = os.path.join(self.session_dir, 'session.json')
+        with open(session_path + '.tmp', 'w') as f:
+            json.dump({'format_version': RECORDING_FORMAT_VERSION, 'chunks': self.chunks}, f, indent=2)
+        os.replace(session_path + '.tmp', session_path)
+
+    def close(self):
+        """Finish the recording"""
+        self.flush_chunk()
+        self.columns = {}
+
+
+class MocapRecording:
+    """
+    Read-only access to a recorded session. The chunks are memory-mapped, so nothing is read until it's needed.
+    """
+
+    def __init__(self, session_dir: str):
+        """
+        Args:
+            session_dir (str): Directory that the session was recorded into.
+        """
+        self.session_dir = session_dir
+
+        with open(os.path.join(session_dir, 'session.json'), 'r') as f:
+            session = json.load(f)
+        if session['format_version'] != RECORDING_FORMAT_VERSION:
+            raise ValueError(f"Unsupported recording format version: {session['format_version']}")
+
+        self.chunks = [chunk for chunk in session['chunks'] if chunk['num_frames'] > 0]
+
+    def __len__(self) -> int:
+        return sum(chunk['num_frames'] for chunk in self.chunks)
+
+    def load_chunk(self, chunk: dict) -> dict:
+        """
+        Memory-map the used part of a chunk's columns.
+
+        Returns:
+            dict: The columns, keyed by name (eg. 'timestamp', 'labelled', 'labelled_offset').
+        """
+        chunk_dir = os.path.join(self.session_dir, chunk['name'])
+        used = {'labelled': chunk['num_labelled'], 'unlabelled': chunk['num_unlabelled']}
+
+        columns = {}
+        for name in FRAME_COLUMNS:
+            columns[name] = np.load(os.path.join(chunk_dir, f'{name}.npy'), mmap_mode='r')[:chunk['num_frames']]
+        for name in MARKER_COLUMNS:
+            columns[name] = np.load(os.path.join(chunk_dir, f'{name}.npy'), mmap_mode='r')[:used[name]]
+            columns[f'{name}_offset'] = np.load(os.path.join(chunk_dir, f'{name}_offset.npy'),
+                                                mmap_mode='r')[:chunk['num_frames'] + 1]
+        return columns
+
+    def frames(self) -> Iterator[Tuple[int, int, int, np.ndarray, np.ndarray]]:
+        """
+        Iterate over the recorded frames, in order.
+
+        Yields:
+            Tuple[int, int, int, np.ndarray, np.ndarray]: (timestamp, frame_number, receive_time, labelled, unlabelled)
+        """
+        for chunk in self.chunks:
+            columns = self.load_chunk(chunk)
+            for frame in range(chunk['num_frames']):
+                markers = [columns[name][columns[f'{name}_offset'][frame]:columns[f'{name}_offset'][frame + 1]]
+                           for name in MARKER_COLUMNS]
+                yield (int(columns['timestamp'][frame]), int(columns['frame_number'][frame]),
+                       int(columns['receive_time'][frame]), markers[0], markers[1])
+
+
+class MocapReplaySource:
+    """
+    Streams a recorded session into MocapInterface in place of QTM (see SyntheticMocapSource for the interface).
+
+    Frames keep their recorded QTM timestamps and frame numbers. At 1x speed, everything downstream sees the session
+    exactly as it was recorded. Faster replays are for throughput benchmarking: nodes that time measurements with the
+    ROS clock will see the session compressed in time.
+    """
+
+    def __init__(self, session_dir: str, speed: float = 1.0, logger=None):
+        """
+        Args:
+            session_dir (str): Directory that the session was recorded into.
+            speed (float): Playback speed, as a multiple of real time. 0 replays as fast as possible.
+            logger: Optional logger to report the end of the replay to.
+        """
+        self.recording = MocapRecording(session_dir)
+        self.speed = speed
+        self.logger = logger
+        self.running = False
+
+    async def stream(self, on_packet: Callable):
+        """
+        Stream the recorded frames to on_packet until the end of the recording, or until stop() is called.
+
+        Args:
+            on_packet (Callable[[QRTPacket], None]): Called with each frame, as qtm_rt's stream_frames would.
+        """
+        loop = asyncio.get_running_loop()
+        self.running = True
+
+        start_time: Optional[float] = None
+        first_timestamp: Optional[int] = None
+        count = 0
+
+        for timestamp, frame_number, _, labelled, unlabelled in self.recording.frames():
+            if not self.running:
+                break
+
+            if self.speed > 0:
+                # Schedule each frame against its recorded timestamp, so that timing errors don't accumulate
+                if start_time is None:
+                    start_time, first_timestamp = loop.time(), timestamp
+                frame_time = start_time + (timestamp - first_timestamp) * 1e-6 / self.speed
+                await asyncio.sleep(max(0.0, frame_time - loop.time()))
+            else:
+                await asyncio.sleep(0)
+
+            on_packet(build_packet(timestamp, frame_number, labelled, unlabelled))
+            count += 1
+
+        self.running = False
+        if self.logger is not None:
+            self.logger.info(f"Replay finished after {count} frames.")
+
+    def stop(self):
+        """Stop streaming after the current frame"""
+        self.running = False
@@ -0,0 +1,214 @@
+# rigid_transform.py
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from typing import Optional, Tuple
+
+
+def kabsch(body_markers: np.ndarray, world_markers: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the rotation and translation that best map matched body-frame markers onto world-frame markers, in the
+    least-squares sense (Kabsch algorithm).
+
+    Args:
+        body_markers (np.ndarray): Nx3 array of markers in the body frame.
+        world_markers (np.ndarray): Nx3 array of the same markers (in the same order) in the world frame.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Rotation matrix (3x3), translation vector (3,) and the distance
+                                                   between each fitted and measured marker (N,).
+    """
+    centroid_body = body_markers.mean(axis=0)
+    centroid_world = world_markers.mean(axis=0)
+
+    # Covariance of the centred markers
+    H = (body_markers - centroid_body).T @ (world_markers - centroid_world)
+
+    U, _, Vt = np.linalg.svd(H)
+    R = Vt.T @ U.T
+
+    # Correct for reflection if necessary
+    if np.linalg.det(R) < 0:
+        Vt[2, :] *= -1
+        R = Vt.T @ U.T
+
+    t = centroid_world - R @ centroid_body
+
+    errors = np.linalg.norm(body_markers @ R.T + t - world_markers, axis=1)
+
+    return R, t, errors
+
+
+def match_markers(body_markers: np.ndarray, world_markers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Match body-frame markers to world-frame markers by solving the assignment problem (Hungarian algorithm) on the
+    distances between them.
+
+    Args:
+        body_markers (np.ndarray): Nx3 array of markers in the body frame.
+        world_markers (np.ndarray): Mx3 array of markers in the world frame.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Indices of the matched body markers and the world markers they're matched to.
+    """
+    cost_matrix = np.linalg.norm(body_markers[:, np.newaxis] - world_markers[np.newaxis, :], axis=2)
+    return linear_sum_assignment(cost_matrix)
+
+
+def match_markers_by_shape(body_markers: np.ndarray, world_markers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Match body-frame markers to world-frame markers without knowing anything about the transformation between them,
+    using the distances from each marker to the others (which don't change with rotation or translation).
+
+    Each world marker's distances are compared to each body marker's distances. Every world distance is matched to
+    the closest body distance, so a missing or extra marker only adds to the cost of the distances it affects. The
+    assignment problem is then solved on the total cost.
+
+    Args:
+        body_markers (np.ndarray): Nx3 array of markers in the body frame.
+        world_markers (np.ndarray): Mx3 array of markers in the world frame.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Indices of the matched body markers and the world markers they're matched to.
+    """
+    body_distances = np.linalg.norm(body_markers[:, np.newaxis] - body_markers[np.newaxis, :], axis=2)
+    world_distances = np.linalg.norm(world_markers[:, np.newaxis] - world_markers[np.newaxis, :], axis=2)
+
+    # (N, M, M, N) differences between every world distance and every body distance. Marker counts are small.
+    # Each marker's distance to itself (zero) always matches the other's at no cost, so it doesn't need removing
+    differences = np.abs(world_distances[np.newaxis, :, :, np.newaxis] - body_distances[:, np.newaxis, np.newaxis, :])
+    cost_matrix = differences.min(axis=3).sum(axis=2)
+
+    return linear_sum_assignment(cost_matrix)
+
+
+def inverse_affine(R: np.ndarray, t: np.ndarray, alignment: np.ndarray = np.eye(3)) -> np.ndarray:
+    """
+    Build the 3x4 affine transformation that takes points from the world frame into a body frame, followed by a fixed
+    alignment rotation. That is, [A | b] such that alignment @ R.T @ (p - t) = A @ p + b.
+
+    Args:
+        R (np.ndarray): Rotation matrix from the body frame to the world frame (3x3).
+        t (np.ndarray): Translation vector from the body frame to the world frame (3,).
+        alignment (np.ndarray): Rotation applied after the inverse transformation (3x3).
+
+    Returns:
+        np.ndarray: The affine transformation (3x4).
+    """
+    A = alignment @ R.T
+    return np.hstack((A, -(A @ t)[:, np.newaxis]))
+
+
+def relative_affine(old: np.ndarray, new: np.ndarray) -> np.ndarray:
+    """
+    Given two rigid 3x4 affine transformations from the same frame, build the one that takes points from the output
+    frame of `old` to the output frame of `new`. Eg. with two successive world to base transformations, this moves
+    points that were transformed with the old one to where the new one would have put them.
+
+    Args:
+        old (np.ndarray): The old affine transformation (3x4). Its 3x3 part must be a rotation.
+        new (np.ndarray): The new affine transformation (3x4).
+
+    Returns:
+        np.ndarray: The relative affine transformation (3x4).
+    """
+    A = new[:, :3] @ old[:, :3].T
+    return np.hstack((A, (new[:, 3] - A @ old[:, 3])[:, np.newaxis]))
+
+
+def apply_affine(affine: np.ndarray, points: np.ndarray, out: np.ndarray,
+                 scratch: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Apply a 3x4 affine transformation to a set of points with a single matrix multiply.
+
+    Args:
+        affine (np.ndarray): The affine transformation (3x4).
+        points (np.ndarray): Nx3 array of points. Can be a view, eg. the position columns of an array of markers.
+        out (np.ndarray): Nx3 array to write the transformed points into. Can be the same as points.
+        scratch (np.ndarray): Optional preallocated Nx3 array to multiply into, so that nothing is allocated.
+
+    Returns:
+        np.ndarray: out
+    """
+    # Multiply into scratch first, since out may share memory with points
+    if scratch is None:
+        scratch = np.empty((len(points), 3))
+    np.matmul(points, affine[:, :3].T, out=scratch)
+    scratch += affine[:, 3]
+    out[...] = scratch
+    return out
+
+
+class RigidBodyRegistration:
+    """
+    Tracks the transformation from a rigid body's frame to the world frame, from its markers.
+
+    The correspondence between body markers and world markers is found once (with match_markers) and then cached.
+    Each new set of world markers is fitted with a closed-form Kabsch update on the cached matches, which costs one
+    3x3 SVD. The matching is only solved again if the cached one stops fitting (a marker is further than `tolerance`
+    from where the fit puts it), eg. because a marker has dropped out or QTM has reordered them. When it is, the
+    world markers are first matched to where the last good fit puts the body markers. If there is no good fit yet
+    (or that match doesn't fit either), they're matched by shape instead, which works whatever the transformation.
+    """
+
+    def __init__(self, body_markers: np.ndarray, tolerance: float = 5.0):
+        """
+        Args:
+            body_markers (np.ndarray): Nx3 array of the known marker positions in the body frame.
+            tolerance (float): Largest error between a fitted and measured marker for a match to be accepted {mm}.
+        """
+        self.body_markers = np.asarray(body_markers, dtype=float)
+        self.tolerance = tolerance
+
+        # Cached correspondence: body_markers[body_indices] matches world_markers[world_indices]
+        self.body_indices: Optional[np.ndarray] = None
+        self.world_indices: Optional[np.ndarray] = None
+        self.num_world_markers = 0
+
+        # Last transformation that fitted within tolerance
+        self.R: Optional[np.ndarray] = None
+        self.t: Optional[np.ndarray] = None
+
+        self.match_count = 0  # Number of times the correspondence has been solved from scratch
+
+    def update(self, world_markers: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray, float, bool]]:
+        """
+        Fit the transformation to a new set of world-frame markers. If no match fits within tolerance, the last good
+        transformation and the cached correspondence are kept.
+
+        Args:
+            world_markers (np.ndarray): Mx3 array of markers in the world frame, in whatever order QTM gives them.
+
+        Returns:
+            Optional[Tuple[np.ndarray, np.ndarray, float, bool]]: Rotation matrix (3x3), translation vector (3,),
+                RMS error of the fit {mm} and whether the correspondence had to be solved again. None if there are
+                fewer than three markers, or if no match fits within tolerance.
+        """
+        if len(world_markers) < 3:
+            return None
+
+        # Try the cached correspondence first
+        if self.body_indices is not None and len(world_markers) == self.num_world_markers:
+            R, t, errors = kabsch(self.body_markers[self.body_indices], world_markers[self.world_indices])
+            if np.all(errors < self.tolerance):
+                self.R, self.t = R, t
+                return R, t, float(np.sqrt(np.mean(errors ** 2))), False
+
+        # Otherwise, solve the matching again
+        self.match_count += 1
+
+        matchers = [match_markers_by_shape]
+        if self.R is not None:
+            predicted_markers = self.body_markers @ self.R.T + self.t
+            matchers.insert(0, lambda body, world: match_markers(predicted_markers, world))
+
+        for matcher in matchers:
+            body_indices, world_indices = matcher(self.body_markers, world_markers)
+            R, t, errors = kabsch(self.body_markers[body_indices], world_markers[world_indices])
+            if np.all(errors < self.tolerance):
+                self.body_indices, self.world_indices = body_indices, world_indices
+                self.num_world_markers = len(world_markers)
+                self.R, self.t = R, t
+                return R, t, float(np.sqrt(np.mean(errors ** 2))), True
+
+        return None
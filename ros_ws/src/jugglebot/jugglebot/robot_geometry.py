@@ -1,17 +1,40 @@
 """
-Holds the geometry for the robot and publishes the initial node positions to the 'get_robot_geometry' service
+Holds the geometry for the robot and publishes the initial node positions to the 'get_robot_geometry' service.
+
+The geometry is also published on the latched (transient-local) 'robot_geometry_topic', along with a version number
+and the hash of the parameters it was built from, and is cached on disk (see geometry_cache.py) so that other nodes can
+start from the cache without waiting for this node. The geometry parameters are ROS parameters, so changing one
+(eg. `ros2 param set /robot_geometry base_radius 411.0`) rebuilds and republishes the geometry without any restarts.
+
+If the 'calibration_file' parameter points to a geometry file from the offline calibration (see geometry_calibration.py),
+the calibrated base nodes, platform nodes and leg lengths replace the nominal ones built from the parameters above.
 """
 
 from jugglebot_interfaces.srv import GetRobotGeometry
+from jugglebot_interfaces.msg import RobotGeometryMessage
 from std_srvs.srv import Trigger
+from rcl_interfaces.msg import SetParametersResult
 
 import rclpy
 from rclpy.node import Node
+from rclpy.qos import QoSProfile, DurabilityPolicy, ReliabilityPolicy
 import numpy as np
-import math
+import hashlib
+
+from .geometry_cache import (hash_geometry_parameters, load_calibration, load_geometry, next_geometry_version,
+                             save_geometry)
+from . import kinematics
+
+# QoS for the latched geometry topic. Late joiners get the last published geometry
+GEOMETRY_QOS = QoSProfile(depth=1, durability=DurabilityPolicy.TRANSIENT_LOCAL, reliability=ReliabilityPolicy.RELIABLE)
 
 
 class RobotGeometry(Node):
+    # Names of the parameters that the geometry is built from
+    GEOMETRY_PARAMETERS = ('initial_height', 'base_radius', 'plat_radius', 'base_small_angle', 'plat_small_angle',
+                           'plat_x_axis_offset', 'leg_stroke', 'arm_radius', 'arm_height_from_platform',
+                           'hand_stroke', 'hand_radius')
+
     def __init__(self):
         super().__init__('robot_geometry')
 
@@ -23,6 +46,11 @@ class RobotGeometry(Node):
         self.shutdown_flag = False
         # Set up a service to trigger closing the node
         self.service = self.create_service(Trigger, 'end_session', self.end_session)
+
+        # Set up the latched geometry publisher
+        self.geometry_publisher = self.create_publisher(RobotGeometryMessage, 'robot_geometry_topic', GEOMETRY_QOS)
+        self.geometry_hash = None
+        self.geometry_version = 0
         
         # Initialise the geometry parameters. Start with the platform
         # Nodes for the various elements
@@ -53,76 +81,139 @@ class RobotGeometry(Node):
         self.hand_stroke = 355.0  # Stroke of hand. DOES need to be ~exact. Used to inform overextensions etc.
         self.hand_radius = 35.0  # Radius of hand. Doesn't need to be exact
 
-        self.start_pos = np.array([[0], [0], [self.initial_height]])
-
-        # Build the platform
-        self.build_platform()
+        # Expose the geometry parameters as ROS parameters so that they can be changed on the fly
+        for name in self.GEOMETRY_PARAMETERS:
+            setattr(self, name, self.declare_parameter(name, getattr(self, name)).get_parameter_value().double_value)
+        self.calibration_file = self.declare_parameter('calibration_file', '').get_parameter_value().string_value
+        self.add_on_set_parameters_callback(self.geometry_parameters_callback)
 
-    def build_platform(self):
-        # Builds the stewart platform, calculating the initial positions of all nodes
-        deg_to_rad = math.pi / 180
+        # Build (or load) the platform and publish it
+        self.update_geometry()
 
-        # Define the angles to the nodes
-        gamma2 = self.base_small_angle  # Angle between close base nodes {deg}
-        gamma0 = 210 - gamma2 / 2  # Offset from horizontal
-        gamma1 = 120 - gamma2  # Angle between far base nodes {deg}
+    def geometry_parameters_callback(self, params):
+        '''Rebuild and republish the geometry whenever one of the geometry parameters is changed'''
+        geometry_params = [param for param in params if param.name in self.GEOMETRY_PARAMETERS + ('calibration_file',)]
 
-        lambda1 = self.plat_small_angle  # Angle between close platform nodes {deg}
-        lambda2 = 120 - lambda1  # Angle between far platform nodes {deg}
-        lambda0 = self.plat_x_axis_offset  # Offset from x axis for platform nodes {deg} (measured in Onshape)
+        for param in geometry_params:
+            if param.name == 'calibration_file':
+                if param.type_ != param.Type.STRING:
+                    return SetParametersResult(successful=False, reason='calibration_file must be a string')
+            elif param.type_ != param.Type.DOUBLE:
+                return SetParametersResult(successful=False, reason=f'{param.name} must be a float')
 
-        # self.get_logger().info(f"Gamma0: {gamma0}, Gamma1: {gamma1}, Gamma2: {gamma2}")
-        # self.get_logger().info(f"Lambda0: {lambda0}, Lambda1: {lambda1}, Lambda2: {lambda2}")
+        if geometry_params:
+            for param in geometry_params:
+                setattr(self, param.name, param.value)
+            self.update_geometry()
 
-        base_node_angles = np.zeros((6, 1))  # Angles to each of the 6 base nodes {deg}
-        plat_node_angles = np.zeros((6, 1))  # Angles to each of the 6 platform nodes {deg}
+        return SetParametersResult(successful=True)
 
-        # Find the nodes for the arm
-        # Doesn't need to be perfectly realistic, so just assume arm nodes are equally spaced radially
-        for node in range(6):
-            # Find top three nodes first
-            self.init_arm_nodes[node][0] = self.arm_radius * math.cos((np.pi * 2 / 3 * node))
-            self.init_arm_nodes[node][1] = self.arm_radius * math.sin((np.pi * 2 / 3 * node))
-            self.init_arm_nodes[node][2] = self.arm_height_from_platform
+    def update_geometry(self):
+        '''Load the geometry for the current parameters from the cache (building it if it isn't cached), then publish it'''
+        parameters = {name: getattr(self, name) for name in self.GEOMETRY_PARAMETERS}
+        parameters['calibration'] = self.calibration_file_hash()
+        geometry_hash = hash_geometry_parameters(parameters)
 
-            if node > 2:
-                # Then find the bottom three nodes
-                self.init_arm_nodes[node][0] = self.init_arm_nodes[node - 3][0]
-                self.init_arm_nodes[node][1] = self.init_arm_nodes[node - 3][1]
-                self.init_arm_nodes[node][2] = self.init_arm_nodes[node - 3][2] - self.hand_stroke
+        # Bump the version if the geometry has changed since it was last built
+        self.geometry_version = next_geometry_version(geometry_hash)
+        self.geometry_hash = geometry_hash
 
-        # Find the main 6 nodes for the base and platform
-        for node in range(6):
-            first_angle_index = int(math.floor(node / 2))
-            second_angle_index = int(math.floor((node + 1) / 2))
-
-            # self.get_logger().info(f"Node: {node}, First: {first_angle_index}, Second: {second_angle_index}")
-
-            base_node_angles[node] = gamma0 + gamma1 * first_angle_index + gamma2 * second_angle_index
-            plat_node_angles[node] = lambda0 + lambda1 * first_angle_index + lambda2 * second_angle_index
-
-            # self.get_logger().info(f"ANGLES:\nNode: {node}, Base: {base_node_angles[node]}, Plat: {plat_node_angles[node]}")
-
-            self.base_nodes[node][0] = self.base_radius * math.cos(base_node_angles[node] * deg_to_rad)
-            self.base_nodes[node][1] = self.base_radius * math.sin(base_node_angles[node] * deg_to_rad)
-            self.base_nodes[node][2] = 0
-
-            self.init_plat_nodes[node][0] = self.plat_radius * math.cos(plat_node_angles[node] * deg_to_rad)
-            self.init_plat_nodes[node][1] = self.plat_radius * math.sin(plat_node_angles[node] * deg_to_rad)
-            self.init_plat_nodes[node][2] = 0
-
-        # Find the nodes for the hand
-        for node in range(3):
-            self.init_hand_nodes[node][0] = self.hand_radius * math.cos(np.pi / 3 * (1 + 2 * node))
-            self.init_hand_nodes[node][1] = self.hand_radius * math.sin(np.pi / 3 * (1 + 2 * node))
-            self.init_hand_nodes[node][2] = 0
+        self.start_pos = np.array([[0], [0], [self.initial_height]])
 
-        # Log the base and platform nodes
-        # self.get_logger().info(f"Base Nodes: \n{self.base_nodes}")
-        # self.get_logger().info(f"Platform Nodes: \n{self.init_plat_nodes}")
+        geometry = load_geometry(geometry_hash)
+        if geometry is not None:
+            self.base_nodes = geometry['base_nodes']
+            self.init_plat_nodes = geometry['init_plat_nodes']
+            self.init_arm_nodes = geometry['init_arm_nodes']
+            self.init_hand_nodes = geometry['init_hand_nodes']
+            self.init_leg_lengths = geometry['init_leg_lengths']
+        else:
+            self.build_platform()
+            self.apply_calibration()
+
+        try:
+            save_geometry(self.geometry_dict(), geometry_hash, self.geometry_version)
+        except OSError as e:
+            self.get_logger().warn(f'Unable to cache the robot geometry: {e}')
+
+        self.publish_geometry()
+        self.get_logger().info(f'Robot geometry v{self.geometry_version} ({geometry_hash}) published')
+
+    def calibration_file_hash(self):
+        '''Hash the contents of the calibration file, so that the cached geometry is rebuilt if the file changes'''
+        if not self.calibration_file:
+            return ''
+
+        try:
+            with open(self.calibration_file, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        except OSError as e:
+            self.get_logger().error(f'Unable to read calibration file {self.calibration_file}: {e}. '
+                                    'Using the nominal geometry')
+            return ''
+
+    def apply_calibration(self):
+        '''Replace the nominal base nodes, platform nodes and leg lengths with those from the calibration file'''
+        if not self.calibration_file:
+            return
+
+        try:
+            calibration = load_calibration(self.calibration_file)
+        except (OSError, KeyError, ValueError) as e:
+            self.get_logger().error(f'Unable to load calibration file {self.calibration_file}: {e}. '
+                                    'Using the nominal geometry')
+            return
+
+        self.get_logger().info(f'Calibration loaded. Largest base node change: '
+                               f'{np.max(np.abs(calibration["base_nodes"] - self.base_nodes)):.2f} mm, largest '
+                               f'platform node change: '
+                               f'{np.max(np.abs(calibration["init_plat_nodes"] - self.init_plat_nodes)):.2f} mm')
+
+        self.base_nodes = calibration['base_nodes']
+        self.init_plat_nodes = calibration['init_plat_nodes']
+        self.init_leg_lengths = calibration['init_leg_lengths']
+
+    def geometry_dict(self):
+        '''Collect the geometry arrays into a dictionary, as used by geometry_cache'''
+        return {
+            'start_pos': self.start_pos,
+            'base_nodes': self.base_nodes,
+            'init_plat_nodes': self.init_plat_nodes,
+            'init_arm_nodes': self.init_arm_nodes,
+            'init_hand_nodes': self.init_hand_nodes,
+            'init_leg_lengths': self.init_leg_lengths,
+            'leg_stroke': self.leg_stroke,
+            'hand_stroke': self.hand_stroke,
+        }
+
+    def publish_geometry(self):
+        '''Publish the geometry on the latched geometry topic'''
+        msg = RobotGeometryMessage()
+        msg.version = self.geometry_version
+        msg.geometry_hash = self.geometry_hash
+        msg.start_pos = self.start_pos.flatten().tolist()
+        msg.base_nodes = self.base_nodes.flatten().tolist()
+        msg.init_plat_nodes = self.init_plat_nodes.flatten().tolist()
+        msg.init_arm_nodes = self.init_arm_nodes.flatten().tolist()
+        msg.init_hand_nodes = self.init_hand_nodes.flatten().tolist()
+        msg.init_leg_lengths = self.init_leg_lengths.flatten().tolist()
+        msg.leg_stroke = self.leg_stroke
+        msg.hand_stroke = self.hand_stroke
+
+        self.geometry_publisher.publish(msg)
 
-        # Calculate the lengths of the legs in the initial state
-        self.init_leg_lengths = np.linalg.norm(self.init_plat_nodes + self.start_pos.T - self.base_nodes, axis=1)
+    def build_platform(self):
+        # Builds the stewart platform, calculating the initial positions of all nodes
+        geometry = kinematics.build_platform(self.initial_height, self.base_radius, self.plat_radius,
+                                             self.base_small_angle, self.plat_small_angle, self.plat_x_axis_offset,
+                                             self.arm_radius, self.arm_height_from_platform, self.hand_stroke,
+                                             self.hand_radius)
+
+        self.base_nodes = geometry['base_nodes']
+        self.init_plat_nodes = geometry['init_plat_nodes']
+        self.init_arm_nodes = geometry['init_arm_nodes']
+        self.init_hand_nodes = geometry['init_hand_nodes']
+        self.init_leg_lengths = geometry['init_leg_lengths']
 
     def handle_get_robot_geometry(self, request, response):
         # Send all the node data
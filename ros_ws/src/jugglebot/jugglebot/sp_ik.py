@@ -1,7 +1,18 @@
 """
 This ROS2 node is responsible for taking in the pose of the platform and converting it into leg lengths using
-inverse kinematics. The leg lengths are then published to the 'leg_lengths_topic' topic. The node also publishes
+inverse kinematics. The velocity of the platform (either supplied with the pose or estimated from successive stamped
+poses) is mapped through the platform Jacobian to find the leg velocities, which are used as velocity feedforward terms.
+The leg lengths and velocities are then published to the 'legs_target_topic' topic. The node also publishes
 the state of each leg (overextended [1], underextended [-1], within bounds [0]) to the 'leg_state_topic' topic.
+
+The arm and hand nodes are moved along with the platform. Each time the robot state arrives from the CAN interface
+(ie. at encoder rate), the hand position from its encoder is combined with the latest platform pose and the position of
+the hand tip in the base frame is published to the 'hand_tip_topic' topic.
+
+Every few poses, the conditioning of the Jacobian (condition numbers, smallest singular value) is published to the
+'platform_dexterity_topic' topic, and planners can query the same metrics for a batch of candidate poses with the
+'get_pose_dexterity' service. This lets them steer clear of poorly-conditioned regions, where small leg errors are
+amplified into large platform errors.
 """
 
 import rclpy
@@ -9,10 +20,15 @@ from rclpy.node import Node
 import numpy as np
 from geometry_msgs.msg import PoseStamped, Quaternion
 from std_srvs.srv import Trigger
-from std_msgs.msg import Float64MultiArray, Int8MultiArray, String
-from jugglebot_interfaces.msg import PlatformPoseMessage
-from jugglebot_interfaces.srv import GetRobotGeometry
+from std_msgs.msg import Int8MultiArray, String
+from jugglebot_interfaces.msg import (PlatformPoseMessage, LegsTargetMessage, RobotGeometryMessage, RobotState,
+                                      PlatformDexterityMessage)
+from jugglebot_interfaces.srv import GetPoseDexterity
 import quaternion  # numpy quaternion
+from .geometry_cache import geometry_from_message, load_latest_geometry
+from .robot_geometry import GEOMETRY_QOS
+from . import kinematics
+
 
 class SPInverseKinematics(Node):
     def __init__(self):
@@ -27,18 +43,12 @@ class SPInverseKinematics(Node):
         #                                          Geometry Related                                             #
         #########################################################################################################
 
-        # Set up service client to get robot geometry
-        self.geometry_client = self.create_client(GetRobotGeometry, 'get_robot_geometry')
-        
-        while not self.geometry_client.wait_for_service(timeout_sec=1.0):
-                self.get_logger().info('Waiting for "get_robot_geometry" service...')
-
-        # Send a request to get the robot geometry
-        self.send_geometry_request()
         # Initialize flag to track whether geometry data has been received or not
         self.has_geometry_data = False
+        self.geometry_hash = None
+        self.geometry_version = None
 
-        # Initialize geometry terms to be populated with a call to the get_robot_geometry service
+        # Initialize geometry terms to be populated from the geometry cache or the robot_geometry_topic
         self.start_pos = None         # Base frame
         self.base_nodes = None        # Base frame
         self.init_plat_nodes = None   # Platform frame
@@ -47,11 +57,25 @@ class SPInverseKinematics(Node):
 
         self.init_leg_lengths = None
         self.leg_stroke = None
+        self.hand_stroke = None
 
         self.new_plat_nodes = None    # Base frame
         self.new_arm_nodes  = None    # Base frame
         self.new_hand_nodes = None    # Base frame
 
+        self.init_body_nodes = None   # Platform and arm nodes stacked together, so they can be moved in one go. Platform frame
+
+        self.jacobian = None          # Maps platform twist [vx, vy, vz, wx, wy, wz] to leg velocities. Base frame
+
+        # Start from the cached geometry (if there is one) so that we don't need to wait for the robot_geometry node
+        cached_geometry = load_latest_geometry()
+        if cached_geometry is not None:
+            self.set_geometry(*cached_geometry)
+
+        # Subscribe to the latched geometry topic to get the latest geometry, and any changes to it while we're running
+        self.geometry_subscription = self.create_subscription(RobotGeometryMessage, 'robot_geometry_topic',
+                                                              self.geometry_callback, GEOMETRY_QOS)
+
         #########################################################################################################
         #                                           Control Related                                             #
         #########################################################################################################
@@ -69,42 +93,85 @@ class SPInverseKinematics(Node):
         # Initialize the pose offset as a unit numpy quaternion
         self.pose_offset = quaternion.quaternion(1, 0, 0, 0)
 
+        # Initialize the last received pose (time {s}, position {mm}, rotation matrix) for estimating the platform velocity
+        self.last_pose = None
+        # Bounds on the time between successive poses for the velocity estimate to be trusted {s}
+        self.min_pose_dt = 0.001
+        self.max_pose_dt = 0.1
+        # Largest velocity feedforward that will be sent {rev/s}. Anything faster is assumed to be a jump in the setpoint
+        # (eg. moving straight to a catch pose) rather than a trajectory, so no feedforward is sent.
+        self.max_leg_vel_ff = 20.0
+
+        #########################################################################################################
+        #                                            Hand Related                                               #
+        #########################################################################################################
+
+        # Subscribe to the robot state to get the hand position from its encoder
+        self.robot_state_subscription = self.create_subscription(RobotState, 'robot_state', self.robot_state_callback, 10)
+
+        self.hand_axis = 6            # ODrive axis of the hand
+        self.hand_direction = 1       # +1 is upwards +ve (the hand is homed at the bottom of its stroke)
+
+        # Latest commanded platform pose (position of the platform origin in the base frame {mm}, rotation matrix)
+        self.platform_position = None
+        self.platform_rot = None
+
         #########################################################################################################
         #                                              Publishing                                               #
         #########################################################################################################
 
-        # Set up a publisher to publish the leg lengths, and one to publish the state of each leg (overextended [1], underextended [-1], within bounds [0])
-        self.leg_length_publisher = self.create_publisher(Float64MultiArray, 'leg_lengths_topic', 10)
+        # Set up a publisher to publish the leg lengths (with velocity feedforward), and one to publish the state of each leg (overextended [1], underextended [-1], within bounds [0])
+        self.legs_target_publisher = self.create_publisher(LegsTargetMessage, 'legs_target_topic', 10)
         self.leg_state_publisher = self.create_publisher(Int8MultiArray, 'leg_state_topic', 10)
 
+        # Set up a publisher for the position of the hand tip in the base frame
+        self.hand_tip_publisher = self.create_publisher(PoseStamped, 'hand_tip_topic', 10)
+
+        #########################################################################################################
+        #                                              Dexterity                                                #
+        #########################################################################################################
+
+        # Publish the dexterity metrics every n poses. They aren't needed at the full pose rate
+        self.dexterity_decimation = self.declare_parameter('dexterity_decimation', 10).get_parameter_value().integer_value
+        self.poses_since_dexterity = 0
+        self.dexterity_publisher = self.create_publisher(PlatformDexterityMessage, 'platform_dexterity_topic', 10)
+
+        # Set up a service for planners to query the dexterity of candidate poses
+        self.dexterity_service = self.create_service(GetPoseDexterity, 'get_pose_dexterity', self.handle_get_pose_dexterity)
+
     #########################################################################################################
     #                                               Geometry                                                #
     #########################################################################################################
 
-    def send_geometry_request(self):
-        req = GetRobotGeometry.Request()
-        self.future = self.geometry_client.call_async(req)
-        self.future.add_done_callback(self.handle_geometry_response)
-
-    def handle_geometry_response(self, future):
-        response = future.result()
-        if response is not None:
-            # Store the geometry data after converting it to numpy arrays
-            self.start_pos = np.array(response.start_pos).reshape(3, 1)
-            self.base_nodes = np.array(response.base_nodes).reshape(6, 3)
-            self.init_plat_nodes = np.array(response.init_plat_nodes).reshape(6, 3)
-            self.init_arm_nodes = np.array(response.init_arm_nodes).reshape(6, 3)
-            self.init_hand_nodes = np.array(response.init_hand_nodes).reshape(3, 3)
-            self.init_leg_lengths = np.array(response.init_leg_lengths).reshape(6,)
-            self.leg_stroke = response.leg_stroke
-
-            # Report the receipt of data
-            self.get_logger().info('Received geometry data!')
-
-            # Record the receipt of data so that we know we've got it
-            self.has_geometry_data = True
-        else:
-            self.get_logger().error('Exception while calling "get_robot_geometry" service')
+    def geometry_callback(self, msg):
+        '''Callback for the latched robot_geometry_topic'''
+        if msg.geometry_hash == self.geometry_hash and msg.version == self.geometry_version:
+            # Already have this geometry (probably from the cache)
+            return
+
+        self.set_geometry(msg.geometry_hash, msg.version, geometry_from_message(msg))
+
+    def set_geometry(self, geometry_hash, version, geometry):
+        '''Store the geometry arrays (as built by robot_geometry or loaded from the cache)'''
+        self.start_pos = geometry['start_pos']
+        self.base_nodes = geometry['base_nodes']
+        self.init_plat_nodes = geometry['init_plat_nodes']
+        self.init_arm_nodes = geometry['init_arm_nodes']
+        self.init_hand_nodes = geometry['init_hand_nodes']
+        self.init_leg_lengths = geometry['init_leg_lengths']
+        self.leg_stroke = float(geometry['leg_stroke'])
+        self.hand_stroke = float(geometry['hand_stroke'])
+
+        self.init_body_nodes = np.vstack((self.init_plat_nodes, self.init_arm_nodes))
+
+        self.geometry_hash = geometry_hash
+        self.geometry_version = version
+
+        # Report the receipt of data
+        self.get_logger().info(f'Received geometry data! (v{version}, {geometry_hash})')
+
+        # Record the receipt of data so that we know we've got it
+        self.has_geometry_data = True
 
     #########################################################################################################
     #                                             Pose Offset                                               #
@@ -123,6 +190,9 @@ class SPInverseKinematics(Node):
         '''Callback function for the control mode topic'''
         self.control_mode = msg.data
 
+        # Don't difference poses from different controllers when estimating the platform velocity
+        self.last_pose = None
+
     def pose_callback(self, msg):
         '''Callback function for the platform pose topic'''
         # Check if we have geometry data
@@ -133,6 +203,7 @@ class SPInverseKinematics(Node):
         # Deconstruct the message
         pose_publisher = msg.publisher
         pose = msg.pose_stamped.pose
+        stamp = msg.pose_stamped.header.stamp
 
         # Check if the pose was published by the correct publisher
         if pose_publisher != self.control_mode:
@@ -157,27 +228,63 @@ class SPInverseKinematics(Node):
         # Extract the 3x3 rotation matrix
         rot = rot[:3, :3]
 
+        # Get the velocity of the platform, either from the message or by differencing with the last pose
+        twist = self.estimate_platform_velocity(stamp, pos, rot)
+        if msg.twist_is_valid:
+            # The publisher's twist is for the pose it sent, before the pose offset was applied
+            twist = np.array([msg.twist.linear.x, msg.twist.linear.y, msg.twist.linear.z,
+                              msg.twist.angular.x, msg.twist.angular.y, msg.twist.angular.z])
+            twist = kinematics.offset_twists(quaternion.as_rotation_matrix(self.pose_offset), twist[np.newaxis])[0]
+
         # Use this data to update the locations of all the platform nodes
-        self.update_pose(pos, rot)
+        self.update_pose(pos, rot, twist, stamp)
+
+    def estimate_platform_velocity(self, stamp, pos, rot):
+        '''Estimate the twist [vx, vy, vz, wx, wy, wz] {mm/s, rad/s} of the platform by differencing this pose with the
+        last one received. Returns zero twist if the poses are unstamped or too far apart to be trusted.'''
+        pose_time = stamp.sec + stamp.nanosec * 1e-9
+
+        twist = np.zeros(6)
+        if self.last_pose is not None:
+            last_time, last_pos, last_rot = self.last_pose
+            twist = kinematics.estimate_twists(last_pos.T, last_rot[np.newaxis], pos.T, rot[np.newaxis],
+                                               np.array([pose_time - last_time]), self.min_pose_dt,
+                                               self.max_pose_dt)[0]
+
+        self.last_pose = (pose_time, pos, rot)
+
+        return twist
 
     #########################################################################################################
     #                              Inverse Kinematics, Clipping and Converting                              #
     #########################################################################################################
 
-    def update_pose(self, pos, rot):
+    def update_pose(self, pos, rot, twist, stamp):
         # Calculate the positions of all nodes
 
         new_position = pos + self.start_pos
+        self.platform_position = new_position
+        self.platform_rot = rot
+
+        # Update plat_nodes and arm_nodes to reflect change in pose. Both are moved in one go
+        new_body_nodes = new_position.T + np.dot(rot, self.init_body_nodes.T).T
+        self.new_plat_nodes = new_body_nodes[:6]
+        self.new_arm_nodes = new_body_nodes[6:]
 
-        # Update plat_nodes to reflect change in pose
-        self.new_plat_nodes = (new_position + np.dot(rot, self.init_plat_nodes.T)).T
+        # Calculate the leg lengths and the Jacobian
+        leg_lengths, jacobians = kinematics.jacobians(new_position.T, rot[np.newaxis, :, :], self.base_nodes,
+                                                      self.init_plat_nodes)
+        leg_lengths_mm = leg_lengths[0] - self.init_leg_lengths
+        self.jacobian = jacobians[0]
 
-        # Calculate leg lengths
-        leg_lengths_mm = np.linalg.norm(self.new_plat_nodes - self.base_nodes, axis=1) - self.init_leg_lengths
+        self.poses_since_dexterity += 1
+        if self.poses_since_dexterity >= self.dexterity_decimation:
+            self.poses_since_dexterity = 0
+            self.publish_dexterity(leg_lengths_mm, stamp)
 
-        self.check_leg_lengths(leg_lengths_mm)
+        self.check_leg_lengths(leg_lengths_mm, twist, stamp)
 
-    def check_leg_lengths(self, leg_lens_mm):
+    def check_leg_lengths(self, leg_lens_mm, twist, stamp):
         # Check the leg lengths. Make sure they're within allowable bounds
         clipped_leg_lengths = np.clip(leg_lens_mm, 0, self.leg_stroke)
 
@@ -218,23 +325,28 @@ class SPInverseKinematics(Node):
         leg_state_msg = Int8MultiArray()
         leg_state_msg.data = leg_state.tolist()
         self.leg_state_publisher.publish(leg_state_msg)
-        
+
+        # Map the platform twist through the Jacobian to get the leg velocities {rev/s}. Legs that have been clipped
+        # are held at their limit, so they aren't given any feedforward, and neither is a jump in the setpoint
+        leg_vels_revs = kinematics.leg_velocity_feedforward(self.jacobian[np.newaxis], twist[np.newaxis],
+                                                            (leg_state == 0)[np.newaxis], self.max_leg_vel_ff)[0]
+
         # Send the data off to be converted into revs
-        self.convert_mm_to_revs(leg_lens_mm=clipped_leg_lengths)
+        self.convert_mm_to_revs(leg_lens_mm=clipped_leg_lengths, leg_vels_revs=leg_vels_revs, stamp=stamp)
 
-    def convert_mm_to_revs(self, leg_lens_mm):
+    def convert_mm_to_revs(self, leg_lens_mm, leg_vels_revs, stamp):
         # Converts the leg lengths from mm to revs
-        spool_dia = 22 # mm
-        mm_to_rev = 1 / (spool_dia * np.pi)
+        mm_to_rev = 1 / kinematics.LEG_MM_PER_REV
 
         # self.get_logger().debug(f'Leg lengths (mm): \n{leg_lens_mm}')
-        leg_lengths_revs = [length * mm_to_rev for length in leg_lens_mm]
+        leg_lengths_revs = leg_lens_mm * mm_to_rev
 
         # If the legs need to be remapped, do so
         # leg_lengths_revs = self.remap_leg_lengths(leg_lengths_revs)
+        # leg_vels_revs = self.remap_leg_lengths(leg_vels_revs)
 
         # Send the data to be published
-        self.publish_leg_lengths(leg_lengths_revs)
+        self.publish_leg_lengths(leg_lengths_revs, leg_vels_revs, stamp)
 
     def remap_leg_lengths(self, leg_lens_revs):
         '''May need to re-map the legs to the correct ODrive axes.
@@ -246,11 +358,106 @@ class SPInverseKinematics(Node):
 
         return leg_lengths_remapped
 
-    def publish_leg_lengths(self, leg_lenths):
-        leg_lengths = Float64MultiArray()
-        leg_lengths.data = leg_lenths
+    def publish_leg_lengths(self, leg_lengths, leg_velocities, stamp):
+        legs_target = LegsTargetMessage()
+        legs_target.header.stamp = stamp
+        legs_target.header.frame_id = 'base'
+        legs_target.positions = [float(length) for length in leg_lengths]
+        legs_target.velocities = [float(velocity) for velocity in leg_velocities]
+
+        self.legs_target_publisher.publish(legs_target)
+
+    #########################################################################################################
+    #                                               Dexterity                                               #
+    #########################################################################################################
+
+    def publish_dexterity(self, leg_lengths_mm, stamp):
+        '''Publish the dexterity metrics for the Jacobian at the current pose'''
+        condition_number, submatrix_condition_number, min_singular_value, norm_score = \
+            kinematics.evaluate_dexterity(self.jacobian[np.newaxis, :, :])
+
+        dexterity_msg = PlatformDexterityMessage()
+        dexterity_msg.header.stamp = stamp
+        dexterity_msg.header.frame_id = 'base'
+        dexterity_msg.condition_number = float(condition_number[0])
+        dexterity_msg.submatrix_condition_number = float(submatrix_condition_number[0])
+        dexterity_msg.min_singular_value = float(min_singular_value[0])
+        dexterity_msg.norm_score = float(norm_score[0])
+        dexterity_msg.reachable = bool(kinematics.check_reachability(leg_lengths_mm[np.newaxis, :], 0.0, self.leg_stroke)[0])
+
+        self.dexterity_publisher.publish(dexterity_msg)
+
+    def handle_get_pose_dexterity(self, request, response):
+        '''Service callback to evaluate the dexterity of a batch of poses (in the same frame as platform_pose_topic)'''
+        if not self.has_geometry_data or not request.poses:
+            return response
+
+        positions = np.array([[pose.position.x, pose.position.y, pose.position.z] for pose in request.poses])
+        positions += self.start_pos.T
+
+        orientations = quaternion.as_quat_array(np.array([[pose.orientation.w, pose.orientation.x, pose.orientation.y,
+                                                           pose.orientation.z] for pose in request.poses]))
+        rotations = quaternion.as_rotation_matrix(self.pose_offset * orientations)
+
+        leg_lengths, jacobians = kinematics.jacobians(positions, rotations, self.base_nodes, self.init_plat_nodes)
+        leg_lengths_mm = leg_lengths - self.init_leg_lengths
+        condition_number, submatrix_condition_number, min_singular_value, _ = kinematics.evaluate_dexterity(jacobians)
+
+        response.condition_number = condition_number.tolist()
+        response.submatrix_condition_number = submatrix_condition_number.tolist()
+        response.min_singular_value = min_singular_value.tolist()
+        response.reachable = kinematics.check_reachability(leg_lengths_mm, 0.0, self.leg_stroke).tolist()
+
+        return response
+
+    #########################################################################################################
+    #                                            Hand Kinematics                                            #
+    #########################################################################################################
+
+    def robot_state_callback(self, msg):
+        '''Callback for the robot state. Find where the hand is in the base frame and publish it'''
+        if self.platform_position is None or len(msg.motor_states) <= self.hand_axis:
+            # No platform pose yet, or the hand state isn't available
+            return
+
+        hand_pos_revs = msg.motor_states[self.hand_axis].pos_estimate
+        hand_nodes, hand_tip = self.find_hand_nodes(hand_pos_revs)
+        self.new_hand_nodes = hand_nodes
+
+        self.publish_hand_tip(hand_tip, msg.timestamp)
+
+    def find_hand_nodes(self, hand_pos_revs):
+        '''
+        Find the hand nodes and the hand tip (centre of the hand) in the base frame.
+
+        Args:
+            hand_pos_revs: Position of the hand from its encoder {rev}. 0 is the bottom of the hand stroke.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Hand nodes (3x3) and hand tip (3,) in the base frame {mm}
+        '''
+        hand_nodes, hand_tips = kinematics.hand_nodes(np.array([hand_pos_revs]), self.platform_position.T,
+                                                      self.platform_rot[np.newaxis], self.init_hand_nodes,
+                                                      self.init_arm_nodes, self.hand_stroke, self.hand_direction)
+
+        return hand_nodes[0], hand_tips[0]
+
+    def publish_hand_tip(self, hand_tip, stamp):
+        hand_tip_msg = PoseStamped()
+        hand_tip_msg.header.stamp = stamp
+        hand_tip_msg.header.frame_id = 'base'
+        hand_tip_msg.pose.position.x = float(hand_tip[0])
+        hand_tip_msg.pose.position.y = float(hand_tip[1])
+        hand_tip_msg.pose.position.z = float(hand_tip[2])
+
+        # The hand moves along the platform z axis, so it has the same orientation as the platform
+        hand_ori = quaternion.from_rotation_matrix(self.platform_rot)
+        hand_tip_msg.pose.orientation.w = float(hand_ori.w)
+        hand_tip_msg.pose.orientation.x = float(hand_ori.x)
+        hand_tip_msg.pose.orientation.y = float(hand_ori.y)
+        hand_tip_msg.pose.orientation.z = float(hand_ori.z)
 
-        self.leg_length_publisher.publish(leg_lengths)
+        self.hand_tip_publisher.publish(hand_tip_msg)
 
     #########################################################################################################
     #                                          Utility Functions                                            #
@@ -0,0 +1,273 @@
+# streaming_statistics.py
+
+import numpy as np
+from typing import Dict, Optional, Sequence
+
+
+class RunningStatistics:
+    """
+    Mean, variance, min and max of a stream of values, in constant memory.
+
+    Uses Welford's algorithm, merging each batch of values in one go (Chan et al.'s parallel update), so adding the
+    residuals of every marker in a frame is a single vectorized call.
+
+    Attributes:
+        count (int): Number of values seen.
+        mean (float): Mean of the values seen.
+        min (float): Smallest value seen.
+        max (float): Largest value seen.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all values seen so far.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0  # Sum of squared differences from the mean
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """
+        Add a batch of values (or a single value).
+
+        Args:
+            values (array_like): The values to add.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        batch_count = values.size
+        if batch_count == 0:
+            return
+
+        batch_mean = values.mean()
+        batch_m2 = np.sum((values - batch_mean) ** 2)
+
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_count / total
+        self._m2 += batch_m2 + delta ** 2 * self.count * batch_count / total
+        self.count = total
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    @property
+    def variance(self) -> Optional[float]:
+        """
+        Returns:
+            Optional[float]: The sample variance, or None if fewer than two values have been seen.
+        """
+        return self._m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def std(self) -> Optional[float]:
+        """
+        Returns:
+            Optional[float]: The sample standard deviation, or None if fewer than two values have been seen.
+        """
+        variance = self.variance
+        return np.sqrt(variance) if variance is not None else None
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the most recent values. Once full, new values overwrite the oldest ones.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        Args:
+            capacity (int): Number of values to keep.
+        """
+        self.capacity = capacity
+        self._data = np.zeros(capacity)
+        self._next = 0  # Index that the next value will be written to
+        self.count = 0  # Number of values stored (up to capacity)
+
+    def extend(self, values):
+        """
+        Add a batch of values (or a single value).
+
+        Args:
+            values (array_like): The values to add.
+        """
+        values = np.asarray(values, dtype=float).ravel()[-self.capacity:]
+        num_values = values.size
+        if num_values == 0:
+            return
+
+        # Write in (up to) two slices, wrapping around the end of the buffer
+        first = min(num_values, self.capacity - self._next)
+        self._data[self._next:self._next + first] = values[:first]
+        self._data[:num_values - first] = values[first:]
+
+        self._next = (self._next + num_values) % self.capacity
+        self.count = min(self.count + num_values, self.capacity)
+
+    def values(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The stored values, oldest first.
+        """
+        return self.latest(self.count)
+
+    def latest(self, count: int) -> np.ndarray:
+        """
+        Args:
+            count (int): Number of values to get (clipped to the number stored).
+
+        Returns:
+            np.ndarray: The most recent values, oldest first.
+        """
+        count = min(count, self.count)
+        start = self._next - count
+        if start >= 0:
+            return self._data[start:self._next].copy()
+        return np.concatenate((self._data[start:], self._data[:self._next]))
+
+    def clear(self):
+        """
+        Empty the buffer.
+        """
+        self._next = 0
+        self.count = 0
+
+
+class StreamingMetric:
+    """
+    Tracks a metric over a whole session (count, mean, std, min and max), and its quantiles and windowed metrics over
+    the most recent values, all in constant memory.
+
+    Adding values is one copy into a ring buffer of raw values, so that it's cheap enough to do under a lock on every
+    frame. The running totals catch up with the buffer (in one vectorized update) just before values that they haven't
+    seen would be overwritten, and when a snapshot is taken. Quantiles are calculated from a snapshot of the buffer, so
+    that the caller can do it outside the lock.
+    """
+
+    def __init__(self, window: int = 1000, quantiles: Sequence[float] = (0.5, 0.95, 0.99), history: int = 100000):
+        """
+        Args:
+            window (int): Number of recent values for the windowed metrics.
+            quantiles (Sequence[float]): Quantiles to calculate over the history (eg. 0.95).
+            history (int): Number of recent values to keep, for the quantiles. At least the window.
+        """
+        if not all(0.0 < quantile < 1.0 for quantile in quantiles):
+            raise ValueError("Quantiles must be between 0 and 1.")
+
+        self.window = window
+        self.quantiles = tuple(quantiles)
+        self.totals = RunningStatistics()
+        self.recent = RingBuffer(max(history, window))
+        self.last = None
+        self._unfolded = 0  # Number of the most recent values that aren't in the totals yet
+
+    def update(self, values):
+        """
+        Add a batch of values (or a single value).
+
+        Args:
+            values (array_like): The values to add.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+
+        # Bring the totals up to date before the buffer overwrites values they haven't seen, and fold in directly
+        # any values that won't fit in the buffer at all
+        if self._unfolded + values.size > self.recent.capacity:
+            self._fold()
+            if values.size > self.recent.capacity:
+                self.totals.update(values[:-self.recent.capacity])
+                values = values[-self.recent.capacity:]
+
+        self.recent.extend(values)
+        self._unfolded += values.size
+        self.last = float(values[-1])
+
+    def _fold(self):
+        if self._unfolded:
+            self.totals.update(self.recent.latest(self._unfolded))
+            self._unfolded = 0
+
+    def snapshot(self) -> 'MetricSnapshot':
+        """
+        Take a copy of what the summary needs. This is one copy of the buffer, so it's cheap enough to take under the
+        same lock as update(), leaving the quantiles (which sort the whole history) to be calculated outside it.
+
+        Returns:
+            MetricSnapshot: The session metrics and recent values, as of now.
+        """
+        self._fold()
+        has_values = self.totals.count > 0
+        stats = {
+            'count': self.totals.count,
+            'last': self.last,
+            'mean': float(self.totals.mean) if has_values else None,
+            'std': float(self.totals.std) if self.totals.count > 1 else None,
+            'min': float(self.totals.min) if has_values else None,
+            'max': float(self.totals.max) if has_values else None,
+        }
+        return MetricSnapshot(stats, self.recent.values(), self.window, self.quantiles)
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """
+        Returns:
+            Dict[str, Optional[float]]: As for MetricSnapshot.summary, as of now.
+        """
+        return self.snapshot().summary()
+
+    def reset(self):
+        """
+        Forget all values seen so far.
+        """
+        self.totals.reset()
+        self.recent.clear()
+        self.last = None
+        self._unfolded = 0
+
+
+class MetricSnapshot:
+    """
+    The state of a StreamingMetric at one moment (see StreamingMetric.snapshot), that the summary is calculated from.
+    """
+
+    def __init__(self, stats: Dict[str, Optional[float]], history: np.ndarray, window: int,
+                 quantiles: Sequence[float]):
+        """
+        Args:
+            stats (Dict[str, Optional[float]]): Session metrics (count, last, mean, std, min, max).
+            history (np.ndarray): Copy of the recent values, oldest first.
+            window (int): Number of recent values for the windowed metrics.
+            quantiles (Sequence[float]): Quantiles to calculate over the history.
+        """
+        self.stats = stats
+        self.history = history
+        self.window = window
+        self.quantiles = quantiles
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """
+        Returns:
+            Dict[str, Optional[float]]: Session metrics (count, mean, std, min, max), quantiles over the history
+                                        (p50, p95 etc.) and windowed metrics (window_mean, window_std, window_max,
+                                        window_p95). Metrics are None until there are values to calculate them from.
+        """
+        stats = dict(self.stats)
+        history = self.history
+
+        values = np.percentile(history, np.multiply(self.quantiles, 100)) if history.size else None
+        for i, quantile in enumerate(self.quantiles):
+            stats[f'p{quantile * 100:g}'] = float(values[i]) if values is not None else None
+
+        recent = history[-self.window:]
+        stats['window_count'] = recent.size
+        stats['window_mean'] = float(recent.mean()) if recent.size else None
+        stats['window_std'] = float(recent.std(ddof=1)) if recent.size > 1 else None
+        stats['window_max'] = float(recent.max()) if recent.size else None
+        stats['window_p95'] = float(np.percentile(recent, 95)) if recent.size else None
+
+        return stats
@@ -0,0 +1,222 @@
+"""
+A stand-in for QTM, for testing and load-testing the perception pipeline without the lab.
+
+SyntheticMocapSource simulates the base markers and a number of juggled balls, and builds real QTM RT packets
+(3dres and 3dnolabelsres components) from them, so that everything downstream of qtm_rt is exercised exactly as it
+would be with QTM: the MocapInterface parser, the base registration, the frame buffer and everything that subscribes
+to 'mocap_data'. It can add measurement noise, marker dropouts and ghost markers, and stream at any frame rate (or as
+fast as possible, for load testing).
+
+To use it, run the mocap interface with:
+    ros2 run jugglebot mocap_interface_node --ros-args -p mocap_source:=synthetic
+"""
+
+import asyncio
+import struct
+import numpy as np
+from qtm_rt.packet import QRTPacket, QRTComponentType
+from typing import Callable, Optional
+
+GRAVITY = 9810.0  # {mm/s^2}
+
+# Marker layouts, as QTM sends them
+LABELLED_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('residual', '<f4')])
+UNLABELLED_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('id', '<i4'), ('residual', '<f4')])
+
+PACKET_HEADER = struct.Struct('<qII')     # Timestamp {us}, frame number, component count
+COMPONENT_HEADER = struct.Struct('<II')   # Component size (including this header), component type
+MARKERS_HEADER = struct.Struct('<Ihh')    # Marker count, 2D drop rate, 2D out of sync rate
+
+
+def build_packet(timestamp: int, frame_number: int, labelled: np.ndarray, unlabelled: np.ndarray) -> QRTPacket:
+    """
+    Build a QTM packet with 3dres and 3dnolabelsres components.
+
+    Args:
+        timestamp (int): Capture timestamp for the frame {us}.
+        frame_number (int): QTM frame number.
+        labelled (np.ndarray): Nx4 array of labelled markers (x, y, z, residual) {mm}.
+        unlabelled (np.ndarray): Mx4 array of unlabelled markers (x, y, z, residual) {mm}.
+
+    Returns:
+        QRTPacket: The packet, as qtm_rt would pass it to on_packet.
+    """
+    labelled_markers = np.empty(len(labelled), dtype=LABELLED_DTYPE)
+    for column, field in enumerate(LABELLED_DTYPE.names):
+        labelled_markers[field] = labelled[:, column]
+
+    unlabelled_markers = np.empty(len(unlabelled), dtype=UNLABELLED_DTYPE)
+    for column, field in enumerate(('x', 'y', 'z')):
+        unlabelled_markers[field] = unlabelled[:, column]
+    unlabelled_markers['id'] = np.arange(len(unlabelled))
+    unlabelled_markers['residual'] = unlabelled[:, 3]
+
+    components = (make_component(QRTComponentType.Component3dRes, labelled_markers) +
+                  make_component(QRTComponentType.Component3dNoLabelsRes, unlabelled_markers))
+    return QRTPacket(PACKET_HEADER.pack(timestamp, frame_number, 2) + components)
+
+
+def make_component(component_type: QRTComponentType, markers: np.ndarray) -> bytes:
+    """Pack a 3D marker component: header, then the markers as they're laid out in memory"""
+    body = MARKERS_HEADER.pack(len(markers), 0, 0) + markers.tobytes()
+    return COMPONENT_HEADER.pack(COMPONENT_HEADER.size + len(body), component_type.value) + body
+
+
+class SyntheticMocapSource:
+    """
+    Streams synthetic QTM frames of the base markers and some juggled balls.
+
+    The balls are thrown straight up (with a little sideways scatter) from around the hand position and 'caught' when
+    they fall back through the catch height, at which point they're thrown again after a short pause. Everything is
+    simulated in the robot base frame and then transformed into the QTM (world) frame using the base pose, the same
+    way MocapInterface expects to find it.
+    """
+
+    def __init__(self, base_markers: np.ndarray, frame_rate: float = 300.0, num_balls: int = 3,
+                 noise_std: float = 0.3, dropout_probability: float = 0.01, ghost_rate: float = 0.05,
+                 base_rotation: Optional[np.ndarray] = None, base_translation: Optional[np.ndarray] = None,
+                 catch_height: float = 735.0, seed: Optional[int] = None):
+        """
+        Args:
+            base_markers (np.ndarray): Nx3 positions of the base markers in the body frame {mm}.
+            frame_rate (float): Frames per second to stream at. 0 streams as fast as possible.
+            num_balls (int): Number of balls in the air (or waiting to be thrown).
+            noise_std (float): Standard deviation of the noise added to every marker position {mm}.
+            dropout_probability (float): Chance of any one marker being missing from a frame.
+            ghost_rate (float): Average number of ghost markers (reflections etc.) per frame.
+            base_rotation (np.ndarray): Rotation from the body frame to the QTM frame (3x3). Defaults to identity.
+            base_translation (np.ndarray): Translation from the body frame to the QTM frame (3,) {mm}.
+            catch_height (float): Height at which balls are thrown and caught, in the robot base frame {mm}.
+            seed (int): Seed for the random number generator, for repeatable streams.
+        """
+        self.base_markers = np.asarray(base_markers, dtype=float)
+        self.frame_rate = frame_rate
+        self.num_balls = num_balls
+        self.noise_std = noise_std
+        self.dropout_probability = dropout_probability
+        self.ghost_rate = ghost_rate
+        self.catch_height = catch_height
+        self.rng = np.random.default_rng(seed)
+
+        R = np.eye(3) if base_rotation is None else np.asarray(base_rotation, dtype=float)
+        t = np.zeros(3) if base_translation is None else np.asarray(base_translation, dtype=float)
+
+        # The robot base frame is the body frame rotated 90 degrees about z (see MocapInterface), so the
+        # transformation from the robot base frame to the QTM frame is R @ alignment.T
+        alignment = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]], dtype=float)
+        self.base_to_world_rotation = R @ alignment.T
+        self.base_to_world_translation = t
+        self.base_markers_world = self.base_markers @ R.T + t
+
+        # Ball states in the robot base frame
+        self.ball_positions = np.zeros((num_balls, 3))
+        self.ball_velocities = np.zeros((num_balls, 3))
+        self.ball_wait_times = self.rng.uniform(0.0, 0.5, num_balls)  # Time until each ball is thrown {s}
+        self.ball_positions[:, 2] = catch_height
+
+        self.frame_number = 0
+        self.running = False
+
+    #########################################################################################################
+    #                                              Simulation                                               #
+    #########################################################################################################
+
+    def throw_balls(self, ball_indices: np.ndarray):
+        """Throw the given balls from around the hand position, each to a random height"""
+        count = len(ball_indices)
+        heights = self.rng.uniform(300.0, 1000.0, count)  # Apex height above the catch height {mm}
+
+        self.ball_positions[ball_indices, :2] = self.rng.normal(0.0, 30.0, (count, 2))
+        self.ball_positions[ball_indices, 2] = self.catch_height
+        self.ball_velocities[ball_indices, :2] = self.rng.normal(0.0, 50.0, (count, 2))
+        self.ball_velocities[ball_indices, 2] = np.sqrt(2 * GRAVITY * heights)
+
+    def step(self, dt: float):
+        """Advance the balls by dt {s}"""
+        waiting = self.ball_wait_times > 0
+        self.ball_wait_times[waiting] -= dt
+        to_throw = np.flatnonzero(waiting & (self.ball_wait_times <= 0))
+        if len(to_throw) > 0:
+            self.throw_balls(to_throw)
+
+        flying = ~waiting
+        self.ball_positions[flying] += self.ball_velocities[flying] * dt
+        self.ball_positions[flying, 2] -= 0.5 * GRAVITY * dt ** 2
+        self.ball_velocities[flying, 2] -= GRAVITY * dt
+
+        # Catch any balls that have fallen back through the catch height, and hold them for a moment
+        caught = flying & (self.ball_velocities[:, 2] < 0) & (self.ball_positions[:, 2] < self.catch_height)
+        self.ball_positions[caught, 2] = self.catch_height
+        self.ball_velocities[caught] = 0.0
+        self.ball_wait_times[caught] = self.rng.uniform(0.1, 0.3, np.count_nonzero(caught))
+
+    def measure(self, positions: np.ndarray) -> np.ndarray:
+        """Return a noisy copy of some marker positions"""
+        if self.noise_std > 0:
+            return positions + self.rng.normal(0.0, self.noise_std, positions.shape)
+        return positions.copy()
+
+    #########################################################################################################
+    #                                               Packets                                                 #
+    #########################################################################################################
+
+    def make_packet(self, timestamp: int) -> QRTPacket:
+        """
+        Build a QTM packet from the current state.
+
+        Args:
+            timestamp (int): Capture timestamp for the frame {us}.
+
+        Returns:
+            QRTPacket: The packet, as qtm_rt would pass it to on_packet.
+        """
+        # Labelled (base) markers. QTM sends every labelled marker, with NaN positions for any it can't see
+        positions = self.measure(self.base_markers_world)
+        positions[self.rng.random(len(positions)) < self.dropout_probability] = np.nan
+        labelled = np.column_stack((positions, self.rng.uniform(0.1, 0.6, len(positions))))
+
+        # Unlabelled markers: the balls (minus any dropouts) and any ghosts, in the QTM frame
+        balls = self.ball_positions[self.rng.random(self.num_balls) >= self.dropout_probability]
+        ghosts = self.rng.uniform([-1000.0, -1000.0, 0.0], [1000.0, 1000.0, 2500.0],
+                                  (self.rng.poisson(self.ghost_rate), 3))
+        positions = self.measure(np.vstack((balls, ghosts)) @ self.base_to_world_rotation.T +
+                                 self.base_to_world_translation)
+        unlabelled = np.column_stack((positions, self.rng.uniform(0.1, 1.0, len(positions))))
+
+        return build_packet(timestamp, self.frame_number, labelled, unlabelled)
+
+    #########################################################################################################
+    #                                              Streaming                                                #
+    #########################################################################################################
+
+    async def stream(self, on_packet: Callable[[QRTPacket], None]):
+        """
+        Stream frames to on_packet until stop() is called.
+
+        Frames are scheduled against absolute times, so a slow frame doesn't push every later frame back. The QTM
+        timestamps follow the simulation, so they run at exactly the frame rate regardless of scheduling jitter.
+
+        Args:
+            on_packet (Callable[[QRTPacket], None]): Called with each frame, as qtm_rt's stream_frames would.
+        """
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.frame_rate if self.frame_rate > 0 else 0.0
+        sim_dt = period if period > 0 else 1.0 / 300.0
+
+        self.running = True
+        next_frame_time = loop.time()
+
+        while self.running:
+            self.step(sim_dt)
+            self.frame_number += 1
+            on_packet(self.make_packet(int(self.frame_number * sim_dt * 1e6)))
+
+            if period > 0:
+                next_frame_time += period
+                await asyncio.sleep(max(0.0, next_frame_time - loop.time()))
+            else:
+                await asyncio.sleep(0)
+
+    def stop(self):
+        """Stop streaming after the current frame"""
+        self.running = False
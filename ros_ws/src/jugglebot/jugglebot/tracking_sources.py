@@ -0,0 +1,370 @@
+"""
+Tracking sources with a common frame format, and a fusion stage that combines them into one stream.
+
+Every source (QTM, SteamVR trackers, ...) runs as its own task on a shared asyncio loop and emits TrackingFrames:
+unlabelled markers and rigid body poses in the robot base frame {mm}, stamped with their capture time in the host
+clock {ns}. TrackingFusion runs the sources side by side and time-aligns them onto a reference source (normally QTM),
+so that each frame of the reference comes out with the latest poses from every other source, interpolated to its
+capture time.
+
+The mocap interface node runs QTM and the SteamVR trackers this way with:
+    ros2 run jugglebot mocap_interface_node --ros-args -p steamvr_trackers:=true
+
+Example, with QTM and the SteamVR trackers (needs the openvr package and SteamVR running):
+    mocap = MocapInterface(logger=logger)
+    fusion = TrackingFusion([QtmTrackingSource(mocap), OpenVRTrackingSource(vr_to_base=calibration)],
+                            on_frame=handle_frame, logger=logger)
+    fusion.start()
+    ...
+    fusion.stop()
+    mocap.stop()
+"""
+
+import asyncio
+import threading
+import time
+import numpy as np
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from .clock_sync import ClockOffsetEstimator
+
+
+class TrackingFrame:
+    """
+    One frame from a tracking source.
+    """
+
+    __slots__ = ('source', 'sequence', 'capture_time', 'markers', 'rigid_bodies', 'device_time')
+
+    def __init__(self, source: str, sequence: int, capture_time: int, markers: Optional[np.ndarray] = None,
+                 rigid_bodies: Optional[Dict[str, np.ndarray]] = None, device_time: Optional[int] = None):
+        """
+        Args:
+            source (str): Name of the source that the frame came from.
+            sequence (int): Frame number from the source (eg. the QTM frame number).
+            capture_time (int): Time that the frame was captured, in the host clock {ns}.
+            markers (np.ndarray): Mx4 array of unlabelled markers (x, y, z, residual) in the robot base frame {mm}.
+            rigid_bodies (Dict[str, np.ndarray]): 3x4 poses ([R | t]) of named rigid bodies (eg. trackers) in the
+                                                  robot base frame {mm}.
+            device_time (int): Time that the frame was captured in the source's own clock, if it has one {ns}.
+        """
+        self.source = source
+        self.sequence = sequence
+        self.capture_time = capture_time
+        self.markers = np.empty((0, 4)) if markers is None else markers
+        self.rigid_bodies = {} if rigid_bodies is None else rigid_bodies
+        self.device_time = device_time
+
+
+class TrackingSource(ABC):
+    """
+    Base class for tracking sources. A source streams TrackingFrames from its own task until it's stopped.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.running = False
+
+    @abstractmethod
+    async def stream(self, on_frame: Callable[[TrackingFrame], None]):
+        """
+        Stream frames to on_frame until stop() is called.
+
+        Args:
+            on_frame (Callable[[TrackingFrame], None]): Called (on the event loop) with each new frame.
+        """
+
+    def stop(self):
+        """Stop streaming after the current frame"""
+        self.running = False
+
+
+class QtmTrackingSource(TrackingSource):
+    """
+    Adapts a MocapInterface into a tracking source.
+
+    MocapInterface keeps streaming from QTM on its own thread. This source waits (on the event loop) for it to signal
+    new frames, drains them from its frame buffer and stamps them with their capture time in the host clock. It takes
+    over the interface's on_frame callback, and has to be the only consumer of its frame buffer.
+    """
+
+    def __init__(self, mocap_interface, name: str = 'qtm'):
+        """
+        Args:
+            mocap_interface (MocapInterface): The (already started) interface to take frames from.
+            name (str): Name of the source, as given in its frames.
+        """
+        super().__init__(name)
+        self.mocap_interface = mocap_interface
+        self.clock_offset = ClockOffsetEstimator()
+        self.new_frames: Optional[asyncio.Event] = None
+
+    async def stream(self, on_frame: Callable[[TrackingFrame], None]):
+        loop = asyncio.get_running_loop()
+        self.new_frames = asyncio.Event()
+        self.mocap_interface.on_frame = lambda: loop.call_soon_threadsafe(self.new_frames.set)
+        self.running = True
+
+        try:
+            while self.running:
+                await self.new_frames.wait()
+                self.new_frames.clear()
+
+                for frame_number, timestamp, receive_time, markers in self.mocap_interface.frame_buffer.drain():
+                    # QTM timestamps are in {us}
+                    capture_time = self.clock_offset.update(timestamp * 1000, receive_time)
+                    on_frame(TrackingFrame(self.name, frame_number, capture_time, markers.copy(),
+                                           device_time=timestamp * 1000))
+        finally:
+            self.mocap_interface.on_frame = None
+
+    def stop(self):
+        super().stop()
+        # Wake the stream up so that it sees it's been stopped. Must be called on the event loop
+        if self.new_frames is not None:
+            self.new_frames.set()
+
+
+class OpenVRTrackingSource(TrackingSource):
+    """
+    Polls the poses of SteamVR trackers (eg. Vive/Tundra trackers) through OpenVR.
+
+    OpenVR gives each device's pose in its standing tracking universe, in metres. The poses are converted to {mm} and
+    then into the robot base frame with a fixed calibration transformation.
+    """
+
+    def __init__(self, rate: float = 250.0, vr_to_base: Optional[np.ndarray] = None,
+                 device_classes=('Tracker',), name: str = 'openvr'):
+        """
+        Args:
+            rate (float): Rate to poll the poses at {Hz}.
+            vr_to_base (np.ndarray): 3x4 affine transformation from the SteamVR frame {mm} to the robot base frame {mm}.
+                                     Defaults to identity.
+            device_classes (tuple): Classes of device to report: any of 'Tracker', 'Controller' and 'HMD'.
+            name (str): Name of the source, as given in its frames.
+        """
+        super().__init__(name)
+
+        # OpenVR only works where SteamVR is installed, so it's only needed if this source is used
+        import openvr
+        self.openvr = openvr
+
+        self.rate = rate
+        self.vr_to_base = np.hstack((np.eye(3), np.zeros((3, 1)))) if vr_to_base is None else np.asarray(vr_to_base)
+        self.device_classes = {
+            openvr.TrackedDeviceClass_GenericTracker: 'Tracker',
+            openvr.TrackedDeviceClass_Controller: 'Controller',
+            openvr.TrackedDeviceClass_HMD: 'HMD',
+        }
+        self.wanted_classes = set(device_classes)
+
+        self.vr = None
+        self.device_names: Dict[int, Optional[str]] = {}  # Name (serial number) of each device index, None to ignore
+
+    def device_name(self, index: int) -> Optional[str]:
+        """Serial number of the device at an index, or None if it isn't a class of device that's being reported"""
+        if index not in self.device_names:
+            device_class = self.device_classes.get(self.vr.getTrackedDeviceClass(index))
+            if device_class in self.wanted_classes:
+                self.device_names[index] = self.vr.getStringTrackedDeviceProperty(
+                    index, self.openvr.Prop_SerialNumber_String)
+            else:
+                self.device_names[index] = None
+        return self.device_names[index]
+
+    def read_poses(self) -> Dict[str, np.ndarray]:
+        """Read the current pose of every valid device, in the robot base frame"""
+        poses = self.vr.getDeviceToAbsoluteTrackingPose(self.openvr.TrackingUniverseStanding, 0,
+                                                        self.openvr.k_unMaxTrackedDeviceCount)
+        A, b = self.vr_to_base[:, :3], self.vr_to_base[:, 3]
+
+        rigid_bodies = {}
+        for index in range(self.openvr.k_unMaxTrackedDeviceCount):
+            if not poses[index].bDeviceIsConnected:
+                self.device_names.pop(index, None)  # The index may be reused by another device
+                continue
+            if not poses[index].bPoseIsValid:
+                continue
+
+            name = self.device_name(index)
+            if name is None:
+                continue
+
+            matrix = poses[index].mDeviceToAbsoluteTracking
+            pose = np.array([[matrix[row][column] for column in range(4)] for row in range(3)])
+            rigid_bodies[name] = np.hstack((A @ pose[:, :3], (A @ (pose[:, 3] * 1000.0) + b)[:, np.newaxis]))
+
+        return rigid_bodies
+
+    async def stream(self, on_frame: Callable[[TrackingFrame], None]):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.rate
+
+        self.vr = self.openvr.init(self.openvr.VRApplication_Other)
+        self.running = True
+        sequence = 0
+        next_poll_time = loop.time()
+
+        try:
+            while self.running:
+                # OpenVR gives the latest pose, so the poll time is as close as we can get to the capture time
+                capture_time = time.time_ns()
+                on_frame(TrackingFrame(self.name, sequence, capture_time, rigid_bodies=self.read_poses()))
+                sequence += 1
+
+                # Schedule against absolute times, so that a slow poll doesn't push every later poll back
+                next_poll_time += period
+                await asyncio.sleep(max(0.0, next_poll_time - loop.time()))
+        finally:
+            self.openvr.shutdown()
+            self.vr = None
+
+
+class TrackingFusion:
+    """
+    Runs a set of tracking sources side by side and time-aligns them into one stream.
+
+    Each frame from the reference source (the first one, unless named) is passed on as soon as it arrives, together
+    with the poses of every rigid body from the other sources at its capture time. The reference frames arrive later
+    after capture than the other sources' samples (QTM's capture times are a few ms old by the time a frame arrives),
+    so a short history of each rigid body's samples is kept. Positions are interpolated linearly between the two
+    samples that bracket the capture time, or taken from the nearest sample if the capture time is outside the history
+    (there's no extrapolation). Rotations are taken from the nearer sample. Poses whose latest sample is more than
+    max_age older than the capture time are left out.
+    """
+
+    def __init__(self, sources: List[TrackingSource], on_frame: Callable[[TrackingFrame], None],
+                 reference: Optional[str] = None, max_age: float = 0.05, history: int = 64, logger=None):
+        """
+        Args:
+            sources (List[TrackingSource]): The sources to run.
+            on_frame (Callable[[TrackingFrame], None]): Called (from the fusion thread) with each fused frame.
+            reference (str): Name of the source whose frames drive the output. Defaults to the first source.
+            max_age (float): Oldest a pose from another source can be to be included in a fused frame {s}.
+            history (int): Number of samples to keep of each rigid body. Enough to cover the reference source's
+                           latency at the other sources' rates (64 is 0.25 s at 250 Hz).
+            logger: Optional logger to report errors to.
+        """
+        self.sources = sources
+        self.on_frame = on_frame
+        self.reference = sources[0].name if reference is None else reference
+        self.max_age_ns = int(max_age * 1e9)
+        self.history = history
+        self.logger = logger
+
+        # The most recent samples, (capture time, pose), of each rigid body from the non-reference sources, oldest first
+        self.pose_history: Dict[str, deque] = {}
+
+        self.loop = None
+        self.thread = None
+        self.stopping = False  # Whether stop() has been called. Only used on the event loop
+        self.stop_requested: Optional[asyncio.Event] = None
+
+    def on_source_frame(self, frame: TrackingFrame):
+        """Handle a frame from any of the sources"""
+        if frame.source != self.reference:
+            for name, pose in frame.rigid_bodies.items():
+                self.pose_history.setdefault(name, deque(maxlen=self.history)).append((frame.capture_time, pose))
+            return
+
+        rigid_bodies = dict(frame.rigid_bodies)
+        for name, history in self.pose_history.items():
+            pose = self.pose_at(history, frame.capture_time)
+            if pose is not None:
+                rigid_bodies[name] = pose
+
+        self.on_frame(TrackingFrame('fused', frame.sequence, frame.capture_time, frame.markers, rigid_bodies,
+                                    frame.device_time))
+
+    def pose_at(self, history: deque, capture_time: int) -> Optional[np.ndarray]:
+        """
+        Estimate a rigid body's pose at a given time from its recent samples.
+
+        Returns:
+            Optional[np.ndarray]: The 3x4 pose, or None if the latest sample is too old.
+        """
+        latest_time, latest_pose = history[-1]
+        if capture_time - latest_time > self.max_age_ns:
+            return None
+        if capture_time >= latest_time:
+            return latest_pose
+
+        # Search back from the newest sample, as the capture time is usually only a few samples old
+        later_time, later_pose = latest_time, latest_pose
+        for index in range(len(history) - 2, -1, -1):
+            earlier_time, earlier_pose = history[index]
+            if earlier_time <= capture_time:
+                break
+            later_time, later_pose = earlier_time, earlier_pose
+        else:
+            return later_pose  # Older than the whole history
+
+        if later_time == earlier_time:
+            return later_pose
+
+        fraction = (capture_time - earlier_time) / (later_time - earlier_time)
+        pose = (earlier_pose if fraction < 0.5 else later_pose).copy()
+        pose[:, 3] = earlier_pose[:, 3] + fraction * (later_pose[:, 3] - earlier_pose[:, 3])
+        return pose
+
+    async def run(self):
+        """Run every source on its own task until they've all stopped, or stop() is called"""
+        self.stop_requested = asyncio.Event()
+        if self.stopping:
+            self.stop_requested.set()
+
+        streams = asyncio.gather(*(source.stream(self.on_source_frame) for source in self.sources),
+                                 return_exceptions=True)
+        stop_requested = asyncio.ensure_future(self.stop_requested.wait())
+        await asyncio.wait({streams, stop_requested}, return_when=asyncio.FIRST_COMPLETED)
+
+        # Every stream has started by now, so stopping the sources can't be undone by a stream starting afterwards
+        if stop_requested.done():
+            for source in self.sources:
+                source.stop()
+        else:
+            stop_requested.cancel()
+
+        results = await streams
+        for source, result in zip(self.sources, results):
+            if isinstance(result, Exception) and self.logger is not None:
+                self.logger.error(f"Tracking source '{source.name}' failed: {result}")
+
+    def start(self):
+        """
+        Start running the sources in a separate thread.
+        """
+        # The loop is made here rather than on the thread, so that it's there for stop() however soon that's called
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_asyncio_loop)
+        self.thread.start()
+
+    def _run_asyncio_loop(self):
+        """
+        Run the asyncio event loop in a separate thread.
+        """
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.run())
+        finally:
+            self.loop.close()
+
+    def _request_stop(self):
+        """Ask run() to stop the sources. Called on the event loop, possibly before run() has started"""
+        self.stopping = True
+        if self.stop_requested is not None:
+            self.stop_requested.set()
+
+    def stop(self):
+        """
+        Stop every source and wait for them to finish.
+        """
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._request_stop)
+            except RuntimeError:
+                pass  # The loop has already closed, as every source had stopped by itself
+        if self.thread:
+            self.thread.join()
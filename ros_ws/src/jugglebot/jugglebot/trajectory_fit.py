@@ -0,0 +1,183 @@
+# trajectory_fit.py
+
+import numpy as np
+from typing import Optional, Tuple
+
+
+class IncrementalPolynomialFit:
+    """
+    Least-squares polynomial fit (up to quadratic) of 3D position against time, over a window of samples that can grow
+    at one end and shrink at the other.
+
+    Rather than refitting the whole window for every new sample, the fit keeps running sums of t^k (k = 0..4) and
+    t^k * p (k = 0..2) for each axis. Adding or removing a sample updates the sums in O(1), and a fit only has to solve
+    the (at most) 3x3 normal equations. The residuals are summed over the window's samples, in one vectorized pass:
+    a ball moves hundreds of mm over a window but only fits to within a few mm, so the sum of squared residuals from
+    running sums (sum(p^2) minus the part the fit explains) loses most of its precision to cancellation.
+
+    Times and positions are kept relative to a reference sample so that the sums stay well conditioned. The reference
+    is moved up to the oldest sample (and the sums rebuilt from the window) once the newest sample is more than
+    `rebase_interval` after it, which also clears out any accumulated rounding error.
+
+    The samples are kept in preallocated ring buffers, so the window holds at most `capacity` samples. Appending to a
+    full window drops its oldest sample.
+    """
+
+    def __init__(self, rebase_interval: float = 1.0, capacity: int = 128):
+        """
+        Args:
+            rebase_interval (float): Longest time between the reference and the newest sample before the sums are
+                                     rebuilt around a new reference {s}.
+            capacity (int): Most samples that the window can hold.
+        """
+        self.rebase_interval = rebase_interval
+
+        # Ring buffers of the samples in the window. The oldest is at `first`, and the rest follow it (wrapping around)
+        self.times = np.zeros(capacity)
+        self.positions = np.zeros((capacity, 3))
+        self.first = 0
+        self.count = 0
+
+        self.reference_time = 0.0
+        self.reference_position = np.zeros(3)
+        self.time_sums = np.zeros(5)              # sum(t^k) for k = 0..4
+        self.position_sums = np.zeros((3, 3))     # sum(t^k * p) for k = 0..2 (rows) and each axis (columns)
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def capacity(self) -> int:
+        return len(self.times)
+
+    @property
+    def last(self) -> int:
+        """Index of the newest sample in the ring buffers"""
+        return (self.first + self.count - 1) % self.capacity
+
+    @property
+    def start_time(self) -> float:
+        """Time of the oldest sample in the window {s}"""
+        return self.times[self.first]
+
+    @property
+    def end_time(self) -> float:
+        """Time of the newest sample in the window {s}"""
+        return self.times[self.last]
+
+    @property
+    def latest_position(self) -> np.ndarray:
+        """Position of the newest sample in the window (3,)"""
+        return self.positions[self.last]
+
+    def accumulate(self, time: float, position: np.ndarray, sign: float):
+        """Add (sign = 1) or remove (sign = -1) one sample's contribution to the sums"""
+        t = time - self.reference_time
+        p = position - self.reference_position
+        powers = t ** np.arange(5)
+
+        self.time_sums += sign * powers
+        self.position_sums += sign * np.outer(powers[:3], p)
+
+    def append(self, time: float, position: np.ndarray):
+        """
+        Add a sample to the newest end of the window.
+
+        Args:
+            time (float): Time of the sample {s}. Must not be before the newest sample.
+            position (np.ndarray): Position of the sample (3,).
+        """
+        if self.count == self.capacity:
+            self.pop_oldest()
+
+        index = (self.first + self.count) % self.capacity
+        self.times[index] = time
+        self.positions[index] = np.ravel(position)
+        position = self.positions[index]
+        self.count += 1
+
+        if self.count == 1:
+            self.reference_time = time
+            self.reference_position[:] = position
+
+        if time - self.reference_time > self.rebase_interval:
+            self.rebase()
+        else:
+            self.accumulate(time, position, 1.0)
+
+    def pop_oldest(self):
+        """Remove the oldest sample from the window"""
+        index = self.first
+        self.first = (self.first + 1) % self.capacity
+        self.count -= 1
+        if self.count:
+            self.accumulate(self.times[index], self.positions[index], -1.0)
+        else:
+            self.clear()
+
+    def clear(self):
+        """Remove every sample"""
+        self.first = 0
+        self.count = 0
+        self.time_sums[:] = 0.0
+        self.position_sums[:] = 0.0
+
+    def window(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Times (N,) and positions (N, 3) of the samples in the window, oldest first,
+                relative to the reference.
+        """
+        indices = (self.first + np.arange(self.count)) % self.capacity
+        return self.times[indices] - self.reference_time, self.positions[indices] - self.reference_position
+
+    def rebase(self):
+        """Move the reference to the oldest sample and rebuild the sums from the window"""
+        self.reference_time = self.times[self.first]
+        self.reference_position[:] = self.positions[self.first]
+
+        times, positions = self.window()
+        powers = times[:, np.newaxis] ** np.arange(5)
+
+        self.time_sums = powers.sum(axis=0)
+        self.position_sums = powers[:, :3].T @ positions
+
+    def fit(self, degree: int = 2) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Fit a polynomial in time to each axis of the samples in the window.
+
+        Args:
+            degree (int): Degree of the polynomial (0, 1 or 2).
+
+        Returns:
+            Optional[Tuple[np.ndarray, np.ndarray]]: Coefficients ((degree + 1) x 3, lowest power first, for times
+                relative to reference_time and positions relative to reference_position) and the sum of squared
+                residuals for each axis (3,). None if the window doesn't have enough distinct times for the fit.
+        """
+        terms = degree + 1
+        if self.count < terms:
+            return None
+
+        normal_matrix = self.time_sums[np.add.outer(np.arange(terms), np.arange(terms))]
+        try:
+            coefficients = np.linalg.solve(normal_matrix, self.position_sums[:terms])
+        except np.linalg.LinAlgError:
+            return None
+
+        times, positions = self.window()
+        residuals = positions - (times[:, np.newaxis] ** np.arange(terms)) @ coefficients
+        return coefficients, np.sum(residuals ** 2, axis=0)
+
+    def velocity_at(self, coefficients: np.ndarray, time: float) -> np.ndarray:
+        """
+        Evaluate the velocity of a fitted polynomial.
+
+        Args:
+            coefficients (np.ndarray): Coefficients from fit() ((degree + 1) x 3).
+            time (float): Time to evaluate the velocity at {s}.
+
+        Returns:
+            np.ndarray: Velocity on each axis (3,).
+        """
+        t = time - self.reference_time
+        return sum((k * coefficients[k] * t ** (k - 1) for k in range(1, len(coefficients))), np.zeros(3))
@@ -21,7 +21,7 @@ setup(
     maintainer_email='harrisonlow.jugglebot@gmail.com',
     description="v1 of (proper) Jugglebot code. Now with a state machine!",
     license='MIT Licence',
-    tests_require=['pytest'],
+    tests_require=['pytest', 'pytest-benchmark'],
     entry_points={
         'console_scripts': [
             'yasmin_state_machine = jugglebot.yasmin_state_machine:main',
@@ -35,6 +35,7 @@ setup(
             'catch_a_ball_node = jugglebot.catch_a_ball_node:main',
             'mocap_visualizer_node = jugglebot.mocap_visualizer_node:main',
             'landing_analysis_node = jugglebot.landing_analysis_node:main',
+            'geometry_calibration = jugglebot.geometry_calibration:main',
         ],
     },
 )
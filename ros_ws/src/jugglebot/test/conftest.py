@@ -0,0 +1,72 @@
+"""
+Shared fixtures for the tests.
+
+The benchmarks use pytest-benchmark, and any test that asks for its benchmark fixture is skipped if it isn't installed
+(or is disabled with -p no:benchmark).
+"""
+
+import numpy as np
+import pytest
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.pluginmanager.hasplugin('benchmark'):
+        return
+
+    skip_benchmark = pytest.mark.skip(reason='pytest-benchmark is not installed')
+    for item in items:
+        if 'benchmark' in getattr(item, 'fixturenames', ()):
+            item.add_marker(skip_benchmark)
+
+
+def make_throws(num_balls, seed=0):
+    '''States of balls on their way up or down, above a catch height of about 735 mm'''
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform([-200, -200, 800], [200, 200, 1500], (num_balls, 3))
+    velocities = rng.uniform([-300, -300, -3000], [300, 300, 3000], (num_balls, 3))
+    return np.hstack((positions, velocities))
+
+
+@pytest.fixture
+def throws():
+    '''make_throws, for tests of landing on the catch surfaces'''
+    return make_throws
+
+
+class QuietLogger:
+    def info(self, *args, **kwargs):
+        pass
+
+    warn = warning = error = info
+
+
+class IdleSource:
+    '''Stands in for QTM without sending anything, so that a test can hand the mocap interface its own packets'''
+    async def stream(self, on_packet):
+        pass
+
+    def stop(self):
+        pass
+
+
+@pytest.fixture
+def make_mocap_interface():
+    '''Makes MocapInterfaces that aren't connected to anything (with any other arguments), stopped after the test'''
+    # Only imported here, so that tests that don't need the mocap interface don't need qtm_rt
+    from jugglebot.mocap_interface import MocapInterface
+
+    interfaces = []
+
+    def make(**kwargs):
+        interfaces.append(MocapInterface(logger=QuietLogger(), source=IdleSource(), **kwargs))
+        return interfaces[-1]
+
+    yield make
+    for interface in interfaces:
+        interface.stop()
+
+
+@pytest.fixture
+def mocap_interface(make_mocap_interface):
+    '''A MocapInterface that isn't connected to anything, stopped after the test'''
+    return make_mocap_interface()
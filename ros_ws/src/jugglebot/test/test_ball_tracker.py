@@ -0,0 +1,197 @@
+"""
+Tests for the ball track table: confirming tracks among noise markers, the track IDs as slots are reused, and
+predicting where thrown balls land.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('jugglebot_interfaces')
+
+from jugglebot.ball_tracker import CONFIRMED, SLOT_BITS, TENTATIVE, BallTrackTable  # noqa: E402
+from jugglebot.landing_solver import SphereSurface  # noqa: E402
+from jugglebot.synthetic_mocap import GRAVITY  # noqa: E402
+
+DT = 1.0 / 300.0            # Mocap frame period {s}
+GROUND_HEIGHT = 735.0       # {mm}
+START_TIME = 1.7e9          # Capture time of the first frame, in the ROS clock {s}
+FAR_AWAY = np.array([[1500.0, 1500.0, 300.0]])  # A still marker well away from everything else {mm}
+
+# Balls thrown from about the catch height (start position and velocity) {mm, mm/s}
+THROWS = np.array([
+    [100.0, 200.0, 800.0, 200.0, -100.0, 3000.0],
+    [-150.0, -50.0, 900.0, -100.0, 150.0, 2500.0],
+])
+
+
+def ball_positions(throws, time):
+    '''Positions of thrown balls at a time after the throw (N, 3) {mm}'''
+    positions = throws[:, :3] + throws[:, 3:] * time
+    positions[:, 2] -= 0.5 * GRAVITY * time ** 2
+    return positions
+
+
+def landing_times(throws, height):
+    '''Time after the throw that each ball falls through a height {s}'''
+    vz, dz = throws[:, 5], throws[:, 2] - height
+    return (vz + np.sqrt(vz ** 2 + 2 * GRAVITY * dz)) / GRAVITY
+
+
+def make_table(**kwargs):
+    return BallTrackTable(DT, ground_height=GROUND_HEIGHT, **kwargs)
+
+
+def run_frames(table, frames, predict=True):
+    '''
+    Hand the table one frame of markers at a time, predicting the landings after each one as the node's timer would.
+    Returns the landing predictions after each frame.
+    '''
+    predictions = []
+    for frame, markers in enumerate(frames):
+        time = START_TIME + frame * DT
+        table.add_measurements(np.asarray(markers).reshape(-1, 3), time)
+        if predict:
+            predictions.append(table.predict_landings(time))
+    return predictions
+
+
+def test_throws_among_noise():
+    rng = np.random.default_rng(0)
+    table = make_table(capacity=16)
+    flight_time = landing_times(THROWS, GROUND_HEIGHT).max()
+    num_frames = int(flight_time / DT) + 30
+
+    # The balls, plus a marker that shows up somewhere new every frame, plus one that flickers in and out
+    frames = []
+    for frame in range(num_frames):
+        time = frame * DT
+        balls = ball_positions(THROWS, time)
+        balls = balls[balls[:, 2] > GROUND_HEIGHT]
+        noise = rng.uniform([-1000, 1000, 0], [1000, 2000, 2000], (1, 3))
+        flicker = FAR_AWAY if frame % 3 == 0 else np.empty((0, 3))
+        frames.append(np.vstack((balls + rng.normal(0.0, 0.5, balls.shape), noise, flicker)))
+
+    predictions = run_frames(table, frames)
+
+    # Noise that never shows up twice in the same place is deleted before it's confirmed, and so is the marker that's
+    # only there for one in every three frames. With the balls landed, no confirmed tracks are left
+    assert table.dropped_count == 0
+    assert np.count_nonzero(table.state == CONFIRMED) == 0
+    assert np.count_nonzero(table.state == TENTATIVE) <= table.confirm_window
+
+    # Once a ball is in projectile motion, its landing is predicted every frame until it lands
+    true_times = START_TIME + landing_times(THROWS, GROUND_HEIGHT)
+    true_positions = np.array([ball_positions(THROWS[[i]], true_times[i] - START_TIME)[0] for i in range(2)])
+    ids = set()
+    for frame, landing_states in enumerate(predictions[:int(0.5 / DT)]):
+        if frame < 50:
+            continue
+        assert len(landing_states) == 2, frame
+        for landing_state in landing_states:
+            ids.add(landing_state.id)
+            position = [landing_state.landing_position.x, landing_state.landing_position.y]
+            ball = np.argmin(np.linalg.norm(true_positions[:, :2] - position, axis=1))
+            np.testing.assert_allclose(position, true_positions[ball, :2], atol=5.0)
+            time_at_land = landing_state.time_at_land.sec + landing_state.time_at_land.nanosec * 1e-9
+            assert time_at_land == pytest.approx(true_times[ball], abs=0.005)
+            assert 0.0 < landing_state.confidence <= 1.0
+    assert len(ids) == 2
+
+    # Landed balls are deleted, freeing their Kalman Filter slots
+    assert len(table.filter_bank) == 0
+    assert np.all(table.kf_slots == -1)
+    assert len(predictions[-1]) == 0
+
+
+def test_m_of_n_confirmation():
+    # With the default 3 of 5: a marker in frames 0, 2 and 4 is confirmed at frame 4. One in frames 0 and 3 is
+    # deleted at frame 4, once it's run out of frames to be confirmed in
+    table = make_table(capacity=8)
+    confirmed = np.array([[0.0, 0.0, 1000.0]])
+    deleted = np.array([[500.0, 0.0, 1000.0]])
+    frames = [[FAR_AWAY]] * 5
+    for frame in (0, 2, 4):
+        frames[frame] = frames[frame] + [confirmed]
+    for frame in (0, 3):
+        frames[frame] = frames[frame] + [deleted]
+
+    states = []
+    for markers in frames:
+        run_frames(table, [np.vstack(markers)], predict=False)
+        states.append(table.state[:3].copy())
+
+    # Slots are handed out lowest first, in the order of the markers
+    far_away_slot, confirmed_slot, deleted_slot = 0, 1, 2
+    assert [state[far_away_slot] for state in states] == [TENTATIVE] * 2 + [CONFIRMED] * 3
+    assert [state[confirmed_slot] for state in states] == [TENTATIVE] * 4 + [CONFIRMED]
+    assert [state[deleted_slot] for state in states] == [TENTATIVE] * 4 + [0]
+    assert len(table) == 2
+
+
+def test_ids_after_slot_reuse():
+    table = make_table(capacity=4)
+    run_frames(table, [FAR_AWAY, FAR_AWAY + [0.0, 500.0, 0.0]], predict=False)
+
+    # The second marker is too far from the first track to match it, so it gets its own
+    first_id = int(table.ids[0])
+    second_id = int(table.ids[1])
+    assert table.slot_of(first_id) == 0
+    assert table.slot_of(second_id) == 1
+
+    table.delete(0)
+    assert table.slot_of(first_id) is None
+
+    # A new track takes the freed slot, with the next generation
+    table.add_measurements(np.array([[0.0, 0.0, 1000.0]]), START_TIME + 2 * DT)
+    new_id = int(table.ids[0])
+    assert new_id != first_id
+    assert new_id & ((1 << SLOT_BITS) - 1) == 0
+    assert new_id >> SLOT_BITS == (first_id >> SLOT_BITS) + 1
+    assert table.slot_of(new_id) == 0
+    assert table.slot_of(first_id) is None
+    assert table.slot_of(second_id) == 1
+
+
+def test_full_table_drops_markers():
+    table = make_table(capacity=4)
+    markers = FAR_AWAY + np.arange(6)[:, np.newaxis] * [0.0, 200.0, 0.0]
+    run_frames(table, [markers], predict=False)
+    assert len(table) == 4
+    assert table.dropped_count == 2
+
+    # Once a slot is free, the next marker that doesn't match a track gets it
+    table.delete(2)
+    table.add_measurements(markers, START_TIME + DT)
+    np.testing.assert_array_equal(table.positions[:4], markers[:4])
+    assert len(table) == 4
+    assert table.dropped_count == 4
+
+
+def test_landing_on_the_landing_surface():
+    # A sphere around a hand, that the ball enters on its way down, well above the ground
+    throw = THROWS[:1]
+    entry_time = 0.5
+    entry = ball_positions(throw, entry_time)[0]
+    velocity = throw[0, 3:] - [0.0, 0.0, GRAVITY * entry_time]
+    center = entry + 100.0 * velocity / np.linalg.norm(velocity)
+    table = make_table(capacity=4, landing_surface=SphereSurface(center, 100.0))
+
+    frames = [ball_positions(throw, frame * DT) for frame in range(int((entry_time + 0.05) / DT))]
+    predictions = run_frames(table, frames)
+
+    for landing_states in predictions[50:int(0.45 / DT)]:
+        assert len(landing_states) == 1
+        landing_state = landing_states[0]
+        position = [landing_state.landing_position.x, landing_state.landing_position.y,
+                    landing_state.landing_position.z]
+        np.testing.assert_allclose(position, entry, atol=1.0)
+        time_at_land = landing_state.time_at_land.sec + landing_state.time_at_land.nanosec * 1e-9
+        assert time_at_land == pytest.approx(START_TIME + entry_time, abs=0.001)
+
+    # The track is deleted as the ball comes within landing_threshold of the sphere, rather than once it reaches the
+    # ground. S is in mm^2 for a sphere, so this needs S / |grad S| as the distance
+    landed_frame = next(frame for frame, landing_states in enumerate(predictions) if frame > 50 and not landing_states)
+    distances = [np.linalg.norm(frames[frame][0] - center) - 100.0 for frame in (landed_frame - 1, landed_frame)]
+    assert distances[0] > table.landing_threshold - 1.0
+    assert distances[1] <= table.landing_threshold + 1.0
+    assert frames[landed_frame][0, 2] > GROUND_HEIGHT + 200.0
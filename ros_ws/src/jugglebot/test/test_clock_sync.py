@@ -0,0 +1,74 @@
+"""
+Tests for estimating the offset between the QTM clock and the host clock.
+"""
+
+import numpy as np
+
+from jugglebot.clock_sync import ClockOffsetEstimator
+
+FRAME_PERIOD = 1_000_000_000 // 300  # {ns}
+
+
+def deliveries(num_frames, offset=5_000_000_000, drift=50e-6, min_latency=200_000, mean_latency=2_000_000, seed=0):
+    '''
+    Capture times in a device clock, and receive times in a host clock that runs drift faster, with jittered delivery:
+    a minimum latency plus an exponentially distributed delay, and occasional bursts of frames held up together.
+    Returns the device times, host times and true offset (host - device) at each capture {ns}.
+    '''
+    rng = np.random.default_rng(seed)
+    device_times = np.arange(num_frames, dtype=np.int64) * FRAME_PERIOD + 1_000_000_000
+    true_offsets = offset + (drift * (device_times - device_times[0])).astype(np.int64)
+
+    latencies = min_latency + rng.exponential(mean_latency - min_latency, num_frames)
+    for start in rng.integers(0, num_frames, num_frames // 200):
+        latencies[start:start + 20] += np.linspace(50_000_000, 0, len(latencies[start:start + 20]))
+
+    host_times = device_times + true_offsets + latencies.astype(np.int64)
+    return device_times, host_times, true_offsets
+
+
+def test_follows_drifting_offset():
+    # A minute of frames, with the host clock 50 ppm fast (3 ms of drift over the minute)
+    device_times, host_times, true_offsets = deliveries(300 * 60)
+    estimator = ClockOffsetEstimator(window=2.0)
+
+    errors = []
+    for device_time, host_time, true_offset in zip(device_times, host_times, true_offsets):
+        capture_time = estimator.update(int(device_time), int(host_time))
+        errors.append(capture_time - (device_time + true_offset))
+    errors = np.array(errors[300 * 2:]) / 1e6  # Once the window has filled {ms}
+
+    # The estimate sits near the minimum latency (0.2 ms), rather than the mean latency (2 ms), and follows the drift.
+    # It lags the drift by up to the drift over the window (0.1 ms), as the smallest offset is the oldest one
+    assert np.all(errors >= 0.1)
+    assert np.all(errors < 0.5)
+    assert estimator.reset_count == 0
+    assert abs(estimator.offset - true_offsets[-1]) < 500_000
+
+
+def test_resets_on_device_clock_jump():
+    estimator = ClockOffsetEstimator()
+    estimator.update(1_000_000_000, 6_000_000_000)
+    estimator.update(1_000_000_000 + FRAME_PERIOD, 6_000_000_000 + FRAME_PERIOD)
+
+    # QTM starts a new measurement, and its clock starts again from zero
+    assert estimator.update(0, 7_000_000_000) == 7_000_000_000
+    assert estimator.offset == 7_000_000_000
+    assert estimator.reset_count == 1
+
+
+def test_resets_after_host_clock_step():
+    estimator = ClockOffsetEstimator(reset_after=10)
+    device_time = 0
+    for _ in range(20):
+        device_time += FRAME_PERIOD
+        estimator.update(device_time, device_time + 1_000_000)
+
+    # Once the host clock is stepped forward a second, every sample is well above the estimate
+    for i in range(10):
+        device_time += FRAME_PERIOD
+        capture_time = estimator.update(device_time, device_time + 1_001_000_000)
+        assert estimator.reset_count == (1 if i == 9 else 0)
+
+    assert capture_time == device_time + 1_001_000_000
+    assert estimator.offset == 1_001_000_000
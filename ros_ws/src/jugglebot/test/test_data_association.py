@@ -0,0 +1,103 @@
+"""
+Tests and benchmarks for associating measurements with ball trackers.
+
+To run the benchmarks:
+    python -m pytest test/test_data_association.py --benchmark-only --benchmark-group-by=func
+"""
+
+import numpy as np
+import pytest
+
+from jugglebot.data_association import gated_nearest_neighbour
+
+GATE = 50.0**2  # With identity covariances, pairs up to 50 mm apart
+
+
+def scene(num_tracks, num_noise, seed=0):
+    '''Tracks spread over the workspace, a measurement near each one (shuffled) and some noise markers'''
+    rng = np.random.default_rng(seed)
+    tracks = rng.uniform([-500, -500, 500], [500, 500, 2000], (num_tracks, 3))
+    measurements = np.vstack((tracks + rng.normal(0.0, 2.0, tracks.shape),
+                              rng.uniform([-500, -500, 500], [500, 500, 2000], (num_noise, 3))))
+    order = rng.permutation(len(measurements))
+    return tracks, measurements[order], np.argsort(order)
+
+
+def test_global_assignment():
+    # Greedily, measurement 0 would take track 1 (its nearest), leaving measurement 1 with nothing in range
+    tracks = np.array([[0.0, 0.0, 0.0], [30.0, 0.0, 0.0]])
+    measurements = np.array([[20.0, 0.0, 0.0], [60.0, 0.0, 0.0]])
+
+    paired_tracks, paired_measurements, unpaired = gated_nearest_neighbour(tracks, measurements, gate=GATE)
+
+    assert dict(zip(paired_tracks, paired_measurements)) == {0: 0, 1: 1}
+    assert len(unpaired) == 0
+
+
+def test_gating():
+    tracks = np.array([[0.0, 0.0, 0.0]])
+    measurements = np.array([[100.0, 0.0, 0.0], [0.0, 40.0, 0.0], [0.0, 0.0, 10.0]])
+
+    paired_tracks, paired_measurements, unpaired = gated_nearest_neighbour(tracks, measurements, gate=GATE)
+
+    # One measurement per track, the nearest one, and the rest are left over
+    assert list(paired_tracks) == [0] and list(paired_measurements) == [2]
+    assert list(unpaired) == [0, 1]
+
+
+def test_mahalanobis_gate():
+    # A track that's much less certain along x than along y or z
+    tracks = np.zeros((1, 3))
+    covariances = np.diag([100.0, 1.0, 1.0])[np.newaxis]
+    measurements = np.array([[20.0, 0.0, 0.0], [0.0, 20.0, 0.0]])
+
+    _, paired_measurements, unpaired = gated_nearest_neighbour(tracks, measurements, covariances, gate=11.345)
+
+    assert list(paired_measurements) == [0]
+    assert list(unpaired) == [1]
+
+
+def test_no_tracks_or_measurements():
+    paired_tracks, _, unpaired = gated_nearest_neighbour(np.empty((0, 3)), np.zeros((2, 3)), gate=GATE)
+    assert len(paired_tracks) == 0 and list(unpaired) == [0, 1]
+
+    paired_tracks, _, unpaired = gated_nearest_neighbour(np.zeros((2, 3)), np.empty((0, 3)), gate=GATE)
+    assert len(paired_tracks) == 0 and len(unpaired) == 0
+
+    # Nothing within the gate
+    paired_tracks, _, unpaired = gated_nearest_neighbour(np.zeros((1, 3)), np.full((1, 3), 1000.0), gate=GATE)
+    assert len(paired_tracks) == 0 and list(unpaired) == [0]
+
+
+@pytest.mark.parametrize('num_tracks', [5, 100])
+def test_kdtree_matches_dense(num_tracks):
+    tracks, measurements, truth = scene(num_tracks, 20)
+    # Twice the measurement noise, so that every true pair is well inside the gate
+    covariances = np.tile(np.eye(3) * 16.0, (num_tracks, 1, 1))
+
+    dense = gated_nearest_neighbour(tracks, measurements, covariances, kdtree_min_tracks=num_tracks + 1)
+    kdtree = gated_nearest_neighbour(tracks, measurements, covariances, kdtree_min_tracks=1)
+
+    for dense_result, kdtree_result in zip(dense, kdtree):
+        np.testing.assert_array_equal(np.sort(dense_result), np.sort(kdtree_result))
+
+    # Every track should have found its own measurement
+    paired_tracks, paired_measurements, _ = kdtree
+    np.testing.assert_array_equal(paired_measurements[np.argsort(paired_tracks)], truth[:num_tracks])
+
+#########################################################################################################
+#                                              Benchmarks                                               #
+#########################################################################################################
+
+
+def test_benchmark_five_balls(benchmark):
+    '''Juggling five balls, with as many noise markers'''
+    tracks, measurements, _ = scene(5, 5)
+    covariances = np.tile(np.eye(3) * 4.0, (5, 1, 1))
+    benchmark(gated_nearest_neighbour, tracks, measurements, covariances)
+
+
+def test_benchmark_many_tracks(benchmark):
+    tracks, measurements, _ = scene(200, 50)
+    covariances = np.tile(np.eye(3) * 4.0, (200, 1, 1))
+    benchmark(gated_nearest_neighbour, tracks, measurements, covariances)
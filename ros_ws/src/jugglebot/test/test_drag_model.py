@@ -0,0 +1,199 @@
+"""
+Tests and benchmarks for the ballistic model with air drag, and the landing accuracy that it gains over the model
+without drag.
+
+To run the benchmarks, including the landing accuracy of both
+models on synthetic throws with drag (in each benchmark's extra_info):
+    python -m pytest test/test_drag_model.py --benchmark-only --benchmark-group-by=func
+"""
+
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+
+from jugglebot.drag_model import DRAG_COEFFICIENT, integrate, integrate_landing, integrate_with_jacobian
+from jugglebot.kalman_filter import DragKalmanFilterBank, KalmanFilterBank
+from jugglebot.landing_solver import GRAVITY, HeightMapSurface, PlaneSurface, SphereSurface, solve_landing
+
+DT = 1.0 / 300.0  # Mocap frame period {s}
+CATCH_HEIGHT = 735.0
+CATCH_PLANE = PlaneSurface((0.0, 0.0, CATCH_HEIGHT))
+
+
+def dynamics(_, state):
+    velocity = state[3:6]
+    acceleration = np.array([0.0, 0.0, GRAVITY]) - state[6] * np.linalg.norm(velocity) * velocity
+    return np.concatenate((velocity, acceleration, [0.0]))
+
+
+def crosses_catch_plane(_, state):
+    return state[2] - CATCH_HEIGHT
+
+
+crosses_catch_plane.terminal = True
+crosses_catch_plane.direction = -1
+
+
+def synthetic_throws(num_throws, seed=0):
+    '''
+    Juggling throws from just above the catch plane with drag, 0.5 to 2 m high, integrated to high precision. Returns
+    the initial state, the trajectory (a function of time), and the landing time and state of each throw.
+    '''
+    rng = np.random.default_rng(seed)
+    for _ in range(num_throws):
+        heading = rng.uniform(0.0, 2 * np.pi)
+        horizontal_speed = rng.uniform(300.0, 1500.0)
+        state = np.array([*rng.uniform(-100.0, 100.0, 2), CATCH_HEIGHT + 50.0,
+                          horizontal_speed * np.cos(heading), horizontal_speed * np.sin(heading),
+                          np.sqrt(-2 * GRAVITY * rng.uniform(500.0, 2000.0)),
+                          DRAG_COEFFICIENT * rng.uniform(0.7, 1.3)])
+        solution = solve_ivp(dynamics, [0.0, 5.0], state, events=crosses_catch_plane, dense_output=True,
+                             rtol=1e-11, atol=1e-9)
+        yield state, solution.sol, solution.t_events[0][0], solution.y_events[0][0]
+
+
+def landing_errors(num_throws=20, lead_time=0.5, process_noise=5.0, measurement_noise=1.0, seed=0):
+    '''
+    Track synthetic throws with drag through noisy mocap frames with a filter bank of each kind, and predict their
+    landings lead_time before they land. Returns the horizontal landing position error {mm} and landing time error {s}
+    of each throw with each model (as 'ballistic' and 'drag'), and the ratio of each learned drag coefficient to the
+    true one.
+    '''
+    rng = np.random.default_rng(seed + 1)
+    errors = {'ballistic': [], 'drag': []}
+    drag_ratios = []
+
+    for true_state, trajectory, landing_time, landing_state in synthetic_throws(num_throws, seed):
+        prediction_time = landing_time - lead_time
+        times = np.arange(0.0, prediction_time, DT)
+        measurements = trajectory(times)[:3].T + rng.normal(0.0, np.sqrt(measurement_noise), (len(times), 3))
+
+        # Start the filters a few frames in, from an estimate about as good as their initial covariance says
+        initial_state = trajectory(times[5])[:6] + np.concatenate((rng.normal(0.0, 1.0, 3), rng.normal(0.0, 20.0, 3)))
+
+        for name, bank_type, solve in (('ballistic', KalmanFilterBank, solve_landing),
+                                       ('drag', DragKalmanFilterBank, integrate_landing)):
+            bank = bank_type(DT, capacity=1, process_noise=process_noise, measurement_noise=measurement_noise)
+            slot = bank.add(initial_state, times[5])
+            for measurement, time in zip(measurements[6:], times[6:]):
+                bank.queue_measurement(slot, measurement, time)
+                bank.update()
+
+            states, covariances = bank.predict_states(np.array([slot]), prediction_time)
+            solution = solve(states, CATCH_PLANE, covariances)
+            errors[name].append((np.linalg.norm(solution.position[0, :2] - landing_state[:2]),
+                                 abs(prediction_time + solution.time[0] - landing_time)))
+
+            if name == 'drag':
+                drag_ratios.append(bank.states[slot, 6] / true_state[6])
+
+    return {name: np.array(model_errors) for name, model_errors in errors.items()}, np.array(drag_ratios)
+
+
+@pytest.mark.parametrize('surface', [
+    PlaneSurface((0.0, 0.0, 735.0), (0.2, -0.1, 1.0)),
+    SphereSurface((0.0, 0.0, 900.0), 400.0),
+    HeightMapSurface(np.linspace(-600, 600, 13), np.linspace(-600, 600, 13),
+                     735.0 + 50.0 * np.sin(np.linspace(-3, 3, 13))[:, np.newaxis] * np.ones(13)),
+], ids=['plane', 'sphere', 'height_map'])
+def test_without_drag_matches_closed_form(surface, throws):
+    states = throws(50)
+    covariances = np.tile(np.diag([4.0, 4.0, 4.0, 400.0, 400.0, 400.0]), (len(states), 1, 1))
+    expected = solve_landing(states, surface, covariances)
+    # Short steps, so that balls only briefly outside the sphere aren't missed
+    solution = integrate_landing(np.hstack((states, np.zeros((len(states), 1)))), surface, covariances, step=0.02)
+
+    np.testing.assert_array_equal(solution.valid, expected.valid)
+    valid = expected.valid
+    np.testing.assert_allclose(solution.time[valid], expected.time[valid], atol=1e-9)
+    np.testing.assert_allclose(solution.position[valid], expected.position[valid], atol=1e-6)
+    np.testing.assert_allclose(solution.velocity[valid], expected.velocity[valid], atol=1e-6)
+    np.testing.assert_allclose(solution.covariance[valid], expected.covariance[valid], rtol=1e-6, atol=1e-6)
+
+
+def test_matches_reference_integrator(throws):
+    states = np.hstack((throws(10, seed=1), np.full((10, 1), DRAG_COEFFICIENT)))
+    solution = integrate_landing(states, CATCH_PLANE)
+    assert np.all(solution.valid)
+
+    for state, time, position in zip(states, solution.time, solution.position):
+        reference = solve_ivp(dynamics, [0.0, 5.0], state, events=crosses_catch_plane, rtol=1e-11, atol=1e-9)
+        # To within a micron or so
+        assert time == pytest.approx(reference.t_events[0][0], abs=1e-6)
+        np.testing.assert_allclose(position, reference.y_events[0][0, :3], atol=5e-3)
+
+    # Drag takes energy out of the ball, so it lands slower than it would without it
+    ballistic = solve_landing(states[:, :6], CATCH_PLANE)
+    assert np.all(np.linalg.norm(solution.velocity, axis=1) < np.linalg.norm(ballistic.velocity, axis=1))
+
+
+def test_integrate_with_jacobian(throws):
+    states = np.hstack((throws(5, seed=2), np.full((5, 1), DRAG_COEFFICIENT)))
+    dt = np.array([DT, -DT, 0.05, 0.2, 1.0])
+
+    # By central differences, with steps scaled to each state variable
+    steps = np.array([1e-3, 1e-3, 1e-3, 1e-3, 1e-3, 1e-3, 1e-7])
+    jacobian = np.zeros((5, 7, 7))
+    for i, step in enumerate(steps):
+        offset = np.zeros(7)
+        offset[i] = step
+        jacobian[:, :, i] = (integrate(states + offset, dt) - integrate(states - offset, dt)) / (2 * step)
+
+    integrated, F = integrate_with_jacobian(states, dt)
+    np.testing.assert_array_equal(integrated, integrate(states, dt))
+    np.testing.assert_allclose(F, jacobian, rtol=1e-6, atol=1e-6)
+
+
+def test_drag_bank_without_drag_matches_bank(throws):
+    # With no drag (and no uncertainty in it), the extended filter is the ballistic one
+    trajectory = throws(1, seed=3)[0]
+    ballistic = KalmanFilterBank(DT, capacity=1)
+    drag = DragKalmanFilterBank(DT, capacity=1, drag_coefficient=0.0, drag_variance=0.0, drag_process_noise=0.0)
+    rng = np.random.default_rng(3)
+
+    slots = ballistic.add(trajectory, 0.0), drag.add(trajectory, 0.0)
+    for step in range(1, 100):
+        time = step * DT
+        measurement = trajectory[:3] + trajectory[3:] * time + [0.0, 0.0, 0.5 * GRAVITY * time**2]
+        measurement += rng.normal(0.0, 1.0, 3)
+        for bank, slot in zip((ballistic, drag), slots):
+            bank.queue_measurement(slot, measurement, time)
+            bank.update()
+
+    np.testing.assert_allclose(drag.states[slots[1], :6], ballistic.states[slots[0]], atol=1e-6)
+    np.testing.assert_allclose(drag.covariances[slots[1], :6, :6], ballistic.covariance(slots[0]), atol=1e-6)
+    assert drag.states[slots[1], 6] == 0.0
+
+
+def test_drag_improves_landing_accuracy():
+    errors, drag_ratios = landing_errors()
+
+    # Landing position and time errors, half a second out
+    assert np.mean(errors['drag'][:, 0]) < 0.8 * np.mean(errors['ballistic'][:, 0])
+    assert np.mean(errors['drag'][:, 1]) < 0.8 * np.mean(errors['ballistic'][:, 1])
+
+    # The drag coefficients learned are in the right range
+    assert np.all((drag_ratios > 0.5) & (drag_ratios < 2.0))
+
+#########################################################################################################
+#                                              Benchmarks                                               #
+#########################################################################################################
+
+
+@pytest.mark.parametrize('num_balls', [5, 100])
+def test_benchmark_integrate_landing(benchmark, num_balls, throws):
+    states = np.hstack((throws(num_balls), np.full((num_balls, 1), DRAG_COEFFICIENT)))
+    covariances = np.tile(np.eye(7), (num_balls, 1, 1))
+    benchmark(integrate_landing, states, CATCH_PLANE, covariances)
+
+
+@pytest.mark.parametrize('process_noise', [0.01, 5.0])
+@pytest.mark.parametrize('lead_time', [0.5, 0.2])
+def test_benchmark_landing_accuracy(benchmark, process_noise, lead_time):
+    '''Both models on the same synthetic throws. The errors are in extra_info, rather than the timings'''
+    errors, drag_ratios = benchmark.pedantic(landing_errors, kwargs={'lead_time': lead_time,
+                                                                     'process_noise': process_noise}, rounds=1)
+    for name, model_errors in errors.items():
+        benchmark.extra_info[f'{name}_position_error_mm'] = float(np.mean(model_errors[:, 0]))
+        benchmark.extra_info[f'{name}_time_error_ms'] = float(np.mean(model_errors[:, 1]) * 1e3)
+    benchmark.extra_info['drag_coefficient_ratio'] = float(np.median(drag_ratios))
@@ -0,0 +1,126 @@
+"""
+Tests for caching the robot geometry on disk, and for falling back to rebuilding it when the cache can't be read.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from jugglebot import geometry_cache, kinematics
+from jugglebot.geometry_cache import (GEOMETRY_SHAPES, hash_geometry_parameters, latest_geometry_version,
+                                      load_geometry, load_latest_geometry, next_geometry_version, save_geometry)
+
+# The parameters that robot_geometry builds the geometry from
+PARAMETERS = {'initial_height': 565.0, 'base_radius': 410.0, 'plat_radius': 219.075, 'base_small_angle': 20.0,
+              'plat_small_angle': 8.6024446, 'plat_x_axis_offset': 154.3012223, 'leg_stroke': 280.0,
+              'arm_radius': 70.0, 'arm_height_from_platform': 210.25, 'hand_stroke': 355.0, 'hand_radius': 35.0,
+              'calibration': ''}
+
+
+def build_geometry(parameters=PARAMETERS):
+    '''The geometry as robot_geometry builds and caches it'''
+    geometry = kinematics.build_platform(*(parameters[name] for name in (
+        'initial_height', 'base_radius', 'plat_radius', 'base_small_angle', 'plat_small_angle', 'plat_x_axis_offset',
+        'arm_radius', 'arm_height_from_platform', 'hand_stroke', 'hand_radius')))
+    geometry['leg_stroke'] = parameters['leg_stroke']
+    geometry['hand_stroke'] = parameters['hand_stroke']
+    return geometry
+
+
+def test_hash_geometry_parameters(monkeypatch):
+    geometry_hash = hash_geometry_parameters(PARAMETERS)
+
+    # The same parameters in any order give the same hash, and any change to them gives a different one
+    assert hash_geometry_parameters(dict(reversed(list(PARAMETERS.items())))) == geometry_hash
+    assert hash_geometry_parameters({**PARAMETERS, 'base_radius': 411.0}) != geometry_hash
+    assert hash_geometry_parameters({**PARAMETERS, 'calibration': 'abc123'}) != geometry_hash
+
+    # As does a change to the way that the geometry is built
+    monkeypatch.setattr(geometry_cache, 'GEOMETRY_FORMAT_VERSION', geometry_cache.GEOMETRY_FORMAT_VERSION + 1)
+    assert hash_geometry_parameters(PARAMETERS) != geometry_hash
+
+
+def test_save_and_load_round_trip(tmp_path):
+    geometry = build_geometry()
+    geometry_hash = hash_geometry_parameters(PARAMETERS)
+    file_path = save_geometry(geometry, geometry_hash, 3, cache_dir=str(tmp_path))
+
+    # Files are moved into place, so no temporary files are left behind
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(file_path), 'latest.json']
+
+    loaded = load_geometry(geometry_hash, cache_dir=str(tmp_path))
+    assert loaded.keys() == GEOMETRY_SHAPES.keys()
+    for key, shape in GEOMETRY_SHAPES.items():
+        assert loaded[key].shape == shape
+        np.testing.assert_array_equal(loaded[key], np.reshape(geometry[key], shape))
+
+    latest_hash, version, latest = load_latest_geometry(cache_dir=str(tmp_path))
+    assert (latest_hash, version) == (geometry_hash, 3)
+    np.testing.assert_array_equal(latest['base_nodes'], geometry['base_nodes'])
+    assert latest_geometry_version(cache_dir=str(tmp_path)) == (geometry_hash, 3)
+
+    assert load_geometry('0123456789abcdef', cache_dir=str(tmp_path)) is None
+
+
+def test_nothing_cached(tmp_path):
+    assert load_latest_geometry(cache_dir=str(tmp_path / 'missing')) is None
+    assert latest_geometry_version(cache_dir=str(tmp_path / 'missing')) == (None, 0)
+    assert next_geometry_version('0123456789abcdef', cache_dir=str(tmp_path / 'missing')) == 1
+
+
+@pytest.mark.parametrize('contents', ['', '{"geometry_hash": "01234', '[]', '"latest"', '{"version": 2}', '\x00\x01'])
+def test_unreadable_latest(tmp_path, contents):
+    # latest.json is replaced atomically, but could still be truncated by a full disk or edited by hand
+    geometry_hash = hash_geometry_parameters(PARAMETERS)
+    save_geometry(build_geometry(), geometry_hash, 3, cache_dir=str(tmp_path))
+    (tmp_path / 'latest.json').write_text(contents)
+
+    assert load_latest_geometry(cache_dir=str(tmp_path)) is None
+    assert latest_geometry_version(cache_dir=str(tmp_path)) == (None, 0)
+
+    # The geometry itself can still be loaded by its hash
+    assert load_geometry(geometry_hash, cache_dir=str(tmp_path)) is not None
+
+
+@pytest.mark.parametrize('fault', ['missing', 'corrupt', 'partial'])
+def test_unreadable_geometry_file(tmp_path, fault):
+    geometry = build_geometry()
+    geometry_hash = hash_geometry_parameters(PARAMETERS)
+    file_path = save_geometry(geometry, geometry_hash, 3, cache_dir=str(tmp_path))
+
+    if fault == 'missing':
+        os.remove(file_path)
+    elif fault == 'corrupt':
+        with open(file_path, 'wb') as f:
+            f.write(b'not an npz file')
+    else:
+        np.savez(file_path, base_nodes=geometry['base_nodes'])
+
+    assert load_geometry(geometry_hash, cache_dir=str(tmp_path)) is None
+    assert load_latest_geometry(cache_dir=str(tmp_path)) is None
+
+    # latest.json still says which geometry was built last, so rebuilding it keeps the version
+    assert latest_geometry_version(cache_dir=str(tmp_path)) == (geometry_hash, 3)
+    assert next_geometry_version(geometry_hash, cache_dir=str(tmp_path)) == 3
+
+
+def test_version_bump(tmp_path):
+    cache_dir = str(tmp_path)
+    first_hash = hash_geometry_parameters(PARAMETERS)
+    second_parameters = {**PARAMETERS, 'base_radius': 411.0}
+    second_hash = hash_geometry_parameters(second_parameters)
+
+    # Rebuilding the same geometry keeps its version, and a change to it bumps the version
+    version = next_geometry_version(first_hash, cache_dir)
+    save_geometry(build_geometry(), first_hash, version, cache_dir)
+    assert next_geometry_version(first_hash, cache_dir) == version == 1
+
+    version = next_geometry_version(second_hash, cache_dir)
+    save_geometry(build_geometry(second_parameters), second_hash, version, cache_dir)
+    assert latest_geometry_version(cache_dir) == (second_hash, 2)
+
+    # Going back to an earlier geometry is still a change, and both stay cached
+    assert next_geometry_version(first_hash, cache_dir) == 3
+    first, second = load_geometry(first_hash, cache_dir), load_geometry(second_hash, cache_dir)
+    assert not np.array_equal(first['base_nodes'], second['base_nodes'])
@@ -0,0 +1,145 @@
+"""
+Tests for the offline geometry calibration: the analytical Jacobian, recovering a known geometry from synthetic
+recordings, and loading the recordings and the calibrated geometry back in.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+quaternion = pytest.importorskip('quaternion')
+
+from jugglebot import kinematics  # noqa: E402
+from jugglebot.geometry_cache import CALIBRATED_KEYS, GEOMETRY_SHAPES, load_calibration  # noqa: E402
+from jugglebot.geometry_calibration import (LEG_COLUMNS, GeometryCalibrator, load_calibration_data,  # noqa: E402
+                                            pack_parameters, save_calibrated_geometry)
+
+# The nominal geometry, as built by robot_geometry
+NOMINAL = kinematics.build_platform(initial_height=565.0, base_radius=410.0, plat_radius=219.075,
+                                    base_small_angle=20.0, plat_small_angle=8.6024446,
+                                    plat_x_axis_offset=154.3012223, arm_radius=70.0,
+                                    arm_height_from_platform=210.25, hand_stroke=355.0, hand_radius=35.0)
+NOMINAL['leg_stroke'] = 280.0
+NOMINAL['hand_stroke'] = 355.0
+START_POS = NOMINAL['start_pos'].T
+
+
+def true_geometry(seed=0, node_error=3.0, leg_offset_error=3.0):
+    '''The nominal geometry, with every node and leg offset moved by up to a few mm'''
+    rng = np.random.default_rng(seed)
+    geometry = {key: np.asarray(value, dtype=float) for key, value in NOMINAL.items()}
+    geometry['base_nodes'] = geometry['base_nodes'] + rng.uniform(-node_error, node_error, (6, 3))
+    geometry['init_plat_nodes'] = geometry['init_plat_nodes'] + rng.uniform(-node_error, node_error, (6, 3))
+    geometry['init_leg_lengths'] = geometry['init_leg_lengths'] + rng.uniform(-leg_offset_error, leg_offset_error, 6)
+    return geometry
+
+
+def record(geometry, num_samples, seed=0, noise_std=0.0):
+    '''
+    Poses spread over the workspace, and the leg positions the encoders would read at them {rev}.
+    Returns (leg positions (N, 6) {rev}, positions (N, 3) {mm}, rotation matrices (N, 3, 3))
+    '''
+    rng = np.random.default_rng(seed)
+    positions = START_POS + np.column_stack((rng.uniform(-80, 80, (num_samples, 2)),
+                                             rng.uniform(20, 250, num_samples)))
+    rotations = kinematics.euler_to_rotation_matrix(rng.uniform(-15, 15, (num_samples, 3)))
+    lengths = kinematics.inverse_kinematics(positions, rotations, geometry['base_nodes'], geometry['init_plat_nodes'])
+    lengths = lengths + rng.normal(0.0, noise_std, lengths.shape)
+    leg_positions_revs = (lengths - geometry['init_leg_lengths']) / kinematics.LEG_MM_PER_REV
+    return leg_positions_revs, positions, rotations
+
+
+def test_jacobian_matches_finite_differences():
+    leg_positions_revs, positions, rotations = record(true_geometry(), 20)
+    leg_positions_mm = leg_positions_revs * kinematics.LEG_MM_PER_REV
+    calibrator = GeometryCalibrator(NOMINAL, node_prior_std=5.0, leg_offset_prior_std=2.0)
+    args = (leg_positions_mm, positions, rotations, 0.5)
+
+    # Evaluate away from both the nominal and the true geometry, so that nothing in the Jacobian happens to vanish
+    params = calibrator.nominal_params + np.random.default_rng(1).uniform(-5.0, 5.0, 42)
+    jac = calibrator.jacobian(params, *args)
+    assert jac.shape == (20 * 6 + 42, 42)
+
+    step = 1e-6
+    finite_differences = np.column_stack([
+        (calibrator.residuals(params + step * np.eye(42)[i], *args) -
+         calibrator.residuals(params - step * np.eye(42)[i], *args)) / (2 * step)
+        for i in range(42)])
+    np.testing.assert_allclose(jac, finite_differences, rtol=1e-6, atol=1e-6)
+
+
+# The legs are close to vertical over the whole workspace, so the base node heights and leg offsets are the hardest to
+# tell apart. With noisy leg lengths it takes a lot of samples to pin them down
+@pytest.mark.parametrize('noise_std, num_samples, tolerance', [(0.0, 300, 0.01), (0.05, 2000, 0.5)])
+def test_recovers_perturbed_geometry(noise_std, num_samples, tolerance):
+    truth = true_geometry()
+    leg_positions_revs, positions, rotations = record(truth, num_samples, noise_std=noise_std)
+
+    calibrator = GeometryCalibrator(NOMINAL)
+    geometry, summary = calibrator.calibrate(leg_positions_revs * kinematics.LEG_MM_PER_REV, positions, rotations,
+                                             measurement_std=max(noise_std, 0.01))
+
+    # The nominal geometry is out by mm, and the calibrated one by a small fraction of a mm
+    assert summary['converged']
+    assert summary['initial_rms_mm'] > 1.0
+    assert summary['final_rms_mm'] < noise_std + 0.01
+    nominal_params = pack_parameters(NOMINAL['base_nodes'], NOMINAL['init_plat_nodes'], NOMINAL['init_leg_lengths'])
+    true_params = pack_parameters(truth['base_nodes'], truth['init_plat_nodes'], truth['init_leg_lengths'])
+    assert np.max(np.abs(nominal_params - true_params)) > 2.0
+    for key in CALIBRATED_KEYS:
+        np.testing.assert_allclose(geometry[key], truth[key], atol=tolerance)
+
+    # The rest of the geometry is left as it was
+    for key in GEOMETRY_SHAPES.keys() - CALIBRATED_KEYS:
+        np.testing.assert_array_equal(geometry[key], NOMINAL[key])
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.npz'])
+def test_recording_and_calibration_files(tmp_path, extension):
+    leg_positions_revs, positions, rotations = record(true_geometry(), 100, noise_std=0.05)
+
+    # Write the recording as the calibration recorder would, with quaternions (sign and all) rather than matrices
+    quats = quaternion.as_float_array(quaternion.from_rotation_matrix(rotations))
+    quats[::2] *= -1.0
+    columns = dict(zip(LEG_COLUMNS, leg_positions_revs.T))
+    columns.update(dict(zip(['x', 'y', 'z', 'qw', 'qx', 'qy', 'qz'], np.column_stack((positions, quats)).T)))
+    data_path = str(tmp_path / f'recording{extension}')
+    if extension == '.csv':
+        np.savetxt(data_path, np.column_stack(list(columns.values())), delimiter=',',
+                   header=','.join(columns.keys()), comments='', fmt='%.17g')
+    else:
+        np.savez(data_path, **columns)
+
+    leg_positions_mm, loaded_positions, loaded_rotations = load_calibration_data(data_path)
+    np.testing.assert_allclose(leg_positions_mm, leg_positions_revs * kinematics.LEG_MM_PER_REV, rtol=1e-12)
+    np.testing.assert_allclose(loaded_positions, positions, rtol=1e-12)
+    np.testing.assert_allclose(loaded_rotations, rotations, atol=1e-12)
+
+    # The calibrated geometry loads back in the way that robot_geometry loads its calibration_file
+    geometry, summary = GeometryCalibrator(NOMINAL).calibrate(leg_positions_mm, loaded_positions, loaded_rotations,
+                                                              measurement_std=0.05)
+    geometry_path = str(tmp_path / 'calibrated_geometry.npz')
+    save_calibrated_geometry(geometry_path, geometry, summary)
+
+    calibration = load_calibration(geometry_path)
+    assert calibration.keys() == set(CALIBRATED_KEYS)
+    for key in CALIBRATED_KEYS:
+        assert calibration[key].shape == GEOMETRY_SHAPES[key]
+        np.testing.assert_array_equal(calibration[key], geometry[key])
+
+
+def test_unreadable_calibration_file(tmp_path):
+    # robot_geometry falls back to the nominal geometry on any of these
+    with pytest.raises(OSError):
+        load_calibration(str(tmp_path / 'missing.npz'))
+
+    partial_path = str(tmp_path / 'partial.npz')
+    np.savez(partial_path, base_nodes=NOMINAL['base_nodes'])
+    with pytest.raises(KeyError):
+        load_calibration(partial_path)
+
+    wrong_shape_path = str(tmp_path / 'wrong_shape.npz')
+    np.savez(wrong_shape_path, base_nodes=NOMINAL['base_nodes'][:5], init_plat_nodes=NOMINAL['init_plat_nodes'],
+             init_leg_lengths=NOMINAL['init_leg_lengths'])
+    with pytest.raises(ValueError):
+        load_calibration(wrong_shape_path)
@@ -0,0 +1,217 @@
+"""
+Tests and benchmarks for the ball tracking Kalman Filter.
+
+ReferenceKalmanFilter below is the filter as it was before it was split into per-axis blocks (full 6x6 matrices, an
+explicit inverse of S and the simple covariance update). The tests check that the restructured filter gives the same
+estimates, and how far the two drift apart over a long run. The benchmarks compare the cost of one step of each.
+To run the benchmarks:
+    python -m pytest test/test_kalman_filter.py --benchmark-only --benchmark-group-by=func
+"""
+
+import numpy as np
+
+from jugglebot.kalman_filter import KalmanFilter, KalmanFilterBank
+
+DT = 1.0 / 300.0
+PROCESS_NOISE = 5.0
+MEASUREMENT_NOISE = 1.0
+
+
+class ReferenceKalmanFilter:
+    '''The original implementation of KalmanFilter's predict and update steps'''
+
+    H = np.array([
+        [1, 0, 0, 0, 0, 0],
+        [0, 1, 0, 0, 0, 0],
+        [0, 0, 1, 0, 0, 0]
+    ])
+
+    def __init__(self, dt, process_noise, measurement_noise, initial_state):
+        self.dt = dt
+        self.state = initial_state.copy()
+        self.covariance = np.eye(6) * 500.0
+        self.F = np.eye(6)
+        self.F[:3, 3:] = np.eye(3) * dt
+        self.Q = np.eye(6) * process_noise
+        self.R = np.eye(3) * measurement_noise
+
+    def predict(self):
+        u = np.array([[0], [0], [-9810.0]])
+        B = np.array([
+            [0.5 * self.dt**2, 0, 0],
+            [0, 0.5 * self.dt**2, 0],
+            [0, 0, 0.5 * self.dt**2],
+            [self.dt, 0, 0],
+            [0, self.dt, 0],
+            [0, 0, self.dt]
+        ])
+        self.state = self.F @ self.state + B @ u
+        self.covariance = self.F @ self.covariance @ self.F.T + self.Q
+
+    def update(self, measurement):
+        S = self.H @ self.covariance @ self.H.T + self.R
+        K = self.covariance @ self.H.T @ np.linalg.inv(S)
+        y = measurement - (self.H @ self.state)
+        self.state = self.state + K @ y
+        I = np.eye(self.F.shape[0])
+        self.covariance = (I - K @ self.H) @ self.covariance
+
+
+def initial_state():
+    return np.array([[100.0], [-50.0], [735.0], [300.0], [-100.0], [4000.0]])
+
+
+def simulate_measurements(num_steps, seed=0):
+    '''Noisy measurements of a ball thrown from initial_state, one per step'''
+    rng = np.random.default_rng(seed)
+    times = np.arange(1, num_steps + 1) * DT
+    x0 = initial_state().ravel()
+    positions = x0[:3] + np.outer(times, x0[3:])
+    positions[:, 2] += 0.5 * -9810.0 * times**2
+    return (positions + rng.normal(0.0, 1.0, positions.shape))[:, :, np.newaxis]
+
+
+def make_filters():
+    kf = KalmanFilter(DT, PROCESS_NOISE, MEASUREMENT_NOISE)
+    kf.initialize_with_state(initial_state())
+    return kf, ReferenceKalmanFilter(DT, PROCESS_NOISE, MEASUREMENT_NOISE, initial_state())
+
+
+def run_side_by_side(num_steps):
+    '''Step both filters through the same measurements, returning the largest differences between them'''
+    kf, reference = make_filters()
+    max_state_difference = 0.0
+    max_covariance_difference = 0.0
+    for measurement in simulate_measurements(num_steps):
+        for f in (kf, reference):
+            f.predict()
+            f.update(measurement)
+        max_state_difference = max(max_state_difference, np.abs(kf.state - reference.state).max())
+        max_covariance_difference = max(max_covariance_difference,
+                                        np.abs(kf.covariance - reference.covariance).max())
+    return kf, reference, max_state_difference, max_covariance_difference
+
+
+def test_matches_reference_filter():
+    _, _, state_difference, covariance_difference = run_side_by_side(300)
+    assert state_difference < 1e-9
+    assert covariance_difference < 1e-9
+
+
+def test_long_run_drift():
+    kf, reference, state_difference, covariance_difference = run_side_by_side(20000)
+
+    # The two implementations should still agree closely after a long run...
+    assert state_difference < 1e-6
+    assert covariance_difference < 1e-6
+
+    # ...and the Joseph form keeps the covariance symmetric and positive definite
+    covariance = kf.covariance
+    np.testing.assert_allclose(covariance, covariance.T, atol=1e-12)
+    assert np.all(np.linalg.eigvalsh(covariance) > 0)
+
+
+def test_bank_matches_single_filter():
+    kf, _ = make_filters()
+    bank = KalmanFilterBank(DT, capacity=1, process_noise=PROCESS_NOISE, measurement_noise=MEASUREMENT_NOISE)
+    slot = bank.add(initial_state(), 0.0)
+
+    for step, measurement in enumerate(simulate_measurements(300), start=1):
+        kf.predict()
+        kf.update(measurement)
+        bank.queue_measurement(slot, measurement, step * DT)
+        bank.update()
+
+    np.testing.assert_allclose(bank.get_state(slot), kf.state.ravel(), atol=1e-9)
+    np.testing.assert_allclose(bank.covariance(slot), kf.covariance, atol=1e-9)
+
+    # Predictions from the per-axis blocks match the full matrices, without changing the bank's filter
+    covariance = bank.covariance(slot)
+    states, covariances = bank.predict_states(np.array([slot]), 300 * DT + 0.1)
+    positions, innovation_covariances = bank.predict_measurements(np.array([slot]), 300 * DT + 0.1)
+    kf.predict(0.1)
+    np.testing.assert_allclose(states[0], kf.state.ravel(), atol=1e-9)
+    np.testing.assert_allclose(covariances[0], kf.covariance, atol=1e-9)
+    np.testing.assert_allclose(positions[0], kf.state[:3, 0], atol=1e-9)
+    np.testing.assert_allclose(innovation_covariances[0], kf.covariance[:3, :3] + kf.R, atol=1e-9)
+    np.testing.assert_array_equal(bank.covariance(slot), covariance)
+
+
+def test_variable_time_steps():
+    '''Predicting with irregular time steps should give the same state as the fixed-step filter at the same times'''
+    rng = np.random.default_rng(1)
+    kf, _ = make_filters()
+    bank = KalmanFilterBank(DT, capacity=1, process_noise=PROCESS_NOISE, measurement_noise=MEASUREMENT_NOISE)
+    slot = bank.add(initial_state(), 0.0)
+
+    # Take every measurement, but with the frames jittered around (and sometimes missing from) the nominal rate
+    time = 0.0
+    for _ in range(300):
+        dt = DT * rng.uniform(0.5, 2.5)
+        time += dt
+        measurement = kf.state[:3] + dt * kf.state[3:] + rng.normal(0.0, 1.0, (3, 1))
+        kf.predict(dt)
+        kf.update(measurement)
+        bank.queue_measurement(slot, measurement, time)
+        bank.update()
+
+    np.testing.assert_allclose(bank.get_state(slot), kf.state.ravel(), atol=1e-9)
+    np.testing.assert_allclose(bank.covariance(slot), kf.covariance, atol=1e-9)
+    assert bank.times[slot] == time
+
+    # Carrying the state forward should match predicting the filter, without changing the bank's filter
+    state = bank.get_state(slot).copy()
+    future_state = bank.state_at(slot, time + 0.1)
+    kf.predict(0.1)
+    np.testing.assert_allclose(future_state, kf.state.ravel(), atol=1e-9)
+    np.testing.assert_array_equal(bank.get_state(slot), state)
+
+    # Measurements older than the filter's state are dropped
+    bank.queue_measurement(slot, np.zeros(3), time - DT)
+    bank.update()
+    assert bank.stale_measurement_count == 1
+    assert bank.times[slot] == time
+
+#########################################################################################################
+#                                              Benchmarks                                               #
+#########################################################################################################
+
+
+def step(f, measurement):
+    f.predict()
+    f.update(measurement)
+
+
+def test_benchmark_step_reference(benchmark):
+    _, reference = make_filters()
+    measurement = simulate_measurements(1)[0]
+    benchmark(step, reference, measurement)
+
+
+def test_benchmark_step(benchmark):
+    kf, _ = make_filters()
+    measurement = simulate_measurements(1)[0]
+    benchmark(step, kf, measurement)
+
+
+def test_benchmark_bank_update(benchmark):
+    '''One frame of the bank with 10 balls in flight'''
+    bank = KalmanFilterBank(DT, capacity=10, process_noise=PROCESS_NOISE, measurement_noise=MEASUREMENT_NOISE)
+    slots = [bank.add(initial_state(), 0.0) for _ in range(10)]
+    measurement = simulate_measurements(1)[0]
+    frame = iter(range(1, 10**9))
+
+    def update():
+        time = next(frame) * DT
+        for slot in slots:
+            bank.queue_measurement(slot, measurement, time)
+        bank.update()
+
+    benchmark(update)
+
+
+def test_benchmark_drift(benchmark):
+    '''Not a timing benchmark: records how far the two implementations drift apart over 20000 steps'''
+    _, _, state_difference, covariance_difference = benchmark.pedantic(run_side_by_side, args=(20000,), rounds=1)
+    benchmark.extra_info['max_state_difference'] = state_difference
+    benchmark.extra_info['max_covariance_difference'] = covariance_difference
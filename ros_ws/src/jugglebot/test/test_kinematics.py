@@ -0,0 +1,270 @@
+"""
+Tests and benchmarks for the ROS-free kinematics module.
+
+The benchmarks use pytest-benchmark. To compare the batched maths against the per-pose cost:
+    python -m pytest test/test_kinematics.py --benchmark-only
+"""
+
+import numpy as np
+import pytest
+
+from jugglebot import kinematics
+
+# The robot's geometry, as built by robot_geometry
+GEOMETRY = kinematics.build_platform(initial_height=565.0, base_radius=410.0, plat_radius=219.075,
+                                     base_small_angle=20.0, plat_small_angle=8.6024446,
+                                     plat_x_axis_offset=154.3012223, arm_radius=70.0,
+                                     arm_height_from_platform=210.25, hand_stroke=355.0, hand_radius=35.0)
+BASE_NODES = GEOMETRY['base_nodes']
+PLAT_NODES = GEOMETRY['init_plat_nodes']
+START_POS = GEOMETRY['start_pos'].T
+
+
+def random_poses(num_poses, seed=0):
+    '''Generate poses scattered around the middle of the workspace'''
+    rng = np.random.default_rng(seed)
+    positions = START_POS + np.column_stack((rng.uniform(-60, 60, (num_poses, 2)), rng.uniform(50, 200, num_poses)))
+    rotations = kinematics.euler_to_rotation_matrix(rng.uniform(-10, 10, (num_poses, 3)))
+    return positions, rotations
+
+
+def test_initial_leg_lengths():
+    lengths = kinematics.inverse_kinematics(START_POS, np.eye(3)[np.newaxis], BASE_NODES, PLAT_NODES)
+    np.testing.assert_allclose(lengths[0], GEOMETRY['init_leg_lengths'])
+
+
+def test_rotation_vector_matches_euler():
+    angles = np.array([[10.0, 0.0, 0.0], [0.0, -20.0, 0.0], [0.0, 0.0, 30.0]])
+    rotation_vectors = np.radians(angles)
+    np.testing.assert_allclose(kinematics.rotation_vector_to_matrix(rotation_vectors),
+                               kinematics.euler_to_rotation_matrix(angles), atol=1e-12)
+
+
+def test_jacobian_matches_finite_differences():
+    positions, rotations = random_poses(5)
+    twist = np.array([3.0, -2.0, 5.0, 0.01, -0.02, 0.015])  # {mm/s, rad/s}
+    dt = 1e-6
+
+    lengths, jac = kinematics.jacobians(positions, rotations, BASE_NODES, PLAT_NODES)
+    next_lengths = kinematics.inverse_kinematics(positions + twist[:3] * dt,
+                                                 kinematics.rotation_vector_to_matrix(twist[3:] * dt) @ rotations,
+                                                 BASE_NODES, PLAT_NODES)
+
+    np.testing.assert_allclose((next_lengths - lengths) / dt, jac @ twist, rtol=1e-4, atol=1e-4)
+
+
+def test_forward_kinematics_round_trip():
+    positions, rotations = random_poses(50)
+    lengths = kinematics.inverse_kinematics(positions, rotations, BASE_NODES, PLAT_NODES)
+
+    # Seed with the start position, as the robot would be after homing
+    fk_positions, fk_rotations, converged = kinematics.forward_kinematics(
+        lengths, BASE_NODES, PLAT_NODES, np.repeat(START_POS, 50, axis=0), np.repeat(np.eye(3)[np.newaxis], 50, axis=0))
+
+    assert np.all(converged)
+    np.testing.assert_allclose(fk_positions, positions, atol=1e-4)
+    np.testing.assert_allclose(fk_rotations, rotations, atol=1e-6)
+
+
+def test_dexterity_matches_svd():
+    positions, rotations = random_poses(20)
+    _, jac = kinematics.jacobians(positions, rotations, BASE_NODES, PLAT_NODES)
+    condition_number, submatrix_condition_number, min_singular_value, _ = kinematics.evaluate_dexterity(jac)
+
+    np.testing.assert_allclose(condition_number, np.linalg.cond(jac), rtol=1e-6)
+    np.testing.assert_allclose(submatrix_condition_number, np.linalg.cond(jac[:, :, [0, 1, 3, 4]]), rtol=1e-6)
+    np.testing.assert_allclose(min_singular_value, np.linalg.svd(jac, compute_uv=False)[:, -1], rtol=1e-6)
+
+
+def test_reachability():
+    positions, rotations = random_poses(3)
+    lengths = kinematics.inverse_kinematics(positions, rotations, BASE_NODES, PLAT_NODES)
+    leg_lengths_mm = lengths - GEOMETRY['init_leg_lengths']
+
+    assert np.all(kinematics.check_reachability(leg_lengths_mm, 0.0, 280.0))
+    assert not np.any(kinematics.check_reachability(leg_lengths_mm, 0.0, 1.0))
+
+
+def test_rotation_matrix_to_vector_round_trip():
+    rng = np.random.default_rng(2)
+    axes = rng.normal(size=(20, 3))
+    axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+    rotation_vectors = axes * np.concatenate((rng.uniform(0.0, 3.0, 17), [1e-9, 1e-12, 0.0]))[:, np.newaxis]
+
+    rotations = kinematics.rotation_vector_to_matrix(rotation_vectors)
+    np.testing.assert_allclose(kinematics.rotation_matrix_to_vector(rotations), rotation_vectors, atol=1e-12)
+
+#########################################################################################################
+#                                          Velocity Feedforward                                         #
+#########################################################################################################
+
+
+TWIST = np.array([150.0, -80.0, 200.0, 0.4, -0.3, 0.5])  # Platform twist {mm/s, rad/s}
+POSE_PERIOD = 0.005  # Time between poses, at 200 Hz {s}
+
+
+def moved_poses(positions, rotations, twist, time, offset_rotation=np.eye(3)):
+    '''
+    Poses after moving with a constant twist for a time, with a pose offset applied to their orientations afterwards
+    as sp_ik does
+    '''
+    moved_rotations = kinematics.rotation_vector_to_matrix(twist[3:] * time) @ rotations
+    return positions + twist[:3] * time, offset_rotation @ moved_rotations
+
+
+def finite_difference_leg_velocities(positions, rotations, twist, offset_rotation=np.eye(3), step=1e-5):
+    '''Central differences of inverse_kinematics along the twist {rev/s}'''
+    lengths = [kinematics.inverse_kinematics(*moved_poses(positions, rotations, twist, time, offset_rotation),
+                                             BASE_NODES, PLAT_NODES) for time in (-step, step)]
+    return (lengths[1] - lengths[0]) / (2 * step) / kinematics.LEG_MM_PER_REV
+
+
+def feedforward(positions, rotations, twists, max_velocity=np.inf):
+    _, jac = kinematics.jacobians(positions, rotations, BASE_NODES, PLAT_NODES)
+    in_bounds = np.ones(jac.shape[:2], dtype=bool)
+    return kinematics.leg_velocity_feedforward(jac, twists, in_bounds, max_velocity)
+
+
+def test_estimated_twist_feedforward_matches_finite_differences():
+    positions, rotations = random_poses(5)
+    last_positions, last_rotations = moved_poses(positions, rotations, TWIST, -POSE_PERIOD)
+
+    # Differencing poses that move with a constant twist recovers it exactly
+    twists = kinematics.estimate_twists(last_positions, last_rotations, positions, rotations,
+                                        np.full(5, POSE_PERIOD), 0.001, 0.1)
+    np.testing.assert_allclose(twists, np.tile(TWIST, (5, 1)), rtol=1e-9, atol=1e-9)
+
+    # ...and is the same as the twist that the publisher would have sent
+    np.testing.assert_allclose(feedforward(positions, rotations, twists),
+                               finite_difference_leg_velocities(positions, rotations, TWIST), rtol=1e-6, atol=1e-8)
+
+
+def test_pose_offset_twist():
+    # The pose offset rotates the orientation (R -> O @ R) but not the position, so only the angular velocity of a
+    # twist sent with the pose is rotated
+    positions, rotations = random_poses(5, seed=1)
+    offset_rotation = kinematics.euler_to_rotation_matrix(np.array([3.0, -2.0, 5.0]))
+    offset_positions, offset_rotations = moved_poses(positions, rotations, TWIST, 0.0, offset_rotation)
+
+    twists = kinematics.offset_twists(offset_rotation, np.tile(TWIST, (5, 1)))
+    np.testing.assert_array_equal(twists[:, :3], np.tile(TWIST[:3], (5, 1)))
+    expected = finite_difference_leg_velocities(positions, rotations, TWIST, offset_rotation)
+    np.testing.assert_allclose(feedforward(offset_positions, offset_rotations, twists), expected, rtol=1e-6, atol=1e-8)
+
+    # Differencing the offset poses gives the same twist
+    last_positions, last_rotations = moved_poses(positions, rotations, TWIST, -POSE_PERIOD, offset_rotation)
+    estimated = kinematics.estimate_twists(last_positions, last_rotations, offset_positions, offset_rotations,
+                                           np.full(5, POSE_PERIOD), 0.001, 0.1)
+    np.testing.assert_allclose(estimated, twists, rtol=1e-9, atol=1e-9)
+
+
+def test_estimated_twist_time_bounds():
+    # Poses too close together or too far apart (or out of order, or unstamped) aren't differenced
+    dt = np.array([POSE_PERIOD, 0.0005, 0.001, 0.1, 0.5, -POSE_PERIOD, 1.7e9])
+    positions, rotations = random_poses(len(dt))
+    last_positions, last_rotations = moved_poses(positions, rotations, TWIST, -POSE_PERIOD)
+
+    twists = kinematics.estimate_twists(last_positions, last_rotations, positions, rotations, dt, 0.001, 0.1)
+    np.testing.assert_allclose(twists[0], TWIST, rtol=1e-9)
+    np.testing.assert_array_equal(twists[1:], 0.0)
+
+
+def test_feedforward_left_out_for_clipped_legs_and_jumps():
+    positions, rotations = random_poses(3, seed=2)
+    _, jac = kinematics.jacobians(positions, rotations, BASE_NODES, PLAT_NODES)
+    twists = np.tile(TWIST, (3, 1))
+    leg_velocities = jac @ TWIST / kinematics.LEG_MM_PER_REV
+    assert np.abs(leg_velocities).max() < 20.0
+
+    # A clipped leg (held at its limit) gets no feedforward, and the others are left alone
+    in_bounds = np.ones((3, 6), dtype=bool)
+    in_bounds[1, 2] = False
+    velocities = kinematics.leg_velocity_feedforward(jac, twists, in_bounds, 20.0)
+    np.testing.assert_allclose(velocities[[0, 2]], leg_velocities[[0, 2]])
+    np.testing.assert_allclose(velocities[1, [0, 1, 3, 4, 5]], leg_velocities[1, [0, 1, 3, 4, 5]])
+    assert velocities[1, 2] == 0.0
+
+    # A pose with a leg faster than 20 rev/s has jumped, so none of its legs get feedforward
+    twists[2] *= 1.01 * 20.0 / np.abs(leg_velocities[2]).max()
+    velocities = kinematics.leg_velocity_feedforward(jac, twists, np.ones((3, 6), dtype=bool), 20.0)
+    np.testing.assert_array_equal(velocities[2], 0.0)
+    np.testing.assert_allclose(velocities[0], leg_velocities[0])
+
+#########################################################################################################
+#                                                 Hand                                                  #
+#########################################################################################################
+
+HAND_STROKE = 355.0              # As GEOMETRY was built with {mm}
+ARM_HEIGHT_FROM_PLATFORM = 210.25
+
+
+def hand_nodes(hand_positions, positions, rotations, hand_direction=1):
+    return kinematics.hand_nodes(np.asarray(hand_positions, dtype=float), positions, rotations,
+                                 GEOMETRY['init_hand_nodes'], GEOMETRY['init_arm_nodes'], HAND_STROKE, hand_direction)
+
+
+def test_hand_at_home_pose():
+    # Encoder readings for the bottom of the stroke, the top, and past either end
+    full_stroke = HAND_STROKE / kinematics.HAND_MM_PER_REV
+    hand_positions = [0.0, full_stroke, 1.5 * full_stroke, -0.5]
+    positions = np.repeat(START_POS, 4, axis=0)
+    rotations = np.repeat(np.eye(3)[np.newaxis], 4, axis=0)
+
+    nodes, tips = hand_nodes(hand_positions, positions, rotations)
+
+    # At the bottom of the stroke the hand is level with the bottom arm nodes, and at the top with the top ones
+    bottom = START_POS[0] + [0.0, 0.0, ARM_HEIGHT_FROM_PLATFORM - HAND_STROKE]
+    top = START_POS[0] + [0.0, 0.0, ARM_HEIGHT_FROM_PLATFORM]
+    np.testing.assert_allclose(tips, [bottom, top, top, bottom], atol=1e-9)
+    np.testing.assert_allclose(tips[0, 2], START_POS[0, 2] + np.mean(GEOMETRY['init_arm_nodes'][3:, 2]))
+    np.testing.assert_allclose(tips[1, 2], START_POS[0, 2] + np.mean(GEOMETRY['init_arm_nodes'][:3, 2]))
+    np.testing.assert_allclose(nodes[0], GEOMETRY['init_hand_nodes'] + bottom, atol=1e-9)
+
+    # A hand that's wound the other way reads the same heights with the sign flipped
+    _, flipped_tips = hand_nodes(-np.array(hand_positions), positions, rotations, hand_direction=-1)
+    np.testing.assert_allclose(flipped_tips, tips)
+
+
+def test_hand_moves_with_the_platform():
+    positions, rotations = random_poses(20)
+    hand_positions = np.linspace(0.0, HAND_STROKE / kinematics.HAND_MM_PER_REV, 20)
+
+    nodes, tips = hand_nodes(hand_positions, positions, rotations)
+
+    # The hand moves along the platform z axis, keeping its shape
+    heights = ARM_HEIGHT_FROM_PLATFORM - HAND_STROKE + np.linspace(0.0, HAND_STROKE, 20)
+    np.testing.assert_allclose(tips, positions + heights[:, np.newaxis] * rotations[:, :, 2], atol=1e-9)
+    np.testing.assert_allclose(nodes - tips[:, np.newaxis], np.einsum('nij,kj->nki', rotations,
+                                                                      GEOMETRY['init_hand_nodes']), atol=1e-9)
+
+#########################################################################################################
+#                                              Benchmarks                                               #
+#########################################################################################################
+
+
+@pytest.mark.parametrize('num_poses', [1, 100, 10000])
+def test_benchmark_inverse_kinematics(benchmark, num_poses):
+    positions, rotations = random_poses(num_poses)
+    benchmark(kinematics.inverse_kinematics, positions, rotations, BASE_NODES, PLAT_NODES)
+
+
+@pytest.mark.parametrize('num_poses', [1, 100, 10000])
+def test_benchmark_jacobians(benchmark, num_poses):
+    positions, rotations = random_poses(num_poses)
+    benchmark(kinematics.jacobians, positions, rotations, BASE_NODES, PLAT_NODES)
+
+
+@pytest.mark.parametrize('num_poses', [1, 100, 10000])
+def test_benchmark_dexterity(benchmark, num_poses):
+    positions, rotations = random_poses(num_poses)
+    _, jac = kinematics.jacobians(positions, rotations, BASE_NODES, PLAT_NODES)
+    benchmark(kinematics.evaluate_dexterity, jac)
+
+
+@pytest.mark.parametrize('num_poses', [1, 100])
+def test_benchmark_forward_kinematics(benchmark, num_poses):
+    positions, rotations = random_poses(num_poses)
+    lengths = kinematics.inverse_kinematics(positions, rotations, BASE_NODES, PLAT_NODES)
+    initial_positions = np.repeat(START_POS, num_poses, axis=0)
+    initial_rotations = np.repeat(np.eye(3)[np.newaxis], num_poses, axis=0)
+    benchmark(kinematics.forward_kinematics, lengths, BASE_NODES, PLAT_NODES, initial_positions, initial_rotations)
@@ -0,0 +1,166 @@
+"""
+Tests and benchmarks for solving where and when balls land on the catch surfaces.
+
+To run the benchmarks:
+    python -m pytest test/test_landing_solver.py --benchmark-only --benchmark-group-by=func
+"""
+
+import numpy as np
+import pytest
+
+from jugglebot.landing_solver import (GRAVITY, HeightMapSurface, LandingSurface, PlaneSurface, SphereSurface,
+                                      landing_confidence, solve_landing)
+
+
+def trajectory(states, times):
+    t = np.asarray(times)[:, np.newaxis]
+    positions = states[:, :3] + states[:, 3:] * t
+    positions[:, 2] += 0.5 * GRAVITY * t[:, 0]**2
+    return positions
+
+
+def test_horizontal_plane(throws):
+    states = throws(50)
+    solution = solve_landing(states, PlaneSurface((0.0, 0.0, 735.0)))
+    assert np.all(solution.valid)
+
+    # The later root of z + vz t + 0.5 g t^2 = 735
+    z, vz = states[:, 2], states[:, 5]
+    expected = (vz + np.sqrt(vz**2 - 2 * GRAVITY * (z - 735.0))) / -GRAVITY
+    np.testing.assert_allclose(solution.time, expected, rtol=1e-12)
+    np.testing.assert_allclose(solution.position[:, 2], 735.0, atol=1e-9)
+    np.testing.assert_allclose(solution.velocity[:, 2], vz + GRAVITY * expected, atol=1e-9)
+
+
+def test_tilted_plane(throws):
+    states = throws(50)
+    normal = np.array([0.2, -0.1, 1.0])
+    solution = solve_landing(states, PlaneSurface((0.0, 0.0, 735.0), normal))
+    assert np.all(solution.valid)
+
+    np.testing.assert_allclose((solution.position - [0.0, 0.0, 735.0]) @ normal, 0.0, atol=1e-9)
+    np.testing.assert_allclose(solution.position, trajectory(states, solution.time), atol=1e-9)
+    assert np.all(solution.velocity @ normal < 0.0)  # Falling through the plane
+
+    # A ball that's already fallen through the plane doesn't land on it
+    below = np.array([[0.0, 0.0, 500.0, 0.0, 0.0, -100.0]])
+    assert not solve_landing(below, PlaneSurface((0.0, 0.0, 735.0), normal)).valid[0]
+
+
+def test_sphere(throws):
+    states = throws(50)
+    surface = SphereSurface((0.0, 0.0, 735.0), 150.0)
+    solution = solve_landing(states, surface)
+
+    for state, valid, time in zip(states, solution.valid, solution.time):
+        # The earliest real root still to come where the ball is entering the sphere
+        d, v = state[:3] - surface.center, state[3:]
+        roots = np.roots([0.25 * GRAVITY**2, GRAVITY * v[2], v @ v + GRAVITY * d[2], 2 * d @ v,
+                          d @ d - surface.radius**2])
+        roots = roots.real[(np.abs(roots.imag) < 1e-6) & (roots.real >= 0.0)]
+        positions = trajectory(state[np.newaxis], roots) - surface.center
+        velocities = v + np.outer(roots, [0.0, 0.0, GRAVITY])
+        entering = roots[np.einsum('ij,ij->i', positions, velocities) < 0.0]
+
+        assert valid == (len(entering) > 0)
+        if valid:
+            assert time == pytest.approx(entering.min(), abs=1e-9)
+
+    assert np.any(solution.valid) and not np.all(solution.valid)
+    np.testing.assert_allclose(np.linalg.norm(solution.position[solution.valid] - surface.center, axis=1),
+                               surface.radius, atol=1e-6)
+
+
+def test_height_map_matches_plane(throws):
+    # A sloping height map is a tilted plane
+    x, y = np.linspace(-600, 600, 13), np.linspace(-600, 600, 13)
+    heights = 735.0 + 0.2 * x[:, np.newaxis] - 0.1 * y[np.newaxis, :]
+    states = throws(50)
+
+    solution = solve_landing(states, HeightMapSurface(x, y, heights))
+    expected = solve_landing(states, PlaneSurface((0.0, 0.0, 735.0), (-0.2, 0.1, 1.0)))
+
+    assert np.all(solution.valid)
+    np.testing.assert_allclose(solution.time, expected.time, atol=1e-9)
+    np.testing.assert_allclose(solution.position, expected.position, atol=1e-6)
+
+    # Outside the map, the ball doesn't land
+    far = np.array([[2000.0, 0.0, 1000.0, 0.0, 0.0, 0.0]])
+    assert not solve_landing(far, HeightMapSurface(x, y, heights)).valid[0]
+
+
+@pytest.mark.parametrize('surface', [
+    PlaneSurface((0.0, 0.0, 735.0), (0.2, -0.1, 1.0)),
+    SphereSurface((0.0, 0.0, 900.0), 400.0),
+    HeightMapSurface(np.linspace(-600, 600, 13), np.linspace(-600, 600, 13),
+                     735.0 + 50.0 * np.sin(np.linspace(-3, 3, 13))[:, np.newaxis] * np.ones(13)),
+], ids=['plane', 'sphere', 'height_map'])
+def test_covariance_matches_finite_differences(surface, throws):
+    states = throws(20, seed=1)
+    covariances = np.tile(np.diag([4.0, 4.0, 4.0, 400.0, 400.0, 400.0]), (len(states), 1, 1))
+    solution = solve_landing(states, surface, covariances)
+
+    # Jacobian of [time, position, velocity] with respect to the state, by central differences
+    step = 1e-4
+    jacobian = np.zeros((len(states), 7, 6))
+    for i in range(6):
+        offset = np.zeros(6)
+        offset[i] = step
+        plus, minus = solve_landing(states + offset, surface), solve_landing(states - offset, surface)
+        for columns, values in ((slice(0, 1), 'time'), (slice(1, 4), 'position'), (slice(4, 7), 'velocity')):
+            difference = (getattr(plus, values) - getattr(minus, values)) / (2 * step)
+            jacobian[:, columns, i] = difference.reshape(len(states), -1)
+
+    expected = jacobian @ covariances @ jacobian.transpose(0, 2, 1)
+    valid = solution.valid
+    assert np.any(valid)
+    np.testing.assert_allclose(solution.covariance[valid], expected[valid], rtol=1e-4, atol=1e-4)
+
+
+def test_landing_confidence():
+    covariances = np.array([np.diag([100.0, 100.0, 1.0]), np.diag([400.0, 25.0, 1.0]), np.zeros((3, 3))])
+    covariances[1, :2, :2] = [[300.0, 150.0], [150.0, 125.0]]
+    confidence = landing_confidence(covariances, 20.0)
+
+    # Circular: exactly 1 - exp(-r^2 / 2 sigma^2). Certain: 1
+    assert confidence[0] == pytest.approx(1.0 - np.exp(-2.0))
+    assert confidence[2] == 1.0
+
+    # Elongated: a lower bound on the actual probability
+    rng = np.random.default_rng(0)
+    samples = rng.multivariate_normal(np.zeros(2), covariances[1, :2, :2], 100000)
+    assert confidence[1] <= np.mean(np.linalg.norm(samples, axis=1) < 20.0)
+    assert confidence[1] == pytest.approx(1.0 - np.exp(-400.0 / (2 * np.linalg.eigvalsh(covariances[1, :2, :2])[-1])))
+
+def test_landing_surface_is_abstract():
+    class NoGradient(LandingSurface):
+        def intersect(self, positions, velocities):
+            return np.full(len(positions), np.nan)
+
+        def value(self, points):
+            return points[:, 2]
+
+    # The landed check and the covariance need every method, so a surface without one can't be made
+    with pytest.raises(TypeError):
+        LandingSurface()
+    with pytest.raises(TypeError):
+        NoGradient()
+
+#########################################################################################################
+#                                              Benchmarks                                               #
+#########################################################################################################
+
+
+SURFACES = {
+    'plane': PlaneSurface((0.0, 0.0, 735.0), (0.2, -0.1, 1.0)),
+    'sphere': SphereSurface((0.0, 0.0, 900.0), 400.0),
+    'height_map': HeightMapSurface(np.linspace(-600, 600, 13), np.linspace(-600, 600, 13), np.full((13, 13), 735.0)),
+}
+
+
+@pytest.mark.parametrize('surface', SURFACES.keys())
+@pytest.mark.parametrize('num_balls', [5, 100])
+def test_benchmark_solve_landing(benchmark, surface, num_balls, throws):
+    states = throws(num_balls)
+    covariances = np.tile(np.eye(6), (num_balls, 1, 1))
+    benchmark(solve_landing, states, SURFACES[surface], covariances)
@@ -0,0 +1,122 @@
+"""
+Tests for rejecting unlabelled markers that can't be balls, on their own and as the mocap interface runs them: after
+the base has been registered from its markers, and as the base moves.
+"""
+
+import numpy as np
+
+from jugglebot.marker_filter import MarkerPreFilter
+from jugglebot.synthetic_mocap import GRAVITY, build_packet
+
+FRAME_PERIOD = 1.0 / 300.0  # {s}
+
+
+def rotation_about_z(angle_deg):
+    angle = np.radians(angle_deg)
+    return np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+
+
+def ball_positions(time):
+    '''Two balls in flight, in the robot base frame {mm}'''
+    starts = np.array([[100.0, 200.0, 800.0], [-150.0, -50.0, 900.0]])
+    velocities = np.array([[200.0, -100.0, 3000.0], [-100.0, 150.0, 2500.0]])
+    positions = starts + velocities * time
+    positions[:, 2] -= 0.5 * GRAVITY * time ** 2
+    return positions
+
+
+def with_residuals(positions, residual=0.5):
+    return np.column_stack((positions, np.full(len(positions), residual)))
+
+
+def test_stages():
+    marker_filter = MarkerPreFilter(exclusion_centers=[[0.0, 0.0, 0.0]], exclusion_radii=30.0)
+    markers = np.array([
+        [0.0, 0.0, 1000.0, 0.5],      # A ball
+        [0.0, 0.0, 5000.0, 0.5],      # Outside the workspace
+        [0.0, 100.0, 1000.0, 10.0],   # Poorly reconstructed
+        [10.0, 10.0, 10.0, 0.5],      # Near the robot
+    ])
+
+    np.testing.assert_array_equal(marker_filter.apply(markers), markers[:1])
+    stats = marker_filter.get_statistics()
+    assert (stats['rejected_workspace'], stats['rejected_residual'], stats['rejected_exclusion']) == (1, 1, 1)
+
+
+def test_static_suppression_follows_change_frame():
+    marker_filter = MarkerPreFilter(static_frames=10)
+    reflection = np.array([[300.0, -300.0, 200.0, 0.5]])
+    for frame in range(10):
+        filtered = marker_filter.apply(reflection)
+    assert len(filtered) == 0
+
+    # The base moves 20 mm, so the reflection (still in the world) moves -20 mm in the base frame. Once the candidates
+    # have been moved into the new frame, it's still suppressed
+    affine = np.hstack((np.eye(3), [[-20.0], [0.0], [0.0]]))
+    marker_filter.change_frame(affine)
+    moved = reflection + [-20.0, 0.0, 0.0, 0.0]
+    assert len(marker_filter.apply(moved)) == 0
+
+    # Without it, the reflection looks like a new marker
+    unchanged = MarkerPreFilter(static_frames=10)
+    for frame in range(10):
+        unchanged.apply(reflection)
+    assert len(unchanged.apply(moved)) == 1
+
+
+def test_mocap_interface_filters_as_the_base_moves(mocap_interface):
+    '''
+    The base is registered at one pose, and then knocked to another (20 mm and 2 degrees) halfway through. A stray
+    marker on the base and a reflection in the room should be rejected throughout, and balls in flight never.
+    '''
+    interface = mocap_interface
+    interface.marker_filter.static_frames = 60
+    body_markers = interface.base_marker_positions
+    alignment = interface.base_alignment
+
+    poses = [(rotation_about_z(30.0), np.array([120.0, -80.0, 15.0])),
+             (rotation_about_z(32.0), np.array([140.0, -80.0, 15.0]))]
+    stray_on_base = body_markers[0] + [10.0, 10.0, 0.0]  # Body frame, inside the base marker's exclusion zone
+    reflection = np.array([700.0, 500.0, 300.0])           # World frame
+
+    num_frames = 200
+    frames = []
+    for frame in range(num_frames):
+        R, t = poses[frame * 2 // num_frames]
+        time = frame * FRAME_PERIOD
+
+        # Base frame positions to world positions: the inverse of p_base = alignment @ R.T @ (p_world - t)
+        balls_world = ball_positions(time) @ alignment @ R.T + t
+        labelled = with_residuals(body_markers @ R.T + t)
+        unlabelled = with_residuals(np.vstack((balls_world, stray_on_base @ R.T + t, reflection)))
+        interface.on_packet(build_packet(int(time * 1e6), frame, labelled, unlabelled))
+        # The drained markers are views into the frame buffer, so keep copies
+        frames.extend((timestamp, markers.copy()) for _, timestamp, _, markers in interface.frame_buffer.drain())
+
+    assert len(frames) == num_frames
+
+    for frame, (timestamp, markers) in enumerate(frames):
+        expected_balls = ball_positions(timestamp * 1e-6)
+        # The reflection passes until it's been still for static_frames frames, and then stays suppressed
+        expected_count = len(expected_balls) + (frame < 59)
+        assert len(markers) == expected_count, frame
+        np.testing.assert_allclose(markers[:2, :3], expected_balls, atol=0.1)
+
+    stats = interface.get_performance_statistics()
+    assert stats['marker_filter_rejected_exclusion'] == num_frames
+    assert stats['marker_filter_rejected_static'] == num_frames - 59
+    np.testing.assert_allclose(interface.t, poses[1][1], atol=1e-3)
+
+
+def test_mocap_interface_marker_filter_options(make_mocap_interface):
+    # The filter is set up before the QTM thread starts, so even the first frame gets the configured filter
+    configured = make_mocap_interface(marker_filter_options={'max_residual': 1.5, 'static_frames': 20})
+    assert (configured.marker_filter.max_residual, configured.marker_filter.static_frames) == (1.5, 20)
+    assert len(configured.marker_filter.exclusion_centers) == len(configured.base_marker_positions)
+
+    unfiltered = make_mocap_interface(marker_filter=False)
+    assert unfiltered.marker_filter is None
+    markers = np.array([[0.0, 0.0, 5000.0, 10.0], [100.0, 0.0, 1000.0, 0.5]])
+    unfiltered.unlabelled_markers = markers.copy()
+    unfiltered.filter_unlabelled_markers()
+    np.testing.assert_array_equal(unfiltered.unlabelled_markers, markers)
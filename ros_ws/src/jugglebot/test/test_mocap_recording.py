@@ -0,0 +1,90 @@
+"""
+Tests for recording mocap sessions to disk and replaying them.
+"""
+
+import asyncio
+import json
+import os
+
+import numpy as np
+
+from jugglebot.mocap_recording import MocapRecorder, MocapRecording, MocapReplaySource
+
+
+def session_frames(num_frames, seed=0):
+    '''Frames of (timestamp, frame_number, receive_time, labelled, unlabelled), with varying numbers of markers'''
+    rng = np.random.default_rng(seed)
+    frames = []
+    for frame in range(num_frames):
+        timestamp = 1_000_000 + frame * 3333
+        labelled = rng.uniform(-500, 500, (6, 4))
+        # Occasional frames with lots of unlabelled markers, so that chunks also run out of marker space
+        unlabelled = rng.uniform(-1000, 1000, (rng.choice([0, 2, 5, 20], p=[0.2, 0.3, 0.3, 0.2]), 4))
+        frames.append((timestamp, 500 + frame, 7_000_000_000 + timestamp * 1000 + int(rng.integers(0, 2_000_000)),
+                       labelled, unlabelled))
+    return frames
+
+
+def record(session_dir, frames, **kwargs):
+    recorder = MocapRecorder(session_dir, **kwargs)
+    for frame in frames:
+        recorder.append(*frame)
+    recorder.close()
+    return recorder
+
+
+def assert_frames_equal(actual, expected):
+    assert len(actual) == len(expected)
+    for (timestamp, frame_number, receive_time, labelled, unlabelled), expected_frame in zip(actual, expected):
+        assert (timestamp, frame_number, receive_time) == expected_frame[:3]
+        # Markers are stored as float32
+        np.testing.assert_array_equal(labelled, expected_frame[3].astype(np.float32))
+        np.testing.assert_array_equal(unlabelled, expected_frame[4].astype(np.float32))
+
+
+def test_record_and_read_back_across_chunks(tmp_path):
+    frames = session_frames(250)
+    record(str(tmp_path), frames, frames_per_chunk=60, markers_per_frame=6, save_every=50)
+
+    recording = MocapRecording(str(tmp_path))
+    # Chunks roll over on frame count, and early when the unlabelled markers run out of space
+    num_frames = [chunk['num_frames'] for chunk in recording.chunks]
+    assert 60 in num_frames[:-1]
+    assert any(count < 60 for count in num_frames[:-1])
+    assert sorted(os.listdir(tmp_path)) == [chunk['name'] for chunk in recording.chunks] + ['session.json']
+
+    assert len(recording) == 250
+    assert_frames_equal(list(recording.frames()), frames)
+
+
+def test_unclosed_recording_keeps_saved_frames(tmp_path):
+    # session.json is rewritten every save_every frames, so a recorder that isn't closed loses at most that many
+    frames = session_frames(130)
+    recorder = MocapRecorder(str(tmp_path), frames_per_chunk=1000, save_every=50)
+    for frame in frames:
+        recorder.append(*frame)
+
+    with open(tmp_path / 'session.json') as f:
+        assert json.load(f)['chunks'][-1]['num_frames'] == 100
+
+    recording = MocapRecording(str(tmp_path))
+    assert_frames_equal(list(recording.frames()), frames[:100])
+
+
+def test_replay_round_trip(tmp_path):
+    frames = session_frames(150)
+    record(str(tmp_path), frames, frames_per_chunk=40, markers_per_frame=4)
+
+    # Replayed packets parse back into the recorded frames, as qtm_rt would deliver them
+    packets = []
+    asyncio.run(MocapReplaySource(str(tmp_path), speed=0).stream(packets.append))
+
+    replayed = []
+    for packet, frame in zip(packets, frames):
+        _, labelled = packet.get_3d_markers_residual()
+        _, unlabelled = packet.get_3d_markers_no_label_residual()
+        labelled = np.array([[m.x, m.y, m.z, m.residual] for m in labelled]).reshape(-1, 4)
+        unlabelled = np.array([[m.x, m.y, m.z, m.residual] for m in unlabelled]).reshape(-1, 4)
+        replayed.append((packet.timestamp, packet.framenumber, frame[2], labelled, unlabelled))
+
+    assert_frames_equal(replayed, frames)
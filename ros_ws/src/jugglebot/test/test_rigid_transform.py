@@ -0,0 +1,141 @@
+"""
+Tests and benchmarks for the rigid body transformations used by the mocap interface.
+
+The benchmarks use pytest-benchmark. To compare the per-frame cost of transforming the unlabelled markers into the
+robot base frame against the number of markers:
+    python -m pytest test/test_rigid_transform.py --benchmark-only --benchmark-group-by=param:num_markers
+"""
+
+import numpy as np
+import pytest
+
+from jugglebot import rigid_transform
+
+# Known positions of the base markers in the body frame, as used by the mocap interface
+BASE_MARKERS = np.array([
+    [-383.49, -42.23, -77.20],
+    [-125.29, 417.32, -74.50],
+    [-172.27, 400.22, -73.30],
+    [172.27, 400.22, -75.10],
+    [151.55, 87.50, -73.80],
+    [432.73, -50.92, -75.80]
+])
+
+# Rotation of 90 degrees about z, from the QTM-aligned body frame to the robot base frame
+BASE_ALIGNMENT = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]], dtype=float)
+
+
+def rotation_about_z(angle_deg):
+    angle = np.radians(angle_deg)
+    return np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+
+
+R_BASE = rotation_about_z(30.0)
+T_BASE = np.array([120.0, -80.0, 15.0])
+
+
+def random_markers(num_markers, seed=0):
+    '''Generate unlabelled markers (x, y, z, residual) in the world frame'''
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(-1000, 1000, (num_markers, 3)), rng.uniform(0, 1, num_markers)))
+
+
+def transform_two_step(markers):
+    '''The per-frame transformation as it was done before the combined affine'''
+    positions_world = markers[:, :3]
+    positions_body = (R_BASE.T @ (positions_world - T_BASE).T).T
+    rotation_matrix = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+    positions_body = (rotation_matrix @ positions_body.T).T
+    markers[:, :3] = positions_body
+    return markers
+
+
+def test_affine_matches_two_step_transform():
+    markers = random_markers(20)
+    expected = transform_two_step(markers.copy())
+
+    affine = rigid_transform.inverse_affine(R_BASE, T_BASE, BASE_ALIGNMENT)
+    rigid_transform.apply_affine(affine, markers[:, :3], markers[:, :3], np.empty((20, 3)))
+
+    np.testing.assert_allclose(markers, expected, atol=1e-9)
+
+
+def test_kabsch_recovers_transform():
+    world = BASE_MARKERS @ R_BASE.T + T_BASE
+    R, t, errors = rigid_transform.kabsch(BASE_MARKERS, world)
+
+    np.testing.assert_allclose(R, R_BASE, atol=1e-9)
+    np.testing.assert_allclose(t, T_BASE, atol=1e-9)
+    assert np.all(errors < 1e-9)
+
+
+def test_registration_reuses_correspondence():
+    world = BASE_MARKERS @ R_BASE.T + T_BASE
+    order = np.random.default_rng(0).permutation(len(world))
+    registration = rigid_transform.RigidBodyRegistration(BASE_MARKERS)
+
+    # The first frame has to be matched, the following ones (with the base drifting slightly) shouldn't be
+    for frame in range(5):
+        R, t, residual, _ = registration.update(world[order] + [frame * 0.5, 0.0, 0.0])
+    assert registration.match_count == 1
+    np.testing.assert_allclose(t, T_BASE + [2.0, 0.0, 0.0], atol=1e-9)
+
+    # Losing a marker forces a new match, which should still give the right transform
+    R, t, residual, rematched = registration.update(world[order][1:])
+    assert rematched
+    np.testing.assert_allclose(R, R_BASE, atol=1e-9)
+    assert residual < 1e-9
+
+
+@pytest.mark.parametrize('fault', ['displaced', 'occluded'])
+def test_registration_keeps_last_fit_on_failure(fault):
+    world = BASE_MARKERS @ R_BASE.T + T_BASE
+    order = np.random.default_rng(0).permutation(len(world))
+    registration = rigid_transform.RigidBodyRegistration(BASE_MARKERS)
+    registration.update(world[order])
+    body_indices, world_indices = registration.body_indices.copy(), registration.world_indices.copy()
+
+    # A base marker knocked 20 mm out of place, or hidden with a stray marker showing up elsewhere
+    bad = world[order].copy()
+    if fault == 'displaced':
+        bad[2] += [0.0, 20.0, 0.0]
+    else:
+        bad[2] = [600.0, 600.0, 0.0]
+    assert registration.update(bad) is None
+
+    # Neither the failed fit nor its correspondence is adopted
+    np.testing.assert_allclose(registration.R, R_BASE, atol=1e-9)
+    np.testing.assert_allclose(registration.t, T_BASE, atol=1e-9)
+    np.testing.assert_array_equal(registration.body_indices, body_indices)
+    np.testing.assert_array_equal(registration.world_indices, world_indices)
+
+    # Once the marker is back, the cached correspondence still fits
+    R, t, residual, rematched = registration.update(world[order])
+    assert not rematched
+    assert residual < 1e-9
+
+#########################################################################################################
+#                                              Benchmarks                                               #
+#########################################################################################################
+
+
+@pytest.mark.parametrize('num_markers', [1, 10, 100])
+def test_benchmark_transform_two_step(benchmark, num_markers):
+    markers = random_markers(num_markers)
+    benchmark(transform_two_step, markers)
+
+
+@pytest.mark.parametrize('num_markers', [1, 10, 100])
+def test_benchmark_transform_affine(benchmark, num_markers):
+    markers = random_markers(num_markers)
+    affine = rigid_transform.inverse_affine(R_BASE, T_BASE, BASE_ALIGNMENT)
+    positions = markers[:, :3]
+    scratch = np.empty((num_markers, 3))
+    benchmark(rigid_transform.apply_affine, affine, positions, positions, scratch)
+
+
+def test_benchmark_registration_update(benchmark):
+    world = BASE_MARKERS @ R_BASE.T + T_BASE
+    registration = rigid_transform.RigidBodyRegistration(BASE_MARKERS)
+    registration.update(world)
+    benchmark(registration.update, world)
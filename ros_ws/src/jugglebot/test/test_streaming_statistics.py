@@ -0,0 +1,142 @@
+"""
+Tests and benchmarks for the streaming statistics that the mocap interface keeps its residuals in.
+
+The benchmarks compare the per-frame cost of adding the residuals of every unlabelled marker against the number of
+markers. To run them:
+    python -m pytest test/test_streaming_statistics.py --benchmark-only --benchmark-group-by=param:num_markers
+"""
+
+import numpy as np
+import pytest
+
+from jugglebot.streaming_statistics import RingBuffer, RunningStatistics, StreamingMetric
+
+
+def residual_batches(num_frames, seed=0):
+    '''Residuals of a varying number of markers per frame, skewed like real marker residuals {mm}'''
+    rng = np.random.default_rng(seed)
+    return [rng.gamma(2.0, 0.4, rng.integers(0, 12)) for _ in range(num_frames)]
+
+
+def test_running_statistics_matches_numpy():
+    batches = residual_batches(200)
+    values = np.concatenate(batches)
+    stats = RunningStatistics()
+    for batch in batches:
+        stats.update(batch)
+
+    assert stats.count == values.size
+    assert stats.mean == pytest.approx(values.mean(), rel=1e-12)
+    assert stats.variance == pytest.approx(values.var(ddof=1), rel=1e-10)
+    assert (stats.min, stats.max) == (values.min(), values.max())
+
+
+def test_ring_buffer_wraps_around():
+    buffer = RingBuffer(5)
+    buffer.extend([1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(buffer.values(), [1.0, 2.0, 3.0])
+
+    buffer.extend([4.0, 5.0, 6.0, 7.0])
+    np.testing.assert_array_equal(buffer.values(), [3.0, 4.0, 5.0, 6.0, 7.0])
+    np.testing.assert_array_equal(buffer.latest(2), [6.0, 7.0])
+    np.testing.assert_array_equal(buffer.latest(4), [4.0, 5.0, 6.0, 7.0])
+
+    # A batch longer than the buffer keeps its last values
+    buffer.extend(np.arange(10.0, 22.0))
+    np.testing.assert_array_equal(buffer.values(), np.arange(17.0, 22.0))
+
+
+@pytest.mark.parametrize('history', [100000, 50, 7])
+def test_streaming_metric_matches_numpy(history):
+    # With short histories the totals catch up with the buffer many times, including batches longer than it
+    batches = residual_batches(300)
+    metric = StreamingMetric(window=5, history=history)
+    for batch in batches:
+        metric.update(batch)
+    values = np.concatenate(batches)
+    kept = values[-max(history, 5):]
+
+    stats = metric.summary()
+    assert stats['count'] == values.size
+    assert stats['last'] == values[-1]
+    assert stats['mean'] == pytest.approx(values.mean(), rel=1e-12)
+    assert stats['std'] == pytest.approx(values.std(ddof=1), rel=1e-10)
+    assert (stats['min'], stats['max']) == (values.min(), values.max())
+    for quantile in (50, 95, 99):
+        assert stats[f'p{quantile}'] == pytest.approx(np.percentile(kept, quantile))
+
+    assert stats['window_count'] == 5
+    assert stats['window_mean'] == pytest.approx(values[-5:].mean())
+    assert stats['window_max'] == values[-5:].max()
+    assert stats['window_p95'] == pytest.approx(np.percentile(values[-5:], 95))
+
+    # Taking a summary doesn't change what later ones see
+    metric.update([100.0])
+    assert metric.summary()['count'] == values.size + 1
+    assert metric.summary()['max'] == 100.0
+
+
+def test_streaming_metric_quantile_accuracy():
+    # Over a whole session that fits in the history, the quantiles are exact, however the values arrive
+    rng = np.random.default_rng(1)
+    values = rng.lognormal(0.0, 0.5, 50000)
+    metric = StreamingMetric()
+    for batch in np.array_split(values, 5000):
+        metric.update(batch)
+
+    stats = metric.summary()
+    for quantile in (0.5, 0.95, 0.99):
+        assert stats[f'p{quantile * 100:g}'] == np.quantile(values, quantile)
+
+
+def test_streaming_metric_empty_and_reset():
+    metric = StreamingMetric()
+    metric.update([])
+    stats = metric.summary()
+    assert stats['count'] == 0
+    assert all(value is None for key, value in stats.items() if key not in ('count', 'window_count'))
+
+    metric.update([1.0, 2.0])
+    metric.reset()
+    assert metric.summary() == stats
+
+    with pytest.raises(ValueError):
+        StreamingMetric(quantiles=(0.5, 1.0))
+
+def test_snapshot_is_unaffected_by_later_values():
+    metric = StreamingMetric(window=5, history=50)
+    for batch in residual_batches(100):
+        metric.update(batch)
+    snapshot = metric.snapshot()
+    stats = metric.summary()
+
+    # The buffer is overwritten many times over (and the totals catch up) after the snapshot is taken
+    for batch in residual_batches(100, seed=1):
+        metric.update(batch + 10.0)
+
+    assert snapshot.summary() == stats
+    assert metric.summary() != stats
+
+#########################################################################################################
+#                                              Benchmarks                                               #
+#########################################################################################################
+
+
+@pytest.mark.parametrize('num_markers', [1, 10, 50])
+def test_benchmark_update(benchmark, num_markers):
+    metric = StreamingMetric(window=2000)
+    residuals = np.random.default_rng(0).gamma(2.0, 0.4, num_markers)
+    benchmark(metric.update, residuals)
+
+
+def test_benchmark_summary(benchmark):
+    metric = StreamingMetric(window=2000)
+    metric.update(np.random.default_rng(0).gamma(2.0, 0.4, 100000))
+    benchmark(metric.summary)
+
+
+def test_benchmark_snapshot(benchmark):
+    # The part of the summary that's taken under the mocap interface's data lock
+    metric = StreamingMetric(window=2000)
+    metric.update(np.random.default_rng(0).gamma(2.0, 0.4, 100000))
+    benchmark(metric.snapshot)
@@ -0,0 +1,190 @@
+"""
+Tests for the tracking sources and for fusing them into one stream, time-aligned onto the QTM frames.
+"""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from jugglebot.synthetic_mocap import build_packet
+from jugglebot.tracking_sources import QtmTrackingSource, TrackingFrame, TrackingFusion, TrackingSource
+
+QTM_PERIOD = 1_000_000_000 // 300  # {ns}
+VR_PERIOD = 1_000_000_000 // 250   # {ns}
+TRACKER_VELOCITY = np.array([500.0, -200.0, 100.0])  # {mm/s}
+
+
+def tracker_pose(capture_time):
+    '''A tracker moving in a straight line, and turning about z by a degree per sample'''
+    angle = np.radians(capture_time // VR_PERIOD)
+    rotation = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+    return np.hstack((rotation, (TRACKER_VELOCITY * capture_time * 1e-9)[:, np.newaxis]))
+
+
+def tracker_frames(start, end):
+    return [TrackingFrame('openvr', i, capture_time, rigid_bodies={'LHR-1': tracker_pose(capture_time)})
+            for i, capture_time in enumerate(range(start, end, VR_PERIOD))]
+
+
+def qtm_frames(start, end):
+    return [TrackingFrame('qtm', i, capture_time, np.zeros((1, 4)), device_time=capture_time - 5_000_000)
+            for i, capture_time in enumerate(range(start, end, QTM_PERIOD))]
+
+
+def arrive(fusion, frames_and_latencies):
+    '''Hand frames from each source to the fusion in the order that they'd arrive, given each source's latency'''
+    arrivals = [(frame.capture_time + latency, frame) for frames, latency in frames_and_latencies for frame in frames]
+    for _, frame in sorted(arrivals, key=lambda arrival: arrival[0]):
+        fusion.on_source_frame(frame)
+
+
+class ListSource(TrackingSource):
+    '''Streams a list of frames, one per event loop iteration'''
+    def __init__(self, name, frames):
+        super().__init__(name)
+        self.frames = frames
+
+    async def stream(self, on_frame):
+        self.running = True
+        for frame in self.frames:
+            if not self.running:
+                break
+            on_frame(frame)
+            await asyncio.sleep(0)
+
+
+class EndlessSource(TrackingSource):
+    '''Streams nothing until it's stopped'''
+    async def stream(self, on_frame):
+        self.running = True
+        while self.running:
+            await asyncio.sleep(0.001)
+
+
+def returns_within(function, timeout=5.0):
+    '''Call a function on another thread, so that a test fails rather than hangs if it never returns'''
+    thread = threading.Thread(target=function, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def test_tracking_source_is_abstract():
+    with pytest.raises(TypeError):
+        TrackingSource('incomplete')
+
+
+@pytest.mark.parametrize('qtm_latency', [5_000_000, 20_000_000])
+def test_fusion_interpolates_to_qtm_capture_times(qtm_latency):
+    # QTM frames arrive after the tracker samples around their capture time, so the samples that bracket each capture
+    # time can be several samples old by then
+    fused = []
+    fusion = TrackingFusion([ListSource('qtm', []), ListSource('openvr', [])], on_frame=fused.append)
+    arrive(fusion, [(qtm_frames(10_000_000, 500_000_000), qtm_latency), (tracker_frames(0, 550_000_000), 0)])
+
+    assert len(fused) == len(qtm_frames(10_000_000, 500_000_000))
+    for frame in fused:
+        assert frame.source == 'fused'
+        assert frame.device_time == frame.capture_time - 5_000_000
+
+        # The motion is linear, so interpolating between the bracketing samples is exact
+        pose = frame.rigid_bodies['LHR-1']
+        np.testing.assert_allclose(pose[:, 3], TRACKER_VELOCITY * frame.capture_time * 1e-9, atol=1e-6)
+
+        # The rotation is from the nearer sample (the later one, halfway between)
+        nearest_sample = (frame.capture_time + VR_PERIOD // 2) // VR_PERIOD * VR_PERIOD
+        np.testing.assert_allclose(pose[:, :3], tracker_pose(nearest_sample)[:, :3], atol=1e-12)
+
+
+def test_fusion_leaves_out_stale_and_unbracketed_poses():
+    fused = []
+    fusion = TrackingFusion([ListSource('qtm', []), ListSource('openvr', [])], on_frame=fused.append, history=8)
+    arrive(fusion, [(tracker_frames(100_000_000, 200_000_000), 0)])
+
+    # After the latest sample, the pose is held for up to max_age, and then left out
+    fusion.on_source_frame(TrackingFrame('qtm', 0, 230_000_000))
+    fusion.on_source_frame(TrackingFrame('qtm', 1, 260_000_000))
+    np.testing.assert_allclose(fused[0].rigid_bodies['LHR-1'], tracker_pose(196_000_000))
+    assert 'LHR-1' not in fused[1].rigid_bodies
+
+    # Before the history (only 8 samples are kept), the oldest sample is used rather than extrapolating
+    fusion.on_source_frame(TrackingFrame('qtm', 2, 150_000_000))
+    np.testing.assert_allclose(fused[2].rigid_bodies['LHR-1'], tracker_pose(196_000_000 - 7 * VR_PERIOD))
+
+
+def test_fusion_runs_sources_together():
+    fused = []
+    fusion = TrackingFusion([ListSource('qtm', qtm_frames(10_000_000, 100_000_000)),
+                             ListSource('openvr', tracker_frames(0, 100_000_000))], on_frame=fused.append)
+    fusion.start()
+    fusion.thread.join(timeout=5.0)
+    fusion.stop()
+
+    assert [frame.sequence for frame in fused] == list(range(len(qtm_frames(10_000_000, 100_000_000))))
+    # The sources interleave, so later frames have the tracker's pose
+    assert 'LHR-1' in fused[-1].rigid_bodies
+
+
+def test_qtm_source_streams_mocap_frames(mocap_interface):
+    fused = []
+    fusion = TrackingFusion([QtmTrackingSource(mocap_interface)], on_frame=fused.append)
+    fusion.start()
+
+    def wait_for(condition):
+        deadline = time.monotonic() + 5.0
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.001)
+        assert condition()
+
+    try:
+        # The source takes over the interface's frame callback once it starts streaming
+        wait_for(lambda: mocap_interface.on_frame is not None)
+
+        base_markers = np.column_stack((mocap_interface.base_marker_positions, np.full(6, 0.5)))
+        ball = np.array([[0.0, 500.0, 1000.0, 0.5]])  # In the workspace, once it's rotated into the base frame
+        for frame_number in range(10):
+            timestamp = 1_000_000 + frame_number * QTM_PERIOD // 1000
+            mocap_interface.on_packet(build_packet(timestamp, frame_number, base_markers, ball))
+        wait_for(lambda: len(fused) == 10)
+    finally:
+        fusion.stop()
+
+    assert mocap_interface.on_frame is None
+    assert [frame.sequence for frame in fused] == list(range(10))
+    assert [frame.device_time for frame in fused] == [(1_000_000 + i * QTM_PERIOD // 1000) * 1000 for i in range(10)]
+    # Capture times are in the host clock
+    assert all(abs(frame.capture_time - time.time_ns()) < 5e9 for frame in fused)
+    assert all(len(frame.markers) == 1 for frame in fused)
+
+
+def test_stop_straight_after_start(monkeypatch, make_mocap_interface):
+    from jugglebot.mocap_interface import MocapInterface
+
+    # Hold the threads up before they run their event loops, so that stop() always comes first
+    def slow_to_start(run_asyncio_loop):
+        def run(self):
+            time.sleep(0.05)
+            run_asyncio_loop(self)
+        return run
+
+    for cls in (TrackingFusion, MocapInterface):
+        monkeypatch.setattr(cls, '_run_asyncio_loop', slow_to_start(cls._run_asyncio_loop))
+
+    sources = [EndlessSource('qtm'), EndlessSource('openvr')]
+    fusion = TrackingFusion(sources, on_frame=lambda frame: None)
+    fusion.start()
+    assert returns_within(fusion.stop)
+    assert not any(source.running for source in sources)
+
+    mocap_interface = make_mocap_interface()
+    assert returns_within(mocap_interface.stop)
+
+    # Stopping before starting, or twice, does nothing
+    fusion = TrackingFusion([EndlessSource('qtm')], on_frame=lambda frame: None)
+    assert returns_within(fusion.stop)
+    fusion.start()
+    assert returns_within(fusion.stop)
+    assert returns_within(fusion.stop)
@@ -0,0 +1,96 @@
+"""
+Tests for the incremental polynomial fit that decides whether a ball is in projectile motion.
+"""
+
+import numpy as np
+import pytest
+
+from jugglebot.synthetic_mocap import GRAVITY
+from jugglebot.trajectory_fit import IncrementalPolynomialFit
+
+DT = 1.0 / 300.0  # Mocap frame period {s}
+
+
+def ball_samples(num_samples, noise=1.0, start_time=1.0e5, seed=0):
+    '''Noisy samples of a thrown ball, as the ball tracker sees them (times in the ROS clock) {s, mm}'''
+    rng = np.random.default_rng(seed)
+    times = start_time + np.arange(num_samples) * DT
+    t = times - times[0]
+    positions = np.column_stack((200.0 + 500.0 * t, -100.0 - 300.0 * t, 800.0 + 4000.0 * t - 0.5 * GRAVITY * t ** 2))
+    return times, positions + rng.normal(0.0, noise, positions.shape)
+
+
+def reference_fit(fit, degree):
+    '''np.polyfit on the fit's window, with the same reference. Returns the coefficients and residual sums'''
+    times, positions = fit.window()
+    coefficients, residuals, *_ = np.polyfit(times, positions, degree, full=True)
+    return coefficients[::-1], residuals
+
+
+def assert_matches_polyfit(fit):
+    for degree in (0, 1, 2):
+        coefficients, squared_residuals = fit.fit(degree)
+        expected_coefficients, expected_residuals = reference_fit(fit, degree)
+        np.testing.assert_allclose(coefficients, expected_coefficients, rtol=1e-6, atol=1e-6)
+        np.testing.assert_allclose(squared_residuals, expected_residuals, rtol=1e-8)
+
+
+@pytest.mark.parametrize('window_duration', [0.1, 0.3])
+def test_sliding_window_matches_polyfit(window_duration):
+    # A small capacity so that the ring buffers wrap around many times, and a short rebase interval so that the
+    # reference moves too
+    fit = IncrementalPolynomialFit(rebase_interval=0.2, capacity=40)
+    times, positions = ball_samples(400)
+
+    for i, (time, position) in enumerate(zip(times, positions)):
+        fit.append(time, position)
+        # Trimmed the way the ball tracker trims it
+        while fit.end_time - fit.start_time > window_duration:
+            fit.pop_oldest()
+        assert fit.end_time == time
+
+        if i % 7 == 0 and len(fit) >= 3:
+            assert_matches_polyfit(fit)
+
+    # The window only holds as many samples as fit in the duration, up to the capacity
+    assert len(fit) == min(np.count_nonzero(times[-1] - times <= window_duration), 40)
+    assert_matches_polyfit(fit)
+
+
+def test_residuals_of_a_short_window():
+    # Almost a second after the reference, the positions are ~1 m from it, but the fit over 0.1 s is within a few
+    # hundredths of a mm. The residual sum is still exact to rounding, rather than what's left of sum(p^2) once the
+    # fitted part is taken off
+    fit = IncrementalPolynomialFit(rebase_interval=1.0, capacity=64)
+    times, positions = ball_samples(295, noise=0.03, seed=1)
+    for time, position in zip(times, positions):
+        fit.append(time, position)
+        while fit.end_time - fit.start_time > 0.1:
+            fit.pop_oldest()
+
+    _, squared_residuals = fit.fit(2)
+    _, expected = reference_fit(fit, 2)
+    np.testing.assert_allclose(squared_residuals, expected, rtol=1e-9)
+
+    # The fitted acceleration is gravity
+    coefficients, _ = fit.fit(2)
+    assert 2 * coefficients[2, 2] == pytest.approx(-GRAVITY, rel=0.05)
+
+
+def test_not_enough_samples():
+    fit = IncrementalPolynomialFit()
+    times, positions = ball_samples(3)
+    fit.append(times[0], positions[0])
+    fit.append(times[1], positions[1])
+    assert fit.fit(2) is None
+    assert fit.fit(1) is not None
+
+    # Samples at the same time can't be fitted with a line
+    fit.clear()
+    fit.append(times[0], positions[0])
+    fit.append(times[0], positions[1])
+    assert fit.fit(1) is None
+
+    fit.pop_oldest()
+    fit.pop_oldest()
+    assert len(fit) == 0
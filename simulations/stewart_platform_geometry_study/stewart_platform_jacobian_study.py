@@ -5,6 +5,12 @@ from mpl_toolkits.mplot3d import Axes3D
 import json
 from scipy.spatial import ConvexHull
 import time
+import os
+import sys
+
+# Use the same kinematics as the robot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ros_ws', 'src', 'jugglebot'))
+from jugglebot import kinematics
 
 #####################################################
 #       Build the Platform and Generate Poses       #
@@ -149,28 +155,13 @@ def compute_analytical_jacobian(plat_nodes, base_nodes, pose):
         J (numpy.ndarray): Jacobian matrix, shape (6, 6).
     """
     # Extract translation and rotation from pose
-    r = np.array(pose[0])
-    alpha, beta, gamma = pose[1]
-    # Convert angles into radians
-    alpha, beta, gamma = np.deg2rad(alpha), np.deg2rad(beta), np.deg2rad(gamma)
-    R = euler_to_rot_matrix(alpha, beta, gamma)
-    
-    # Compute leg vectors
-    L = np.zeros((3, 6))
-    for i in range(6):
-        L[:, i] = r + np.dot(R, plat_nodes[:, i]) - base_nodes[:, i]
-    
-    # Compute the Jacobian matrix
-    J = np.zeros((6, 6))
-    for i in range(6):
-        Li_norm = np.linalg.norm(L[:, i])
-        Li = L[:, i] / Li_norm
-        Ri_pi = np.dot(R, plat_nodes[:, i])
-        skew_Ri_pi = skew_symmetric(Ri_pi)
-        J[i, :3] = Li
-        J[i, 3:] = np.dot(skew_Ri_pi, Li)
+    r = np.array(pose[0], dtype=float).reshape(1, 3)
+    R = kinematics.euler_to_rotation_matrix(np.array(pose[1], dtype=float))[np.newaxis]
+
+    # Row i is [u_i, (R p_i) x u_i], where u_i is the unit vector along leg i
+    _, J = kinematics.jacobians(r, R, base_nodes.T, plat_nodes.T)
 
-    return J
+    return J[0]
 
 def check_reachability(pose, plat_nodes, base_nodes, shortLeg, longLeg, legAngleLimit):
     '''
@@ -179,86 +170,20 @@ def check_reachability(pose, plat_nodes, base_nodes, shortLeg, longLeg, legAngle
     Note that pose is a tuple of ((x, y, z), (alpha, beta, gamma)).
     '''
     # Extract translation and rotation from pose ((x, y, z), (alpha, beta, gamma)):
-    r = np.array(pose[0])
-    alpha, beta, gamma = pose[1]
-    # Convert angles into radians
-    alpha, beta, gamma = np.deg2rad(alpha), np.deg2rad(beta), np.deg2rad(gamma)
-    R = euler_to_rot_matrix(alpha, beta, gamma)
-
-    # Compute leg vectors
-    L = np.zeros((3, 6))
-    for i in range(6):
-        L[:, i] = r + np.dot(R, plat_nodes[:, i]) - base_nodes[:, i]
+    r = np.array(pose[0], dtype=float).reshape(1, 3)
+    R = kinematics.euler_to_rotation_matrix(np.array(pose[1], dtype=float))[np.newaxis]
 
-    # Check if the legs are within the reach limits
-    leg_lengths = np.linalg.norm(L, axis=0)
-    short_legs = leg_lengths < shortLeg # Will return True for each leg that is shorter than shortLeg
-    long_legs = leg_lengths > longLeg # Will return True for each leg that is longer than longLeg
+    # Compute leg vectors, then check the leg lengths and the angles of the legs with the x-y plane
+    L, _ = kinematics.leg_vectors(r, R, base_nodes.T, plat_nodes.T)
+    leg_lengths = np.linalg.norm(L, axis=2)
 
-    # check leg angles
-    unit_legs = np.zeros((3, 6))  # Unit vector for each leg
-    proj_unit_legs = np.zeros((3, 6))  # Projection of each unit vector to the x-y plane
-    angles = np.zeros(6)
-    for j in range(6):
-        unit_legs[:, j] = L[:, j] / leg_lengths[j]
-        # Project the legs to the x-y plane to measure the angles of the legs with the z axis
-        proj_unit_legs[:, j] = np.array([unit_legs[0, j], unit_legs[1, j], 0])
-        angles[j] = abs(np.arctan2(unit_legs[2, j], np.linalg.norm(proj_unit_legs[:, j])) * 180 / np.pi)
-
-    leg_angles = np.array(angles) < legAngleLimit  # Will return True for each leg that is within the leg angle limit
-
-    # print(f'Short legs: {short_legs}, Long legs: {long_legs}, Leg angle limit: {leg_angles}')
-    # print(f'Leg lengths: {leg_lengths}')
-    # print(f'shortLeg: {shortLeg}, longLeg: {longLeg}, legAngleLimit: {legAngleLimit}')
-
-    # If any of the legs are outside the reach limits, return False
-    if np.any(short_legs) or np.any(long_legs) or np.any(leg_angles):
-        return False
-    else:
-        return True
+    return bool(kinematics.check_reachability(leg_lengths, shortLeg, longLeg, L, legAngleLimit)[0])
 
 
 #####################################################
 #                   Scoring                         #
 #####################################################
 
-def evaluate_jacobian(J):
-    """
-    Evaluates how well-balanced the Jacobian matrix is and returns the results.
-    
-    Args:
-        J (numpy.ndarray): Jacobian matrix, shape (6, 6).
-
-    Returns:
-        tuple: A tuple containing:
-            - condition_number (float): The condition number of the Jacobian matrix.
-            - rank_deficiency (int): The rank deficiency of the Jacobian matrix.
-            - submatrix_condition_number (float): The condition number of the submatrix (1st, 2nd, 4th, 5th columns).
-            - norm_score (float): The ratio of average rotation norms to average translation norms.
-    """
-    # Compute the condition number. This should ideally be close to 1.
-    condition_number = np.linalg.cond(J)
-    
-    # Compute the rank deficiency (number of linearly dependent columns). This will ideally be 0.
-    rank_deficiency = 6 - np.linalg.matrix_rank(J)
-
-    # Compute the condition number for the submatrix of translation and rotation columns
-    submatrix = J[:, [0, 1, 3, 4]]
-    submatrix_condition_number = np.linalg.cond(submatrix)
-
-    # Compute the ratio between translation and rotation column norms. This should ideally be 1.
-    norm_trans_x = np.linalg.norm(J[:, 0])
-    norm_trans_y = np.linalg.norm(J[:, 1])
-    norm_rot_x = np.linalg.norm(J[:, 3])
-    norm_rot_y = np.linalg.norm(J[:, 4])
-    # Compute average norms
-    avg_norm_trans = (norm_trans_x + norm_trans_y) / 2
-    avg_norm_rot = (norm_rot_x + norm_rot_y) / 2
-
-    norm_score = avg_norm_rot / avg_norm_trans
-    
-    return condition_number, submatrix_condition_number, rank_deficiency, norm_score
-
 def aggregate_scores(scores, unreachable_count):
     """
     Aggregates scores for a given geometry.
@@ -329,7 +254,7 @@ def plot_geometry_with_poses(curr_pose, platRad, platAngle, poses, plat_nodes, b
     
     # Plot the platform
     alpha, beta, gamma = np.deg2rad(curr_pose[1])
-    R = euler_to_rot_matrix(alpha, beta, gamma)
+    R = kinematics.euler_to_rotation_matrix(np.array(curr_pose[1], dtype=float))
     A = np.array(curr_pose[0]).reshape(3, 1) + np.dot(R, plat_nodes)
 
     # Calculate the direction of the arrow
@@ -353,7 +278,7 @@ def plot_geometry_with_poses(curr_pose, platRad, platAngle, poses, plat_nodes, b
     for pos, orientation in poses:
         if check_reachability((pos, orientation), plat_nodes, base_nodes, geom_limits[0], geom_limits[1], geom_limits[2]):
             J = compute_analytical_jacobian(plat_nodes, base_nodes, (pos, orientation))
-            condition_number, submatrix_condition_number, rank_deficiency, norm_score = evaluate_jacobian(J)
+            condition_number = kinematics.evaluate_dexterity(J[np.newaxis])[0][0]
             condition_numbers.append(condition_number)
         else:
             condition_numbers.append(None)
@@ -462,71 +387,6 @@ def euler_to_vector(roll, pitch, yaw):
 
     return rotated_direction
 
-def euler_to_rot_matrix(alpha, beta, gamma):
-    """
-    Computes the rotation matrix for given Euler angles.
-    
-    Args:
-        alpha, beta, gamma (float): Euler angles in radians.
-    
-    Returns:
-        R (numpy.ndarray): Rotation matrix, shape (3, 3).
-    """
-    R_x = np.array([[1, 0, 0],
-                    [0, np.cos(alpha), -np.sin(alpha)],
-                    [0, np.sin(alpha), np.cos(alpha)]])
-    
-    R_y = np.array([[np.cos(beta), 0, np.sin(beta)],
-                    [0, 1, 0],
-                    [-np.sin(beta), 0, np.cos(beta)]])
-    
-    R_z = np.array([[np.cos(gamma), -np.sin(gamma), 0],
-                    [np.sin(gamma), np.cos(gamma), 0],
-                    [0, 0, 1]])
-    
-    R = np.dot(R_z, np.dot(R_y, R_x))
-    return R
-
-def skew_symmetric(v):
-    """
-    Computes the skew-symmetric matrix of a vector.
-    
-    Args:
-        v (numpy.ndarray): Input vector, shape (3,).
-    
-    Returns:
-        skew_v (numpy.ndarray): Skew-symmetric matrix, shape (3, 3).
-    """
-    skew_v = np.array([[0, -v[2], v[1]],
-                       [v[2], 0, -v[0]],
-                       [-v[1], v[0], 0]])
-    return skew_v
-
-def compute_leg_lengths(plat_nodes, base_nodes, pose):
-    """
-    Computes the lengths of the legs for a given platform geometry and pose.
-    
-    Args:
-        plat_nodes (numpy.ndarray): Position vectors of platform leg nodes in platform frame, shape (3, 6).
-        base_nodes (numpy.ndarray): Position vectors of base leg nodes in base frame, shape (3, 6).
-        pose (numpy.ndarray): Pose of the platform [x, y, z, alpha, beta, gamma]. Units are in mm and degrees.
-    
-    Returns:
-        lengths (numpy.ndarray): Lengths of the legs, shape (6,).
-    """
-    x, y, z, alpha, beta, gamma = pose
-    r = np.array([x, y, z])
-    # Convert angles into radians
-    alpha, beta, gamma = np.deg2rad(alpha), np.deg2rad(beta), np.deg2rad(gamma)
-    R = euler_to_rot_matrix(alpha, beta, gamma)
-    
-    lengths = np.zeros(6)
-    for i in range(6):
-        L = r + np.dot(R, plat_nodes[:, i]) - base_nodes[:, i]
-        lengths[i] = np.linalg.norm(L)
-    
-    return lengths
-
 def compute_pose_error(J, leg_length_error):
     """
     Computes the pose error (translation and rotation) due to a given leg length error.
@@ -566,19 +426,15 @@ def compute_numerical_jacobian(plat_nodes, base_nodes, pose, delta=1e-6):
     Returns:
         J_numerical (numpy.ndarray): Numerical Jacobian matrix, shape (6, 6).
     """
-    # Convert pose into a 6x1 array
-    pose = np.array([*pose[0], *pose[1]])
+    # The pose, then the pose with each of [x, y, z, alpha, beta, gamma] perturbed in turn
+    poses = np.tile(np.array([*pose[0], *pose[1]], dtype=float), (7, 1))
+    poses[1:] += np.eye(6) * delta
 
-    J_numerical = np.zeros((6, 6))
-    original_lengths = compute_leg_lengths(plat_nodes, base_nodes, pose)
+    rotations = kinematics.euler_to_rotation_matrix(poses[:, 3:])
+    lengths = kinematics.inverse_kinematics(poses[:, :3], rotations, base_nodes.T, plat_nodes.T)
+
+    J_numerical = ((lengths[1:] - lengths[0]) / delta).T
 
-    for i in range(6):
-        perturbed_pose = np.copy(pose)
-        perturbed_pose[i] += delta
-        perturbed_lengths = compute_leg_lengths(plat_nodes, base_nodes, perturbed_pose)
-        length_diff = perturbed_lengths - original_lengths
-        J_numerical[:, i] = length_diff / delta
-    
     return J_numerical
 
 
@@ -679,8 +535,10 @@ if running_geometry_study:
                 # Compute the Jacobian matrix
                 J = compute_analytical_jacobian(plat_nodes, base_nodes, pose)
 
-                # Evaluate the Jacobian matrix
-                condition_number, submatrix_condition_number, rank_deficiency, norm_score = evaluate_jacobian(J)
+                # Evaluate the Jacobian matrix. Rank deficiency is the number of linearly dependent columns
+                condition_number, submatrix_condition_number, _, norm_score = (
+                    metric[0] for metric in kinematics.evaluate_dexterity(J[np.newaxis]))
+                rank_deficiency = 6 - np.linalg.matrix_rank(J)
 
                 # Store the results
                 temp_results[k] = [condition_number, rank_deficiency, submatrix_condition_number, norm_score]
@@ -733,11 +591,11 @@ print(f"Analytical Jacobian:\n{J_analytical}\n")
 
 print('Sum of differences between analytic and numeric Jacobian:', np.sum(J_analytical - J_numerical))
 
-results = evaluate_jacobian(J_analytical)
-print(f"Condition Number: {results[0]:.2f}")
-print(f"Submatrix Condition Number: {results[1]:.2f}")
-print(f"Rank Deficiency: {results[2]:.2f}")
-print(f"Norm Score: {results[3]:.2f}")
+condition_number, submatrix_condition_number, _, norm_score = kinematics.evaluate_dexterity(J_analytical[np.newaxis])
+print(f"Condition Number: {condition_number[0]:.2f}")
+print(f"Submatrix Condition Number: {submatrix_condition_number[0]:.2f}")
+print(f"Rank Deficiency: {6 - np.linalg.matrix_rank(J_analytical):.2f}")
+print(f"Norm Score: {norm_score[0]:.2f}")
 
 plot_geometry_with_poses(pose_deg, platRad, platSmallAngle, poses, plat_nodes, base_nodes, arrow_length=50, geom_limits=geometric_limits, hide_unreachable=False)
 plt.show()
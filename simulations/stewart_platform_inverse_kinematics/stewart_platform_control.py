@@ -5,6 +5,12 @@ from matplotlib.animation import FuncAnimation
 from mpl_toolkits.mplot3d import Axes3D
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 from scipy.interpolate import interp1d
+import os
+import sys
+
+# Use the same kinematics as the robot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ros_ws', 'src', 'jugglebot'))
+from jugglebot.kinematics import euler_to_rotation_matrix, hexagon_node_angles, inverse_kinematics, nodes_on_circle
 
 
 class StewartPlatform:
@@ -56,11 +62,10 @@ class StewartPlatform:
 
     def leg_lengths(self):
         # Calculate and return the lengths of the legs using the position and rotation
-        T = self.position  # Get the new translational position
         self._populate_rotation_matrix()
-        legs = T + np.dot(self.rot_matrix, self._init_plat_nodes.T) - self.base_nodes.T
+        lengths = inverse_kinematics(self.position.T, self.rot_matrix[np.newaxis], self.base_nodes, self._init_plat_nodes)[0]
 
-        leg_lengths = np.linalg.norm(legs, axis=0) - self.init_leg_lengths
+        leg_lengths = lengths - self.init_leg_lengths
 
         # Remap the leg lengths so the numbering matches the robot
         schema = [5, 0, 1, 2, 3, 4]
@@ -123,8 +128,6 @@ class StewartPlatform:
         # Builds the SP using the given dimensions.
         # Origin of platform is at platform pos in lowest position (initial_height)
 
-        deg_to_rad = math.pi / 180
-
         # Define the angles to the nodes
         gamma0 = 180 + self._base_small_angle*2  # Offset from horizontal
         gamma2 = self._base_small_angle  # Angle between close base nodes {deg}
@@ -134,24 +137,13 @@ class StewartPlatform:
         lambda2 = 120 - lambda1  # Angle between far platform nodes {deg}
         lambda0 = (gamma1 - lambda1) / 2 + gamma0  # Offset from x axis for platform nodes {deg}
 
-        base_node_angles = np.zeros((6, 1))  # Angles to each of the 6 base nodes {deg}
-        plat_node_angles = np.zeros((6, 1))  # Angles to each of the 6 platform nodes {deg}
+        # Angles to each of the 6 base and platform nodes {deg}
+        base_node_angles = hexagon_node_angles(gamma0, gamma1, gamma2)
+        plat_node_angles = hexagon_node_angles(lambda0, lambda1, lambda2)
 
         # Find the main 6 nodes for the base and platform
-        for node in range(6):
-            first_angle_index = int(math.floor((node + 1) / 2))
-            second_angle_index = int(math.floor(node / 2))
-
-            base_node_angles[node] = gamma0 + gamma1 * first_angle_index + gamma2 * second_angle_index
-            plat_node_angles[node] = lambda0 + lambda1 * first_angle_index + lambda2 * second_angle_index
-
-            self.base_nodes[node][0] = self._base_radius * math.cos(base_node_angles[node][0] * deg_to_rad)
-            self.base_nodes[node][1] = self._base_radius * math.sin(base_node_angles[node][0] * deg_to_rad)
-            self.base_nodes[node][2] = 0
-
-            self._init_plat_nodes[node][0] = self._plat_radius * math.cos(plat_node_angles[node][0] * deg_to_rad)
-            self._init_plat_nodes[node][1] = self._plat_radius * math.sin(plat_node_angles[node][0] * deg_to_rad)
-            self._init_plat_nodes[node][2] = 0
+        self.base_nodes[:6] = nodes_on_circle(self._base_radius, base_node_angles)
+        self._init_plat_nodes[:6] = nodes_on_circle(self._plat_radius, plat_node_angles)
 
         # Set the new position to be the current one, for plotting purposes
         self.new_plat_nodes = self._init_plat_nodes + self.start_pos.T
@@ -159,32 +151,12 @@ class StewartPlatform:
     def _populate_rotation_matrix(self):
         # angles is vector of [phi, theta, psi] which correspond to the rotation of the platform (in base frame)
         # around the x, y and z axes, respectively.
-        angles = np.deg2rad(self.rotation)
-        phi = angles[0][0]
-        theta = angles[1][0]
-        psi = angles[2][0]
-
-        rot_x = np.array([[1, 0, 0],
-                          [0, np.cos(phi), -np.sin(phi)],
-                          [0, np.sin(phi), np.cos(phi)]])
-
-        rot_y = np.array([[np.cos(theta), 0, np.sin(theta)],
-                          [0, 1, 0],
-                          [-np.sin(theta), 0, np.cos(theta)]])
-
-        rot_z = np.array([[np.cos(psi), -np.sin(psi), 0],
-                          [np.sin(psi), np.cos(psi), 0],
-                          [0, 0, 1]])
-
-        rot = np.dot(rot_z, np.dot(rot_y, rot_x))
-        # print("rot = \n", rot)
-        self.rot_matrix = rot
+        self.rot_matrix = euler_to_rotation_matrix(self.rotation.ravel())
 
     def _calc_init_leg_lengths(self):
         # Calculates the initial length of the legs
-        legs = self.start_pos + self._init_plat_nodes.T - self.base_nodes.T
-
-        self.init_leg_lengths = np.linalg.norm(legs, axis=0)
+        self.init_leg_lengths = inverse_kinematics(self.start_pos.T, np.eye(3)[np.newaxis], self.base_nodes,
+                                                   self._init_plat_nodes)[0]
 
     @property
     def initial_height(self):